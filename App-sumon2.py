@@ -1,11 +1,25 @@
 import streamlit as st
 import pandas as pd
-import google.generativeai as genai
-import PyPDF2
-import docx
-import re
-import io # Importar el módulo io para manejar archivos en memoria
-import openai # Importar la librería OpenAI para modelos GPT
+import hashlib
+import os
+import uuid
+
+from sumon.banco import COLUMNAS_CLASIFICACION, obtener_banco_items
+from sumon.cache_respuestas import CACHE_LLM_TTL_SEGUNDOS, obtener_cache_respuestas_llm
+from sumon.cuota import obtener_registro_control_cuota
+from sumon.duplicados import obtener_indice_duplicados
+from sumon.enrutamiento import obtener_registro_salud_modelos
+from sumon.estructura import JerarquiaEstructura, cargar_estructura_con_cache
+from sumon.exportacion import FORMATOS_EXPORTACION, TIPOS_MIME_EXPORTACION, exportar_items
+from sumon.llm import ConfiguracionLLM
+from sumon.manual import (
+    MANUAL_MAX_CARACTERES_COMPLETO, MANUAL_PRESUPUESTO_TOKENS, MANUAL_TOP_K, construir_indice_manual, diferencia_manual,
+    leer_texto_manual, parametros_manual
+)
+from sumon.metricas import obtener_registro_metricas, resumen_cascada, resumen_metricas_por_modelo
+from sumon.pipeline import generar_lote_de_preguntas, generar_pregunta_con_seleccion
+from sumon.segundo_plano import ESTADO_EN_COLA, ESTADO_FALLIDO, PRIORIDAD_INTERACTIVA, obtener_ejecutor_segundo_plano
+from sumon.trabajos import obtener_almacen_trabajos
 
 # --- Configuración de la API de Gemini y OpenAI ---
 # Se recomienda usar st.secrets para API keys en despliegues reales
@@ -20,31 +34,38 @@ gemini_config_ok = False
 openai_config_ok = False
 
 if gemini_api_key:
-    try:
-        genai.configure(api_key=gemini_api_key)
-        gemini_config_ok = True
-        st.sidebar.success("API Key de Gemini configurada.")
-    except Exception as e:
-        st.sidebar.error(f"Error al configurar la API Key de Gemini: {e}")
+    gemini_config_ok = True
+    st.sidebar.success("API Key de Gemini configurada.")
 else:
     st.sidebar.warning("Por favor, ingresa tu API Key de Gemini para usar modelos Gemini.")
 
 if openai_api_key:
-    openai.api_key = openai_api_key
     openai_config_ok = True
     st.sidebar.success("API Key de OpenAI configurada.")
 else:
     st.sidebar.warning("Por favor, ingresa tu API Key de OpenAI para usar modelos GPT.")
 
+# --- Caché de respuestas ---
+st.sidebar.header("Caché de Respuestas")
+cache_llm_activa = st.sidebar.checkbox(
+    "Reutilizar respuestas en caché", value=True, key="cache_llm_activa",
+    help="Evita repetir llamadas idénticas al modelo (mismo proveedor, modelo y prompt). Por defecto solo se reutilizan las auditorías."
+)
+cache_generacion_activa = st.sidebar.checkbox(
+    "Reutilizar también la generación de ítems", value=False, key="cache_generacion_activa", disabled=not cache_llm_activa,
+    help="Si la activas, volver a generar la misma fila devuelve el mismo ítem guardado en caché en lugar de una variante nueva."
+)
+
 # --- Funciones de Lectura de Archivos (Adaptadas para Streamlit Uploader) ---
 @st.cache_data # Decorador de Streamlit para cachear los datos y no recargar el Excel/PDF cada vez
 def leer_excel_cargado(uploaded_file):
     """
-    Lee un archivo Excel cargado por Streamlit y lo carga en un DataFrame de pandas.
+    Lee un archivo Excel cargado por Streamlit y lo carga en un DataFrame de pandas
+    (solo las columnas que usa la aplicación, con caché columnar en disco).
     """
     if uploaded_file is not None:
         try:
-            df = pd.read_excel(uploaded_file)
+            df = cargar_estructura_con_cache(uploaded_file.getvalue())
             st.sidebar.success(f"Archivo Excel '{uploaded_file.name}' cargado exitosamente.")
             return df
         except Exception as e:
@@ -56,14 +77,12 @@ def leer_excel_cargado(uploaded_file):
 def leer_pdf_cargado(uploaded_file):
     """
     Lee el texto de un archivo PDF cargado por Streamlit.
+    Las páginas se extraen en paralelo y se separan con un salto de página; el resultado queda
+    en caché en disco según el hash del contenido del archivo.
     """
     if uploaded_file is not None:
         try:
-            texto_pdf = ""
-            # PyPDF2.PdfReader necesita un objeto tipo archivo binario
-            reader = PyPDF2.PdfReader(io.BytesIO(uploaded_file.read()))
-            for page_num in range(len(reader.pages)):
-                texto_pdf += reader.pages[page_num].extract_text()
+            texto_pdf = leer_texto_manual(uploaded_file.getvalue())
             st.sidebar.success(f"Archivo PDF '{uploaded_file.name}' leído exitosamente.")
             return texto_pdf
         except Exception as e:
@@ -71,461 +90,79 @@ def leer_pdf_cargado(uploaded_file):
             return ""
     return ""
 
-# --- Función para obtener la descripción de la taxonomía de Bloom ---
-def get_descripcion_bloom(proceso_cognitivo_elegido):
-    descripcion_bloom_map = {
-        "RECORDAR": "Recuperar información relevante desde la memoria de largo plazo.",
-        "COMPRENDER": "Construir significado a partir de información mediante interpretación, resumen, explicación u otras tareas.",
-        "APLICAR": "Usar procedimientos en situaciones conocidas o nuevas.",
-        "ANALIZAR": "Descomponer información y examinar relaciones entre partes.",
-        "EVALUAR": "Emitir juicios basados en criterios para valorar ideas o soluciones.",
-        "CREAR": "Generar nuevas ideas, productos o formas de reorganizar información."
-    }
-    return descripcion_bloom_map.get(str(proceso_cognitivo_elegido).upper(), "Descripción no disponible para este proceso cognitivo.")
-
-# --- Función para generar texto con Gemini o GPT ---
-def generar_texto_con_llm(model_type, model_name, prompt):
-    if model_type == "Gemini":
-        if not gemini_config_ok:
-            st.error("API Key de Gemini no configurada. No se puede generar texto con Gemini.")
-            return None
-        modelo = genai.GenerativeModel(model_name)
-        response = modelo.generate_content(prompt)
-        return response.text
-    elif model_type == "GPT":
-        if not openai_config_ok:
-            st.error("API Key de OpenAI no configurada. No se puede generar texto con GPT.")
-            return None
-        client = openai.OpenAI(api_key=openai.api_key)
-        response = client.chat.completions.create(
-            model=model_name,
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=2000 # Ajusta según necesidad
-        )
-        return response.choices[0].message.content
-    return None
-
-# --- Función para auditar el ítem generado ---
-def auditar_item_con_llm(model_type, model_name, item_generado, grado, area, asignatura, estacion, 
-                         proceso_cognitivo, nanohabilidad, microhabilidad, 
-                         competencia_nanohabilidad, contexto_educativo, manual_reglas_texto="", descripcion_bloom="", grafico_necesario="", descripcion_grafico=""):
-    """
-    Audita un ítem generado para verificar su cumplimiento con criterios específicos.
-    """
-    auditoria_prompt = f"""
-    Eres un experto en validación de ítems educativos, especializado en pruebas tipo ICFES y las directrices del equipo IMPROVE.
-    Tu tarea es AUDITAR RIGUROSAMENTE el siguiente ítem generado por un modelo de lenguaje.
-
-    Debes verificar que el ítem cumpla con TODOS los siguientes criterios, prestando especial atención a la alineación con los parámetros proporcionados y a las reglas de formato y contenido.
-
-    --- CRITERIOS DE AUDITORÍA ---
-    1.  **Formato del Enunciado:** ¿El enunciado está formulado como pregunta clara y directa, sin ambigüedades ni errores?
-    2.  **Número de Opciones:** ¿Hay exactamente 3 opciones (A, B, C)?
-    3.  **Respuesta Correcta Indicada:** ¿La sección 'RESPUESTA CORRECTA:' está claramente indicada y coincide con una de las opciones?
-    4.  **Diseño de Justificaciones:**
-        * ¿Hay justificaciones bien diferenciadas para CADA opción (A, B, C)?
-        * ¿La justificación de la opción **correcta** explica el razonamiento, procedimiento o estrategia relevante (NO por descarte)?
-        * ¿Las justificaciones de las opciones **incorrectas** están redactadas siguiendo el formato: “El estudiante podría escoger la opción X porque… Sin embargo, esto es incorrecto porque…”?
-    5.  **Estilo y Restricciones:** ¿No se usan negaciones mal redactadas, nombres reales, marcas, lugares reales, datos personales o frases vagas como “ninguna de las anteriores” o “todas las anteriores”?
-    6.  **Alineación del Contenido:** ¿El ítem (contexto, enunciado, opciones) está alineado EXCLUSIVAMENTE con los siguientes elementos temáticos y cognitivos?
-        * Grado: {grado}
-        * Área: {area}
-        * Asignatura: {asignatura}
-        * Estación o unidad temática: {estacion}
-        * Proceso Cognitivo (Taxonomía de Bloom): {proceso_cognitivo} (su descripción es "{descripcion_bloom}")
-        * Nanohabilidad (foco principal): {nanohabilidad}
-        * Microhabilidad (evidencia de aprendizaje): {microhabilidad}
-        * Competencia (asociada a Nanohabilidad): {competencia_nanohabilidad}
-        * Nivel educativo del estudiante: {contexto_educativo}
-    7.  **Gráfico (si aplica):** Si el ítem indica que requiere un gráfico, ¿la descripción del gráfico es clara, detallada y funcional para su futura creación?
-        * Gráfico Necesario: {grafico_necesario}
-        * Descripción del Gráfico: {descripcion_grafico if grafico_necesario == 'SÍ' else 'N/A'}
-
-    --- MANUAL DE REGLAS ADICIONAL ---
-    Las siguientes reglas son de suma importancia para la calidad y pertinencia del ítem. Debes asegurar que el ítem cumple con todas ellas.
-    {manual_reglas_texto}
-    -----------------------------------
-
-    ÍTEM A AUDITAR:
-    --------------------
-    {item_generado}
-    --------------------
-
-    Devuelve tu auditoría con este formato estructurado:
-
-    VALIDACIÓN DE CRITERIOS:
-    - Formato del Enunciado: [✅ / ❌] + Comentario (si ❌)
-    - Número de Opciones (3): [✅ / ❌]
-    - Respuesta Correcta Indicada: [✅ / ❌]
-    - Diseño de Justificaciones: [✅ / ⚠️ / ❌] + Observaciones (si ⚠️/❌)
-    - Estilo y Restricciones: [✅ / ⚠️ / ❌] + Observaciones (si ⚠️/❌)
-    - Alineación del Contenido: [✅ / ❌] + Comentario (si ❌)
-    - Gráfico (si aplica): [✅ / ⚠️ / ❌] + Observaciones (si ⚠️/❌)
-
-    DICTAMEN FINAL:
-    [✅ CUMPLE TOTALMENTE / ⚠️ CUMPLE PARCIALMENTE / ❌ RECHAZADO]
-
-    OBSERVACIONES FINALES:
-    [Explica de forma concisa qué aspectos necesitan mejora, si el dictamen no es ✅. Si es ✅, puedes indicar "El ítem cumple con todos los criterios."]
-    """
-    return generar_texto_con_llm(model_type, model_name, auditoria_prompt)
-
-# --- Función para generar preguntas usando el modelo de generación seleccionado ---
-def generar_pregunta_con_seleccion(gen_model_type, gen_model_name, audit_model_type, audit_model_name, 
-                                 fila_datos, criterios_generacion, manual_reglas_texto="", informacion_adicional_usuario=""):
-    """
-    Genera una pregunta educativa de opción múltiple usando el modelo de generación seleccionado
-    y la itera para refinarla si la auditoría lo requiere.
-    """
-    tipo_pregunta = criterios_generacion.get("tipo_pregunta", "opción múltiple con 3 opciones") 
-    dificultad = criterios_generacion.get("dificultad", "media")
-    contexto_educativo = criterios_generacion.get("contexto_educativo", "general")
-    formato_justificacion = criterios_generacion.get("formato_justificacion", """
-        • Justificación correcta: debe explicar el razonamiento o proceso cognitivo (NO por descarte).
-        • Justificaciones incorrectas: deben redactarse como: “El estudiante podría escoger la opción X porque… Sin embargo, esto es incorrecto porque…”
-    """)
-    
-    grado_elegido = fila_datos.get('GRADO', 'no especificado')
-    area_elegida = fila_datos.get('ÁREA', 'no especificada')
-    asignatura_elegida = fila_datos.get('ASIGNATURA', 'no especificada')
-    estacion_elegida = fila_datos.get('ESTACIÓN', 'no especificada')
-    proceso_cognitivo_elegido = fila_datos.get('PROCESO COGNITIVO', 'no especificado')
-    nanohabilidad_elegida = fila_datos.get('NANOHABILIDAD', 'no especificada')
-    microhabilidad_elegida = fila_datos.get('MICROHABILIDAD', 'no especificada')
-    competencia_nanohabilidad_elegida = fila_datos.get('COMPETENCIA NANOHABILIDAD', 'no especificada')
-
-    dato_para_pregunta_foco = nanohabilidad_elegida
-    descripcion_bloom = get_descripcion_bloom(proceso_cognitivo_elegido)
-
-    current_item_text = ""
-    auditoria_status = "❌ RECHAZADO" # Estado inicial
-    audit_observations = "" # Observaciones para el refinamiento
-    max_refinement_attempts = 5 # Número máximo de intentos de refinamiento
-    attempt = 0
-    grafico_necesario = "NO" # Valor por defecto
-    descripcion_grafico = "" # Valor por defecto
-
-    # Almacenar detalles de clasificación para el ítem
-    classification_details = {
-        "Grado": grado_elegido,
-        "Área": area_elegida,
-        "Asignatura": asignatura_elegida,
-        "Estación": estacion_elegida,
-        "Proceso Cognitivo": proceso_cognitivo_elegido,
-        "Nanohabilidad": nanohabilidad_elegida,
-        "Microhabilidad": microhabilidad_elegida,
-        "Competencia Nanohabilidad": competencia_nanohabilidad_elegida
-    }
-
-    item_final_data = None # Variable para guardar el ítem final (aprobado o la última versión auditada)
-
-    while auditoria_status != "✅ CUMPLE TOTALMENTE" and attempt < max_refinement_attempts:
-        attempt += 1
-        st.info(f"--- Generando/Refinando Ítem (Intento {attempt}/{max_refinement_attempts}) ---")
-
-        prompt_content_for_llm = f"""
-        Eres un diseñador experto en ítems de evaluación educativa, especializado en pruebas tipo ICFES u otras de alta calidad técnica.
-
-        Tu tarea es construir un ítem de {tipo_pregunta} con una única respuesta correcta, cumpliendo rigurosamente las reglas de construcción de ítems y alineado con el marco cognitivo de la Taxonomía de Bloom.
-
-        --- CONTEXTO Y PARÁMETROS DEL ÍTEM ---
-        - Grado: {grado_elegido}
-        - Área: {area_elegida}
-        - Asignatura: {asignatura_elegida}
-        - Estación o unidad temática: {estacion_elegida}
-        - Proceso cognitivo (Taxonomía de Bloom): {proceso_cognitivo_elegido}
-        - Descripción del proceso cognitivo:
-          "{descripcion_bloom}"
-        - Nanohabilidad (foco principal del ítem): {nanohabilidad_elegida}
-        - Nivel educativo esperado del estudiante: {contexto_educativo}
-        - Nivel de dificultad deseado: {dificultad}
-
-        --- INSTRUCCIONES PARA LA CONSTRUCCIÓN DEL ÍTEM ---
-        CONTEXTO DEL ÍTEM:
-        - Incluye una situación contextualizada, relevante y plausible para el grado y área indicada.
-        - La temática debe ser la de la {estacion_elegida}, y esto debe ser central, no una mera contextualización.
-        - La situación debe ser funcional: debe activar el pensamiento requerido por la nanohabilidad.
-        - Debe garantizarse que el proceso cognitivo corresponde fielmente a la descripción de la taxonomia de Bloom.
-        - Evita referencias a marcas, nombres propios, lugares reales o información personal identificable.
-
-        ENUNCIADO:
-        - Formula una pregunta clara, directa, sin ambigüedades ni tecnicismos innecesarios.
-        - Si utilizas negaciones, resáltalas en MAYÚSCULAS Y NEGRITA (por ejemplo: **NO ES**, **EXCEPTO**).
-        - Asegúrate de que el enunciado refleje el tipo de tarea cognitiva esperado según el proceso de Bloom.
-
-        OPCIONES DE RESPUESTA:
-        - Escribe exactamente tres opciones (A, B y C).
-        - Solo una opción debe ser correcta.
-        - Los distractores (respuestas incorrectas) deben estar bien diseñados: deben ser creíbles, funcionales y representar errores comunes o concepciones alternativas frecuentes.
-        - No utilices fórmulas vagas como “ninguna de las anteriores” o “todas las anteriores”.
-
-        JUSTIFICACIONES:
-        {formato_justificacion}
-
-        --- REGLAS ADICIONALES DEL MANUAL DE CONSTRUCCIÓN ---
-        Considera y aplica estrictamente todas las directrices, ejemplos y restricciones contenidas en el siguiente manual.
-        Esto es de suma importancia para la calidad y pertinencia del ítem.
-
-        Manual de Reglas:
-        {manual_reglas_texto}
-        ----------------------------------------------------
-
-        --- INFORMACIÓN ADICIONAL PROPORCIONADA POR EL USUARIO ---
-        {informacion_adicional_usuario if informacion_adicional_usuario else "No se proporcionó información adicional."}
-        ----------------------------------------------------------
-
-        --- DATO CLAVE PARA LA CONSTRUCCIÓN ---
-        Basado en el foco temático y el proceso cognitivo, considera el siguiente dato o idea esencial:
-        "{dato_para_pregunta_foco}"
-
-        --- INSTRUCCIONES ESPECÍFICAS DE SALIDA PARA GRÁFICO ---
-        Después del bloque de JUSTIFICACIONES, incluye la siguiente información para indicar si el ítem necesita un gráfico y cómo sería:
-        GRAFICO_NECESARIO: [SÍ/NO]
-        DESCRIPCION_GRAFICO: [Si GRAFICO_NECESARIO es SÍ, proporciona una descripción MUY DETALLADA del gráfico. Incluye: tipo de gráfico (ej. barras, líneas, circular, diagrama de flujo, imagen de un objeto), datos o rangos de valores, etiquetas de ejes, elementos clave, propósito del gráfico y cómo se relaciona con la pregunta. Si es NO, escribe N/A.]
-
-        --- FORMATO ESPERADO DE SALIDA ---
-        PREGUNTA: [Redacta aquí el enunciado de la pregunta]
-        A. [Opción A]  
-        B. [Opción B]  
-        C. [Opción C]  
-        RESPUESTA CORRECTA: [Letra de la opción correcta, por ejemplo: B]
-        JUSTIFICACIONES:  
-        A. [Explica por qué A es incorrecta o correcta]  
-        B. [Explica por qué B es incorrecta o correcta]  
-        C. [Explica por qué C es incorrecta o correcta]  
-        GRAFICO_NECESARIO: [SÍ/NO]
-        DESCRIPCION_GRAFICO: [Descripción detallada o N/A]
-        """
-        
-        # Si no es el primer intento, añade las observaciones de auditoría para refinamiento
-        if attempt > 1:
-            prompt_content_for_llm += f"""
-            --- RETROALIMENTACIÓN DE AUDITORÍA PARA REFINAMIENTO ---
-            El ítem anterior no cumplió con todos los criterios. Por favor, revisa las siguientes observaciones y mejora el ítem para abordarlas.
-            Observaciones del Auditor:
-            {audit_observations}
-            ---------------------------------------------------
-            """
-            # Agrega el ítem anterior para que el LLM lo pueda reformular
-            prompt_content_for_llm += f"""
-            --- ÍTEM ANTERIOR A REFINAR ---
-            {current_item_text}
-            -------------------------------
-            """
-
-        try:
-            with st.spinner(f"Generando contenido con IA ({gen_model_type} - {gen_model_name}, Intento {attempt})..."):
-                full_llm_response = generar_texto_con_llm(gen_model_type, gen_model_name, prompt_content_for_llm)
-                
-                if full_llm_response is None: # Si hubo un error en la generación con LLM
-                    st.error(f"Fallo en la generación de texto con {gen_model_type} ({gen_model_name}).")
-                    auditoria_status = "❌ RECHAZADO (Error de Generación)"
-                    audit_observations = "El modelo de generación no pudo producir una respuesta válida."
-                    break # Salir del bucle de refinamiento
-                
-                # --- Parsear la respuesta para extraer el ítem y la información del gráfico ---
-                item_and_graphic_match = re.search(r"(PREGUNTA:.*?)(GRAFICO_NECESARIO:\s*(SÍ|NO).*?DESCRIPCION_GRAFICO:.*)", full_llm_response, re.DOTALL)
-                
-                if item_and_graphic_match:
-                    current_item_text = item_and_graphic_match.group(1).strip()
-                    grafico_info_block = item_and_graphic_match.group(2).strip()
-                    
-                    grafico_necesario_match = re.search(r"GRAFICO_NECESARIO:\s*(SÍ|NO)", grafico_info_block)
-                    if grafico_necesario_match:
-                        grafico_necesario = grafico_necesario_match.group(1).strip()
-
-                    descripcion_grafico_match = re.search(r"DESCRIPCION_GRAFICO:\s*(.*)", grafico_info_block, re.DOTALL)
-                    if descripcion_grafico_match:
-                        descripcion_grafico = descripcion_grafico_match.group(1).strip()
-                        if descripcion_grafico.upper() == 'N/A':
-                            descripcion_grafico = ""
-                else:
-                    current_item_text = full_llm_response
-                    grafico_necesario = "NO"
-                    descripcion_grafico = ""
-                    st.warning("No se pudo parsear el formato de gráfico de la respuesta. Asumiendo que no requiere gráfico.")
-
-                st.subheader(f"Ítem Generado/Refinado (Intento {attempt}):")
-                st.markdown(current_item_text)
-                if grafico_necesario == "SÍ":
-                    st.info(f"**Gráfico Necesario:** SÍ")
-                    st.markdown(f"**Descripción del Gráfico:**\n{descripcion_grafico}")
-                else:
-                    st.info("**Gráfico Necesario:** NO")
-                st.markdown("---")
-            
-            with st.spinner(f"Auditando ítem ({audit_model_type} - {audit_model_name}, Intento {attempt})..."):
-                auditoria_resultado = auditar_item_con_llm(
-                    audit_model_type, audit_model_name,
-                    item_generado=current_item_text,
-                    grado=grado_elegido, area=area_elegida, asignatura=asignatura_elegida, estacion=estacion_elegida,
-                    proceso_cognitivo=proceso_cognitivo_elegido, nanohabilidad=nanohabilidad_elegida,
-                    microhabilidad=microhabilidad_elegida, competencia_nanohabilidad=competencia_nanohabilidad_elegida,
-                    contexto_educativo=contexto_educativo, manual_reglas_texto=manual_reglas_texto,
-                    descripcion_bloom=descripcion_bloom,
-                    grafico_necesario=grafico_necesario,
-                    descripcion_grafico=descripcion_grafico
-                )
-                if auditoria_resultado is None: # Si hubo un error en la auditoría con LLM
-                    st.error(f"Fallo en la auditoría con {audit_model_type} ({audit_model_name}).")
-                    auditoria_status = "❌ RECHAZADO (Error de Auditoría)"
-                    audit_observations = "El modelo de auditoría no pudo producir una respuesta válida."
-                    break # Salir del bucle de refinamiento
-
-                st.subheader("Resultado de Auditoría:")
-                st.markdown(auditoria_resultado)
-                st.markdown("---")
-
-            # --- Extraer DICTAMEN FINAL de forma más robusta ---
-            dictamen_final_match = re.search(r"DICTAMEN FINAL:\s*\[(.*?)]", auditoria_resultado, re.DOTALL)
-            if dictamen_final_match:
-                auditoria_status = dictamen_final_match.group(1).strip()
-            else:
-                auditoria_status = "❌ RECHAZADO (no se pudo extraer dictamen)"
-            
-            observaciones_start = auditoria_resultado.find("OBSERVACIONES FINALES:")
-            if observaciones_start != -1:
-                audit_observations = auditoria_resultado[observaciones_start + len("OBSERVACIONES FINALES:"):].strip()
-            else:
-                audit_observations = "No se pudieron extraer observaciones específicas del auditor. Posiblemente un error de formato en la respuesta del auditor."
-            
-            st.info(f"Dictamen extraído: {auditoria_status}. Observaciones: {audit_observations[:100]}...")
-
-            # Guardar los datos del ítem, incluyendo el estado final de la auditoría y observaciones
-            item_final_data = {
-                "item_text": current_item_text,
-                "classification": classification_details,
-                "grafico_necesario": grafico_necesario,
-                "descripcion_grafico": descripcion_grafico,
-                "final_audit_status": auditoria_status, # Guarda el estado final del intento
-                "final_audit_observations": audit_observations # Guarda las observaciones del intento
-            }
-
-            if auditoria_status == "✅ CUMPLE TOTALMENTE":
-                st.success(f"¡El ítem ha sido auditado y CUMPLE TOTALMENTE en el intento {attempt}!")
-                break # Sale del ciclo de refinamiento si es aprobado
-            else:
-                st.warning(f"El ítem necesita refinamiento. Dictamen: {auditoria_status}. Intentando de nuevo...")
-
-        except Exception as e:
-            st.error(f"Error durante la generación o auditoría (intento {attempt}): {e}")
-            audit_observations = f"Error técnico durante la generación: {e}. Por favor, corrige este problema."
-            auditoria_status = "❌ RECHAZADO (error técnico)" 
-            item_final_data = {
-                "item_text": current_item_text if current_item_text else "No se pudo generar el ítem debido a un error técnico.",
-                "classification": classification_details,
-                "grafico_necesario": "NO",
-                "descripcion_grafico": "",
-                "final_audit_status": auditoria_status,
-                "final_audit_observations": audit_observations
-            }
-            break # Sale del ciclo si hay un error técnico grave
+@st.cache_resource # Una sola jerarquía por libro (identificado por el hash de su contenido)
+def construir_jerarquia_estructura(_df_datos, huella_archivo):
+    return JerarquiaEstructura(_df_datos)
 
-    if item_final_data is None: 
-        st.error(f"No se pudo generar ningún ítem después de {max_refinement_attempts} intentos debido a fallas en la generación/auditoría.")
-        return [] # Retorna una lista vacía si no se logró generar nada en absoluto.
+# --- Progreso de los trabajos en segundo plano ---
+INTERVALO_SONDEO_TRABAJOS_S = 1.0 # Cada cuánto se refresca en la página el progreso de un trabajo en curso
 
-    return [item_final_data] # Siempre devuelve una lista con el último ítem procesado.
+# Identifica a la sesión del navegador ante el ejecutor de trabajos (compartido por todas las sesiones)
+id_sesion = st.session_state.setdefault('id_sesion', uuid.uuid4().hex)
 
-# --- Función para exportar preguntas a un documento Word ---
-def exportar_a_word(preguntas_procesadas_list):
+def mostrar_evento_progreso(evento):
+    """Muestra un evento de progreso de `generar_pregunta_con_seleccion` (salvo etapas y streaming)."""
+    if evento.tipo == "item":
+        st.subheader(evento.mensaje)
+        st.markdown(evento.datos["item_text"])
+        if evento.datos["grafico_necesario"] == "SÍ":
+            st.info("**Gráfico Necesario:** SÍ")
+            st.markdown(f"**Descripción del Gráfico:**\n{evento.datos['descripcion_grafico']}")
+        else:
+            st.info("**Gráfico Necesario:** NO")
+        st.markdown("---")
+    elif evento.tipo == "auditoria":
+        st.subheader(evento.mensaje)
+        st.markdown(evento.datos["texto"])
+        st.markdown("---")
+    elif evento.tipo == "detalle":
+        st.markdown(evento.mensaje)
+    elif evento.tipo not in ("etapa", "fin_etapa", "texto_parcial"):
+        mostrar = {"nota": st.caption, "advertencia": st.warning, "error": st.error, "exito": st.success}.get(evento.tipo, st.info)
+        mostrar(evento.mensaje)
+
+def mostrar_progreso_trabajo(trabajo):
     """
-    Exporta una lista de preguntas procesadas a un documento de Word (.docx) en memoria,
-    incluyendo sus detalles de clasificación, la descripción del gráfico si aplica,
-    y el dictamen final de la auditoría.
-    Returns: BytesIO object of the document.
+    Estado, avance y eventos de un trabajo en segundo plano. Con el trabajo en curso, la llamada
+    abierta al modelo se muestra con su texto acumulado en streaming.
     """
-    doc = docx.Document()
-    
-    doc.add_heading('Preguntas Generadas y Auditadas', level=1)
-    doc.add_paragraph('Este documento contiene los ítems generados por el sistema de IA y sus resultados de auditoría.')
-    doc.add_paragraph('') # Espacio en blanco
-
-    if not preguntas_procesadas_list:
-        doc.add_paragraph('No se procesaron ítems para este informe.')
-
-    for i, item_data in enumerate(preguntas_procesadas_list):
-        pregunta_texto = item_data["item_text"]
-        classification = item_data["classification"]
-        grafico_necesario = item_data.get("grafico_necesario", "NO")
-        descripcion_grafico = item_data.get("descripcion_grafico", "")
-        final_audit_status = item_data.get("final_audit_status", "N/A")
-        final_audit_observations = item_data.get("final_audit_observations", "No hay observaciones finales de auditoría.")
-
-        doc.add_heading(f'Ítem #{i+1}', level=2)
-        
-        # Añadir detalles de clasificación
-        doc.add_paragraph('--- Clasificación del Ítem ---') # Usando un estilo simple
-        for key, value in classification.items():
-            p = doc.add_paragraph()
-            run = p.add_run(f"{key}: ")
-            run.bold = True
-            p.add_run(str(value)) # Asegurar que el valor sea string
-
-        doc.add_paragraph('') # Espaciador
-        
-        # Añadir el texto de la pregunta y su formato
-        lines = pregunta_texto.split('\n')
-        for line in lines:
-            line = line.strip() # Limpiar espacios en blanco al inicio/final
-            if not line: # Saltar líneas vacías
-                continue
-
-            if line.startswith("PREGUNTA:"):
-                p = doc.add_paragraph()
-                run = p.add_run(line)
-                run.bold = True
-                run.font.size = docx.shared.Pt(12) # Opcional: fuente más grande para la pregunta
-            elif line.startswith("A.") or line.startswith("B.") or line.startswith("C."):
-                p = doc.add_paragraph(line)
-                p.paragraph_format.left_indent = docx.shared.Inches(0.5) # Indentar opciones
-            elif line.startswith("RESPUESTA CORRECTA:"):
-                p = doc.add_paragraph()
-                run = p.add_run(line)
-                run.bold = True
-            elif line.startswith("JUSTIFICACIONES:"):
-                p = doc.add_paragraph()
-                run = p.add_run(line)
-                run.bold = True
-            # No incluir GRAFICO_NECESARIO ni DESCRIPCION_GRAFICO directamente aquí, ya que se añaden aparte
-            # y estas líneas podrían venir de la respuesta cruda de Gemini.
-            elif line.startswith("GRAFICO_NECESARIO:") or line.startswith("DESCRIPCION_GRAFICO:"):
-                continue # Saltar estas líneas ya que las manejamos por separado
-            elif line.startswith("VALIDACIÓN DE CRITERIOS:") or line.startswith("DICTAMEN FINAL:") or line.startswith("OBSERVACIONES FINALES:"):
-                p = doc.add_paragraph()
-                run = p.add_run(line)
-                run.bold = True
-            elif line.startswith("✅") or line.startswith("⚠️") or line.startswith("❌"):
-                p = doc.add_paragraph(line)
-                p.paragraph_format.left_indent = docx.shared.Inches(0.25) # Indentar estado de auditoría
-            else:
-                doc.add_paragraph(line)
-        
-        # Añadir descripción del gráfico si es necesario
-        if grafico_necesario == "SÍ" and descripcion_grafico:
-            doc.add_paragraph('')
-            p = doc.add_paragraph()
-            run = p.add_run("--- Gráfico Sugerido ---")
-            run.bold = True
-            doc.add_paragraph(f"**Tipo y Descripción del Gráfico:** {descripcion_grafico}")
-            doc.add_paragraph('') # Espacio adicional
-
-        # Añadir el dictamen final y las observaciones de la auditoría para CADA ítem
-        doc.add_paragraph('')
-        p = doc.add_paragraph()
-        run = p.add_run("--- Resultado Final de Auditoría ---")
-        run.bold = True
-        doc.add_paragraph(f"**DICTAMEN FINAL:** {final_audit_status}")
-        doc.add_paragraph(f"**OBSERVACIONES FINALES:** {final_audit_observations}")
-        doc.add_paragraph('') # Espacio adicional
-
-        doc.add_page_break() # Separar cada pregunta con un salto de página
-
-    # Guardar el documento en un buffer en memoria
-    buffer = io.BytesIO()
-    doc.save(buffer)
-    buffer.seek(0) # Regresar al inicio del buffer
-    return buffer
+    if trabajo.estado == ESTADO_EN_COLA:
+        posicion = obtener_ejecutor_segundo_plano().posicion_en_cola(trabajo.id_trabajo)
+        st.info(f"Trabajo {trabajo.id_trabajo} en cola" + (f" ({posicion} por delante)." if posicion else "."))
+    elif trabajo.activo:
+        st.caption(f"Trabajo {trabajo.id_trabajo} en curso ({trabajo.duracion():.0f} s). Puedes seguir usando la página.")
+    avance = trabajo.avance
+    if avance is not None:
+        completados, total, mensaje = avance
+        st.progress(completados / total if total else 0.0)
+        st.info(f"Procesados {completados}/{total} ítems. {mensaje}")
+    eventos, _ = trabajo.eventos_desde(0)
+    etapa_abierta = None
+    for evento in eventos:
+        if evento.tipo == "etapa":
+            etapa_abierta = evento
+        elif evento.tipo == "fin_etapa":
+            etapa_abierta = None
+        else:
+            mostrar_evento_progreso(evento)
+    if etapa_abierta is not None and trabajo.activo:
+        st.info(f"⏳ {etapa_abierta.mensaje}")
+        texto_parcial = trabajo.texto_parcial
+        if texto_parcial:
+            st.markdown(texto_parcial + " ▌")
+
+@st.fragment(run_every=INTERVALO_SONDEO_TRABAJOS_S)
+def seguir_trabajo_en_curso(id_trabajo):
+    """Vuelve a dibujar solo este fragmento mientras el trabajo sigue activo; al terminar, toda la página."""
+    trabajo = obtener_ejecutor_segundo_plano().obtener(id_trabajo, sesion=id_sesion)
+    if trabajo is None or not trabajo.activo:
+        st.rerun()
+    mostrar_progreso_trabajo(trabajo)
+
+def trabajo_de_la_sesion(clave):
+    """El trabajo en segundo plano guardado en `st.session_state[clave]`, si sigue en el ejecutor."""
+    id_trabajo = st.session_state.get(clave)
+    return obtener_ejecutor_segundo_plano().obtener(id_trabajo, sesion=id_sesion) if id_trabajo else None
 
 # --- Interfaz de Usuario de Streamlit ---
 st.title("📚 Generador y Auditor de Ítems Educativos con IA 🧠")
@@ -538,17 +175,35 @@ uploaded_pdf_file = st.sidebar.file_uploader("Sube tu archivo PDF (Manual_constr
 
 df_datos = None
 manual_reglas_texto = ""
+indice_manual = None
+manual_trabajo = None # Huella y forma de envío del manual, guardadas con cada trabajo
 
 if uploaded_excel_file:
     df_datos = leer_excel_cargado(uploaded_excel_file)
+    huella_excel = hashlib.sha256(uploaded_excel_file.getvalue()).hexdigest()
 
 if uploaded_pdf_file:
     manual_reglas_texto = leer_pdf_cargado(uploaded_pdf_file)
-    max_manual_length = 15000 
-    if len(manual_reglas_texto) > max_manual_length:
-        st.sidebar.warning(f"Manual es demasiado largo ({len(manual_reglas_texto)} caracteres). Truncando a {max_manual_length} caracteres para la IA.")
-        manual_reglas_texto = manual_reglas_texto[:max_manual_length]
-    st.sidebar.info(f"Manual de reglas cargado. Longitud final: {len(manual_reglas_texto)} caracteres.")
+    usar_indice_manual = st.sidebar.checkbox(
+        "Enviar solo las secciones relevantes del manual", value=True, key="usar_indice_manual",
+        help="Indexa el manual completo y añade a cada prompt las secciones más relacionadas con el área, asignatura, nanohabilidad y proceso cognitivo de la fila. "
+             "Sin esta opción, el manual va en el prefijo estable de los prompts, que el proveedor sirve desde su caché en las llamadas siguientes del lote."
+    )
+    if usar_indice_manual and manual_reglas_texto:
+        manual_trabajo = parametros_manual(manual_reglas_texto)
+        indice_manual = construir_indice_manual(manual_reglas_texto)
+        manual_top_k = st.sidebar.slider("Secciones del manual por prompt", min_value=1, max_value=20, value=MANUAL_TOP_K, key="manual_top_k")
+        manual_presupuesto_tokens = st.sidebar.slider(
+            "Tokens máximos del manual por prompt", min_value=500, max_value=8000, value=MANUAL_PRESUPUESTO_TOKENS, step=250, key="manual_presupuesto_tokens"
+        )
+        st.sidebar.info(f"Manual de reglas indexado: {len(manual_reglas_texto)} caracteres en {len(indice_manual.secciones)} secciones.")
+    else:
+        max_manual_length = MANUAL_MAX_CARACTERES_COMPLETO
+        manual_trabajo = parametros_manual(manual_reglas_texto, max_manual_length)
+        if len(manual_reglas_texto) > max_manual_length:
+            st.sidebar.warning(f"Manual es demasiado largo ({len(manual_reglas_texto)} caracteres). Truncando a {max_manual_length} caracteres para la IA.")
+            manual_reglas_texto = manual_reglas_texto[:max_manual_length]
+        st.sidebar.info(f"Manual de reglas cargado. Longitud final: {len(manual_reglas_texto)} caracteres.")
 
 # --- Selección de Modelos ---
 st.sidebar.header("Configuración de Modelos de IA")
@@ -570,43 +225,189 @@ if audit_model_type == "Gemini":
     audit_model_name = st.sidebar.selectbox("Nombre del Modelo Gemini", ["gemini-1.5-flash", "gemini-1.5-pro"], key="audit_gemini_name")
 else: # GPT
     audit_model_name = st.sidebar.selectbox("Nombre del Modelo GPT", ["gpt-4o", "gpt-4-turbo", "gpt-3.5-turbo"], key="audit_gpt_name")
+auditor_rapido = st.sidebar.selectbox(
+    "Auditor rápido (cascada)", ["Ninguno", "Gemini - gemini-1.5-flash", "GPT - gpt-3.5-turbo"], key="auditor_rapido",
+    help="Audita primero con este modelo y acepta sus rechazos claros; los dictámenes parciales, los que no concuerdan con sus "
+         "criterios y las aprobaciones pasan al auditor principal. La concordancia entre ambos aparece en las métricas."
+)
+fraccion_verificacion_cascada = 0.1
+if auditor_rapido != "Ninguno":
+    fraccion_verificacion_cascada = st.sidebar.slider(
+        "Rechazos rápidos verificados por el auditor principal", min_value=0.0, max_value=1.0, value=0.1, step=0.05,
+        key="fraccion_verificacion_cascada", help="Muestra de rechazos claros que se auditan igual con el modelo principal para medir la concordancia."
+    )
+
+# Respaldo: cobertura de llamadas lentas y conmutación por error a otro modelo (idealmente de otro proveedor)
+st.sidebar.subheader("Modelos de Respaldo")
+OPCIONES_RESPALDO = ["Ninguno", "Gemini - gemini-1.5-flash", "Gemini - gemini-1.5-pro", "GPT - gpt-4o", "GPT - gpt-4-turbo", "GPT - gpt-3.5-turbo"]
+AYUDA_RESPALDO = ("Si el modelo principal tarda más que su latencia p95 observada, se envía la misma petición a este modelo y se usa "
+                  "la primera respuesta; si el principal falla, la llamada se repite aquí. Requiere la API Key de su proveedor.")
+respaldo_generacion = st.sidebar.selectbox("Respaldo del generador", OPCIONES_RESPALDO, key="respaldo_generacion", help=AYUDA_RESPALDO)
+respaldo_auditoria = st.sidebar.selectbox("Respaldo del auditor", OPCIONES_RESPALDO, key="respaldo_auditoria", help=AYUDA_RESPALDO)
+
+streaming_llm_activo = st.sidebar.checkbox(
+    "Mostrar las respuestas en streaming", value=True, key="streaming_llm_activo",
+    help="Muestra el texto a medida que llega y cancela la petición en cuanto la salida se desvía del formato esperado."
+)
+
+refinamiento_compacto_activo = st.sidebar.checkbox(
+    "Refinamiento compacto", value=True, key="refinamiento_compacto_activo",
+    help="En los reintentos envía solo el ítem anterior, los criterios que fallaron y las reglas del manual relacionadas, en lugar del prompt completo."
+)
+
+salida_estructurada_activa = st.sidebar.checkbox(
+    "Salida estructurada (JSON)", value=False, key="salida_estructurada_activa",
+    help="Pide a los modelos el ítem y la auditoría como JSON según un esquema, en lugar de extraerlos del texto con expresiones regulares."
+)
+
+candidatos_por_ronda = st.sidebar.number_input(
+    "Candidatos en paralelo por intento", min_value=1, max_value=6, value=1, step=1, key="candidatos_por_ronda",
+    help="Genera y audita varios candidatos a la vez en cada intento y se queda con el primero aprobado. Reduce el tiempo hasta obtener un ítem aprobado a cambio de más llamadas."
+)
+max_llamadas_por_item = st.sidebar.number_input(
+    "Máximo de llamadas al modelo por ítem (0 = sin límite)", min_value=0, max_value=100, value=0, step=1, key="max_llamadas_por_item",
+    help="Tope de costo: cuenta las llamadas de generación y de auditoría de todos los candidatos."
+)
+
+reutilizar_banco_activo = st.sidebar.checkbox(
+    "Reutilizar ítems aprobados del banco", value=False, key="reutilizar_banco_activo",
+    help="Si el banco ya tiene un ítem aprobado con la misma clasificación, se usa ese ítem en lugar de generar uno nuevo (también en los lotes)."
+)
+detectar_duplicados_activo = st.sidebar.checkbox(
+    "Regenerar ítems casi duplicados", value=True, key="detectar_duplicados_activo",
+    help="Compara cada ítem nuevo con los ya aprobados y con los demás candidatos de su ronda antes de auditarlo; si es casi idéntico a alguno, se vuelve a generar pidiendo que se diferencie."
+)
+
+# API keys y preferencias que el núcleo recibe en cada llamada (no hay estado global compartido entre sesiones)
+configuracion_llm = ConfiguracionLLM(
+    gemini_api_key=gemini_api_key, openai_api_key=openai_api_key,
+    usar_cache=cache_llm_activa, cachear_generacion=cache_generacion_activa, streaming=streaming_llm_activo
+)
+
+# Estado del control de cuota por modelo (concurrencia adaptativa y reintentos)
+resumen_cuota = obtener_registro_control_cuota().resumen()
+if resumen_cuota:
+    with st.sidebar.expander("Estado de cuota por modelo"):
+        st.dataframe(pd.DataFrame(resumen_cuota).T)
+
+# Salud de cada modelo (latencias, fallos, coberturas y conmutaciones)
+resumen_salud = obtener_registro_salud_modelos().resumen()
+if resumen_salud:
+    with st.sidebar.expander("Salud de los modelos"):
+        st.dataframe(pd.DataFrame(resumen_salud).T)
+
+# Trabajos en segundo plano de todas las sesiones
+resumen_ejecutor = obtener_ejecutor_segundo_plano().resumen()
+if resumen_ejecutor["en_curso"] or resumen_ejecutor["en_cola"]:
+    st.sidebar.caption(
+        f"Trabajos en segundo plano: {resumen_ejecutor['en_curso']} en curso, {resumen_ejecutor['en_cola']} en cola "
+        f"({resumen_ejecutor['hilos']} hilos para {resumen_ejecutor['sesiones_activas']} sesiones)."
+    )
+
+# Estado de la caché de respuestas
+cache_respuestas_llm = obtener_cache_respuestas_llm()
+st.sidebar.caption(f"Respuestas en caché: {cache_respuestas_llm.contar()} (válidas por {CACHE_LLM_TTL_SEGUNDOS // 86400} días)")
+if st.sidebar.button("Vaciar caché de respuestas"):
+    cache_respuestas_llm.vaciar()
+    st.sidebar.success("Caché de respuestas vaciada.")
+
+# --- Vista de métricas de rendimiento ---
+st.sidebar.header("Vista")
+vista_app = st.sidebar.radio("Mostrar", ["Generador", "Métricas de rendimiento"], key="vista_app")
+if vista_app == "Métricas de rendimiento":
+    registro_metricas = obtener_registro_metricas()
+    df_llamadas = registro_metricas.llamadas_df()
+    df_items_metricas = registro_metricas.items_df()
+    df_cascada = registro_metricas.cascada_df()
+    st.header("Métricas de Rendimiento")
+    if df_llamadas.empty:
+        st.info("Todavía no hay llamadas registradas en este proceso.")
+    else:
+        st.subheader("Llamadas por modelo")
+        st.dataframe(resumen_metricas_por_modelo(df_llamadas), use_container_width=True)
+        st.caption(
+            f"Costo estimado total: US$ {df_llamadas['costo_usd'].sum():.4f} en {len(df_llamadas)} llamadas. "
+            f"Tokens de prompt servidos desde la caché de prefijos del proveedor: {int(df_llamadas['tokens_cacheados'].sum())} "
+            f"de {int(df_llamadas['tokens_prompt'].sum())}."
+        )
+        if "etapa" in df_llamadas:
+            st.subheader("Llamadas por etapa")
+            st.dataframe(
+                df_llamadas.groupby("etapa").agg(
+                    llamadas=("latencia_s", "size"), latencia_p50_s=("latencia_s", "median"),
+                    latencia_p95_s=("latencia_s", lambda latencias: latencias.quantile(0.95)),
+                    tokens_prompt=("tokens_prompt", "sum"), tokens_cacheados=("tokens_cacheados", "sum"),
+                    costo_usd=("costo_usd", "sum")
+                ).round(4),
+                use_container_width=True
+            )
+    if not df_items_metricas.empty:
+        st.subheader("Ítems")
+        aprobados = df_items_metricas[df_items_metricas["aprobado"]]
+        col_items, col_aprobacion, col_intentos = st.columns(3)
+        col_items.metric("Ítems procesados", len(df_items_metricas))
+        col_aprobacion.metric("Tasa de aprobación", f"{len(aprobados) / len(df_items_metricas):.0%}")
+        col_intentos.metric("Intentos hasta aprobar (media)", f"{aprobados['intentos_hasta_aprobacion'].mean():.2f}" if not aprobados.empty else "—")
+        st.dataframe(df_items_metricas, use_container_width=True)
+    if not df_cascada.empty:
+        st.subheader("Auditoría en cascada")
+        col_auditorias, col_escaladas, col_concordancia = st.columns(3)
+        col_auditorias.metric("Auditorías rápidas", len(df_cascada))
+        col_escaladas.metric("Escaladas al auditor principal", f"{df_cascada['escalada'].mean():.0%}")
+        comparadas = df_cascada["concuerda"].dropna()
+        col_concordancia.metric("Concordancia entre auditores", f"{comparadas.astype(float).mean():.0%}" if not comparadas.empty else "—")
+        st.dataframe(resumen_cascada(df_cascada), use_container_width=True)
+        st.caption("Si la concordancia de los rechazos rápidos verificados es baja, conviene subir la fracción verificada o cambiar de auditor rápido.")
+
+    for nombre_registro, df_registro in (("llamadas", df_llamadas), ("items", df_items_metricas), ("cascada", df_cascada)):
+        if df_registro.empty:
+            continue
+        col_csv, col_jsonl = st.columns(2)
+        col_csv.download_button(
+            f"Descargar {nombre_registro} (CSV)", df_registro.to_csv(index=False).encode("utf-8"),
+            file_name=f"metricas_{nombre_registro}.csv", mime="text/csv", key=f"csv_{nombre_registro}"
+        )
+        col_jsonl.download_button(
+            f"Descargar {nombre_registro} (JSONL)", df_registro.to_json(orient="records", lines=True, force_ascii=False).encode("utf-8"),
+            file_name=f"metricas_{nombre_registro}.jsonl", mime="application/x-ndjson", key=f"jsonl_{nombre_registro}"
+        )
+    if st.button("Vaciar métricas"):
+        registro_metricas.vaciar()
+        st.rerun()
+    st.stop()
 
 
 # --- Lógica Principal de la Aplicación ---
 if df_datos is not None and (gemini_config_ok or openai_config_ok):
     st.header("Selecciona los Criterios para la Generación")
 
-    # Obtener valores únicos para cada columna para los selectbox
-    all_grades = df_datos['GRADO'].dropna().unique().tolist()
-    grado_seleccionado = st.selectbox("Grado", sorted(all_grades), key="grado_sel")
-
-    # Filtrar el DataFrame según la selección del grado
-    df_filtrado_grado = df_datos[df_datos['GRADO'].astype(str).str.upper() == str(grado_seleccionado).upper()]
-    all_areas = df_filtrado_grado['ÁREA'].dropna().unique().tolist()
-    area_seleccionada = st.selectbox("Área", sorted(all_areas), key="area_sel")
-
-    # Filtrar según la selección del área
-    df_filtrado_area = df_filtrado_grado[df_filtrado_grado['ÁREA'].astype(str).str.upper() == str(area_seleccionada).upper()]
-    all_asignaturas = df_filtrado_area['ASIGNATURA'].dropna().unique().tolist()
-    asignatura_seleccionada = st.selectbox("Asignatura", sorted(all_asignaturas), key="asignatura_sel")
-
-    # Filtrar según la selección de asignatura
-    df_filtrado_asignatura = df_filtrado_area[df_filtrado_area['ASIGNATURA'].astype(str).str.upper() == str(asignatura_seleccionada).upper()]
-    all_estaciones = df_filtrado_asignatura['ESTACIÓN'].dropna().unique().tolist()
-    estacion_seleccionada = st.selectbox("Estación", sorted(all_estaciones), key="estacion_sel")
-
-    # Filtrar según la selección de estación
-    df_filtrado_estacion = df_filtrado_asignatura[df_filtrado_asignatura['ESTACIÓN'].astype(str).str.upper() == str(estacion_seleccionada).upper()]
-    all_procesos = df_filtrado_estacion['PROCESO COGNITIVO'].dropna().unique().tolist()
-    proceso_cognitivo_seleccionado = st.selectbox("Proceso Cognitivo", sorted(all_procesos), key="proceso_sel")
-
-    # Filtrar según la selección de proceso cognitivo
-    df_filtrado_proceso = df_filtrado_estacion[df_filtrado_estacion['PROCESO COGNITIVO'].astype(str).str.upper() == str(proceso_cognitivo_seleccionado).upper()]
-    all_nanohabilidades = df_filtrado_proceso['NANOHABILIDAD'].dropna().unique().tolist()
-    nanohabilidad_seleccionada = st.selectbox("Nanohabilidad", sorted(all_nanohabilidades), key="nanohabilidad_sel")
+    # Las opciones de cada selector salen de la jerarquía precalculada del libro
+    jerarquia = construir_jerarquia_estructura(df_datos, huella_excel)
+    grado_seleccionado = st.selectbox("Grado", jerarquia.opciones(), key="grado_sel")
+    area_seleccionada = st.selectbox("Área", jerarquia.opciones(grado_seleccionado), key="area_sel")
+    asignatura_seleccionada = st.selectbox(
+        "Asignatura", jerarquia.opciones(grado_seleccionado, area_seleccionada), key="asignatura_sel"
+    )
+    estacion_seleccionada = st.selectbox(
+        "Estación", jerarquia.opciones(grado_seleccionado, area_seleccionada, asignatura_seleccionada), key="estacion_sel"
+    )
+    proceso_cognitivo_seleccionado = st.selectbox(
+        "Proceso Cognitivo",
+        jerarquia.opciones(grado_seleccionado, area_seleccionada, asignatura_seleccionada, estacion_seleccionada),
+        key="proceso_sel"
+    )
+    nanohabilidad_seleccionada = st.selectbox(
+        "Nanohabilidad",
+        jerarquia.opciones(grado_seleccionado, area_seleccionada, asignatura_seleccionada, estacion_seleccionada, proceso_cognitivo_seleccionado),
+        key="nanohabilidad_sel"
+    )
+    seleccion_jerarquia = (
+        grado_seleccionado, area_seleccionada, asignatura_seleccionada,
+        estacion_seleccionada, proceso_cognitivo_seleccionado, nanohabilidad_seleccionada
+    )
 
-    # Después de todas las selecciones, se filtra el DataFrame final
-    df_item_seleccionado = df_filtrado_proceso[df_filtrado_proceso['NANOHABILIDAD'].astype(str).str.upper() == str(nanohabilidad_seleccionada).upper()]
+    # Después de todas las selecciones, se obtienen las filas finales
+    df_item_seleccionado = jerarquia.filtrar(df_datos, *seleccion_jerarquia)
 
     if df_item_seleccionado.empty:
         st.warning("No se encontraron datos en el Excel para la combinación de criterios seleccionada.")
@@ -623,8 +424,113 @@ if df_datos is not None and (gemini_config_ok or openai_config_ok):
     if opcion_info_adicional == "Sí":
         informacion_adicional_usuario = st.text_area("Escribe la información adicional que deseas incluir:", key="info_ad_text")
 
+    # Preparar los criterios de generación (compartidos por el modo individual y el modo por lote)
+    criterios_para_preguntas = {
+        "tipo_pregunta": "opción múltiple con 3 opciones", 
+        "dificultad": "media", # Se podría hacer seleccionable también
+        "num_preguntas": 1, 
+        "contexto_educativo": "estudiantes de preparatoria (bachillerato)", # Se podría hacer seleccionable
+        "formato_justificacion": """
+            • Justificación correcta: debe explicar el razonamiento o proceso cognitivo (NO por descarte).
+            • Justificaciones incorrectas: deben redactarse como: “El estudiante podría escoger la opción X porque… Sin embargo, esto es incorrecto porque…”
+        """,
+        "refinamiento_compacto": refinamiento_compacto_activo,
+        "salida_estructurada": salida_estructurada_activa,
+        "candidatos_por_ronda": candidatos_por_ronda,
+        "max_llamadas_por_item": max_llamadas_por_item or None,
+        "reutilizar_banco": reutilizar_banco_activo,
+        "detectar_duplicados": detectar_duplicados_activo,
+        "modelo_respaldo_generacion": None if respaldo_generacion == "Ninguno" else respaldo_generacion.split(" - "),
+        "modelo_respaldo_auditoria": None if respaldo_auditoria == "Ninguno" else respaldo_auditoria.split(" - "),
+        "modelo_auditoria_rapida": None if auditor_rapido == "Ninguno" else auditor_rapido.split(" - "),
+        "fraccion_verificacion_cascada": fraccion_verificacion_cascada
+    }
+    if indice_manual is not None:
+        criterios_para_preguntas["manual_top_k"] = manual_top_k
+        criterios_para_preguntas["manual_presupuesto_tokens"] = manual_presupuesto_tokens
+    # Lo que se guarda con cada trabajo para poder reanudarlo con los mismos modelos y criterios
+    parametros_trabajo = {
+        "gen_modelo": [gen_model_type, gen_model_name], "audit_modelo": [audit_model_type, audit_model_name],
+        "criterios_generacion": criterios_para_preguntas, "informacion_adicional_usuario": informacion_adicional_usuario,
+        "manual": manual_trabajo
+    }
+
+    def enviar_trabajo_lote(id_trabajo, df_filas=None, descripcion=""):
+        """
+        Procesa (o reanuda) un trabajo del almacén en segundo plano; su progreso se sigue en la
+        sección «Generación por Lote» aunque la página se vuelva a ejecutar.
+        """
+        parametros = obtener_almacen_trabajos().parametros(id_trabajo)
+
+        def _procesar_lote(trabajo):
+            def _registrar_avance_lote(completados, total, item_data):
+                dictamen = item_data.get('final_audit_status', 'N/A') if item_data else "sin resultado"
+                trabajo.registrar_avance(completados, total, f"Último dictamen: {dictamen}")
+
+            return generar_lote_de_preguntas(
+                *parametros["gen_modelo"], *parametros["audit_modelo"],
+                df_filas=df_filas,
+                criterios_generacion=parametros["criterios_generacion"],
+                manual_reglas_texto=manual_reglas_texto,
+                informacion_adicional_usuario=parametros["informacion_adicional_usuario"],
+                max_concurrencia=max_concurrencia_lote,
+                al_avanzar=_registrar_avance_lote,
+                indice_manual=indice_manual,
+                configuracion=configuracion_llm,
+                id_trabajo=id_trabajo,
+                banco_items=obtener_banco_items(),
+                indice_duplicados=obtener_indice_duplicados(),
+                limite_filas=obtener_ejecutor_segundo_plano().limite_filas_lote
+            )
+
+        trabajo = obtener_ejecutor_segundo_plano().enviar(_procesar_lote, id_sesion, descripcion=descripcion or id_trabajo)
+        st.session_state['trabajo_lote'] = trabajo.id_trabajo
+        st.session_state['trabajo_lote_almacen'] = id_trabajo
+
+    # --- Ítems ya aprobados en el banco para la misma clasificación ---
+    banco_items = obtener_banco_items()
+    aprobados_en_banco = banco_items.aprobados_para(dict(zip(COLUMNAS_CLASIFICACION, seleccion_jerarquia)))
+    if aprobados_en_banco:
+        st.subheader(f"Ítems aprobados en el banco para esta selección ({len(aprobados_en_banco)})")
+        st.caption("Puedes usar uno de ellos directamente en lugar de generar un ítem nuevo.")
+        for item_banco in aprobados_en_banco:
+            with st.expander(f"Ítem #{item_banco['id_banco']} del banco"):
+                st.markdown(item_banco['item_text'])
+                if st.button("Usar este ítem", key=f"usar_banco_{item_banco['id_banco']}"):
+                    banco_items.registrar_uso(item_banco['id_banco'])
+                    st.session_state['last_processed_item_data'] = item_banco
+                    st.success("Ítem del banco listo para exportar.")
+
+    def mostrar_item_procesado(item_procesado):
+        """Dictamen final, clasificación y gráfico del ítem individual ya procesado."""
+        if item_procesado.get('final_audit_status') == "✅ CUMPLE TOTALMENTE":
+            st.success("¡Ítem generado y aprobado por el auditor! Listo para exportar.")
+        else:
+            st.warning(f"Ítem generado pero NO aprobado por el auditor. Dictamen final: {item_procesado.get('final_audit_status')}. Se guardará la última versión con observaciones.")
+
+        st.subheader("Último Ítem Procesado:")
+        st.markdown(item_procesado['item_text'])
+        st.write("--- Clasificación ---")
+        for key, value in item_procesado['classification'].items():
+            st.write(f"- **{key}**: {value}")
+
+        if item_procesado['grafico_necesario'] == "SÍ":
+            st.write("--- Gráfico Sugerido ---")
+            st.write(f"**Descripción del Gráfico:** {item_procesado['descripcion_grafico']}")
+
+        st.write("--- Resultado Final de Auditoría ---")
+        st.write(f"**DICTAMEN FINAL:** {item_procesado['final_audit_status']}")
+        st.write(f"**OBSERVACIONES FINALES:** {item_procesado['final_audit_observations']}")
+        tokens_por_intento = item_procesado.get('tokens_prompt_por_intento', [])
+        if tokens_por_intento:
+            st.caption("Tokens estimados del prompt de generación por intento: " + ", ".join(f"#{i + 1}: {t}" for i, t in enumerate(tokens_por_intento)))
+        st.markdown("---")
+
     # --- Botón para Generar y Auditar ---
-    if st.button("Generar y Auditar Ítem"):
+    # La generación corre en segundo plano: la página envía el trabajo y sigue su progreso, de modo
+    # que cambiar un widget o recargar no la interrumpe
+    trabajo_individual = trabajo_de_la_sesion('trabajo_individual')
+    if st.button("Generar y Auditar Ítem", disabled=trabajo_individual is not None and trabajo_individual.activo):
         if df_item_seleccionado.empty:
             st.error("Por favor, selecciona criterios válidos que resulten en datos para generar el ítem.")
         elif (gen_model_type == "Gemini" and not gemini_config_ok) or (gen_model_type == "GPT" and not openai_config_ok):
@@ -632,82 +538,235 @@ if df_datos is not None and (gemini_config_ok or openai_config_ok):
         elif (audit_model_type == "Gemini" and not gemini_config_ok) or (audit_model_type == "GPT" and not openai_config_ok):
             st.error(f"Por favor, configura la API Key para el modelo de auditoría ({audit_model_type}).")
         else:
-            st.markdown("---")
-            st.info("Iniciando generación y auditoría del ítem. Esto puede tardar unos momentos...")
-
-            # Preparar los criterios de generación para la función
-            criterios_para_preguntas = {
-                "tipo_pregunta": "opción múltiple con 3 opciones", 
-                "dificultad": "media", # Se podría hacer seleccionable también
-                "num_preguntas": 1, 
-                "contexto_educativo": "estudiantes de preparatoria (bachillerato)", # Se podría hacer seleccionable
-                "formato_justificacion": """
-                    • Justificación correcta: debe explicar el razonamiento o proceso cognitivo (NO por descarte).
-                    • Justificaciones incorrectas: deben redactarse como: “El estudiante podría escoger la opción X porque… Sin embargo, esto es incorrecto porque…”
-                """
-            }
-
-            # Llamar a la función para generar y auditar el ítem
-            item_procesado_individual = generar_pregunta_con_seleccion( # Se actualiza el nombre de la función
-                gen_model_type, gen_model_name, audit_model_type, audit_model_name, # Pasa los tipos y nombres de modelos
-                fila_datos=df_item_seleccionado.iloc[0], 
-                criterios_generacion=criterios_para_preguntas,
-                manual_reglas_texto=manual_reglas_texto,
-                informacion_adicional_usuario=informacion_adicional_usuario
+            # El ítem queda en el almacén de trabajos (con un punto de control por intento) para
+            # poder recuperarlo tras reiniciar el servidor
+            almacen_trabajos = obtener_almacen_trabajos()
+            fila_individual = df_item_seleccionado.iloc[0]
+            id_trabajo_individual = almacen_trabajos.crear_trabajo(
+                [fila_individual], parametros=parametros_trabajo,
+                descripcion=f"Ítem individual: {nanohabilidad_seleccionada}"
             )
 
-            # Almacenar el resultado del procesamiento en el estado de la sesión
-            if item_procesado_individual: # Si se procesó y obtuvo un resultado (aprobado o no)
-                st.session_state['last_processed_item_data'] = item_procesado_individual[0] # Guardamos el diccionario directamente
-                
-                if item_procesado_individual[0].get('final_audit_status') == "✅ CUMPLE TOTALMENTE":
-                    st.success("¡Ítem generado y aprobado por el auditor! Listo para exportar.")
-                else:
-                    st.warning(f"Ítem generado pero NO aprobado por el auditor. Dictamen final: {item_procesado_individual[0].get('final_audit_status')}. Se guardará la última versión con observaciones.")
-                
-                st.subheader("Último Ítem Procesado:")
-                st.markdown(item_procesado_individual[0]['item_text'])
-                st.write("--- Clasificación ---")
-                for key, value in item_procesado_individual[0]['classification'].items():
-                    st.write(f"- **{key}**: {value}")
-                
-                if item_procesado_individual[0]['grafico_necesario'] == "SÍ":
-                    st.write("--- Gráfico Sugerido ---")
-                    st.write(f"**Descripción del Gráfico:** {item_procesado_individual[0]['descripcion_grafico']}")
-                
-                st.write("--- Resultado Final de Auditoría ---")
-                st.write(f"**DICTAMEN FINAL:** {item_procesado_individual[0]['final_audit_status']}")
-                st.write(f"**OBSERVACIONES FINALES:** {item_procesado_individual[0]['final_audit_observations']}")
-                st.markdown("---")
+            def _procesar_item_individual(trabajo):
+                item_procesado_individual = generar_pregunta_con_seleccion( # Se actualiza el nombre de la función
+                    gen_model_type, gen_model_name, audit_model_type, audit_model_name, # Pasa los tipos y nombres de modelos
+                    fila_datos=fila_individual,
+                    criterios_generacion=criterios_para_preguntas,
+                    manual_reglas_texto=manual_reglas_texto,
+                    informacion_adicional_usuario=informacion_adicional_usuario,
+                    al_progresar=trabajo.publicar,
+                    indice_manual=indice_manual,
+                    configuracion=configuracion_llm,
+                    punto_control=almacen_trabajos.punto_control(id_trabajo_individual, 0),
+                    banco_items=banco_items,
+                    indice_duplicados=obtener_indice_duplicados()
+                )
+                item_data = item_procesado_individual[0] if item_procesado_individual else None
+                almacen_trabajos.completar_fila(id_trabajo_individual, 0, item_data)
+                return item_data
+
+            trabajo_individual = obtener_ejecutor_segundo_plano().enviar(
+                _procesar_item_individual, id_sesion,
+                descripcion=f"Ítem individual: {nanohabilidad_seleccionada}", prioridad=PRIORIDAD_INTERACTIVA
+            )
+            st.session_state['trabajo_individual'] = trabajo_individual.id_trabajo
 
+    if trabajo_individual is not None:
+        st.markdown("---")
+        if trabajo_individual.activo:
+            st.info("Generando y auditando el ítem en segundo plano. Esto puede tardar unos momentos...")
+            seguir_trabajo_en_curso(trabajo_individual.id_trabajo)
+        else:
+            # El resultado pasa a la sesión una sola vez, para no pisar después un ítem elegido del banco
+            if st.session_state.get('trabajo_individual_recogido') != trabajo_individual.id_trabajo:
+                st.session_state['trabajo_individual_recogido'] = trabajo_individual.id_trabajo
+                st.session_state['last_processed_item_data'] = trabajo_individual.resultado
+            with st.expander(f"Detalle de la generación y auditoría ({trabajo_individual.duracion():.0f} s)"):
+                mostrar_progreso_trabajo(trabajo_individual)
+            if trabajo_individual.estado == ESTADO_FALLIDO:
+                st.error(f"La generación del ítem falló: {trabajo_individual.error}")
+            elif trabajo_individual.resultado:
+                mostrar_item_procesado(trabajo_individual.resultado)
             else: # Si la función generador_preguntas_con_llm devolvió una lista vacía o None
                 st.error("No se pudo generar ni procesar el ítem. Verifica tus entradas y la conexión a la IA.")
-                st.session_state['last_processed_item_data'] = None # No hay ítem para guardar
-    
-    # --- Sección de Exportación a Word (Siempre visible al final) ---
-    st.header("Exportar a Documento Word")
-
-    if 'last_processed_item_data' in st.session_state and st.session_state['last_processed_item_data'] is not None:
-        st.write("Hay un ítem procesado disponible para exportar (aprobado o la última versión con observaciones).")
-        nombre_archivo_word = st.text_input("Ingresa el nombre deseado para el archivo Word (sin la extensión .docx):", key="word_filename")
+
+    # --- Generación por Lote ---
+    st.header("Generación por Lote")
+    st.write("Genera y audita un ítem por cada fila de la estructura dentro del alcance elegido.")
+    # Cada alcance corresponde a cuántos niveles de la selección actual se respetan
+    alcances_lote = {
+        "Nanohabilidad seleccionada": 6,
+        "Proceso cognitivo seleccionado": 5,
+        "Estación seleccionada": 4,
+        "Asignatura seleccionada": 3,
+        "Área seleccionada": 2,
+        "Grado seleccionado": 1,
+        "Todo el libro": 0
+    }
+    alcance_lote = st.selectbox("Alcance del lote", list(alcances_lote.keys()), key="alcance_lote")
+    df_lote = jerarquia.filtrar(df_datos, *seleccion_jerarquia[:alcances_lote[alcance_lote]])
+    max_concurrencia_lote = st.number_input(
+        "Máximo de ítems en paralelo", min_value=1, max_value=16, value=4, step=1, key="concurrencia_lote",
+        help="Límite de llamadas simultáneas a los modelos. Redúcelo si el proveedor devuelve errores de cuota. "
+             "Los lotes de todas las sesiones comparten además un tope común, para no quitarle cupo a los ítems individuales."
+    )
+    st.write(f"Filas a procesar: **{len(df_lote)}**")
+
+    trabajo_lote = trabajo_de_la_sesion('trabajo_lote')
+    lote_en_curso = trabajo_lote is not None and trabajo_lote.activo
+    if st.button("Generar y Auditar Lote", disabled=lote_en_curso):
+        if df_lote.empty:
+            st.error("El alcance seleccionado no contiene filas para generar ítems.")
+        elif (gen_model_type == "Gemini" and not gemini_config_ok) or (gen_model_type == "GPT" and not openai_config_ok):
+            st.error(f"Por favor, configura la API Key para el modelo de generación ({gen_model_type}).")
+        elif (audit_model_type == "Gemini" and not gemini_config_ok) or (audit_model_type == "GPT" and not openai_config_ok):
+            st.error(f"Por favor, configura la API Key para el modelo de auditoría ({audit_model_type}).")
+        else:
+            descripcion_lote = f"Lote ({alcance_lote}): {len(df_lote)} filas"
+            id_trabajo_lote = obtener_almacen_trabajos().crear_trabajo(
+                (fila for _, fila in df_lote.iterrows()), parametros=parametros_trabajo, descripcion=descripcion_lote
+            )
+            enviar_trabajo_lote(id_trabajo_lote, df_filas=df_lote, descripcion=descripcion_lote)
+            trabajo_lote = trabajo_de_la_sesion('trabajo_lote')
+
+    if trabajo_lote is not None:
+        st.caption(f"Trabajo {st.session_state['trabajo_lote_almacen']}: si se interrumpe, puedes reanudarlo en la sección «Trabajos guardados».")
+        if trabajo_lote.activo:
+            seguir_trabajo_en_curso(trabajo_lote.id_trabajo)
+        elif trabajo_lote.estado == ESTADO_FALLIDO:
+            st.error(f"El lote falló: {trabajo_lote.error}")
+        else:
+            items_lote = [item for item in trabajo_lote.resultado or [] if item is not None]
+            # Los ítems pasan a la sesión una sola vez, para no pisar después los cargados desde el banco
+            if st.session_state.get('trabajo_lote_recogido') != trabajo_lote.id_trabajo:
+                st.session_state['trabajo_lote_recogido'] = trabajo_lote.id_trabajo
+                st.session_state['batch_processed_items'] = items_lote
+
+            aprobados = sum(1 for item in items_lote if item.get('final_audit_status') == "✅ CUMPLE TOTALMENTE")
+            st.success(f"Lote terminado: {len(items_lote)} ítems procesados, {aprobados} aprobados por el auditor.")
+            st.dataframe(pd.DataFrame([
+                {
+                    "Nanohabilidad": item['classification'].get("Nanohabilidad"),
+                    "Estación": item['classification'].get("Estación"),
+                    "Dictamen": item.get('final_audit_status')
+                }
+                for item in items_lote
+            ]))
+
+    # --- Búsqueda en el banco de ítems ---
+    st.header("Banco de Ítems")
+    st.caption(f"{banco_items.contar()} ítems guardados, {banco_items.contar(solo_aprobados=True)} aprobados.")
+    texto_busqueda_banco = st.text_input("Buscar en el enunciado, opciones, nanohabilidad, estación o gráfico", key="busqueda_banco")
+    col_aprobados, col_seleccion = st.columns(2)
+    solo_aprobados_banco = col_aprobados.checkbox("Solo aprobados", value=True, key="busqueda_banco_aprobados")
+    niveles_busqueda_banco = col_seleccion.slider(
+        "Niveles de la selección actual que se respetan", min_value=0, max_value=len(seleccion_jerarquia), value=0,
+        key="busqueda_banco_niveles", help="0 busca en todo el banco; 1 solo en el grado elegido; 2 además en el área, etc."
+    )
+    resultados_banco = banco_items.buscar(
+        texto_busqueda_banco,
+        filtros=dict(zip(list(COLUMNAS_CLASIFICACION)[:niveles_busqueda_banco], seleccion_jerarquia)),
+        solo_aprobados=solo_aprobados_banco
+    )
+    if resultados_banco:
+        st.dataframe(pd.DataFrame([
+            {
+                "id": item['id_banco'],
+                "Nanohabilidad": item['classification'].get("Nanohabilidad"),
+                "Estación": item['classification'].get("Estación"),
+                "Dictamen": item.get('final_audit_status'),
+                "Pregunta": item['item_text'][:150]
+            }
+            for item in resultados_banco
+        ]), use_container_width=True)
+        if st.button(f"Cargar estos {len(resultados_banco)} ítems para exportar"):
+            st.session_state['batch_processed_items'] = resultados_banco
+            st.success("Ítems del banco cargados en la sección de exportación.")
+    else:
+        st.info("No hay ítems del banco que coincidan con la búsqueda.")
+
+    # --- Trabajos guardados (reanudar o recuperar tras una recarga o un reinicio) ---
+    st.header("Trabajos Guardados")
+    trabajos_guardados = obtener_almacen_trabajos().listar()
+    if trabajos_guardados:
+        st.dataframe(pd.DataFrame(trabajos_guardados)[
+            ["id_trabajo", "descripcion", "terminadas", "total", "aprobadas", "intentos", "en_curso"]
+        ], use_container_width=True)
+        id_trabajo_elegido = st.selectbox(
+            "Trabajo", [trabajo["id_trabajo"] for trabajo in trabajos_guardados],
+            format_func=lambda id_trabajo: next(f"{t['id_trabajo']} · {t['descripcion']} ({t['terminadas']}/{t['total']})"
+                                                for t in trabajos_guardados if t["id_trabajo"] == id_trabajo),
+            key="trabajo_elegido"
+        )
+        progreso_elegido = obtener_almacen_trabajos().progreso(id_trabajo_elegido)
+        col_reanudar, col_cargar = st.columns(2)
+        if not progreso_elegido["completo"] and col_reanudar.button("Reanudar trabajo", disabled=lote_en_curso):
+            parametros_elegido = obtener_almacen_trabajos().parametros(id_trabajo_elegido)
+            # El manual no se guarda con el trabajo: debe estar cargado el mismo y enviarse de la misma forma
+            problema_manual = diferencia_manual(parametros_elegido["manual"], manual_trabajo) if "manual" in parametros_elegido else None
+            if problema_manual is not None:
+                st.error(f"No se puede reanudar el trabajo {id_trabajo_elegido}: {problema_manual}. "
+                         "Carga el mismo PDF y la misma opción de envío del manual en la barra lateral.")
+            else:
+                enviar_trabajo_lote(id_trabajo_elegido, descripcion=f"Reanudación de {id_trabajo_elegido}")
+                st.rerun() # Su progreso se muestra en «Generación por Lote», más arriba en la página
+        if col_cargar.button("Cargar ítems terminados para exportar"):
+            st.session_state['batch_processed_items'] = obtener_almacen_trabajos().items(id_trabajo_elegido)
+            st.success(f"Se cargaron {len(st.session_state['batch_processed_items'])} ítems del trabajo {id_trabajo_elegido}.")
+    else:
+        st.info("Todavía no hay trabajos guardados.")
+
+    # --- Sección de Exportación (Siempre visible al final) ---
+    st.header("Exportar Ítems")
+
+    item_individual = st.session_state.get('last_processed_item_data')
+    items_lote = st.session_state.get('batch_processed_items') or []
+
+    if item_individual is not None or items_lote:
+        if item_individual is not None and items_lote:
+            origen_exportacion = st.radio("¿Qué deseas exportar?", ("Último lote generado", "Último ítem individual"), key="origen_exportacion")
+        else:
+            origen_exportacion = "Último lote generado" if items_lote else "Último ítem individual"
+
+        if origen_exportacion == "Último lote generado":
+            st.write(f"Hay un lote de {len(items_lote)} ítems procesados disponible para exportar (aprobados o la última versión con observaciones).")
+            items_para_exportar = items_lote
+            fuente_exportacion = items_lote
+        else:
+            st.write("Hay un ítem procesado disponible para exportar (aprobado o la última versión con observaciones).")
+            # Creamos una lista con el único ítem procesado (aprobado o no) para la exportación
+            items_para_exportar = [item_individual]
+            fuente_exportacion = item_individual
+
+        formato_exportacion = st.selectbox(
+            "Formato de exportación", list(FORMATOS_EXPORTACION), format_func=FORMATOS_EXPORTACION.get,
+            key="formato_exportacion",
+            help="Los bancos JSONL/Excel tienen una fila por ítem con sus partes separadas, listos para importar en otros sistemas."
+        )
+        nombre_archivo_word = st.text_input("Ingresa el nombre deseado para el archivo (sin la extensión):", key="word_filename")
         
         if nombre_archivo_word:
-            # Creamos una lista con el único ítem procesado (aprobado o no) para la función exportar_a_word
-            items_para_exportar = [st.session_state['last_processed_item_data']]
-            
-            word_buffer = exportar_a_word(items_para_exportar)
-            
-            st.download_button(
-                label="Descargar Documento Word",
-                data=word_buffer,
-                file_name=f"{nombre_archivo_word}.docx",
-                mime="application/vnd.openxmlformats-officedocument.wordprocessingprocessingml.document"
-            )
-            st.info("Haz clic en el botón de arriba para descargar tu archivo Word. Se guardará en la carpeta de descargas de tu navegador.")
+            # El archivo se genera una vez por conjunto de ítems y formato; en los reruns (p. ej. al
+            # editar el nombre) solo se vuelve a leer de la caché en disco.
+            exportaciones = st.session_state.setdefault('exportaciones', {})
+            fuente_anterior, ruta_exportacion = exportaciones.get((origen_exportacion, formato_exportacion), (None, None))
+            if fuente_anterior is not fuente_exportacion or not os.path.exists(ruta_exportacion):
+                with st.spinner(f"Preparando {FORMATOS_EXPORTACION[formato_exportacion].lower()}..."):
+                    ruta_exportacion = exportar_items(items_para_exportar, formato_exportacion)
+                exportaciones[(origen_exportacion, formato_exportacion)] = (fuente_exportacion, ruta_exportacion)
+
+            with open(ruta_exportacion, "rb") as archivo_exportado:
+                st.download_button(
+                    label=f"Descargar {FORMATOS_EXPORTACION[formato_exportacion]}",
+                    data=archivo_exportado,
+                    file_name=f"{nombre_archivo_word}.{formato_exportacion}",
+                    mime=TIPOS_MIME_EXPORTACION[formato_exportacion]
+                )
+            st.info("Haz clic en el botón de arriba para descargar tu archivo. Se guardará en la carpeta de descargas de tu navegador.")
         else:
-            st.warning("Por favor, ingresa un nombre para el archivo Word para habilitar la descarga.")
+            st.warning("Por favor, ingresa un nombre para el archivo para habilitar la descarga.")
     else:
-        st.info("No hay ítems procesados disponibles para exportar a Word en este momento.")
+        st.info("No hay ítems procesados disponibles para exportar en este momento.")
         st.write("Genera y audita un ítem para que esté disponible aquí.")
 
 elif uploaded_excel_file is None:
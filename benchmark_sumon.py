@@ -0,0 +1,651 @@
+"""
+Benchmark sin conexión del flujo completo generación → auditoría → exportación.
+
+Levanta un servidor HTTP local que imita los endpoints de OpenAI (chat completions) y de
+Gemini (generateContent / streamGenerateContent por REST), con latencia, tasa de errores y
+respuestas bien o mal formadas configurables. Luego importa el núcleo `sumon` apuntando a ese
+servidor, genera un lote de ítems con `generar_pregunta_con_seleccion`, los exporta con
+`exportar_items` y reporta rendimiento, distribución de latencias, intentos por ítem y
+memoria pico. No usa API keys reales ni genera gasto.
+
+Uso:
+    python benchmark_sumon.py --items 40 --concurrencia 8 --latencia 0.3 --tasa-error 0.05
+    python benchmark_sumon.py --salida-json base.json
+    python benchmark_sumon.py --linea-base base.json --tolerancia 0.2   # sale con código 1 si hay regresión
+    python benchmark_sumon.py --api-lotes   # rondas de la API de lotes contra el proveedor simulado con archivos
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- Respuestas simuladas ---
+ITEM_BIEN_FORMADO = """PREGUNTA: En una tienda escolar, Marta compra 2 cuadernos y luego 3 más. ¿Cuántos cuadernos compra en total?
+A. 4 cuadernos
+B. 5 cuadernos
+C. 6 cuadernos
+RESPUESTA CORRECTA: B
+JUSTIFICACIONES:
+A. El estudiante podría escoger la opción A porque cuenta uno de menos. Sin embargo, esto es incorrecto porque 2 + 3 = 5.
+B. Es correcta porque al reunir 2 cuadernos con 3 cuadernos se obtienen 5 cuadernos en total.
+C. El estudiante podría escoger la opción C porque cuenta uno de más. Sin embargo, esto es incorrecto porque 2 + 3 = 5.
+GRAFICO_NECESARIO: NO
+DESCRIPCION_GRAFICO: N/A"""
+
+# Sin justificaciones ni respuesta correcta: lo rechaza la pre-auditoría sin llamar al auditor
+ITEM_MAL_FORMADO = """PREGUNTA: ¿Cuántos cuadernos compra Marta en total?
+A. 4 cuadernos
+B. 5 cuadernos
+GRAFICO_NECESARIO: NO
+DESCRIPCION_GRAFICO: N/A"""
+
+ITEM_BIEN_FORMADO_JSON = {
+    "pregunta": "En una tienda escolar, Marta compra 2 cuadernos y luego 3 más. ¿Cuántos cuadernos compra en total?",
+    "opciones": {"A": "4 cuadernos", "B": "5 cuadernos", "C": "6 cuadernos"},
+    "respuesta_correcta": "B",
+    "justificaciones": {
+        "A": "El estudiante podría escoger la opción A porque cuenta uno de menos. Sin embargo, esto es incorrecto porque 2 + 3 = 5.",
+        "B": "Es correcta porque al reunir 2 cuadernos con 3 cuadernos se obtienen 5 cuadernos en total.",
+        "C": "El estudiante podría escoger la opción C porque cuenta uno de más. Sin embargo, esto es incorrecto porque 2 + 3 = 5."
+    },
+    "grafico_necesario": False,
+    "descripcion_grafico": ""
+}
+
+CRITERIOS_SIMULADOS = [
+    "Formato del Enunciado", "Número de Opciones (3)", "Respuesta Correcta Indicada", "Diseño de Justificaciones",
+    "Estilo y Restricciones", "Alineación del Contenido", "Gráfico (si aplica)"
+]
+
+def _auditoria_texto(dictamen):
+    """Auditoría en texto con dictamen "aprobado", "parcial" o "rechazado"."""
+    marcas = {criterio: "✅" for criterio in CRITERIOS_SIMULADOS}
+    marcas["Gráfico (si aplica)"] = "N/A"
+    if dictamen == "parcial":
+        marcas["Diseño de Justificaciones"] = "⚠️"
+    elif dictamen == "rechazado":
+        marcas["Alineación del Contenido"] = "❌"
+    lineas = "\n".join(f"- {criterio}: {marca}" for criterio, marca in marcas.items())
+    dictamen_final, observaciones = {
+        "aprobado": ("✅ CUMPLE TOTALMENTE", "El ítem cumple con todos los criterios."),
+        "parcial": ("⚠️ CUMPLE PARCIALMENTE", "- Diseño de Justificaciones: la justificación de la opción correcta es demasiado breve."),
+        "rechazado": ("❌ RECHAZADO", "- Alineación del Contenido: el ítem evalúa una habilidad distinta de la nanohabilidad."),
+    }[dictamen]
+    return f"VALIDACIÓN DE CRITERIOS:\n{lineas}\nDICTAMEN FINAL:\n[{dictamen_final}]\nOBSERVACIONES FINALES:\n{observaciones}"
+
+def _auditoria_json(dictamen):
+    criterios = [
+        {"criterio": criterio, "veredicto": "NO APLICA" if criterio == "Gráfico (si aplica)" else "CUMPLE", "comentario": ""}
+        for criterio in CRITERIOS_SIMULADOS
+    ]
+    if dictamen == "parcial":
+        criterios[3] = {"criterio": "Diseño de Justificaciones", "veredicto": "CUMPLE PARCIALMENTE",
+                        "comentario": "La justificación de la opción correcta es demasiado breve."}
+    elif dictamen == "rechazado":
+        criterios[5] = {"criterio": "Alineación del Contenido", "veredicto": "NO CUMPLE",
+                        "comentario": "El ítem evalúa una habilidad distinta de la nanohabilidad."}
+    return {
+        "criterios": criterios,
+        "dictamen_final": {"aprobado": "CUMPLE TOTALMENTE", "parcial": "CUMPLE PARCIALMENTE", "rechazado": "RECHAZADO"}[dictamen],
+        "observaciones_finales": {"aprobado": "", "parcial": "Amplía la justificación de la opción correcta.",
+                                  "rechazado": "Alinea el ítem con la nanohabilidad indicada."}[dictamen]
+    }
+
+# --- Servidor LLM simulado ---
+class ServidorLLMSimulado:
+    """
+    Servidor HTTP local que responde como OpenAI y Gemini.
+    - `latencia_s`: latencia media por respuesta (con ±50 % de variación uniforme); en streaming
+      se reparte entre los fragmentos.
+    - `tasa_error`: probabilidad de responder 429 o 503 en vez de la respuesta.
+    - `tasa_mal_formadas`: probabilidad de que el generador devuelva un ítem mal formado.
+    - `tasa_rechazo`: probabilidad de que el auditor devuelva CUMPLE PARCIALMENTE.
+    - `tasa_rechazo_claro`: probabilidad de que el auditor devuelva RECHAZADO con un criterio ❌.
+    - `tasa_lentas`: probabilidad de una llamada atascada, `factor_lentas` veces más lenta.
+    - `modelos_rapidos`: modelos que responden en `factor_rapidos` veces la latencia media. Cuando
+      otro modelo audita después el mismo prompt, repite el dictamen del rápido con probabilidad
+      `concordancia_rapidos` (auditoría en cascada).
+    Imita además la caché de prefijos: en OpenAI, un mensaje de sistema de 1024 tokens o más ya
+    visto se informa como `cached_tokens`; en Gemini, `cachedContents` guarda el contexto y las
+    peticiones que lo usan informan `cachedContentTokenCount`.
+    `claves_api` guarda, en orden, la API key con que llegó cada petición.
+    """
+    def __init__(self, latencia_s=0.2, tasa_error=0.0, tasa_mal_formadas=0.0, tasa_rechazo=0.0,
+                 fragmentos_stream=8, semilla=None, tasa_lentas=0.0, factor_lentas=20.0, tasa_rechazo_claro=0.0,
+                 modelos_rapidos=(), factor_rapidos=0.3, concordancia_rapidos=0.9):
+        self.latencia_s = latencia_s
+        self.tasa_error = tasa_error
+        self.tasa_mal_formadas = tasa_mal_formadas
+        self.tasa_rechazo = tasa_rechazo
+        self.tasa_rechazo_claro = tasa_rechazo_claro
+        self.modelos_rapidos = set(modelos_rapidos)
+        self.factor_rapidos = factor_rapidos
+        self.concordancia_rapidos = concordancia_rapidos
+        self._dictamenes_rapidos = {} # prompt de auditoría → dictamen del modelo rápido, para el auditor fuerte
+        self.tasa_lentas = tasa_lentas
+        self.factor_lentas = factor_lentas
+        self.fragmentos_stream = max(1, fragmentos_stream)
+        self._azar = random.Random(semilla)
+        self._lock = threading.Lock()
+        self.estadisticas = {"peticiones": 0, "errores_inyectados": 0, "mal_formadas": 0, "rechazos": 0, "rechazos_claros": 0, "lentas": 0,
+                             "tokens_cacheados": 0, "contextos_creados": 0}
+        self.claves_api = []
+        self._prefijos_vistos = set()
+        self._contextos = {} # nombre del CachedContent → texto
+        self._servidor = None
+        self._hilo = None
+
+    @property
+    def url(self):
+        host, puerto = self._servidor.server_address[:2]
+        return f"http://{host}:{puerto}"
+
+    def iniciar(self):
+        servidor_simulado = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                longitud = int(self.headers.get("Content-Length", 0))
+                cuerpo = json.loads(self.rfile.read(longitud) or b"{}")
+                try:
+                    servidor_simulado._atender(self, cuerpo)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass # El cliente cortó el stream (formato inválido o candidato cancelado)
+
+        self._servidor = ThreadingHTTPServer(("127.0.0.1", 0), Manejador)
+        self._servidor.daemon_threads = True
+        self._hilo = threading.Thread(target=self._servidor.serve_forever, daemon=True)
+        self._hilo.start()
+        return self
+
+    def detener(self):
+        if self._servidor is not None:
+            self._servidor.shutdown()
+            self._servidor.server_close()
+
+    def _sortear(self, probabilidad, contador):
+        with self._lock:
+            ocurre = self._azar.random() < probabilidad
+            if ocurre:
+                self.estadisticas[contador] += 1
+            return ocurre
+
+    def _latencia(self, modelo=None):
+        atascada = self._sortear(self.tasa_lentas, "lentas")
+        factor_modelo = self.factor_rapidos if modelo in self.modelos_rapidos else 1.0
+        with self._lock:
+            return self.latencia_s * factor_modelo * self._azar.uniform(0.5, 1.5) * (self.factor_lentas if atascada else 1.0)
+
+    def _sortear_dictamen(self):
+        if self._sortear(self.tasa_rechazo_claro, "rechazos_claros"):
+            return "rechazado"
+        return "parcial" if self._sortear(self.tasa_rechazo, "rechazos") else "aprobado"
+
+    def _respuesta_para(self, prompt, modelo=None):
+        """Elige la respuesta simulada según el tipo de prompt (generación o auditoría, texto o JSON)."""
+        en_json = "FORMATO DE SALIDA (JSON)" in prompt
+        if "AUDITAR" in prompt:
+            if modelo in self.modelos_rapidos:
+                dictamen = self._sortear_dictamen()
+                with self._lock:
+                    self._dictamenes_rapidos[prompt] = dictamen
+            else:
+                with self._lock:
+                    dictamen_rapido = self._dictamenes_rapidos.pop(prompt, None)
+                    concuerda = self._azar.random() < self.concordancia_rapidos
+                dictamen = dictamen_rapido if dictamen_rapido and concuerda else self._sortear_dictamen()
+            return json.dumps(_auditoria_json(dictamen), ensure_ascii=False) if en_json else _auditoria_texto(dictamen)
+        if self._sortear(self.tasa_mal_formadas, "mal_formadas"):
+            return '{"pregunta": "incompleto"' if en_json else ITEM_MAL_FORMADO
+        return json.dumps(ITEM_BIEN_FORMADO_JSON, ensure_ascii=False) if en_json else ITEM_BIEN_FORMADO
+
+    def _atender(self, manejador, cuerpo):
+        with self._lock:
+            self.estadisticas["peticiones"] += 1
+            autorizacion = manejador.headers.get("Authorization", "")
+            self.claves_api.append(manejador.headers.get("x-goog-api-key") or autorizacion.removeprefix("Bearer ") or None)
+        ruta = manejador.path
+        if self._sortear(self.tasa_error, "errores_inyectados"):
+            time.sleep(self._latencia() / 4)
+            codigo = self._azar.choice([429, 503])
+            self._enviar_json(manejador, {"error": {"code": codigo, "message": "Error simulado", "status": "UNAVAILABLE"}},
+                              codigo=codigo, cabeceras={"retry-after-ms": "50"})
+            return
+
+        if "/chat/completions" in ruta:
+            mensajes = cuerpo.get("messages", [])
+            prompt = "\n".join(str(mensaje.get("content", "")) for mensaje in mensajes)
+            sistema = "".join(str(mensaje.get("content", "")) for mensaje in mensajes if mensaje.get("role") == "system")
+            tokens_cacheados = 0
+            if len(sistema) // 4 >= 1024:
+                with self._lock:
+                    if sistema in self._prefijos_vistos:
+                        tokens_cacheados = len(sistema) // 4 // 128 * 128 # OpenAI cachea en bloques de 128 tokens
+                    self._prefijos_vistos.add(sistema)
+            self._responder_openai(manejador, cuerpo, prompt, tokens_cacheados)
+        elif ruta.split("?")[0].rstrip("/").endswith("/cachedContents"):
+            texto = "\n".join(
+                parte.get("text", "") for contenido in cuerpo.get("contents", []) for parte in contenido.get("parts", [])
+            )
+            with self._lock:
+                self.estadisticas["contextos_creados"] += 1
+                nombre = f"cachedContents/simulado{len(self._contextos)}"
+                self._contextos[nombre] = texto
+            ahora = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+            self._enviar_json(manejador, {
+                "name": nombre, "model": cuerpo.get("model", ""), "displayName": cuerpo.get("displayName", ""),
+                "createTime": ahora, "updateTime": ahora, "expireTime": ahora,
+                "usageMetadata": {"totalTokenCount": len(texto) // 4}
+            })
+        elif ":generateContent" in ruta or ":streamGenerateContent" in ruta:
+            prompt = "\n".join(
+                parte.get("text", "") for contenido in cuerpo.get("contents", []) for parte in contenido.get("parts", [])
+            )
+            with self._lock:
+                contexto = self._contextos.get(cuerpo.get("cachedContent") or "", "")
+            modelo = ruta.split("/models/")[-1].split(":")[0]
+            self._responder_gemini(manejador, contexto + "\n" + prompt if contexto else prompt, modelo,
+                                   en_streaming=":streamGenerateContent" in ruta, tokens_cacheados=len(contexto) // 4)
+        else:
+            self._enviar_json(manejador, {"error": {"message": f"Ruta no simulada: {ruta}"}}, codigo=404)
+
+    def _trozos(self, texto):
+        tamano = max(1, len(texto) // self.fragmentos_stream + 1)
+        return [texto[inicio:inicio + tamano] for inicio in range(0, len(texto), tamano)]
+
+    def _contar_cacheados(self, tokens_cacheados):
+        with self._lock:
+            self.estadisticas["tokens_cacheados"] += tokens_cacheados
+
+    def _responder_openai(self, manejador, cuerpo, prompt, tokens_cacheados=0):
+        texto = self._respuesta_para(prompt, cuerpo.get("model"))
+        self._contar_cacheados(tokens_cacheados)
+        uso = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(texto) // 4,
+               "total_tokens": (len(prompt) + len(texto)) // 4, "prompt_tokens_details": {"cached_tokens": tokens_cacheados}}
+        base = {"id": "chatcmpl-simulado", "created": int(time.time()), "model": cuerpo.get("model", "simulado")}
+        latencia = self._latencia(cuerpo.get("model"))
+        if not cuerpo.get("stream"):
+            time.sleep(latencia)
+            self._enviar_json(manejador, {
+                **base, "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": texto}, "finish_reason": "stop"}],
+                "usage": uso
+            })
+            return
+
+        eventos = [
+            {**base, "object": "chat.completion.chunk",
+             "choices": [{"index": 0, "delta": {"content": trozo}, "finish_reason": None}]}
+            for trozo in self._trozos(texto)
+        ]
+        eventos.append({**base, "object": "chat.completion.chunk",
+                        "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (cuerpo.get("stream_options") or {}).get("include_usage"):
+            eventos.append({**base, "object": "chat.completion.chunk", "choices": [], "usage": uso})
+        lineas = [f"data: {json.dumps(evento, ensure_ascii=False)}\n\n" for evento in eventos] + ["data: [DONE]\n\n"]
+        self._enviar_por_partes(manejador, lineas, latencia, "text/event-stream")
+
+    def _responder_gemini(self, manejador, prompt, modelo, en_streaming, tokens_cacheados=0):
+        texto = self._respuesta_para(prompt, modelo)
+        self._contar_cacheados(tokens_cacheados)
+        uso = {"promptTokenCount": len(prompt) // 4, "candidatesTokenCount": len(texto) // 4,
+               "totalTokenCount": (len(prompt) + len(texto)) // 4, "cachedContentTokenCount": tokens_cacheados}
+        latencia = self._latencia(modelo)
+
+        def _respuesta(trozo, con_uso):
+            respuesta = {"candidates": [{"content": {"parts": [{"text": trozo}], "role": "model"}, "finishReason": 1, "index": 0}],
+                         "modelVersion": modelo}
+            if con_uso:
+                respuesta["usageMetadata"] = uso
+            return respuesta
+
+        if not en_streaming:
+            time.sleep(latencia)
+            self._enviar_json(manejador, _respuesta(texto, True))
+            return
+        # La API REST de Gemini transmite un arreglo JSON que se va completando
+        trozos = self._trozos(texto)
+        partes = ["["] + [
+            ("," if indice else "") + json.dumps(_respuesta(trozo, indice == len(trozos) - 1), ensure_ascii=False)
+            for indice, trozo in enumerate(trozos)
+        ] + ["]"]
+        self._enviar_por_partes(manejador, partes, latencia, "application/json")
+
+    @staticmethod
+    def _enviar_json(manejador, datos, codigo=200, cabeceras=None):
+        contenido = json.dumps(datos, ensure_ascii=False).encode("utf-8")
+        manejador.send_response(codigo)
+        manejador.send_header("Content-Type", "application/json")
+        manejador.send_header("Content-Length", str(len(contenido)))
+        for nombre, valor in (cabeceras or {}).items():
+            manejador.send_header(nombre, valor)
+        manejador.end_headers()
+        manejador.wfile.write(contenido)
+
+    @staticmethod
+    def _enviar_por_partes(manejador, partes, latencia, tipo_contenido):
+        manejador.send_response(200)
+        manejador.send_header("Content-Type", tipo_contenido)
+        manejador.send_header("Transfer-Encoding", "chunked")
+        manejador.end_headers()
+        pausa = latencia / max(1, len(partes))
+        for parte in partes:
+            time.sleep(pausa)
+            datos = parte.encode("utf-8")
+            manejador.wfile.write(f"{len(datos):x}\r\n".encode("ascii") + datos + b"\r\n")
+            manejador.wfile.flush()
+        manejador.wfile.write(b"0\r\n\r\n")
+
+# --- Configuración del núcleo contra el servidor simulado ---
+def preparar_entorno(url_servidor, ruta_cache):
+    """
+    Apunta los clientes LLM al servidor simulado y las cachés a un directorio temporal. Debe
+    llamarse antes de importar `sumon`, que lee estas variables al cargarse.
+    """
+    os.environ["SUMON_OPENAI_BASE_URL"] = f"{url_servidor}/v1"
+    os.environ["SUMON_GEMINI_API_ENDPOINT"] = url_servidor
+    for variable, nombre in (("SUMON_CACHE_LLM", "respuestas_llm.sqlite3"), ("SUMON_CACHE_EXCEL", "estructura"),
+                             ("SUMON_CACHE_PDF", "pdf"), ("SUMON_CACHE_EXPORTACION", "exportaciones")):
+        os.environ[variable] = os.path.join(ruta_cache, nombre)
+
+def configurar_nucleo(usar_cache=False, streaming=False, salida_estructurada=False, espera_reintento=0.05,
+                      candidatos_por_ronda=1, max_llamadas_por_item=None, modelo_respaldo=None, auditor_rapido=None):
+    """Configuración equivalente a la barra lateral, sin límites de cuota reales."""
+    from sumon import cuota, enrutamiento
+    from sumon.llm import ConfiguracionLLM
+
+    cuota.ESPERA_BASE_REINTENTO = espera_reintento
+    # Las latencias simuladas son de décimas de segundo: los umbrales de cobertura se escalan igual
+    enrutamiento.UMBRAL_MINIMO_COBERTURA_S = 0.0
+    enrutamiento.UMBRAL_COBERTURA_POR_DEFECTO_S = 1.0
+    # El servidor simulado no impone cuotas: se elimina la espera de los token buckets
+    sin_limite = {"rpm": 10**6, "tpm": 10**9}
+    cuota.LIMITES_CUOTA_POR_PROVEEDOR = {"Gemini": sin_limite, "GPT": sin_limite}
+    cuota.LIMITES_CUOTA_POR_MODELO = {}
+    configuracion = ConfiguracionLLM(gemini_api_key="clave-simulada", openai_api_key="clave-simulada",
+                                     usar_cache=usar_cache, cachear_generacion=usar_cache, streaming=streaming)
+    return configuracion, {"refinamiento_compacto": True, "salida_estructurada": salida_estructurada,
+                           "candidatos_por_ronda": candidatos_por_ronda, "max_llamadas_por_item": max_llamadas_por_item,
+                           "modelo_respaldo_generacion": modelo_respaldo, "modelo_respaldo_auditoria": modelo_respaldo,
+                           "modelo_auditoria_rapida": auditor_rapido}
+
+def calentar_clientes(configuracion, *modelos):
+    """
+    Los SDK se importan de forma perezosa con el primer cliente; se crean aquí para que ese costo
+    de arranque en frío no se mezcle con la latencia de las primeras llamadas medidas.
+    """
+    from sumon.llm import obtener_registro_clientes_llm
+
+    registro_clientes = obtener_registro_clientes_llm()
+    for model_type, model_name in modelos:
+        if model_type == "GPT":
+            registro_clientes.cliente_openai(configuracion.openai_api_key)
+        else:
+            registro_clientes.modelo_gemini(configuracion.gemini_api_key, model_name)
+
+def manual_sintetico(tokens):
+    """Manual de reglas de relleno con ~`tokens` tokens (0 = sin manual)."""
+    regla = "- Regla de construcción {numero}: los distractores deben representar errores frecuentes y plausibles del grado.\n"
+    lineas, total = [], 0
+    while total < tokens:
+        lineas.append(regla.format(numero=len(lineas) + 1))
+        total += len(lineas[-1]) // 4
+    return "".join(lineas)
+
+def filas_sinteticas(n):
+    import pandas as pd
+    return [
+        pd.Series({
+            "GRADO": 3 + indice % 3, "ÁREA": "Matemáticas", "ASIGNATURA": "Aritmética",
+            "ESTACIÓN": f"Estación {indice % 4 + 1}", "PROCESO COGNITIVO": "APLICAR",
+            "NANOHABILIDAD": f"Resolver problemas aditivos {indice}", "MICROHABILIDAD": "Sumar números naturales",
+            "COMPETENCIA NANOHABILIDAD": "Resolución de problemas"
+        })
+        for indice in range(n)
+    ]
+
+# --- Ejecución y reporte ---
+def _percentiles(serie):
+    if serie is None or len(serie) == 0:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    return {clave: round(float(valor), 4) for clave, valor in (
+        ("p50", serie.quantile(0.50)), ("p95", serie.quantile(0.95)), ("p99", serie.quantile(0.99)), ("max", serie.max())
+    )}
+
+def _resolver_lotes_en_segundo_plano(servidor, directorio, detener):
+    """Responde los lotes del proveedor simulado con archivos usando las respuestas del servidor simulado."""
+    from sumon.lotes_proveedor import resolver_lotes_locales
+
+    while not detener.is_set():
+        for formato in ("openai", "gemini"):
+            resolver_lotes_locales(os.path.join(directorio, formato),
+                                   lambda modelo, prompt: servidor._respuesta_para(prompt, modelo))
+        detener.wait(servidor.latencia_s)
+
+def ejecutar_benchmark(items=20, concurrencia=4, gen_model=("GPT", "gpt-4o"), audit_model=("GPT", "gpt-4o"),
+                       medir_memoria=True, tokens_manual=0, api_lotes=False, **opciones):
+    """
+    Ejecuta el benchmark completo y devuelve un diccionario con los resultados.
+    `opciones` admite los parámetros de ServidorLLMSimulado y de configurar_nucleo.
+    `tokens_manual` añade a todos los prompts un manual completo de ese tamaño (en el prefijo estable).
+    Con `api_lotes`, las llamadas van por la API de lotes contra un proveedor simulado con archivos
+    que responde cada lote tras `latencia_s`; todas las filas participan en cada ronda.
+    """
+    parametros_servidor = {clave: opciones.pop(clave) for clave in
+                           ("latencia_s", "tasa_error", "tasa_mal_formadas", "tasa_rechazo", "fragmentos_stream", "semilla",
+                            "tasa_lentas", "factor_lentas", "tasa_rechazo_claro", "modelos_rapidos")
+                           if clave in opciones}
+    servidor = ServidorLLMSimulado(**parametros_servidor).iniciar()
+    try:
+        with tempfile.TemporaryDirectory(prefix="sumon_bench_") as ruta_cache:
+            preparar_entorno(servidor.url, ruta_cache)
+            from sumon.exportacion import exportar_items
+            from sumon.metricas import obtener_registro_metricas
+            from sumon.pipeline import generar_pregunta_con_seleccion
+
+            configuracion, criterios = configurar_nucleo(**opciones)
+            filas = filas_sinteticas(items)
+            calentar_clientes(configuracion, gen_model, audit_model, *([criterios["modelo_auditoria_rapida"]] if criterios["modelo_auditoria_rapida"] else []))
+            detener_lotes = threading.Event()
+            if api_lotes:
+                from sumon.lotes_proveedor import AgrupadorLotesProveedor, clientes_lotes
+
+                directorio_lotes = os.path.join(ruta_cache, "lotes")
+                configuracion.lote = AgrupadorLotesProveedor(
+                    clientes_lotes(configuracion, directorio_lotes), ruta_registro=os.path.join(ruta_cache, "lotes.sqlite3"),
+                    intervalo_sondeo_s=0.02, ventana_agrupacion_s=0.02
+                )
+                threading.Thread(target=_resolver_lotes_en_segundo_plano, args=(servidor, directorio_lotes, detener_lotes),
+                                 daemon=True).start()
+                concurrencia = items
+
+            def _generar(fila):
+                if configuracion.lote is None:
+                    return generar_pregunta_con_seleccion(
+                        *gen_model, *audit_model, fila_datos=fila, criterios_generacion=criterios,
+                        manual_reglas_texto=manual_sintetico(tokens_manual), configuracion=configuracion
+                    )
+                with configuracion.lote.participante():
+                    return generar_pregunta_con_seleccion(
+                        *gen_model, *audit_model, fila_datos=fila, criterios_generacion=criterios,
+                        manual_reglas_texto=manual_sintetico(tokens_manual), configuracion=configuracion
+                    )
+
+            if medir_memoria:
+                tracemalloc.start()
+            inicio = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=max(1, concurrencia)) as executor:
+                resultados = list(executor.map(_generar, filas))
+            duracion_generacion = time.perf_counter() - inicio
+            detener_lotes.set()
+            lotes_enviados = configuracion.lote.lotes_enviados if configuracion.lote is not None else 0
+
+            items_generados = [resultado[0] for resultado in resultados if resultado]
+            inicio_exportacion = time.perf_counter()
+            ruta_documento = exportar_items(items_generados, "docx")
+            bytes_documento = os.path.getsize(ruta_documento)
+            duracion_exportacion = time.perf_counter() - inicio_exportacion
+            memoria_pico = tracemalloc.get_traced_memory()[1] if medir_memoria else None
+            if medir_memoria:
+                tracemalloc.stop()
+
+            registro = obtener_registro_metricas()
+            df_llamadas = registro.llamadas_df()
+            df_items = registro.items_df()
+            df_cascada = registro.cascada_df()
+    finally:
+        servidor.detener()
+
+    llamadas_ok = df_llamadas[df_llamadas["error"].isna()] if not df_llamadas.empty else df_llamadas
+    latencias_por_etapa = {
+        etapa: _percentiles(grupo["latencia_s"]) for etapa, grupo in llamadas_ok.groupby("etapa")
+    } if not llamadas_ok.empty else {}
+    aprobados = df_items[df_items["aprobado"]] if not df_items.empty else df_items
+    return {
+        "configuracion": {"items": items, "concurrencia": concurrencia, "gen_model": list(gen_model),
+                          "audit_model": list(audit_model), "tokens_manual": tokens_manual, "api_lotes": api_lotes,
+                          **parametros_servidor, **opciones},
+        "duracion_generacion_s": round(duracion_generacion, 3),
+        "items_por_segundo": round(items / duracion_generacion, 3) if duracion_generacion else None,
+        "latencia_item_s": _percentiles(df_items["duracion_s"]) if not df_items.empty else _percentiles(None),
+        "latencia_llamada_s": latencias_por_etapa,
+        "ttft_s": _percentiles(llamadas_ok["ttft_s"]) if not llamadas_ok.empty else _percentiles(None),
+        "intentos_por_item": {
+            "media": round(float(df_items["intentos"].mean()), 3) if not df_items.empty else None,
+            "max": int(df_items["intentos"].max()) if not df_items.empty else None,
+            "distribucion": {int(k): int(v) for k, v in df_items["intentos"].value_counts().sort_index().items()} if not df_items.empty else {},
+        },
+        "tasa_aprobacion": round(len(aprobados) / len(df_items), 3) if not df_items.empty else None,
+        "llamadas": int(len(df_llamadas)),
+        "lotes_proveedor": lotes_enviados,
+        "llamadas_por_ruta": {str(ruta): int(n) for ruta, n in df_llamadas["ruta"].value_counts().items()}
+                             if "ruta" in df_llamadas else {},
+        "tokens_prompt": int(df_llamadas["tokens_prompt"].sum()) if not df_llamadas.empty else 0,
+        "tokens_cacheados": int(df_llamadas["tokens_cacheados"].sum()) if not df_llamadas.empty else 0,
+        "costo_usd": round(float(df_llamadas["costo_usd"].sum()), 4) if not df_llamadas.empty else 0.0,
+        "llamadas_con_error": int(df_llamadas["error"].notna().sum()) if not df_llamadas.empty else 0,
+        "llamadas_por_modelo": {str(modelo): int(n) for modelo, n in df_llamadas["model_name"].value_counts().items()}
+                               if not df_llamadas.empty else {},
+        "cascada": {
+            "auditorias": int(len(df_cascada)),
+            "fraccion_escalada": round(float(df_cascada["escalada"].mean()), 3),
+            "concordancia": round(float(df_cascada["concuerda"].dropna().astype(float).mean()), 3)
+                            if df_cascada["concuerda"].notna().any() else None,
+        } if not df_cascada.empty else {},
+        "exportacion_word": {"duracion_s": round(duracion_exportacion, 3), "bytes": bytes_documento,
+                             "items": len(items_generados)},
+        "memoria_pico_tracemalloc_mb": round(memoria_pico / 2**20, 2) if memoria_pico is not None else None,
+        # ru_maxrss viene en KiB en Linux
+        "memoria_pico_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "servidor": dict(servidor.estadisticas),
+    }
+
+def comparar_con_linea_base(resultado, linea_base, tolerancia):
+    """Devuelve la lista de regresiones respecto a una corrida anterior (mismo escenario)."""
+    regresiones = []
+    def _peor(nombre, actual, anterior, mayor_es_mejor):
+        if actual is None or anterior in (None, 0):
+            return
+        cambio = (actual - anterior) / anterior
+        if (mayor_es_mejor and cambio < -tolerancia) or (not mayor_es_mejor and cambio > tolerancia):
+            regresiones.append(f"{nombre}: {anterior} → {actual} ({cambio:+.0%})")
+    _peor("items_por_segundo", resultado["items_por_segundo"], linea_base.get("items_por_segundo"), True)
+    _peor("latencia_item_s.p95", resultado["latencia_item_s"]["p95"], linea_base.get("latencia_item_s", {}).get("p95"), False)
+    _peor("exportacion_word.duracion_s", resultado["exportacion_word"]["duracion_s"],
+          linea_base.get("exportacion_word", {}).get("duracion_s"), False)
+    _peor("memoria_pico_tracemalloc_mb", resultado["memoria_pico_tracemalloc_mb"], linea_base.get("memoria_pico_tracemalloc_mb"), False)
+    return regresiones
+
+def imprimir_reporte(resultado):
+    print(f"Ítems: {resultado['configuracion']['items']}  Concurrencia: {resultado['configuracion']['concurrencia']}")
+    print(f"Rendimiento: {resultado['items_por_segundo']} ítems/s ({resultado['duracion_generacion_s']} s en total)")
+    print(f"Latencia por ítem (s): {resultado['latencia_item_s']}")
+    for etapa, percentiles in resultado["latencia_llamada_s"].items():
+        print(f"Latencia por llamada, {etapa} (s): {percentiles}")
+    print(f"TTFT (s): {resultado['ttft_s']}")
+    print(f"Intentos por ítem: {resultado['intentos_por_item']}  Aprobación: {resultado['tasa_aprobacion']}")
+    print(f"Llamadas: {resultado['llamadas']} ({resultado['llamadas_con_error']} con error)  Servidor: {resultado['servidor']}")
+    print(f"Llamadas por modelo: {resultado['llamadas_por_modelo']}")
+    if resultado["lotes_proveedor"]:
+        print(f"Lotes enviados a la API de lotes: {resultado['lotes_proveedor']}")
+    if resultado["cascada"]:
+        print(f"Auditoría en cascada: {resultado['cascada']}")
+    if resultado["llamadas_por_ruta"]:
+        print(f"Llamadas por ruta (cobertura/conmutación): {resultado['llamadas_por_ruta']}")
+    print(f"Tokens de prompt: {resultado['tokens_prompt']} ({resultado['tokens_cacheados']} desde la caché de prefijos)  "
+          f"Costo estimado: {resultado['costo_usd']} USD")
+    print(f"Exportación Word: {resultado['exportacion_word']}")
+    print(f"Memoria pico: {resultado['memoria_pico_tracemalloc_mb']} MB (tracemalloc), {resultado['memoria_pico_rss_mb']} MB (RSS)")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark sin conexión de generación, auditoría y exportación de ítems.")
+    parser.add_argument("--items", type=int, default=20)
+    parser.add_argument("--concurrencia", type=int, default=4)
+    parser.add_argument("--proveedor", choices=["GPT", "Gemini"], default="GPT")
+    parser.add_argument("--modelo", default=None, help="Por defecto gpt-4o o gemini-1.5-flash según el proveedor.")
+    parser.add_argument("--latencia", type=float, default=0.2, help="Latencia media simulada por respuesta, en segundos.")
+    parser.add_argument("--tasa-error", type=float, default=0.0, help="Probabilidad de responder 429/503.")
+    parser.add_argument("--tasa-mal-formadas", type=float, default=0.0, help="Probabilidad de un ítem mal formado.")
+    parser.add_argument("--tasa-rechazo", type=float, default=0.0, help="Probabilidad de que el auditor no apruebe.")
+    parser.add_argument("--tasa-rechazo-claro", type=float, default=0.0, help="Probabilidad de que el auditor rechace el ítem.")
+    parser.add_argument("--tasa-lentas", type=float, default=0.0, help="Probabilidad de una llamada atascada.")
+    parser.add_argument("--factor-lentas", type=float, default=20.0, help="Cuántas veces más tarda una llamada atascada.")
+    parser.add_argument("--respaldo", help="Modelo de respaldo del mismo proveedor (cobertura y conmutación por error).")
+    parser.add_argument("--audit-rapido", help="Modelo rápido del mismo proveedor que audita primero (auditoría en cascada).")
+    parser.add_argument("--api-lotes", action="store_true", help="Usa la API de lotes (proveedor simulado con archivos).")
+    parser.add_argument("--streaming", action="store_true")
+    parser.add_argument("--salida-estructurada", action="store_true")
+    parser.add_argument("--candidatos", type=int, default=1, help="Candidatos en paralelo por intento.")
+    parser.add_argument("--max-llamadas", type=int, help="Máximo de llamadas al modelo por ítem.")
+    parser.add_argument("--tokens-manual", type=int, default=0, help="Tamaño del manual sintético en el prefijo estable.")
+    parser.add_argument("--con-cache", action="store_true", help="Usa la caché de respuestas (vacía al empezar).")
+    parser.add_argument("--sin-tracemalloc", action="store_true", help="No mide memoria con tracemalloc (menos sobrecarga).")
+    parser.add_argument("--semilla", type=int, default=1234)
+    parser.add_argument("--salida-json", help="Guarda el resultado en este archivo.")
+    parser.add_argument("--linea-base", help="Resultado JSON previo con el que comparar.")
+    parser.add_argument("--tolerancia", type=float, default=0.2, help="Empeoramiento relativo admitido frente a la línea base.")
+    args = parser.parse_args(argv)
+
+    modelo = args.modelo or ("gpt-4o" if args.proveedor == "GPT" else "gemini-1.5-flash")
+    resultado = ejecutar_benchmark(
+        items=args.items, concurrencia=args.concurrencia,
+        gen_model=(args.proveedor, modelo), audit_model=(args.proveedor, modelo),
+        medir_memoria=not args.sin_tracemalloc, tokens_manual=args.tokens_manual, api_lotes=args.api_lotes,
+        latencia_s=args.latencia, tasa_error=args.tasa_error, tasa_mal_formadas=args.tasa_mal_formadas,
+        tasa_rechazo=args.tasa_rechazo, tasa_rechazo_claro=args.tasa_rechazo_claro, semilla=args.semilla, tasa_lentas=args.tasa_lentas, factor_lentas=args.factor_lentas,
+        usar_cache=args.con_cache, streaming=args.streaming, salida_estructurada=args.salida_estructurada,
+        candidatos_por_ronda=args.candidatos, max_llamadas_por_item=args.max_llamadas,
+        modelo_respaldo=[args.proveedor, args.respaldo] if args.respaldo else None,
+        auditor_rapido=[args.proveedor, args.audit_rapido] if args.audit_rapido else None,
+        modelos_rapidos=(args.audit_rapido,) if args.audit_rapido else ()
+    )
+    imprimir_reporte(resultado)
+    if args.salida_json:
+        with open(args.salida_json, "w", encoding="utf-8") as archivo:
+            json.dump(resultado, archivo, ensure_ascii=False, indent=2)
+    if args.linea_base:
+        with open(args.linea_base, encoding="utf-8") as archivo:
+            regresiones = comparar_con_linea_base(resultado, json.load(archivo), args.tolerancia)
+        if regresiones:
+            print("Regresiones respecto a la línea base:")
+            for regresion in regresiones:
+                print(f"  - {regresion}")
+            return 1
+        print("Sin regresiones respecto a la línea base.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
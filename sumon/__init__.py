@@ -0,0 +1,20 @@
+"""
+Núcleo de Sumon: generación y auditoría de ítems educativos con LLM, sin dependencia de Streamlit.
+
+La aplicación de Streamlit (App-sumon2.py) y la línea de comandos (`python -m sumon`) usan los
+mismos módulos:
+    estructura   lectura del libro ESTRUCTURA_TOTAL y jerarquía de selectores
+    manual       índice BM25 sobre el manual de reglas
+    llm          clientes, streaming y `generar_texto_con_llm`
+    enrutamiento salud por modelo, cobertura y conmutación por error a un modelo de respaldo
+    pipeline     generación, auditoría y refinamiento de ítems (individual y por lote)
+    exportacion  exportación a Word
+    banco        banco persistente de ítems con búsqueda de texto completo y reutilización
+    duplicados   índice MinHash/LSH de casi duplicados entre los ítems generados
+    trabajos     almacén persistente de trabajos por lote con puntos de control
+    lotes_proveedor  envío diferido por las API de lotes de OpenAI y Gemini
+    segundo_plano    ejecución de trabajos en segundo plano, repartida entre sesiones
+
+Este archivo no importa nada a propósito: los SDK de los proveedores, pandas y python-docx se
+cargan solo cuando se usan, para que la línea de comandos arranque rápido.
+"""
@@ -0,0 +1,5 @@
+import sys
+
+from sumon.cli import main
+
+sys.exit(main())
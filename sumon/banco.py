@@ -0,0 +1,238 @@
+"""
+Banco persistente (SQLite con FTS5) de los ítems generados: clasificación, gráfico sugerido y
+dictamen de auditoría de cada uno, con índices por GRADO/ÁREA/ASIGNATURA/ESTACIÓN/NANOHABILIDAD
+y búsqueda de texto completo. Antes de generar se consultan los ítems aprobados para la misma
+clasificación, de modo que una nanohabilidad ya resuelta se convierte en una búsqueda.
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from sumon.comun import instancia_por_proceso
+
+RUTA_BANCO_ITEMS = os.environ.get(
+    "SUMON_BANCO_ITEMS",
+    os.path.join(os.path.expanduser("~"), ".cache", "sumon2", "banco_items.sqlite3")
+)
+DICTAMEN_APROBADO = "✅ CUMPLE TOTALMENTE"
+# Clave de `item_data["classification"]` → columna del banco (los niveles de la jerarquía)
+COLUMNAS_CLASIFICACION = {
+    "Grado": "grado",
+    "Área": "area",
+    "Asignatura": "asignatura",
+    "Estación": "estacion",
+    "Proceso Cognitivo": "proceso_cognitivo",
+    "Nanohabilidad": "nanohabilidad",
+}
+
+def _valor_clasificacion(valor):
+    # GRADO llega como número o como texto según el libro: se compara siempre como texto
+    if hasattr(valor, "item"):
+        valor = valor.item()
+    return "" if valor is None else str(valor).strip()
+
+def _consulta_fts(texto):
+    """Convierte texto libre en una consulta FTS5 segura: cada palabra como prefijo entre comillas."""
+    return " ".join(f'"{palabra}"*' for palabra in re.findall(r"\w+", texto))
+
+class BancoItems:
+    """
+    Ítems generados guardados en SQLite. Cada ítem se guarda una sola vez (por el hash de su
+    texto y clasificación); volver a guardarlo actualiza el dictamen. Un ítem guardado con
+    `origen` (trabajo y fila que lo produjo) se reemplaza al volver a guardar desde el mismo
+    origen, aunque cambie el texto. Si el SQLite instalado no
+    incluye FTS5, la búsqueda de texto usa LIKE. Es seguro para usarse desde varios hilos.
+    """
+    def __init__(self, ruta):
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(ruta, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS items (
+                    id INTEGER PRIMARY KEY,
+                    huella TEXT NOT NULL UNIQUE,
+                    grado TEXT NOT NULL,
+                    area TEXT NOT NULL,
+                    asignatura TEXT NOT NULL,
+                    estacion TEXT NOT NULL,
+                    proceso_cognitivo TEXT NOT NULL,
+                    nanohabilidad TEXT NOT NULL,
+                    item_text TEXT NOT NULL,
+                    descripcion_grafico TEXT NOT NULL,
+                    dictamen TEXT NOT NULL,
+                    aprobado INTEGER NOT NULL,
+                    item_data TEXT NOT NULL,
+                    creado REAL NOT NULL,
+                    usos INTEGER NOT NULL DEFAULT 0,
+                    origen TEXT
+                )
+            """)
+            # Bancos creados antes de existir la columna de origen
+            columnas = {fila[1] for fila in self._conn.execute("PRAGMA table_info(items)")}
+            if "origen" not in columnas:
+                self._conn.execute("ALTER TABLE items ADD COLUMN origen TEXT")
+            self._conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_items_origen ON items (origen) WHERE origen IS NOT NULL")
+            # Búsqueda exacta por clasificación (la nanohabilidad es el nivel más selectivo) y filtros sueltos
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_items_clasificacion ON items (nanohabilidad, grado, area, asignatura, estacion, aprobado)"
+            )
+            for columna in ("grado", "area", "asignatura", "estacion"):
+                self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_items_{columna} ON items ({columna})")
+            try:
+                self._conn.execute("""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+                        item_text, nanohabilidad, estacion, descripcion_grafico,
+                        content='items', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+                    )
+                """)
+                # Triggers de "external content": el índice FTS sigue a la tabla items
+                self._conn.execute("""
+                    CREATE TRIGGER IF NOT EXISTS items_fts_insertar AFTER INSERT ON items BEGIN
+                        INSERT INTO items_fts (rowid, item_text, nanohabilidad, estacion, descripcion_grafico)
+                        VALUES (new.id, new.item_text, new.nanohabilidad, new.estacion, new.descripcion_grafico);
+                    END
+                """)
+                self._conn.execute("""
+                    CREATE TRIGGER IF NOT EXISTS items_fts_borrar AFTER DELETE ON items BEGIN
+                        INSERT INTO items_fts (items_fts, rowid, item_text, nanohabilidad, estacion, descripcion_grafico)
+                        VALUES ('delete', old.id, old.item_text, old.nanohabilidad, old.estacion, old.descripcion_grafico);
+                    END
+                """)
+                self._conn.execute("""
+                    CREATE TRIGGER IF NOT EXISTS items_fts_actualizar AFTER UPDATE ON items BEGIN
+                        INSERT INTO items_fts (items_fts, rowid, item_text, nanohabilidad, estacion, descripcion_grafico)
+                        VALUES ('delete', old.id, old.item_text, old.nanohabilidad, old.estacion, old.descripcion_grafico);
+                        INSERT INTO items_fts (rowid, item_text, nanohabilidad, estacion, descripcion_grafico)
+                        VALUES (new.id, new.item_text, new.nanohabilidad, new.estacion, new.descripcion_grafico);
+                    END
+                """)
+                self.fts = True
+            except sqlite3.OperationalError:
+                self.fts = False # SQLite compilado sin FTS5
+
+    @staticmethod
+    def clasificacion_de(classification):
+        """Valores normalizados de la jerarquía a partir de `item_data["classification"]`."""
+        return {columna: _valor_clasificacion(classification.get(clave)) for clave, columna in COLUMNAS_CLASIFICACION.items()}
+
+    def guardar(self, item_data, origen=None):
+        """
+        Guarda (o actualiza) un ítem procesado y devuelve su id en el banco. Con `origen`, reprocesar
+        la misma fila de un trabajo (p. ej. al reanudarlo tras una caída) no añade otro ítem.
+        """
+        clasificacion = self.clasificacion_de(item_data.get("classification", {}))
+        dictamen = item_data.get("final_audit_status", "")
+        material = json.dumps([item_data.get("item_text", ""), clasificacion], ensure_ascii=False, sort_keys=True)
+        huella = hashlib.sha256(material.encode("utf-8")).hexdigest()
+        contenido = json.dumps(item_data, ensure_ascii=False, default=lambda v: v.item() if hasattr(v, "item") else str(v))
+        valores = {
+            "huella": huella, **clasificacion,
+            "item_text": item_data.get("item_text", ""),
+            "descripcion_grafico": item_data.get("descripcion_grafico", "") or "",
+            "dictamen": dictamen, "aprobado": int(dictamen == DICTAMEN_APROBADO),
+            "item_data": contenido, "creado": time.time(), "origen": origen
+        }
+        with self._lock, self._conn:
+            previo = None
+            if origen is not None:
+                previo = self._conn.execute("SELECT id, huella FROM items WHERE origen = ?", (origen,)).fetchone()
+            if previo is not None and previo[1] != huella:
+                igual = self._conn.execute("SELECT id FROM items WHERE huella = ?", (huella,)).fetchone()
+                if igual is None:
+                    # El mismo origen produjo otro texto: se reemplaza el ítem anterior
+                    self._conn.execute(
+                        """
+                        UPDATE items SET huella = :huella, grado = :grado, area = :area, asignatura = :asignatura,
+                                         estacion = :estacion, proceso_cognitivo = :proceso_cognitivo,
+                                         nanohabilidad = :nanohabilidad, item_text = :item_text,
+                                         descripcion_grafico = :descripcion_grafico, dictamen = :dictamen,
+                                         aprobado = :aprobado, item_data = :item_data
+                        WHERE id = :id
+                        """,
+                        {**valores, "id": previo[0]}
+                    )
+                    return previo[0]
+                # El texto nuevo ya estaba en el banco con otro id: ese ocupa el lugar del anterior
+                self._conn.execute("DELETE FROM items WHERE id = ?", (previo[0],))
+            self._conn.execute(
+                """
+                INSERT INTO items (huella, grado, area, asignatura, estacion, proceso_cognitivo, nanohabilidad,
+                                   item_text, descripcion_grafico, dictamen, aprobado, item_data, creado, origen)
+                VALUES (:huella, :grado, :area, :asignatura, :estacion, :proceso_cognitivo, :nanohabilidad,
+                        :item_text, :descripcion_grafico, :dictamen, :aprobado, :item_data, :creado, :origen)
+                ON CONFLICT (huella) DO UPDATE SET dictamen = excluded.dictamen, aprobado = excluded.aprobado,
+                                                   item_data = excluded.item_data,
+                                                   origen = COALESCE(items.origen, excluded.origen)
+                """,
+                valores
+            )
+            (id_banco,) = self._conn.execute("SELECT id FROM items WHERE huella = ?", (huella,)).fetchone()
+        return id_banco
+
+    def aprobados_para(self, classification, limite=5):
+        """Ítems aprobados con la misma clasificación (los seis niveles de la jerarquía), los más recientes primero."""
+        clasificacion = self.clasificacion_de(classification)
+        condiciones = " AND ".join(f"{columna} = :{columna}" for columna in clasificacion)
+        with self._lock:
+            registros = self._conn.execute(
+                f"SELECT id, item_data FROM items WHERE {condiciones} AND aprobado = 1 ORDER BY creado DESC LIMIT :limite",
+                {**clasificacion, "limite": limite}
+            ).fetchall()
+        return [{**json.loads(item_data), "id_banco": id_banco} for id_banco, item_data in registros]
+
+    def registrar_uso(self, id_banco):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE items SET usos = usos + 1 WHERE id = ?", (id_banco,))
+
+    def buscar(self, texto="", filtros=None, solo_aprobados=False, limite=50):
+        """
+        Busca ítems por texto libre (enunciado, opciones, justificaciones, nanohabilidad, estación,
+        gráfico) y por igualdad en los niveles de `filtros` ({"Grado": 5, "Área": ...}).
+        Returns: lista de item_data con "id_banco", ordenada por relevancia (o por fecha sin texto).
+        """
+        condiciones = []
+        parametros = {"limite": limite}
+        for clave, valor in (filtros or {}).items():
+            columna = COLUMNAS_CLASIFICACION[clave]
+            condiciones.append(f"items.{columna} = :{columna}")
+            parametros[columna] = _valor_clasificacion(valor)
+        if solo_aprobados:
+            condiciones.append("items.aprobado = 1")
+        consulta = _consulta_fts(texto) if texto else ""
+        if consulta and self.fts:
+            condiciones.append("items_fts MATCH :consulta")
+            parametros["consulta"] = consulta
+            sentencia = "SELECT items.id, items.item_data FROM items_fts JOIN items ON items.id = items_fts.rowid"
+            orden = "ORDER BY bm25(items_fts)"
+        else:
+            if consulta:
+                for posicion, palabra in enumerate(re.findall(r"\w+", texto)):
+                    condiciones.append(f"items.item_text LIKE :palabra{posicion}")
+                    parametros[f"palabra{posicion}"] = f"%{palabra}%"
+            sentencia = "SELECT items.id, items.item_data FROM items"
+            orden = "ORDER BY items.creado DESC"
+        donde = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        with self._lock:
+            registros = self._conn.execute(f"{sentencia} {donde} {orden} LIMIT :limite", parametros).fetchall()
+        return [{**json.loads(item_data), "id_banco": id_banco} for id_banco, item_data in registros]
+
+    def contar(self, solo_aprobados=False):
+        with self._lock:
+            sentencia = "SELECT COUNT(*) FROM items" + (" WHERE aprobado = 1" if solo_aprobados else "")
+            return self._conn.execute(sentencia).fetchone()[0]
+
+    def eliminar(self, id_banco):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM items WHERE id = ?", (id_banco,))
+
+@instancia_por_proceso
+def obtener_banco_items():
+    return BancoItems(RUTA_BANCO_ITEMS)
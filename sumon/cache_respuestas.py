@@ -0,0 +1,97 @@
+"""
+Caché persistente (SQLite) de las respuestas de los modelos, compartida por todas las sesiones,
+hilos y ejecuciones de la línea de comandos del mismo equipo.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from sumon.comun import instancia_por_proceso
+
+RUTA_CACHE_LLM = os.environ.get(
+    "SUMON_CACHE_LLM",
+    os.path.join(os.path.expanduser("~"), ".cache", "sumon2", "respuestas_llm.sqlite3")
+)
+CACHE_LLM_TTL_SEGUNDOS = 7 * 24 * 3600 # Una semana
+CACHE_LLM_MAX_ENTRADAS = 5000
+
+class CacheRespuestasLLM:
+    """
+    Caché en disco (SQLite) de las respuestas de los modelos, indexada por proveedor, modelo,
+    hash del prompt y parámetros de generación. Las entradas caducan tras `ttl_segundos` y,
+    al superar `max_entradas`, se descartan las de acceso más antiguo.
+    Es segura para usarse desde varios hilos y sesiones del mismo proceso.
+    """
+    def __init__(self, ruta, ttl_segundos=CACHE_LLM_TTL_SEGUNDOS, max_entradas=CACHE_LLM_MAX_ENTRADAS):
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self.ttl_segundos = ttl_segundos
+        self.max_entradas = max_entradas
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(ruta, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS respuestas (
+                    clave TEXT PRIMARY KEY,
+                    model_type TEXT NOT NULL,
+                    model_name TEXT NOT NULL,
+                    respuesta TEXT NOT NULL,
+                    creado REAL NOT NULL,
+                    ultimo_acceso REAL NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_respuestas_acceso ON respuestas (ultimo_acceso)")
+
+    @staticmethod
+    def construir_clave(model_type, model_name, prompt, parametros=None):
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        material = json.dumps(
+            {"model_type": model_type, "model_name": model_name, "prompt": prompt_hash, "parametros": parametros or {}},
+            sort_keys=True, ensure_ascii=False
+        )
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def obtener(self, clave):
+        ahora = time.time()
+        with self._lock, self._conn:
+            fila = self._conn.execute("SELECT respuesta, creado FROM respuestas WHERE clave = ?", (clave,)).fetchone()
+            if fila is None:
+                return None
+            respuesta, creado = fila
+            if ahora - creado > self.ttl_segundos:
+                self._conn.execute("DELETE FROM respuestas WHERE clave = ?", (clave,))
+                return None
+            self._conn.execute("UPDATE respuestas SET ultimo_acceso = ? WHERE clave = ?", (ahora, clave))
+            return respuesta
+
+    def guardar(self, clave, model_type, model_name, respuesta):
+        ahora = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO respuestas (clave, model_type, model_name, respuesta, creado, ultimo_acceso) VALUES (?, ?, ?, ?, ?, ?)",
+                (clave, model_type, model_name, respuesta, ahora, ahora)
+            )
+            self._conn.execute("DELETE FROM respuestas WHERE creado < ?", (ahora - self.ttl_segundos,))
+            (total,) = self._conn.execute("SELECT COUNT(*) FROM respuestas").fetchone()
+            if total > self.max_entradas:
+                self._conn.execute(
+                    "DELETE FROM respuestas WHERE clave IN (SELECT clave FROM respuestas ORDER BY ultimo_acceso ASC LIMIT ?)",
+                    (total - self.max_entradas,)
+                )
+
+    def contar(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM respuestas").fetchone()[0]
+
+    def vaciar(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM respuestas")
+
+@instancia_por_proceso
+def obtener_cache_respuestas_llm():
+    return CacheRespuestasLLM(RUTA_CACHE_LLM)
@@ -0,0 +1,301 @@
+"""
+Línea de comandos para generar ítems sin Streamlit (cron, contenedores, trabajos nocturnos).
+
+Ejemplo:
+    OPENAI_API_KEY=... python -m sumon --excel ESTRUCTURA_TOTAL.xlsx --manual manual.pdf \\
+        --grado 5 --area Matemáticas --gen-modelo GPT:gpt-4o --audit-modelo GPT:gpt-4o \\
+        --concurrencia 8 --salida items.jsonl --word items.docx --banco banco.xlsx
+
+Con `--trabajo ID` el lote queda en el almacén de trabajos (SQLite): si la ejecución se interrumpe,
+volver a lanzar el mismo comando con el mismo ID continúa desde el último intento guardado de cada
+fila, y `python -m sumon --progreso ID` informa su avance. Al reanudar hay que pasar el mismo
+`--manual`: si su contenido no coincide con el que se usó al crear el trabajo, no se reanuda.
+
+Cada ítem procesado se guarda en el banco de ítems (SQLite); con `--reutilizar-banco` las filas cuya
+clasificación ya tiene un ítem aprobado no se vuelven a generar, y `--buscar-banco TEXTO` consulta
+el banco sin generar nada. Los ítems casi idénticos a otro ya aprobado se regeneran antes de
+auditarlos, salvo con `--permitir-duplicados`.
+
+Con `--gen-respaldo` / `--audit-respaldo PROVEEDOR:MODELO`, una llamada que tarda más que el p95
+observado del modelo se duplica en el de respaldo (gana la primera respuesta) y una llamada
+fallida se repite en él.
+
+Con `--audit-rapido PROVEEDOR:MODELO`, cada ítem lo audita primero ese modelo; sus rechazos claros
+se aceptan y el resto (dictamen parcial, desacuerdo con los criterios, aprobación) pasa al modelo de
+`--audit-modelo`. Al terminar se informa la concordancia entre ambos auditores.
+
+Con `--api-lotes`, las llamadas van por la API de lotes del proveedor (OpenAI Batch / modo por
+lotes de Gemini): mitad de precio y cuota aparte, con respuestas en minutos u horas. Cada ronda
+envía juntas las generaciones de todas las filas, la siguiente sus auditorías, etc. Conviene
+combinarlo con `--trabajo` para reanudar sin volver a pagar los lotes ya enviados.
+
+Las API keys se leen de GEMINI_API_KEY (o GOOGLE_API_KEY) y OPENAI_API_KEY. Los módulos pesados
+(pandas, SDK de los proveedores, python-docx) se importan después de leer los argumentos, de
+modo que `--help` y los errores de uso responden al instante.
+"""
+import argparse
+import json
+import logging
+import sys
+
+logger = logging.getLogger("sumon")
+
+# Opción de la línea de comandos → columna de ESTRUCTURA_TOTAL
+FILTROS_CLI = {
+    "grado": "GRADO",
+    "area": "ÁREA",
+    "asignatura": "ASIGNATURA",
+    "estacion": "ESTACIÓN",
+    "proceso": "PROCESO COGNITIVO",
+    "nanohabilidad": "NANOHABILIDAD",
+}
+PROVEEDORES = ("Gemini", "GPT")
+
+def _modelo(valor):
+    """Convierte "GPT:gpt-4o" en ("GPT", "gpt-4o")."""
+    proveedor, separador, nombre = valor.partition(":")
+    if not separador or proveedor not in PROVEEDORES or not nombre:
+        raise argparse.ArgumentTypeError(f"Usa PROVEEDOR:MODELO con PROVEEDOR en {PROVEEDORES} (recibido: '{valor}').")
+    return proveedor, nombre
+
+def construir_parser():
+    parser = argparse.ArgumentParser(prog="sumon", description="Genera y audita ítems educativos a partir de ESTRUCTURA_TOTAL.")
+    parser.add_argument("--excel", help="Libro ESTRUCTURA_TOTAL.xlsx (no hace falta al reanudar un trabajo).")
+    parser.add_argument("--manual", help="Manual de reglas en PDF (opcional).")
+    for opcion, columna in FILTROS_CLI.items():
+        parser.add_argument(f"--{opcion}", help=f"Filtra por {columna}.")
+    parser.add_argument("--max-items", type=int, help="Procesa como máximo esta cantidad de filas.")
+    parser.add_argument("--gen-modelo", type=_modelo, default=("Gemini", "gemini-1.5-flash"), help="PROVEEDOR:MODELO del generador.")
+    parser.add_argument("--audit-modelo", type=_modelo, default=("Gemini", "gemini-1.5-flash"), help="PROVEEDOR:MODELO del auditor.")
+    parser.add_argument("--gen-respaldo", type=_modelo,
+                        help="PROVEEDOR:MODELO secundario del generador (cobertura de llamadas lentas y conmutación por error).")
+    parser.add_argument("--audit-respaldo", type=_modelo, help="PROVEEDOR:MODELO secundario del auditor.")
+    parser.add_argument("--audit-rapido", type=_modelo,
+                        help="PROVEEDOR:MODELO rápido que audita primero; solo lo dudoso y las aprobaciones pasan a --audit-modelo.")
+    parser.add_argument("--verificacion-cascada", type=float, default=0.1,
+                        help="Fracción de rechazos claros del auditor rápido que se verifican igual con --audit-modelo.")
+    parser.add_argument("--concurrencia", type=int, default=4, help="Ítems en paralelo.")
+    parser.add_argument("--api-lotes", action="store_true",
+                        help="Envía las llamadas por la API de lotes del proveedor (más barata y lenta; para lotes nocturnos).")
+    parser.add_argument("--intervalo-sondeo", type=float, default=60.0, help="Segundos entre consultas del estado de un lote.")
+    parser.add_argument("--filas-por-ronda", type=int, default=1000,
+                        help="Con --api-lotes, filas en curso a la vez (cada ronda reúne una petición de cada una).")
+    parser.add_argument("--info-adicional", default="", help="Información adicional para todos los prompts.")
+    parser.add_argument("--dificultad", default="media")
+    parser.add_argument("--contexto-educativo", default="estudiantes de preparatoria (bachillerato)")
+    parser.add_argument("--manual-completo", action="store_true",
+                        help="Envía el manual truncado a 15000 caracteres en lugar de las secciones relevantes.")
+    parser.add_argument("--salida-estructurada", action="store_true", help="Pide el ítem y la auditoría como JSON.")
+    parser.add_argument("--refinamiento-completo", action="store_true", help="Repite el prompt completo en cada reintento.")
+    parser.add_argument("--candidatos", type=int, default=1,
+                        help="Candidatos generados y auditados en paralelo por intento (gana el primero aprobado).")
+    parser.add_argument("--max-llamadas", type=int, help="Máximo de llamadas al modelo por ítem (tope de costo).")
+    parser.add_argument("--sin-cache", action="store_true", help="No reutiliza respuestas de la caché.")
+    parser.add_argument("--cache-generacion", action="store_true",
+                        help="Reutiliza también las respuestas de generación (por defecto solo las auditorías).")
+    parser.add_argument("--salida", default="-", help="Archivo JSONL con un ítem por línea ('-' = salida estándar).")
+    parser.add_argument("--word", help="Exporta además los ítems a este documento de Word (.docx, o .zip con un documento por fragmento).")
+    parser.add_argument("--banco", help="Exporta además un banco de ítems (.jsonl o .xlsx) con una fila por ítem.")
+    parser.add_argument("--trabajo", help="ID del trabajo persistente: lo crea o, si ya existe, lo reanuda con sus filas y parámetros.")
+    parser.add_argument("--reutilizar-banco", action="store_true",
+                        help="Reutiliza los ítems aprobados del banco para las clasificaciones ya resueltas.")
+    parser.add_argument("--permitir-duplicados", action="store_true",
+                        help="No regenera los ítems casi idénticos a otro ya aprobado o a otro candidato de la ronda.")
+    parser.add_argument("--buscar-banco", metavar="TEXTO", help="Busca en el banco de ítems (JSONL a la salida) y termina.")
+    parser.add_argument("--progreso", metavar="ID", help="Muestra el avance del trabajo indicado y termina.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Muestra el progreso de cada ítem.")
+    return parser
+
+def _valor_json(valor):
+    # Los valores de las celdas llegan como tipos de numpy (int64, etc.)
+    return valor.item() if hasattr(valor, "item") else str(valor)
+
+def _registrar_evento(evento):
+    if evento.tipo in ("info", "nota", "advertencia", "error", "exito"):
+        nivel = {"advertencia": logging.WARNING, "error": logging.ERROR}.get(evento.tipo, logging.INFO)
+        logger.log(nivel, "[fila %s] %s", evento.datos.get("fila", "-"), evento.mensaje)
+
+def main(argv=None):
+    parser = construir_parser()
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format="%(asctime)s %(levelname)s %(message)s")
+
+    if args.progreso:
+        from sumon.trabajos import obtener_almacen_trabajos
+
+        almacen = obtener_almacen_trabajos()
+        if not almacen.existe(args.progreso):
+            print(f"No existe el trabajo '{args.progreso}'.", file=sys.stderr)
+            return 1
+        print(json.dumps(almacen.progreso(args.progreso), ensure_ascii=False))
+        return 0
+
+    if args.buscar_banco is not None:
+        from sumon.banco import COLUMNAS_CLASIFICACION, obtener_banco_items
+
+        # FILTROS_CLI y COLUMNAS_CLASIFICACION recorren los mismos niveles en el mismo orden
+        filtros = {clave: getattr(args, opcion) for opcion, clave in zip(FILTROS_CLI, COLUMNAS_CLASIFICACION) if getattr(args, opcion)}
+        for item_data in obtener_banco_items().buscar(args.buscar_banco, filtros, limite=args.max_items or 50):
+            print(json.dumps(item_data, ensure_ascii=False))
+        return 0
+
+    almacen = None
+    reanudar = False
+    if args.trabajo:
+        from sumon.trabajos import obtener_almacen_trabajos
+
+        almacen = obtener_almacen_trabajos()
+        reanudar = almacen.existe(args.trabajo)
+    if not args.excel and not reanudar:
+        parser.error("--excel es obligatorio salvo al reanudar un trabajo existente.")
+
+    from sumon.banco import obtener_banco_items
+    from sumon.duplicados import obtener_indice_duplicados
+    from sumon.estructura import cargar_estructura_con_cache, filtrar_por_valores
+    from sumon.llm import ConfiguracionLLM
+    from sumon.manual import (
+        MANUAL_MAX_CARACTERES_COMPLETO, MANUAL_PRESUPUESTO_TOKENS, MANUAL_TOP_K, construir_indice_manual, diferencia_manual,
+        leer_texto_manual, parametros_manual
+    )
+    from sumon.metricas import obtener_registro_metricas, resumen_cascada
+    from sumon.pipeline import generar_lote_de_preguntas
+
+    configuracion = ConfiguracionLLM.desde_entorno(usar_cache=not args.sin_cache, cachear_generacion=args.cache_generacion)
+    parametros_trabajo = almacen.parametros(args.trabajo) if reanudar else {}
+    # Un trabajo reanudado conserva los modelos, criterios, información adicional y forma de enviar el
+    # manual con que se creó; el manual debe ser el mismo (se comprueba su huella)
+    gen_modelo = tuple(parametros_trabajo.get("gen_modelo", args.gen_modelo))
+    audit_modelo = tuple(parametros_trabajo.get("audit_modelo", args.audit_modelo))
+    for model_type, _ in (gen_modelo, audit_modelo):
+        if not configuracion.proveedor_ok(model_type):
+            variable = "GEMINI_API_KEY" if model_type == "Gemini" else "OPENAI_API_KEY"
+            print(f"Falta la API key de {model_type}: define la variable de entorno {variable}.", file=sys.stderr)
+            return 2
+
+    df_filas = None
+    if reanudar:
+        progreso = almacen.progreso(args.trabajo)
+        print(f"Reanudando el trabajo {args.trabajo}: {progreso['terminadas']}/{progreso['total']} filas terminadas.", file=sys.stderr)
+    else:
+        with open(args.excel, "rb") as archivo:
+            df_datos = cargar_estructura_con_cache(archivo.read())
+        filtros = {columna: getattr(args, opcion) for opcion, columna in FILTROS_CLI.items() if getattr(args, opcion)}
+        try:
+            df_filas = filtrar_por_valores(df_datos, filtros)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 2
+        if args.max_items is not None:
+            df_filas = df_filas.head(args.max_items)
+        if df_filas.empty:
+            print("Ninguna fila de la estructura coincide con los filtros.", file=sys.stderr)
+            return 1
+
+    manual_reglas_texto = ""
+    indice_manual = None
+    if args.manual:
+        with open(args.manual, "rb") as archivo:
+            manual_reglas_texto = leer_texto_manual(archivo.read())
+    max_caracteres_manual = MANUAL_MAX_CARACTERES_COMPLETO if args.manual_completo else None
+    if parametros_trabajo.get("manual"):
+        max_caracteres_manual = parametros_trabajo["manual"]["max_caracteres"]
+    manual_trabajo = parametros_manual(manual_reglas_texto, max_caracteres_manual)
+    if reanudar and "manual" in parametros_trabajo:
+        # Reanudar con otro manual mezclaría en el mismo trabajo ítems generados y auditados con reglas distintas
+        problema = diferencia_manual(parametros_trabajo["manual"], manual_trabajo)
+        if problema is not None:
+            print(f"No se puede reanudar el trabajo {args.trabajo}: {problema}. Vuelve a pasar el mismo --manual.", file=sys.stderr)
+            return 2
+    if manual_reglas_texto:
+        if max_caracteres_manual is not None:
+            manual_reglas_texto = manual_reglas_texto[:max_caracteres_manual]
+        else:
+            indice_manual = construir_indice_manual(manual_reglas_texto)
+
+    criterios_generacion = {
+        "tipo_pregunta": "opción múltiple con 3 opciones",
+        "dificultad": args.dificultad,
+        "contexto_educativo": args.contexto_educativo,
+        "refinamiento_compacto": not args.refinamiento_completo,
+        "salida_estructurada": args.salida_estructurada,
+        "manual_top_k": MANUAL_TOP_K,
+        "manual_presupuesto_tokens": MANUAL_PRESUPUESTO_TOKENS,
+        "candidatos_por_ronda": args.candidatos,
+        "max_llamadas_por_item": args.max_llamadas,
+        "reutilizar_banco": args.reutilizar_banco,
+        "detectar_duplicados": not args.permitir_duplicados,
+        "modelo_respaldo_generacion": list(args.gen_respaldo) if args.gen_respaldo else None,
+        "modelo_respaldo_auditoria": list(args.audit_respaldo) if args.audit_respaldo else None,
+        "modelo_auditoria_rapida": list(args.audit_rapido) if args.audit_rapido else None,
+        "fraccion_verificacion_cascada": args.verificacion_cascada,
+    }
+    criterios_generacion = parametros_trabajo.get("criterios_generacion", criterios_generacion)
+    informacion_adicional = parametros_trabajo.get("informacion_adicional_usuario", args.info_adicional)
+    if args.trabajo and not reanudar:
+        almacen.crear_trabajo(
+            (fila for _, fila in df_filas.iterrows()),
+            parametros={"gen_modelo": gen_modelo, "audit_modelo": audit_modelo, "criterios_generacion": criterios_generacion,
+                        "informacion_adicional_usuario": informacion_adicional, "manual": manual_trabajo},
+            descripcion=f"CLI: {len(df_filas)} filas de {args.excel}", id_trabajo=args.trabajo
+        )
+
+    max_concurrencia = args.concurrencia
+    if args.api_lotes:
+        from sumon.lotes_proveedor import AgrupadorLotesProveedor, clientes_lotes
+
+        configuracion.lote = AgrupadorLotesProveedor(clientes_lotes(configuracion),
+                                                     intervalo_sondeo_s=args.intervalo_sondeo)
+        max_concurrencia = max(args.concurrencia, args.filas_por_ronda)
+
+    def _mostrar_avance(completados, total, item_data):
+        dictamen = item_data.get("final_audit_status", "N/A") if item_data else "sin resultado"
+        print(f"[{completados}/{total}] {dictamen}", file=sys.stderr)
+
+    items = generar_lote_de_preguntas(
+        *gen_modelo, *audit_modelo,
+        df_filas=None if args.trabajo else df_filas,
+        criterios_generacion=criterios_generacion,
+        manual_reglas_texto=manual_reglas_texto,
+        informacion_adicional_usuario=informacion_adicional,
+        max_concurrencia=max_concurrencia,
+        al_avanzar=_mostrar_avance,
+        indice_manual=indice_manual,
+        configuracion=configuracion,
+        al_progresar=_registrar_evento if args.verbose else None,
+        id_trabajo=args.trabajo,
+        almacen_trabajos=almacen,
+        banco_items=obtener_banco_items(),
+        indice_duplicados=obtener_indice_duplicados()
+    )
+    sin_resultado = sum(1 for item_data in items if item_data is None)
+    items = [item_data for item_data in items if item_data is not None]
+
+    salida = sys.stdout if args.salida == "-" else open(args.salida, "w", encoding="utf-8")
+    try:
+        for item_data in items:
+            salida.write(json.dumps(item_data, ensure_ascii=False, default=_valor_json) + "\n")
+    finally:
+        if salida is not sys.stdout:
+            salida.close()
+
+    if args.word or args.banco:
+        from sumon.exportacion import exportar_items
+
+        for ruta, formatos in ((args.word, ("docx", "zip")), (args.banco, ("jsonl", "xlsx"))):
+            if ruta:
+                extension = ruta.rsplit(".", 1)[-1].lower()
+                exportar_items(items, extension if extension in formatos else formatos[0], archivo_destino=ruta)
+
+    aprobados = sum(1 for item_data in items if item_data.get("final_audit_status") == "✅ CUMPLE TOTALMENTE")
+    print(f"{len(items)} ítems procesados, {aprobados} aprobados por el auditor.", file=sys.stderr)
+    if sin_resultado:
+        print(f"{sin_resultado} filas quedaron sin resultado.", file=sys.stderr)
+
+    df_cascada = obtener_registro_metricas().cascada_df()
+    if not df_cascada.empty:
+        for fila in resumen_cascada(df_cascada).itertuples(index=False):
+            concordancia = "—" if fila.comparadas == 0 else f"{fila.concordancia:.0%}"
+            print(f"Cascada {fila.modelo_rapido} → {fila.modelo_fuerte}, dictamen rápido '{fila.dictamen_rapido}': "
+                  f"{fila.auditorias} auditorías, {fila.fraccion_escalada:.0%} escaladas, concordancia {concordancia} "
+                  f"en {fila.comparadas} comparadas.", file=sys.stderr)
+    return 0
@@ -0,0 +1,31 @@
+"""Utilidades compartidas por los módulos del núcleo."""
+import functools
+import threading
+import unicodedata
+
+def instancia_por_proceso(fabrica):
+    """
+    Decorador para funciones sin argumentos que construyen un objeto compartido por todo el
+    proceso (sesiones de Streamlit, hilos del modo por lote, línea de comandos). Equivale a
+    `st.cache_resource` sin depender de Streamlit; el lock evita construir dos instancias
+    cuando varios hilos la piden a la vez.
+    """
+    lock = threading.Lock()
+    instancia = []
+
+    @functools.wraps(fabrica)
+    def obtener():
+        if not instancia:
+            with lock:
+                if not instancia:
+                    instancia.append(fabrica())
+        return instancia[0]
+    return obtener
+
+def estimar_tokens(texto):
+    # Aproximación habitual de ~4 caracteres por token; suficiente para umbrales de corte
+    return len(texto) // 4
+
+def quitar_tildes(texto):
+    texto = unicodedata.normalize("NFKD", str(texto))
+    return "".join(c for c in texto if not unicodedata.combining(c))
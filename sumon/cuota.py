@@ -0,0 +1,213 @@
+"""
+Control de cuota por proveedor y modelo: limitador de solicitudes y tokens por minuto,
+reintentos con backoff exponencial con jitter y concurrencia adaptativa (AIMD).
+"""
+import random
+import sys
+import threading
+import time
+
+from sumon.comun import instancia_por_proceso
+
+# Cuotas por defecto (solicitudes y tokens por minuto); ajústalas a las de tu cuenta
+LIMITES_CUOTA_POR_PROVEEDOR = {
+    "Gemini": {"rpm": 60, "tpm": 1_000_000},
+    "GPT": {"rpm": 500, "tpm": 30_000},
+}
+LIMITES_CUOTA_POR_MODELO = {
+    "gemini-1.5-pro": {"rpm": 30, "tpm": 1_000_000},
+    "gpt-4o": {"rpm": 500, "tpm": 30_000},
+    "gpt-3.5-turbo": {"rpm": 3500, "tpm": 200_000},
+}
+TOKENS_SALIDA_ESTIMADOS = 1500 # Para descontar del cupo de TPM cuando no hay max_tokens explícito
+MAX_REINTENTOS_LLM = 4
+ESPERA_BASE_REINTENTO = 1.0 # Segundos
+ESPERA_MAXIMA_REINTENTO = 60.0
+CONCURRENCIA_INICIAL_POR_MODELO = 4
+CONCURRENCIA_MAXIMA_POR_MODELO = 32
+CODIGOS_REINTENTABLES = {408, 429, 500, 502, 503, 504}
+
+class CuboDeTokens:
+    """Token bucket clásico: `capacidad` unidades que se recargan a `tasa_por_segundo`."""
+    def __init__(self, capacidad, tasa_por_segundo):
+        self.capacidad = float(capacidad)
+        self.tasa_por_segundo = float(tasa_por_segundo)
+        self._disponibles = float(capacidad)
+        self._ultima_recarga = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _recargar(self):
+        # Se llama con `self._lock` adquirido
+        ahora = time.monotonic()
+        self._disponibles = min(self.capacidad, self._disponibles + (ahora - self._ultima_recarga) * self.tasa_por_segundo)
+        self._ultima_recarga = ahora
+
+    def adquirir(self, cantidad=1):
+        """Bloquea hasta poder descontar `cantidad` unidades (nunca más que la capacidad)."""
+        cantidad = min(float(cantidad), self.capacidad)
+        while True:
+            with self._lock:
+                self._recargar()
+                if self._disponibles >= cantidad:
+                    self._disponibles -= cantidad
+                    return
+                espera = (cantidad - self._disponibles) / self.tasa_por_segundo
+            time.sleep(espera)
+
+    def ajustar(self, cantidad):
+        """
+        Corrige lo descontado con `adquirir` sin esperar: devuelve `cantidad` unidades si es positiva
+        (hasta la capacidad) o descuenta las que faltaban si es negativa. El saldo puede quedar
+        negativo; las siguientes llamadas a `adquirir` esperan a que se recupere.
+        """
+        with self._lock:
+            self._recargar()
+            self._disponibles = min(self.capacidad, self._disponibles + cantidad)
+
+class ControladorConcurrencia:
+    """
+    Límite de llamadas simultáneas con ajuste AIMD: sube de a poco mientras las llamadas
+    salen bien y se reduce a la mitad cada vez que el proveedor limita (429).
+    """
+    def __init__(self, inicial=CONCURRENCIA_INICIAL_POR_MODELO, minimo=1, maximo=CONCURRENCIA_MAXIMA_POR_MODELO):
+        self.limite = float(inicial)
+        self.minimo = minimo
+        self.maximo = maximo
+        self._en_curso = 0
+        self._condicion = threading.Condition()
+
+    def __enter__(self):
+        with self._condicion:
+            while self._en_curso >= max(self.minimo, int(self.limite)):
+                self._condicion.wait()
+            self._en_curso += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        with self._condicion:
+            self._en_curso -= 1
+            self._condicion.notify_all()
+        return False
+
+    def registrar_exito(self):
+        with self._condicion:
+            self.limite = min(self.maximo, self.limite + 1.0 / self.limite)
+            self._condicion.notify_all()
+
+    def registrar_limitacion(self):
+        with self._condicion:
+            self.limite = max(float(self.minimo), self.limite / 2)
+
+def _es_excepcion_de(error, modulo, *nombres):
+    # Los SDK se importan de forma diferida: si el módulo no está cargado, el error no puede venir de él
+    modulo = sys.modules.get(modulo)
+    return modulo is not None and isinstance(error, tuple(getattr(modulo, nombre) for nombre in nombres))
+
+def _codigo_estado_error(error):
+    # openai.APIStatusError expone status_code; las excepciones de google.api_core, code
+    codigo = getattr(error, "status_code", None)
+    if codigo is None and _es_excepcion_de(error, "google.api_core.exceptions", "GoogleAPICallError"):
+        codigo = error.code
+    return codigo if isinstance(codigo, int) else None
+
+def _es_error_reintentable(error):
+    if _es_excepcion_de(error, "openai", "APIConnectionError"):
+        return True # openai.APITimeoutError es subclase de APIConnectionError
+    if _es_excepcion_de(error, "google.api_core.exceptions", "DeadlineExceeded", "ServiceUnavailable"):
+        return True
+    return _codigo_estado_error(error) in CODIGOS_REINTENTABLES
+
+def _segundos_retry_after(error):
+    respuesta = getattr(error, "response", None)
+    cabeceras = getattr(respuesta, "headers", None)
+    if not cabeceras:
+        return None
+    try:
+        if cabeceras.get("retry-after-ms"):
+            return float(cabeceras["retry-after-ms"]) / 1000
+        if cabeceras.get("retry-after"):
+            return float(cabeceras["retry-after"])
+    except ValueError:
+        pass # Retry-After con formato de fecha HTTP: se usa el backoff normal
+    return None
+
+class ControlCuota:
+    """
+    Control de cuota de un proveedor y modelo: limitador de solicitudes y tokens por minuto,
+    concurrencia adaptativa y reintentos con backoff exponencial con jitter que respetan Retry-After.
+    """
+    def __init__(self, rpm, tpm):
+        self.solicitudes = CuboDeTokens(rpm, rpm / 60)
+        self.tokens = CuboDeTokens(tpm, tpm / 60)
+        self.concurrencia = ControladorConcurrencia()
+        self.reintentos = 0
+        self.limitaciones = 0
+        self._pausa_hasta = 0.0 # Tras un 429, nadie llama a este modelo antes de este instante
+
+    def ejecutar(self, funcion, tokens_estimados, tokens_reales=None):
+        """
+        Llama a `funcion` respetando la cuota y reintentando los errores transitorios. El cupo de
+        tokens se descuenta por adelantado con `tokens_estimados`; un intento que falla con un error
+        reintentable lo devuelve (el proveedor no lo procesó), y tras la llamada exitosa se ajusta
+        con `tokens_reales()` (el uso que informó el proveedor, o None si no lo informó).
+        """
+        descontados = min(float(tokens_estimados), self.tokens.capacidad) # Lo que descuenta `adquirir`
+        for intento in range(MAX_REINTENTOS_LLM + 1):
+            espera_pausa = self._pausa_hasta - time.monotonic()
+            if espera_pausa > 0:
+                time.sleep(espera_pausa)
+            self.solicitudes.adquirir(1)
+            self.tokens.adquirir(tokens_estimados)
+            with self.concurrencia:
+                try:
+                    resultado = funcion()
+                except Exception as e:
+                    if intento == MAX_REINTENTOS_LLM or not _es_error_reintentable(e):
+                        raise
+                    self.tokens.ajustar(descontados) # El reintento vuelve a descontarlos
+                    espera = random.uniform(0, min(ESPERA_MAXIMA_REINTENTO, ESPERA_BASE_REINTENTO * 2 ** intento))
+                    retry_after = _segundos_retry_after(e)
+                    if retry_after is not None:
+                        espera = max(espera, retry_after)
+                    if _codigo_estado_error(e) == 429 or _es_excepcion_de(e, "google.api_core.exceptions", "ResourceExhausted"):
+                        self.limitaciones += 1
+                        self.concurrencia.registrar_limitacion()
+                        self._pausa_hasta = max(self._pausa_hasta, time.monotonic() + espera)
+                    self.reintentos += 1
+                else:
+                    self.concurrencia.registrar_exito()
+                    usados = tokens_reales() if tokens_reales is not None else None
+                    if usados is not None:
+                        self.tokens.ajustar(descontados - usados)
+                    return resultado
+            time.sleep(espera)
+
+class RegistroControlCuota:
+    """Un ControlCuota por proveedor y modelo, compartido por todo el proceso."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._controles = {}
+
+    def para(self, model_type, model_name):
+        with self._lock:
+            control = self._controles.get((model_type, model_name))
+            if control is None:
+                limites = LIMITES_CUOTA_POR_MODELO.get(model_name, LIMITES_CUOTA_POR_PROVEEDOR.get(model_type, {"rpm": 60, "tpm": 100_000}))
+                control = ControlCuota(limites["rpm"], limites["tpm"])
+                self._controles[(model_type, model_name)] = control
+            return control
+
+    def resumen(self):
+        with self._lock:
+            return {
+                f"{model_type} - {model_name}": {
+                    "concurrencia": round(control.concurrencia.limite, 1),
+                    "reintentos": control.reintentos,
+                    "limitaciones (429)": control.limitaciones
+                }
+                for (model_type, model_name), control in self._controles.items()
+            }
+
+@instancia_por_proceso
+def obtener_registro_control_cuota():
+    return RegistroControlCuota()
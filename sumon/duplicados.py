@@ -0,0 +1,185 @@
+"""
+Índice local de casi duplicados (MinHash + LSH sobre shingles del enunciado y las opciones) de
+los ítems aprobados: de cada ítem se indexa solo su versión final, no los borradores ni los
+candidatos descartados. Cada ítem nuevo se compara con el índice antes de gastar una
+auditoría; la búsqueda solo examina los ítems que comparten alguna banda LSH, de modo que su
+costo no crece con el tamaño del banco. Las firmas se guardan en SQLite y se cargan al iniciar.
+`FirmasRonda` compara entre sí, en memoria, los candidatos de una misma ronda.
+"""
+import hashlib
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from array import array
+
+from sumon.comun import instancia_por_proceso, quitar_tildes
+from sumon.items import parsear_item_texto
+
+RUTA_INDICE_DUPLICADOS = os.environ.get(
+    "SUMON_DUPLICADOS",
+    os.path.join(os.path.expanduser("~"), ".cache", "sumon2", "duplicados.sqlite3")
+)
+MINHASH_PERMUTACIONES = 64
+LSH_BANDAS = 16 # 16 bandas de 4 filas: ~99 % de recuperación con similitud 0,7 y ~64 % con 0,5
+TAMANO_SHINGLE = 3 # Palabras por shingle
+UMBRAL_DUPLICADO = 0.7 # Similitud de Jaccard estimada a partir de la cual un ítem es casi duplicado
+_PRIMO_MERSENNE = (1 << 61) - 1
+_azar = random.Random(20240611) # Permutaciones fijas: las firmas guardadas siguen siendo comparables
+_PERMUTACIONES = [(_azar.randrange(1, _PRIMO_MERSENNE), _azar.randrange(0, _PRIMO_MERSENNE)) for _ in range(MINHASH_PERMUTACIONES)]
+
+def texto_comparable(item_text):
+    """Enunciado y opciones del ítem: las partes que hacen que dos ítems sean el mismo para un editor."""
+    item = parsear_item_texto(item_text)
+    if not item.pregunta and not item.opciones:
+        return item_text
+    return " ".join([item.pregunta] + [item.opciones[letra] for letra in sorted(item.opciones)])
+
+def shingles(texto, tamano=TAMANO_SHINGLE):
+    """Conjunto de hashes de 64 bits de los n-gramas de palabras (minúsculas, sin tildes)."""
+    palabras = re.findall(r"\w+", quitar_tildes(texto.lower()))
+    if len(palabras) <= tamano:
+        grupos = [" ".join(palabras)] if palabras else []
+    else:
+        grupos = [" ".join(palabras[inicio:inicio + tamano]) for inicio in range(len(palabras) - tamano + 1)]
+    return {int.from_bytes(hashlib.blake2b(grupo.encode("utf-8"), digest_size=8).digest(), "little") for grupo in grupos}
+
+def firma_minhash(conjunto):
+    """Firma MinHash (array de MINHASH_PERMUTACIONES enteros) de un conjunto de shingles."""
+    if not conjunto:
+        return array("Q", [_PRIMO_MERSENNE] * MINHASH_PERMUTACIONES)
+    return array("Q", [min((a * x + b) % _PRIMO_MERSENNE for x in conjunto) for a, b in _PERMUTACIONES])
+
+def similitud_estimada(firma_a, firma_b):
+    """Fracción de posiciones iguales: estimador insesgado de la similitud de Jaccard."""
+    return sum(1 for a, b in zip(firma_a, firma_b) if a == b) / len(firma_a)
+
+class IndiceDuplicados:
+    """
+    Índice MinHash/LSH de los ítems aprobados, con una firma por ítem. Las firmas viven en memoria
+    (con las cubetas de cada banda) y en SQLite. Es seguro para usarse desde varios hilos del mismo
+    proceso.
+    """
+    def __init__(self, ruta, umbral=UMBRAL_DUPLICADO, bandas=LSH_BANDAS):
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self.umbral = umbral
+        self.bandas = bandas
+        self._bytes_por_banda = MINHASH_PERMUTACIONES // bandas * array("Q").itemsize
+        self._lock = threading.Lock()
+        self._firmas = {} # id → (id_item, firma)
+        self._cubetas = {} # (banda, bytes de la banda) → [id]
+        self._firma_por_item = {} # id_item → id
+        self._conn = sqlite3.connect(ruta, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS firmas (
+                    id INTEGER PRIMARY KEY,
+                    id_item TEXT NOT NULL,
+                    extracto TEXT NOT NULL,
+                    firma BLOB NOT NULL,
+                    creado REAL NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_firmas_id_item ON firmas (id_item)")
+            # Una firma por ítem: si quedaron varias de un mismo ítem, vale la última
+            self._conn.execute("DELETE FROM firmas WHERE id NOT IN (SELECT MAX(id) FROM firmas GROUP BY id_item)")
+            for id_firma, id_item, datos in self._conn.execute("SELECT id, id_item, firma FROM firmas"):
+                firma = array("Q")
+                firma.frombytes(datos)
+                self._indexar(id_firma, id_item, firma)
+
+    def _bandas_de(self, firma):
+        datos = firma.tobytes()
+        return [(banda, datos[banda * self._bytes_por_banda:(banda + 1) * self._bytes_por_banda]) for banda in range(self.bandas)]
+
+    def _indexar(self, id_firma, id_item, firma):
+        self._firmas[id_firma] = (id_item, firma)
+        self._firma_por_item[id_item] = id_firma
+        for clave in self._bandas_de(firma):
+            self._cubetas.setdefault(clave, []).append(id_firma)
+
+    def _desindexar(self, id_firma):
+        id_item, firma = self._firmas.pop(id_firma)
+        del self._firma_por_item[id_item]
+        for clave in self._bandas_de(firma):
+            cubeta = self._cubetas[clave]
+            cubeta.remove(id_firma)
+            if not cubeta:
+                del self._cubetas[clave]
+
+    def buscar(self, item_text):
+        """Devuelve (similitud, extracto) del ítem indexado más parecido a `item_text` si supera el umbral, o None."""
+        firma = firma_minhash(shingles(texto_comparable(item_text)))
+        with self._lock:
+            candidatos = {id_firma for clave in self._bandas_de(firma) for id_firma in self._cubetas.get(clave, ())}
+            mejor = None
+            for id_firma in candidatos:
+                _, firma_indexada = self._firmas[id_firma]
+                similitud = similitud_estimada(firma, firma_indexada)
+                if similitud >= self.umbral and (mejor is None or similitud > mejor[0]):
+                    mejor = (similitud, id_firma)
+            if mejor is None:
+                return None
+            (extracto,) = self._conn.execute("SELECT extracto FROM firmas WHERE id = ?", (mejor[1],)).fetchone()
+        return mejor[0], extracto
+
+    def agregar(self, item_text, id_item):
+        """Indexa la versión final de un ítem; si `id_item` ya estaba indexado, su firma se reemplaza."""
+        texto = texto_comparable(item_text)
+        firma = firma_minhash(shingles(texto))
+        with self._lock, self._conn:
+            if id_item in self._firma_por_item:
+                self._desindexar(self._firma_por_item[id_item])
+            self._conn.execute("DELETE FROM firmas WHERE id_item = ?", (id_item,))
+            cursor = self._conn.execute(
+                "INSERT INTO firmas (id_item, extracto, firma, creado) VALUES (?, ?, ?, ?)",
+                (id_item, texto[:400], firma.tobytes(), time.time())
+            )
+            self._indexar(cursor.lastrowid, id_item, firma)
+
+    def contar(self):
+        with self._lock:
+            return len(self._firmas)
+
+    def vaciar(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM firmas")
+            self._firmas.clear()
+            self._cubetas.clear()
+            self._firma_por_item.clear()
+
+class FirmasRonda:
+    """
+    Firmas en memoria de los candidatos de una ronda, que se generan a la vez y no pasan por el
+    índice: el primero que llega se registra y los que se le parecen son casi duplicados.
+    """
+    def __init__(self, umbral=UMBRAL_DUPLICADO):
+        self.umbral = umbral
+        self._lock = threading.Lock()
+        self._firmas = [] # (firma, extracto)
+
+    def comparar_y_registrar(self, item_text):
+        """
+        Devuelve (similitud, extracto) del candidato ya registrado más parecido a `item_text` si
+        supera el umbral; si no, registra `item_text` y devuelve None.
+        """
+        texto = texto_comparable(item_text)
+        firma = firma_minhash(shingles(texto))
+        with self._lock:
+            mejor = None
+            for firma_registrada, extracto in self._firmas:
+                similitud = similitud_estimada(firma, firma_registrada)
+                if similitud >= self.umbral and (mejor is None or similitud > mejor[0]):
+                    mejor = (similitud, extracto)
+            if mejor is None:
+                self._firmas.append((firma, texto[:400]))
+            return mejor
+
+@instancia_por_proceso
+def obtener_indice_duplicados():
+    return IndiceDuplicados(RUTA_INDICE_DUPLICADOS)
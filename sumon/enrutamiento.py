@@ -0,0 +1,128 @@
+"""
+Salud por modelo y política de enrutamiento de las llamadas: cobertura (una petición duplicada
+al modelo secundario cuando el primario tarda más que su p95 observado; gana la primera respuesta
+y la otra se cancela) y conmutación automática al secundario cuando el primario falla.
+"""
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+
+from sumon.comun import instancia_por_proceso
+
+MUESTRAS_LATENCIA = 200 # Latencias recientes por modelo para estimar el percentil de cobertura
+MIN_MUESTRAS_COBERTURA = 20 # Con menos muestras se usa el umbral por defecto de la política
+FALLOS_PARA_ABRIR = 3 # Fallos consecutivos que sacan al modelo de circulación
+ENFRIAMIENTO_SEGUNDOS = 30.0 # Tiempo fuera de circulación antes de volver a probar el modelo
+UMBRAL_MINIMO_COBERTURA_S = 1.0 # Nunca se duplica una llamada antes de este tiempo
+UMBRAL_COBERTURA_POR_DEFECTO_S = 30.0 # Umbral mientras no hay muestras suficientes
+
+@dataclass
+class PoliticaEnrutamiento:
+    """
+    Cómo enrutar una llamada cuyo modelo primario es el de `generar_texto_con_llm`:
+    - `secundario`: (tipo, nombre) del modelo de respaldo; None desactiva la política.
+    - `cobertura`: enviar la petición duplicada al secundario si el primario no respondió tras
+      el percentil `percentil_cobertura` de su latencia (acotado por `umbral_minimo_s`; antes de
+      tener MIN_MUESTRAS_COBERTURA muestras se usa `umbral_por_defecto_s`). Sin valor, ambos
+      umbrales toman el de las constantes del módulo.
+    - `conmutar_por_error`: repetir la llamada en el secundario si el primario falla.
+    """
+    secundario: tuple = None
+    cobertura: bool = True
+    percentil_cobertura: float = 0.95
+    umbral_minimo_s: float = None
+    umbral_por_defecto_s: float = None
+    conmutar_por_error: bool = True
+
+    @classmethod
+    def desde_criterios(cls, secundario, **cambios):
+        """Política a partir de ["Tipo", "modelo"] (como se guarda en los criterios); None si no hay respaldo."""
+        return cls(secundario=tuple(secundario), **cambios) if secundario else None
+
+class SaludModelo:
+    """
+    Latencias recientes y fallos de un modelo, con un cortacircuitos: tras FALLOS_PARA_ABRIR fallos
+    consecutivos el modelo queda fuera de circulación ENFRIAMIENTO_SEGUNDOS; un éxito lo restablece.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencias = deque(maxlen=MUESTRAS_LATENCIA)
+        self.exitos = 0
+        self.fallos = 0
+        self.fallos_consecutivos = 0
+        self.coberturas = 0 # Peticiones duplicadas lanzadas porque este modelo tardaba
+        self.coberturas_ganadas = 0 # ... en las que respondió primero el secundario
+        self.conmutaciones = 0 # Llamadas desviadas al secundario por un fallo de este modelo
+        self._fuera_hasta = 0.0
+
+    def registrar_exito(self, latencia_s):
+        with self._lock:
+            self._latencias.append(latencia_s)
+            self.exitos += 1
+            self.fallos_consecutivos = 0
+            self._fuera_hasta = 0.0
+
+    def registrar_latencia(self, latencia_s):
+        """Latencia de una petición abandonada (cota inferior): mantiene honesto el percentil."""
+        with self._lock:
+            self._latencias.append(latencia_s)
+
+    def registrar_fallo(self):
+        with self._lock:
+            self.fallos += 1
+            self.fallos_consecutivos += 1
+            if self.fallos_consecutivos >= FALLOS_PARA_ABRIR:
+                self._fuera_hasta = time.monotonic() + ENFRIAMIENTO_SEGUNDOS
+
+    def contar(self, campo):
+        with self._lock:
+            setattr(self, campo, getattr(self, campo) + 1)
+
+    def disponible(self):
+        with self._lock:
+            return time.monotonic() >= self._fuera_hasta
+
+    def percentil_latencia(self, percentil):
+        with self._lock:
+            if not self._latencias:
+                return None
+            ordenadas = sorted(self._latencias)
+        return ordenadas[min(len(ordenadas) - 1, int(percentil * len(ordenadas)))]
+
+    def umbral_cobertura(self, politica):
+        with self._lock:
+            muestras = len(self._latencias)
+        if muestras < MIN_MUESTRAS_COBERTURA:
+            return politica.umbral_por_defecto_s if politica.umbral_por_defecto_s is not None else UMBRAL_COBERTURA_POR_DEFECTO_S
+        minimo = politica.umbral_minimo_s if politica.umbral_minimo_s is not None else UMBRAL_MINIMO_COBERTURA_S
+        return max(minimo, self.percentil_latencia(politica.percentil_cobertura))
+
+class RegistroSaludModelos:
+    """Un SaludModelo por proveedor y modelo, compartido por todo el proceso."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._salud = {}
+
+    def para(self, model_type, model_name):
+        with self._lock:
+            return self._salud.setdefault((model_type, model_name), SaludModelo())
+
+    def resumen(self):
+        with self._lock:
+            salud_por_modelo = dict(self._salud)
+        return {
+            f"{model_type} - {model_name}": {
+                "disponible": salud.disponible(),
+                "latencia_p50_s": round(salud.percentil_latencia(0.50) or 0.0, 3),
+                "latencia_p95_s": round(salud.percentil_latencia(0.95) or 0.0, 3),
+                "éxitos": salud.exitos, "fallos": salud.fallos,
+                "coberturas": salud.coberturas, "coberturas ganadas": salud.coberturas_ganadas,
+                "conmutaciones": salud.conmutaciones
+            }
+            for (model_type, model_name), salud in salud_por_modelo.items()
+        }
+
+@instancia_por_proceso
+def obtener_registro_salud_modelos():
+    return RegistroSaludModelos()
@@ -0,0 +1,153 @@
+"""
+Lectura del libro ESTRUCTURA_TOTAL (solo las columnas usadas, con instantánea Parquet en disco)
+y jerarquía GRADO → ÁREA → … → NANOHABILIDAD para los selectores y filtros.
+"""
+import hashlib
+import io
+import os
+
+import pandas as pd
+
+# Únicas columnas de ESTRUCTURA_TOTAL que usa la aplicación
+COLUMNAS_ESTRUCTURA = [
+    "GRADO", "ÁREA", "ASIGNATURA", "ESTACIÓN", "PROCESO COGNITIVO",
+    "NANOHABILIDAD", "MICROHABILIDAD", "COMPETENCIA NANOHABILIDAD"
+]
+COLUMNAS_ESTRUCTURA_OBLIGATORIAS = COLUMNAS_ESTRUCTURA[:6] # Las de la jerarquía de selectores
+RUTA_CACHE_EXCEL = os.environ.get(
+    "SUMON_CACHE_EXCEL",
+    os.path.join(os.path.expanduser("~"), ".cache", "sumon2", "estructura")
+)
+
+def leer_columnas_estructura(datos, columnas=COLUMNAS_ESTRUCTURA):
+    """
+    Recorre la primera hoja del libro en modo solo lectura (fila a fila, sin cargar el libro
+    completo) y conserva únicamente `columnas`, almacenadas como categóricas.
+    """
+    import openpyxl # Solo hace falta cuando no hay instantánea Parquet
+
+    libro = openpyxl.load_workbook(io.BytesIO(datos), read_only=True, data_only=True)
+    try:
+        filas = libro.worksheets[0].iter_rows(values_only=True)
+        encabezados = next(filas, None) or ()
+        posiciones = {}
+        for posicion, encabezado in enumerate(encabezados):
+            nombre = str(encabezado).strip() if encabezado is not None else ""
+            if nombre in columnas and nombre not in posiciones:
+                posiciones[nombre] = posicion
+        faltantes = [columna for columna in COLUMNAS_ESTRUCTURA_OBLIGATORIAS if columna not in posiciones]
+        if faltantes:
+            raise ValueError(f"Faltan columnas obligatorias en el Excel: {', '.join(faltantes)}")
+
+        presentes = [columna for columna in columnas if columna in posiciones]
+        valores = {columna: [] for columna in presentes}
+        for fila in filas:
+            celdas = [fila[posiciones[columna]] if posiciones[columna] < len(fila) else None for columna in presentes]
+            if all(celda is None for celda in celdas):
+                continue # Filas vacías (frecuentes al final de la hoja)
+            for columna, celda in zip(presentes, celdas):
+                valores[columna].append(celda)
+    finally:
+        libro.close()
+
+    df = pd.DataFrame(valores, columns=presentes)
+    for columna in presentes:
+        no_nulos = df[columna].dropna()
+        if no_nulos.map(type).nunique() > 1:
+            # Columnas con números y texto mezclados (p. ej. GRADO): se unifican como texto
+            df[columna] = df[columna].map(lambda valor: valor if pd.isna(valor) else str(valor))
+        df[columna] = df[columna].astype("category")
+    return df
+
+def cargar_estructura_con_cache(datos, ruta_cache=RUTA_CACHE_EXCEL):
+    """
+    Devuelve el DataFrame de la estructura, reutilizando una instantánea Parquet guardada en
+    disco según el hash del archivo; las cargas posteriores se leen con memory-map.
+    """
+    ruta_archivo = os.path.join(ruta_cache, f"{hashlib.sha256(datos).hexdigest()}.parquet")
+    if os.path.exists(ruta_archivo):
+        try:
+            return pd.read_parquet(ruta_archivo, memory_map=True)
+        except Exception:
+            pass # Instantánea corrupta o sin motor Parquet: se vuelve a leer el Excel
+
+    df = leer_columnas_estructura(datos)
+    try:
+        os.makedirs(ruta_cache, exist_ok=True)
+        ruta_temporal = f"{ruta_archivo}.{os.getpid()}.tmp"
+        df.to_parquet(ruta_temporal, index=False)
+        os.replace(ruta_temporal, ruta_archivo) # Escritura atómica
+    except (OSError, ImportError, ValueError):
+        pass # Sin instantánea se sigue funcionando, solo que más lento
+    return df
+
+# --- Jerarquía precalculada de la estructura (GRADO → ÁREA → … → NANOHABILIDAD) ---
+COLUMNAS_JERARQUIA = ["GRADO", "ÁREA", "ASIGNATURA", "ESTACIÓN", "PROCESO COGNITIVO", "NANOHABILIDAD"]
+
+def _clave_jerarquia(valor):
+    # Misma normalización que usaban los filtros en cascada: texto en mayúsculas
+    return str(valor).upper()
+
+class JerarquiaEstructura:
+    """
+    Árbol de la estructura construido una sola vez por libro de Excel. Cada nodo guarda sus
+    hijos (por valor normalizado), las opciones ya ordenadas para el selectbox del siguiente
+    nivel y las posiciones de las filas que cuelgan de él, de modo que los selectores en
+    cascada y el filtrado final son recorridos de diccionario en lugar de filtros sobre el DataFrame.
+    """
+    def __init__(self, df, columnas=COLUMNAS_JERARQUIA):
+        self.columnas = columnas
+        self._raiz = {"valor": None, "filas": list(range(len(df))), "hijos": {}}
+        valores_por_columna = [df[columna].tolist() for columna in columnas]
+        for posicion in range(len(df)):
+            nodo = self._raiz
+            for valores in valores_por_columna:
+                valor = valores[posicion]
+                if pd.isna(valor):
+                    break # Igual que el dropna() de los filtros: la fila no baja de este nivel
+                clave = _clave_jerarquia(valor)
+                hijo = nodo["hijos"].get(clave)
+                if hijo is None:
+                    hijo = {"valor": valor, "filas": [], "hijos": {}}
+                    nodo["hijos"][clave] = hijo
+                hijo["filas"].append(posicion)
+                nodo = hijo
+
+        pendientes = [self._raiz]
+        while pendientes:
+            nodo = pendientes.pop()
+            nodo["opciones"] = sorted(hijo["valor"] for hijo in nodo["hijos"].values())
+            pendientes.extend(nodo["hijos"].values())
+
+    def _nodo(self, seleccion):
+        nodo = self._raiz
+        for valor in seleccion:
+            nodo = nodo["hijos"].get(_clave_jerarquia(valor))
+            if nodo is None:
+                return None
+        return nodo
+
+    def opciones(self, *seleccion):
+        """Opciones ordenadas del nivel siguiente a `seleccion` (p. ej. las áreas de un grado)."""
+        nodo = self._nodo(seleccion)
+        return nodo["opciones"] if nodo is not None else []
+
+    def filtrar(self, df, *seleccion):
+        """Filas de `df` que corresponden a `seleccion` (vacío si la combinación no existe)."""
+        nodo = self._nodo(seleccion)
+        if nodo is None:
+            return df.iloc[0:0]
+        return df.iloc[nodo["filas"]]
+
+def filtrar_por_valores(df, filtros):
+    """
+    Filtra `df` con {columna: valor} sin exigir que los niveles sigan el orden de la jerarquía
+    (la línea de comandos admite cualquier combinación). Compara con la misma normalización
+    que los selectores.
+    """
+    mascara = pd.Series(True, index=df.index)
+    for columna, valor in filtros.items():
+        if columna not in df.columns:
+            raise ValueError(f"La columna '{columna}' no existe en la estructura.")
+        mascara &= df[columna].map(lambda celda: pd.notna(celda) and _clave_jerarquia(celda) == _clave_jerarquia(valor)).astype(bool)
+    return df[mascara]
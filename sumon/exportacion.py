@@ -0,0 +1,311 @@
+"""
+Exportación de los ítems procesados: documentos de Word (generados por fragmentos en paralelo)
+y bancos de ítems JSONL/XLSX para importarlos en otros sistemas.
+
+Las exportaciones masivas se escriben en disco, indexadas por el hash del contenido de la lista
+de ítems: repetir la misma exportación devuelve el archivo ya generado. Los procesos del pool
+importan este módulo, por eso python-docx y openpyxl se importan dentro de las funciones.
+"""
+import collections
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import re
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+RUTA_CACHE_EXPORTACION = os.environ.get(
+    "SUMON_CACHE_EXPORTACION",
+    os.path.join(os.path.expanduser("~"), ".cache", "sumon2", "exportaciones")
+)
+ITEMS_POR_FRAGMENTO = 200 # Ítems por documento parcial de Word
+FRAGMENTOS_EN_VUELO_POR_PROCESO = 2 # Limita cuántos documentos parciales hay en memoria a la vez
+
+FORMATOS_EXPORTACION = {
+    "docx": "Documento Word",
+    "zip": "Documentos Word por fragmentos (ZIP)",
+    "jsonl": "Banco de ítems JSONL",
+    "xlsx": "Banco de ítems Excel",
+}
+TIPOS_MIME_EXPORTACION = {
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "zip": "application/zip",
+    "jsonl": "application/x-ndjson",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+# --- Documento de Word ---
+def _agregar_item_a_documento(doc, item_data, numero):
+    """Añade al documento un ítem con su clasificación, el gráfico sugerido y el dictamen final."""
+    import docx
+
+    pregunta_texto = item_data["item_text"]
+    classification = item_data["classification"]
+    grafico_necesario = item_data.get("grafico_necesario", "NO")
+    descripcion_grafico = item_data.get("descripcion_grafico", "")
+    final_audit_status = item_data.get("final_audit_status", "N/A")
+    final_audit_observations = item_data.get("final_audit_observations", "No hay observaciones finales de auditoría.")
+
+    doc.add_heading(f'Ítem #{numero}', level=2)
+
+    # Añadir detalles de clasificación
+    doc.add_paragraph('--- Clasificación del Ítem ---') # Usando un estilo simple
+    for key, value in classification.items():
+        p = doc.add_paragraph()
+        run = p.add_run(f"{key}: ")
+        run.bold = True
+        p.add_run(str(value)) # Asegurar que el valor sea string
+
+    doc.add_paragraph('') # Espaciador
+
+    # Añadir el texto de la pregunta y su formato
+    lines = pregunta_texto.split('\n')
+    for line in lines:
+        line = line.strip() # Limpiar espacios en blanco al inicio/final
+        if not line: # Saltar líneas vacías
+            continue
+
+        if line.startswith("PREGUNTA:"):
+            p = doc.add_paragraph()
+            run = p.add_run(line)
+            run.bold = True
+            run.font.size = docx.shared.Pt(12) # Opcional: fuente más grande para la pregunta
+        elif line.startswith("A.") or line.startswith("B.") or line.startswith("C."):
+            p = doc.add_paragraph(line)
+            p.paragraph_format.left_indent = docx.shared.Inches(0.5) # Indentar opciones
+        elif line.startswith("RESPUESTA CORRECTA:"):
+            p = doc.add_paragraph()
+            run = p.add_run(line)
+            run.bold = True
+        elif line.startswith("JUSTIFICACIONES:"):
+            p = doc.add_paragraph()
+            run = p.add_run(line)
+            run.bold = True
+        # No incluir GRAFICO_NECESARIO ni DESCRIPCION_GRAFICO directamente aquí, ya que se añaden aparte
+        # y estas líneas podrían venir de la respuesta cruda de Gemini.
+        elif line.startswith("GRAFICO_NECESARIO:") or line.startswith("DESCRIPCION_GRAFICO:"):
+            continue # Saltar estas líneas ya que las manejamos por separado
+        elif line.startswith("VALIDACIÓN DE CRITERIOS:") or line.startswith("DICTAMEN FINAL:") or line.startswith("OBSERVACIONES FINALES:"):
+            p = doc.add_paragraph()
+            run = p.add_run(line)
+            run.bold = True
+        elif line.startswith("✅") or line.startswith("⚠️") or line.startswith("❌"):
+            p = doc.add_paragraph(line)
+            p.paragraph_format.left_indent = docx.shared.Inches(0.25) # Indentar estado de auditoría
+        else:
+            doc.add_paragraph(line)
+
+    # Añadir descripción del gráfico si es necesario
+    if grafico_necesario == "SÍ" and descripcion_grafico:
+        doc.add_paragraph('')
+        p = doc.add_paragraph()
+        run = p.add_run("--- Gráfico Sugerido ---")
+        run.bold = True
+        doc.add_paragraph(f"**Tipo y Descripción del Gráfico:** {descripcion_grafico}")
+        doc.add_paragraph('') # Espacio adicional
+
+    # Añadir el dictamen final y las observaciones de la auditoría para CADA ítem
+    doc.add_paragraph('')
+    p = doc.add_paragraph()
+    run = p.add_run("--- Resultado Final de Auditoría ---")
+    run.bold = True
+    doc.add_paragraph(f"**DICTAMEN FINAL:** {final_audit_status}")
+    doc.add_paragraph(f"**OBSERVACIONES FINALES:** {final_audit_observations}")
+    doc.add_paragraph('') # Espacio adicional
+
+    doc.add_page_break() # Separar cada pregunta con un salto de página
+
+def _crear_documento_word(items, numero_inicial=1, con_encabezado=True):
+    import docx # python-docx solo se carga al exportar
+
+    doc = docx.Document()
+    if con_encabezado:
+        doc.add_heading('Preguntas Generadas y Auditadas', level=1)
+        doc.add_paragraph('Este documento contiene los ítems generados por el sistema de IA y sus resultados de auditoría.')
+        doc.add_paragraph('') # Espacio en blanco
+        if not items:
+            doc.add_paragraph('No se procesaron ítems para este informe.')
+
+    for i, item_data in enumerate(items):
+        _agregar_item_a_documento(doc, item_data, numero_inicial + i)
+    return doc
+
+def exportar_a_word(preguntas_procesadas_list):
+    """
+    Exporta una lista de preguntas procesadas a un documento de Word (.docx) en memoria,
+    incluyendo sus detalles de clasificación, la descripción del gráfico si aplica,
+    y el dictamen final de la auditoría.
+    Returns: BytesIO object of the document.
+    """
+    doc = _crear_documento_word(preguntas_procesadas_list)
+
+    # Guardar el documento en un buffer en memoria
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    buffer.seek(0) # Regresar al inicio del buffer
+    return buffer
+
+# --- Exportación masiva por fragmentos ---
+def _documento_word_parcial(items, numero_inicial, con_encabezado):
+    """Trabajo de un proceso del pool: genera un documento parcial y lo devuelve serializado."""
+    buffer = io.BytesIO()
+    _crear_documento_word(items, numero_inicial, con_encabezado).save(buffer)
+    return buffer.getvalue()
+
+def generar_fragmentos_word(items, items_por_fragmento=ITEMS_POR_FRAGMENTO, max_procesos=None):
+    """
+    Genera, en orden, tuplas (numero_inicial, numero_final, bytes del .docx) con los ítems
+    repartidos en documentos parciales. Con varios fragmentos se construyen en paralelo en un
+    pool de procesos, manteniendo como máximo unos pocos fragmentos pendientes en memoria.
+    """
+    inicios = list(range(0, len(items), items_por_fragmento)) or [0]
+    max_procesos = min(max_procesos or os.cpu_count() or 1, len(inicios))
+    if max_procesos < 2:
+        for inicio in inicios:
+            fragmento = items[inicio:inicio + items_por_fragmento]
+            yield inicio + 1, inicio + len(fragmento), _documento_word_parcial(fragmento, inicio + 1, inicio == 0)
+        return
+
+    ventana = max_procesos * FRAGMENTOS_EN_VUELO_POR_PROCESO
+    # "spawn" evita hacer fork de un servidor de Streamlit con hilos activos
+    with ProcessPoolExecutor(max_workers=max_procesos, mp_context=multiprocessing.get_context("spawn")) as executor:
+        pendientes = collections.deque()
+        for inicio in inicios:
+            fragmento = items[inicio:inicio + items_por_fragmento]
+            futuro = executor.submit(_documento_word_parcial, fragmento, inicio + 1, inicio == 0)
+            pendientes.append((inicio + 1, inicio + len(fragmento), futuro))
+            if len(pendientes) >= ventana:
+                numero_inicial, numero_final, futuro = pendientes.popleft()
+                yield numero_inicial, numero_final, futuro.result()
+        while pendientes:
+            numero_inicial, numero_final, futuro = pendientes.popleft()
+            yield numero_inicial, numero_final, futuro.result()
+
+_RE_APERTURA_CUERPO = re.compile(rb"<w:body[^>]*>")
+
+def _partes_documento_xml(datos_docx):
+    """Divide word/document.xml en (inicio hasta <w:body>, contenido del cuerpo, sectPr y cierre)."""
+    with zipfile.ZipFile(io.BytesIO(datos_docx)) as docx_zip:
+        xml = docx_zip.read("word/document.xml")
+    apertura = _RE_APERTURA_CUERPO.search(xml)
+    fin_contenido = xml.rfind(b"<w:sectPr")
+    if fin_contenido == -1:
+        fin_contenido = xml.rfind(b"</w:body>")
+    return xml[:apertura.end()], xml[apertura.end():fin_contenido], xml[fin_contenido:]
+
+def unir_fragmentos_word(fragmentos, archivo_destino):
+    """
+    Une los documentos parciales en un solo .docx. Todos salen de la misma plantilla y solo
+    contienen texto, así que basta con concatenar el cuerpo de cada word/document.xml; el XML
+    se escribe en streaming al ZIP de salida, con un único fragmento en memoria a la vez.
+    """
+    fragmentos = iter(fragmentos)
+    _, _, primer_docx = next(fragmentos)
+    inicio_xml, contenido, cierre_xml = _partes_documento_xml(primer_docx)
+    with zipfile.ZipFile(io.BytesIO(primer_docx)) as plantilla, \
+            zipfile.ZipFile(archivo_destino, "w", zipfile.ZIP_DEFLATED) as salida:
+        for entrada in plantilla.infolist():
+            if entrada.filename != "word/document.xml":
+                salida.writestr(entrada, plantilla.read(entrada.filename), zipfile.ZIP_DEFLATED)
+                continue
+            with salida.open("word/document.xml", "w", force_zip64=True) as xml:
+                xml.write(inicio_xml)
+                xml.write(contenido)
+                for _, _, datos_docx in fragmentos:
+                    xml.write(_partes_documento_xml(datos_docx)[1])
+                xml.write(cierre_xml)
+
+def escribir_zip_fragmentos_word(fragmentos, archivo_destino):
+    """Guarda cada documento parcial como una entrada del ZIP (items_00001-00200.docx, …)."""
+    with zipfile.ZipFile(archivo_destino, "w", zipfile.ZIP_STORED) as salida: # Un .docx ya está comprimido
+        for numero_inicial, numero_final, datos_docx in fragmentos:
+            salida.writestr(f"items_{numero_inicial:05d}-{numero_final:05d}.docx", datos_docx)
+
+# --- Bancos de ítems JSONL/XLSX ---
+def registro_banco(item_data, numero):
+    """Fila plana del banco de ítems: clasificación, partes del ítem y dictamen de la auditoría."""
+    from sumon.items import LETRAS_OPCIONES, parsear_item_texto
+
+    item = parsear_item_texto(item_data.get("item_text", ""))
+    registro = {
+        "id_item": hashlib.sha256(item_data.get("item_text", "").encode("utf-8")).hexdigest()[:16],
+        "numero": numero,
+    }
+    registro.update({clave: str(valor) for clave, valor in item_data.get("classification", {}).items()})
+    registro["pregunta"] = item.pregunta
+    registro.update({f"opcion_{letra}": item.opciones.get(letra, "") for letra in LETRAS_OPCIONES})
+    registro["respuesta_correcta"] = item.respuesta_correcta
+    registro.update({f"justificacion_{letra}": item.justificaciones.get(letra, "") for letra in LETRAS_OPCIONES})
+    registro["grafico_necesario"] = item_data.get("grafico_necesario", "NO")
+    registro["descripcion_grafico"] = item_data.get("descripcion_grafico", "")
+    registro["dictamen_final"] = item_data.get("final_audit_status", "N/A")
+    registro["observaciones_finales"] = item_data.get("final_audit_observations", "")
+    return registro
+
+def escribir_banco_jsonl(items, archivo_destino):
+    with open(archivo_destino, "w", encoding="utf-8") as archivo:
+        for numero, item_data in enumerate(items, start=1):
+            archivo.write(json.dumps(registro_banco(item_data, numero), ensure_ascii=False, separators=(",", ":")) + "\n")
+
+def escribir_banco_xlsx(items, archivo_destino):
+    """Hoja de cálculo en modo solo escritura de openpyxl: las filas se vuelcan a disco al agregarlas."""
+    import openpyxl
+
+    # Columnas en orden de aparición; los ítems con error técnico pueden traer otra clasificación
+    columnas = list(registro_banco({}, 0))
+    for item_data in items:
+        for clave in item_data.get("classification", {}):
+            if clave not in columnas:
+                columnas.insert(columnas.index("pregunta"), clave)
+
+    libro = openpyxl.Workbook(write_only=True)
+    hoja = libro.create_sheet("BANCO_ITEMS")
+    hoja.append(columnas)
+    for numero, item_data in enumerate(items, start=1):
+        registro = registro_banco(item_data, numero)
+        hoja.append([registro.get(columna, "") for columna in columnas])
+    libro.save(archivo_destino)
+
+# --- Punto de entrada con caché en disco ---
+def huella_items(items, *parametros):
+    """Hash del contenido de la lista de ítems (y de los parámetros de la exportación)."""
+    huella = hashlib.sha256(json.dumps(parametros, default=str).encode("utf-8"))
+    for item_data in items:
+        huella.update(json.dumps(item_data, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+        huella.update(b"\n")
+    return huella.hexdigest()
+
+def exportar_items(items, formato="docx", archivo_destino=None, items_por_fragmento=ITEMS_POR_FRAGMENTO,
+                   max_procesos=None, ruta_cache=RUTA_CACHE_EXPORTACION):
+    """
+    Exporta los ítems en uno de FORMATOS_EXPORTACION y devuelve la ruta del archivo generado.
+    Sin `archivo_destino`, el archivo se guarda en la caché según el hash de los ítems y una
+    exportación idéntica posterior lo reutiliza sin volver a generarlo.
+    """
+    if formato not in FORMATOS_EXPORTACION:
+        raise ValueError(f"Formato de exportación no soportado: {formato}")
+    if archivo_destino is None:
+        parametros = (formato, items_por_fragmento) if formato == "zip" else (formato,)
+        archivo_destino = os.path.join(ruta_cache, f"{huella_items(items, *parametros)}.{formato}")
+        if os.path.exists(archivo_destino):
+            return archivo_destino
+    os.makedirs(os.path.dirname(os.path.abspath(archivo_destino)), exist_ok=True)
+
+    ruta_temporal = f"{archivo_destino}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        if formato == "docx":
+            unir_fragmentos_word(generar_fragmentos_word(items, items_por_fragmento, max_procesos), ruta_temporal)
+        elif formato == "zip":
+            escribir_zip_fragmentos_word(generar_fragmentos_word(items, items_por_fragmento, max_procesos), ruta_temporal)
+        elif formato == "jsonl":
+            escribir_banco_jsonl(items, ruta_temporal)
+        else:
+            escribir_banco_xlsx(items, ruta_temporal)
+        os.replace(ruta_temporal, archivo_destino) # Escritura atómica
+    finally:
+        if os.path.exists(ruta_temporal):
+            os.remove(ruta_temporal)
+    return archivo_destino
@@ -0,0 +1,84 @@
+"""
+Extracción del texto de un PDF página por página, en paralelo y con caché en disco.
+
+Los procesos del pool importan este módulo para llegar a la función de trabajo, por eso
+PyPDF2 se importa dentro de las funciones y no al cargar el módulo.
+"""
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+RUTA_CACHE_PDF = os.environ.get(
+    "SUMON_CACHE_PDF",
+    os.path.join(os.path.expanduser("~"), ".cache", "sumon2", "pdf")
+)
+SEPARADOR_PAGINAS = "\f" # Salto de página, como en la salida de pdftotext
+PAGINAS_POR_TAREA = 16
+MIN_PAGINAS_PARA_PARALELO = 32 # Por debajo de esto no compensa arrancar procesos
+
+_datos_pdf_proceso = None # PDF en bytes, recibido una sola vez por proceso del pool
+
+def hash_contenido(datos):
+    return hashlib.sha256(datos).hexdigest()
+
+def _inicializar_proceso(datos):
+    global _datos_pdf_proceso
+    _datos_pdf_proceso = datos
+
+def _extraer_rango(inicio, fin):
+    import PyPDF2
+    reader = PyPDF2.PdfReader(io.BytesIO(_datos_pdf_proceso))
+    return [reader.pages[num_pagina].extract_text() or "" for num_pagina in range(inicio, fin)]
+
+def extraer_paginas_pdf(datos, max_procesos=None):
+    """
+    Devuelve una lista con el texto de cada página del PDF (en orden).
+    Los PDF grandes se reparten en bloques de páginas entre varios procesos.
+    """
+    import PyPDF2
+    reader = PyPDF2.PdfReader(io.BytesIO(datos))
+    total_paginas = len(reader.pages)
+    max_procesos = max_procesos or os.cpu_count() or 1
+    if total_paginas < MIN_PAGINAS_PARA_PARALELO or max_procesos < 2:
+        return [pagina.extract_text() or "" for pagina in reader.pages]
+
+    inicios = list(range(0, total_paginas, PAGINAS_POR_TAREA))
+    fines = [min(inicio + PAGINAS_POR_TAREA, total_paginas) for inicio in inicios]
+    paginas = []
+    # "spawn" evita hacer fork de un servidor de Streamlit con hilos activos
+    with ProcessPoolExecutor(
+        max_workers=min(max_procesos, len(inicios)),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_inicializar_proceso,
+        initargs=(datos,)
+    ) as executor:
+        for bloque in executor.map(_extraer_rango, inicios, fines):
+            paginas.extend(bloque)
+    return paginas
+
+def leer_paginas_pdf_con_cache(datos, ruta_cache=RUTA_CACHE_PDF):
+    """
+    Igual que `extraer_paginas_pdf`, pero guarda el resultado en disco indexado por el hash
+    del contenido: el mismo manual no se vuelve a procesar entre reinicios ni entre usuarios.
+    """
+    ruta_archivo = os.path.join(ruta_cache, f"{hash_contenido(datos)}.json")
+    if os.path.exists(ruta_archivo):
+        try:
+            with open(ruta_archivo, encoding="utf-8") as archivo:
+                return json.load(archivo)
+        except (OSError, ValueError):
+            pass # Entrada corrupta o ilegible: se vuelve a extraer
+
+    paginas = extraer_paginas_pdf(datos)
+    try:
+        os.makedirs(ruta_cache, exist_ok=True)
+        ruta_temporal = f"{ruta_archivo}.{os.getpid()}.tmp"
+        with open(ruta_temporal, "w", encoding="utf-8") as archivo:
+            json.dump(paginas, archivo, ensure_ascii=False)
+        os.replace(ruta_temporal, ruta_archivo) # Escritura atómica
+    except OSError:
+        pass # Sin caché en disco se sigue funcionando, solo que más lento
+    return paginas
@@ -0,0 +1,352 @@
+"""
+Contenido de los ítems: descripción de Bloom, pre-auditoría determinística, esquemas y parseo
+de la salida estructurada (JSON) y prompts de reparación para el refinamiento compacto.
+"""
+import json
+import re
+from dataclasses import dataclass, field
+
+from sumon.comun import quitar_tildes
+
+# --- Función para obtener la descripción de la taxonomía de Bloom ---
+def get_descripcion_bloom(proceso_cognitivo_elegido):
+    descripcion_bloom_map = {
+        "RECORDAR": "Recuperar información relevante desde la memoria de largo plazo.",
+        "COMPRENDER": "Construir significado a partir de información mediante interpretación, resumen, explicación u otras tareas.",
+        "APLICAR": "Usar procedimientos en situaciones conocidas o nuevas.",
+        "ANALIZAR": "Descomponer información y examinar relaciones entre partes.",
+        "EVALUAR": "Emitir juicios basados en criterios para valorar ideas o soluciones.",
+        "CREAR": "Generar nuevas ideas, productos o formas de reorganizar información."
+    }
+    return descripcion_bloom_map.get(str(proceso_cognitivo_elegido).upper(), "Descripción no disponible para este proceso cognitivo.")
+
+# --- Pre-auditoría determinística del ítem ---
+LETRAS_OPCIONES = ("A", "B", "C")
+FRASES_PROHIBIDAS = ("ninguna de las anteriores", "todas las anteriores")
+# Marcador de opción al inicio de línea: "A.", "A)", "**A.**", "- B." ...
+_PATRON_MARCADOR_OPCION = re.compile(r"^[ \t]*(?:[-*•][ \t]*)?\**[ \t]*([A-H])[ \t]*\**[ \t]*[\.\)]", re.MULTILINE)
+# Letra tras "RESPUESTA CORRECTA:": "B", "[B]", "(B)", "**B)**", "Opción B" ... (sobre el texto sin tildes)
+_PATRON_RESPUESTA_CORRECTA = re.compile(
+    r"RESPUESTA CORRECTA:[\s*_\[(]*(?:OPCION[\s*_\[(]*)?([A-Z])\b", re.IGNORECASE
+)
+
+def _letra_respuesta_correcta(texto_sin_tildes):
+    """Letra (en mayúscula) indicada en la sección "RESPUESTA CORRECTA:", o None si no se encuentra."""
+    respuesta_match = _PATRON_RESPUESTA_CORRECTA.search(texto_sin_tildes)
+    return respuesta_match.group(1).upper() if respuesta_match else None
+
+def preauditar_item(item_text):
+    """
+    Revisión mecánica y local del ítem antes de gastar una llamada al auditor LLM: estructura de
+    las opciones, respuesta correcta, justificaciones y frases prohibidas.
+    Returns: lista de observaciones (vacía si el ítem supera todas las comprobaciones).
+    """
+    observaciones = []
+    texto_sin_tildes = quitar_tildes(item_text)
+
+    if "PREGUNTA:" not in texto_sin_tildes:
+        observaciones.append("Falta el encabezado 'PREGUNTA:' con el enunciado.")
+
+    fin_opciones = len(texto_sin_tildes)
+    for encabezado in ("RESPUESTA CORRECTA:", "JUSTIFICACIONES:"):
+        posicion = texto_sin_tildes.find(encabezado)
+        if posicion != -1:
+            fin_opciones = min(fin_opciones, posicion)
+    letras_opciones = [m.group(1) for m in _PATRON_MARCADOR_OPCION.finditer(texto_sin_tildes[:fin_opciones])]
+    if sorted(letras_opciones) != list(LETRAS_OPCIONES):
+        observaciones.append(
+            f"Debe haber exactamente tres opciones (A, B y C), una por línea; se encontraron: {', '.join(letras_opciones) or 'ninguna'}."
+        )
+
+    respuesta_correcta = _letra_respuesta_correcta(texto_sin_tildes)
+    if respuesta_correcta is None:
+        observaciones.append("Falta la sección 'RESPUESTA CORRECTA:' con la letra de la opción correcta.")
+    elif respuesta_correcta not in LETRAS_OPCIONES:
+        observaciones.append(f"La respuesta correcta indicada ({respuesta_correcta}) no corresponde a ninguna de las opciones A, B o C.")
+
+    inicio_justificaciones = texto_sin_tildes.find("JUSTIFICACIONES:")
+    if inicio_justificaciones == -1:
+        observaciones.append("Falta la sección 'JUSTIFICACIONES:' con una justificación para cada opción.")
+    else:
+        bloque = texto_sin_tildes[inicio_justificaciones + len("JUSTIFICACIONES:"):]
+        marcadores = list(_PATRON_MARCADOR_OPCION.finditer(bloque))
+        justificaciones = {}
+        for i, marcador in enumerate(marcadores):
+            fin = marcadores[i + 1].start() if i + 1 < len(marcadores) else len(bloque)
+            justificaciones.setdefault(marcador.group(1), bloque[marcador.end():fin].strip())
+        for letra in LETRAS_OPCIONES:
+            justificacion = justificaciones.get(letra)
+            if not justificacion:
+                observaciones.append(f"Falta la justificación de la opción {letra}.")
+            elif respuesta_correcta in LETRAS_OPCIONES and letra != respuesta_correcta:
+                formato_ok = re.search(
+                    rf"podria\s+escoger\s+la\s+opcion\s+\**{letra}\**\b.*?porque.*?sin\s+embargo",
+                    justificacion, re.IGNORECASE | re.DOTALL
+                )
+                if not formato_ok:
+                    observaciones.append(
+                        f"La justificación de la opción incorrecta {letra} no sigue el formato "
+                        f"“El estudiante podría escoger la opción {letra} porque… Sin embargo, esto es incorrecto porque…”."
+                    )
+
+    texto_minusculas = texto_sin_tildes.lower()
+    for frase in FRASES_PROHIBIDAS:
+        if frase in texto_minusculas:
+            observaciones.append(f"No se permite la frase “{frase}”.")
+
+    return observaciones
+
+# --- Salida estructurada (JSON) para ítems y auditorías ---
+CRITERIOS_AUDITORIA = [
+    "Formato del Enunciado", "Número de Opciones (3)", "Respuesta Correcta Indicada", "Diseño de Justificaciones",
+    "Estilo y Restricciones", "Alineación del Contenido", "Gráfico (si aplica)"
+]
+_PROPIEDADES_POR_OPCION = {
+    "type": "object",
+    "properties": {letra: {"type": "string"} for letra in LETRAS_OPCIONES},
+    "required": list(LETRAS_OPCIONES),
+    "additionalProperties": False
+}
+ESQUEMA_ITEM_JSON = {
+    "type": "object",
+    "properties": {
+        "pregunta": {"type": "string"},
+        "opciones": _PROPIEDADES_POR_OPCION,
+        "respuesta_correcta": {"type": "string", "enum": list(LETRAS_OPCIONES)},
+        "justificaciones": _PROPIEDADES_POR_OPCION,
+        "grafico_necesario": {"type": "boolean"},
+        "descripcion_grafico": {"type": "string"}
+    },
+    "required": ["pregunta", "opciones", "respuesta_correcta", "justificaciones", "grafico_necesario", "descripcion_grafico"],
+    "additionalProperties": False
+}
+VEREDICTOS_CRITERIO = {"CUMPLE": "✅", "CUMPLE PARCIALMENTE": "⚠️", "NO CUMPLE": "❌", "NO APLICA": "N/A"}
+DICTAMENES = {"CUMPLE TOTALMENTE": "✅ CUMPLE TOTALMENTE", "CUMPLE PARCIALMENTE": "⚠️ CUMPLE PARCIALMENTE", "RECHAZADO": "❌ RECHAZADO"}
+ESQUEMA_AUDITORIA_JSON = {
+    "type": "object",
+    "properties": {
+        "criterios": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "criterio": {"type": "string", "enum": CRITERIOS_AUDITORIA},
+                    "veredicto": {"type": "string", "enum": list(VEREDICTOS_CRITERIO)},
+                    "comentario": {"type": "string"}
+                },
+                "required": ["criterio", "veredicto", "comentario"],
+                "additionalProperties": False
+            }
+        },
+        "dictamen_final": {"type": "string", "enum": list(DICTAMENES)},
+        "observaciones_finales": {"type": "string"}
+    },
+    "required": ["criterios", "dictamen_final", "observaciones_finales"],
+    "additionalProperties": False
+}
+INSTRUCCIONES_SALIDA_JSON_ITEM = """
+        --- FORMATO DE SALIDA (JSON) ---
+        IMPORTANTE: en lugar del formato de texto indicado arriba, responde ÚNICAMENTE con un objeto JSON válido, sin texto adicional, con esta estructura:
+        {"pregunta": "contexto y enunciado", "opciones": {"A": "...", "B": "...", "C": "..."}, "respuesta_correcta": "A, B o C",
+         "justificaciones": {"A": "...", "B": "...", "C": "..."}, "grafico_necesario": true o false, "descripcion_grafico": "descripción detallada o cadena vacía"}
+"""
+INSTRUCCIONES_SALIDA_JSON_AUDITORIA = f"""
+    --- FORMATO DE SALIDA (JSON) ---
+    IMPORTANTE: en lugar del formato de texto indicado arriba, responde ÚNICAMENTE con un objeto JSON válido, sin texto adicional, con esta estructura:
+    {{"criterios": [{{"criterio": "uno de: {', '.join(CRITERIOS_AUDITORIA)}", "veredicto": "CUMPLE, CUMPLE PARCIALMENTE, NO CUMPLE o NO APLICA", "comentario": "..."}}],
+     "dictamen_final": "CUMPLE TOTALMENTE, CUMPLE PARCIALMENTE o RECHAZADO", "observaciones_finales": "..."}}
+    Incluye un elemento en "criterios" por cada uno de los siete criterios.
+"""
+
+@dataclass
+class ItemEstructurado:
+    pregunta: str
+    opciones: dict
+    respuesta_correcta: str
+    justificaciones: dict
+    grafico_necesario: bool = False
+    descripcion_grafico: str = ""
+
+    def a_texto(self):
+        """Representación en el formato de texto de siempre (la que usan la pre-auditoría, la UI y Word)."""
+        lineas = [f"PREGUNTA: {self.pregunta.strip()}"]
+        lineas += [f"{letra}. {self.opciones.get(letra, '').strip()}" for letra in LETRAS_OPCIONES]
+        lineas.append(f"RESPUESTA CORRECTA: {self.respuesta_correcta}")
+        lineas.append("JUSTIFICACIONES:")
+        lineas += [f"{letra}. {self.justificaciones.get(letra, '').strip()}" for letra in LETRAS_OPCIONES]
+        return "\n".join(lineas)
+
+@dataclass
+class CriterioAuditado:
+    criterio: str
+    veredicto: str
+    comentario: str = ""
+
+    @property
+    def fallido(self):
+        return self.veredicto in ("CUMPLE PARCIALMENTE", "NO CUMPLE")
+
+@dataclass
+class AuditoriaEstructurada:
+    criterios: list = field(default_factory=list)
+    dictamen_final: str = "RECHAZADO"
+    observaciones_finales: str = ""
+
+    @property
+    def estado(self):
+        return DICTAMENES.get(self.dictamen_final, "❌ RECHAZADO")
+
+    def criterios_fallidos(self):
+        return [f"{c.criterio}: {VEREDICTOS_CRITERIO[c.veredicto]} {c.comentario}".strip() for c in self.criterios if c.fallido]
+
+    def a_texto(self):
+        lineas = ["VALIDACIÓN DE CRITERIOS:"]
+        for c in self.criterios:
+            comentario = f" {c.comentario}" if c.comentario and c.fallido else ""
+            lineas.append(f"- {c.criterio}: {VEREDICTOS_CRITERIO[c.veredicto]}{comentario}")
+        lineas += ["", "DICTAMEN FINAL:", f"[{self.estado}]", "", "OBSERVACIONES FINALES:", self.observaciones_finales]
+        return "\n".join(lineas)
+
+def _cargar_json_respuesta(texto):
+    texto = texto.strip()
+    if texto.startswith("```"):
+        # Algunos modelos envuelven el JSON en un bloque de código pese a las instrucciones
+        texto = re.sub(r"^```(?:json)?\s*|\s*```$", "", texto)
+    try:
+        datos = json.loads(texto)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"La respuesta no es un JSON válido: {e}") from e
+    if not isinstance(datos, dict):
+        raise ValueError("La respuesta JSON no es un objeto.")
+    return datos
+
+def parsear_item_json(texto):
+    """Convierte la respuesta JSON del generador en un ItemEstructurado (ValueError si no cumple el esquema)."""
+    datos = _cargar_json_respuesta(texto)
+    try:
+        opciones = {letra: str(datos["opciones"][letra]) for letra in LETRAS_OPCIONES}
+        justificaciones = {letra: str(datos["justificaciones"][letra]) for letra in LETRAS_OPCIONES}
+        respuesta_correcta = str(datos["respuesta_correcta"]).strip().upper()
+        return ItemEstructurado(
+            pregunta=str(datos["pregunta"]),
+            opciones=opciones,
+            respuesta_correcta=respuesta_correcta,
+            justificaciones=justificaciones,
+            grafico_necesario=bool(datos.get("grafico_necesario", False)),
+            descripcion_grafico=str(datos.get("descripcion_grafico") or "")
+        )
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"Falta un campo obligatorio en el JSON del ítem: {e}") from e
+
+def parsear_item_texto(item_text):
+    """
+    Operación inversa de `ItemEstructurado.a_texto`, tolerante: las partes que falten quedan vacías.
+    Sirve para exportar a bancos de ítems lo generado en formato de texto libre.
+    """
+    item = ItemEstructurado(pregunta="", opciones={}, respuesta_correcta="", justificaciones={})
+    destino = None # Diccionario al que van las líneas "A./B./C." según la sección actual
+    for linea in item_text.splitlines():
+        linea = linea.strip()
+        if linea.startswith("PREGUNTA:"):
+            item.pregunta = linea[len("PREGUNTA:"):].strip()
+            destino = item.opciones
+        elif linea.startswith("RESPUESTA CORRECTA:"):
+            item.respuesta_correcta = _letra_respuesta_correcta(quitar_tildes(linea)) or ""
+        elif linea.startswith("JUSTIFICACIONES:"):
+            destino = item.justificaciones
+        elif linea.startswith("GRAFICO_NECESARIO:") or linea.startswith("DESCRIPCION_GRAFICO:"):
+            destino = None
+        elif destino is not None and len(linea) > 1 and linea[0] in LETRAS_OPCIONES and linea[1] in ".)":
+            destino[linea[0]] = linea[2:].strip()
+        elif linea and destino is item.opciones and not item.opciones:
+            item.pregunta = f"{item.pregunta}\n{linea}".strip() # Enunciados de varias líneas
+    return item
+
+def parsear_auditoria_json(texto):
+    """Convierte la respuesta JSON del auditor en una AuditoriaEstructurada (ValueError si no cumple el esquema)."""
+    datos = _cargar_json_respuesta(texto)
+    dictamen = str(datos.get("dictamen_final", "")).strip().upper()
+    if dictamen not in DICTAMENES:
+        raise ValueError(f"Dictamen final no reconocido: {dictamen or '(vacío)'}")
+    criterios = []
+    for criterio in datos.get("criterios") or []:
+        if not isinstance(criterio, dict):
+            continue
+        veredicto = str(criterio.get("veredicto", "")).strip().upper()
+        criterios.append(CriterioAuditado(
+            criterio=str(criterio.get("criterio", "")),
+            veredicto=veredicto if veredicto in VEREDICTOS_CRITERIO else "NO CUMPLE",
+            comentario=str(criterio.get("comentario") or "")
+        ))
+    return AuditoriaEstructurada(criterios=criterios, dictamen_final=dictamen,
+                                 observaciones_finales=str(datos.get("observaciones_finales") or ""))
+
+# --- Refinamiento compacto (prompt de reparación) ---
+FORMATO_SALIDA_ITEM = """
+        PREGUNTA: [Redacta aquí el enunciado de la pregunta]
+        A. [Opción A]
+        B. [Opción B]
+        C. [Opción C]
+        RESPUESTA CORRECTA: [Letra de la opción correcta, por ejemplo: B]
+        JUSTIFICACIONES:
+        A. [Explica por qué A es incorrecta o correcta]
+        B. [Explica por qué B es incorrecta o correcta]
+        C. [Explica por qué C es incorrecta o correcta]
+        GRAFICO_NECESARIO: [SÍ/NO]
+        DESCRIPCION_GRAFICO: [Descripción detallada o N/A]
+"""
+
+def extraer_criterios_fallidos(auditoria_resultado):
+    """
+    Devuelve las líneas de 'VALIDACIÓN DE CRITERIOS' marcadas con ❌ o ⚠️ (sin las que además
+    contienen ✅, que suelen ser la plantilla repetida por el modelo).
+    """
+    inicio = auditoria_resultado.find("VALIDACIÓN DE CRITERIOS:")
+    if inicio == -1:
+        return []
+    fin = auditoria_resultado.find("DICTAMEN FINAL:", inicio)
+    bloque = auditoria_resultado[inicio + len("VALIDACIÓN DE CRITERIOS:"):fin if fin != -1 else None]
+    return [
+        linea.strip().lstrip("-*• ").strip()
+        for linea in bloque.splitlines()
+        if ("❌" in linea or "⚠" in linea) and "✅" not in linea
+    ]
+
+def construir_prompt_reparacion(item_anterior, grafico_necesario, descripcion_grafico, criterios_fallidos,
+                                observaciones, secciones_manual, classification_details, descripcion_bloom,
+                                tipo_pregunta, contexto_educativo, dificultad):
+    """
+    Prompt corto para los intentos de refinamiento: solo el ítem anterior, los criterios que
+    fallaron y las secciones del manual relacionadas, en lugar de repetir todo el prompt de generación.
+    """
+    parametros = "\n".join(f"        - {clave}: {valor}" for clave, valor in classification_details.items())
+    criterios = "\n".join(f"        - {criterio}" for criterio in criterios_fallidos) or "        - (ver observaciones)"
+    return f"""
+        Eres un diseñador experto en ítems de evaluación educativa, especializado en pruebas tipo ICFES.
+        Debes CORREGIR el siguiente ítem de {tipo_pregunta}, que no superó la auditoría.
+        Modifica solo lo necesario para resolver los criterios no cumplidos y conserva lo que ya es correcto.
+
+        --- PARÁMETROS DEL ÍTEM ---
+{parametros}
+        - Descripción del proceso cognitivo: "{descripcion_bloom}"
+        - Nivel educativo esperado del estudiante: {contexto_educativo}
+        - Nivel de dificultad deseado: {dificultad}
+
+        --- CRITERIOS NO CUMPLIDOS ---
+{criterios}
+
+        --- OBSERVACIONES DEL AUDITOR ---
+        {observaciones or "Sin observaciones adicionales."}
+
+        --- REGLAS DEL MANUAL RELACIONADAS ---
+        {secciones_manual or "No aplica."}
+
+        --- ÍTEM A CORREGIR ---
+        {item_anterior}
+        GRAFICO_NECESARIO: {grafico_necesario}
+        DESCRIPCION_GRAFICO: {descripcion_grafico or "N/A"}
+
+        --- FORMATO ESPERADO DE SALIDA ---
+        Devuelve el ítem completo corregido con exactamente este formato:
+{FORMATO_SALIDA_ITEM}
+        """
@@ -0,0 +1,618 @@
+"""
+Llamadas a los modelos (Gemini y GPT): configuración de API keys, clientes reutilizables,
+streaming con validación incremental del formato y `generar_texto_con_llm`, que combina la
+caché de respuestas, el control de cuota y el registro de métricas.
+
+Los prompts se envían como un prefijo estable (instrucciones y manual, idéntico byte a byte entre
+llamadas) seguido de la parte variable, para aprovechar la caché de prefijos de los proveedores:
+automática en OpenAI y explícita (CachedContent) en Gemini.
+
+Con una PoliticaEnrutamiento, una llamada lenta se cubre con una petición duplicada al modelo
+secundario y una llamada fallida se repite en él (ver `sumon.enrutamiento`).
+
+Con `ConfiguracionLLM.lote` (un AgrupadorLotesProveedor), las llamadas no van a la API interactiva:
+esperan a salir en un lote de la API de lotes del proveedor (ver `sumon.lotes_proveedor`).
+
+Los SDK de los proveedores se importan la primera vez que se construye un cliente.
+"""
+import datetime
+import hashlib
+import logging
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass
+
+from sumon.cache_respuestas import CacheRespuestasLLM, obtener_cache_respuestas_llm
+from sumon.comun import estimar_tokens, instancia_por_proceso
+from sumon.cuota import TOKENS_SALIDA_ESTIMADOS, obtener_registro_control_cuota
+from sumon.enrutamiento import obtener_registro_salud_modelos
+from sumon.metricas import estimar_costo_usd, obtener_registro_metricas
+
+logger = logging.getLogger(__name__)
+
+# --- Configuración de proveedores ---
+@dataclass
+class ConfiguracionLLM:
+    """
+    API keys y preferencias de una sesión o ejecución. La interfaz de Streamlit la construye en
+    cada recarga a partir de la barra lateral; la línea de comandos, desde variables de entorno.
+    `usar_cache` activa la caché de respuestas; la generación de ítems solo la usa además con
+    `cachear_generacion`, para que regenerar la misma fila produzca una variante nueva (las
+    auditorías de un mismo texto sí se reutilizan).
+    `lote` (AgrupadorLotesProveedor) envía las llamadas por la API de lotes del proveedor.
+    """
+    gemini_api_key: str = ""
+    openai_api_key: str = ""
+    usar_cache: bool = True
+    cachear_generacion: bool = False
+    streaming: bool = False
+    lote: object = None
+
+    @property
+    def gemini_ok(self):
+        return bool(self.gemini_api_key)
+
+    @property
+    def openai_ok(self):
+        return bool(self.openai_api_key)
+
+    def proveedor_ok(self, model_type):
+        return self.gemini_ok if model_type == "Gemini" else self.openai_ok
+
+    @classmethod
+    def desde_entorno(cls, **cambios):
+        return cls(
+            gemini_api_key=os.environ.get("GEMINI_API_KEY") or os.environ.get("GOOGLE_API_KEY") or "",
+            openai_api_key=os.environ.get("OPENAI_API_KEY") or "",
+            **cambios
+        )
+
+class ContadorLlamadas:
+    """Peticiones enviadas al proveedor (sin contar los aciertos de caché), sumadas desde varios hilos."""
+    def __init__(self, valor=0):
+        self._lock = threading.Lock()
+        self.valor = valor
+
+    def sumar(self, cantidad=1):
+        with self._lock:
+            self.valor += cantidad
+
+# --- Registro de clientes de LLM reutilizables ---
+LLM_TIMEOUT_SEGUNDOS = 120 # Tiempo máximo de espera por respuesta del proveedor
+# Endpoints alternativos (proxy corporativo, servidor simulado del benchmark, etc.); vacíos = API pública
+OPENAI_BASE_URL = os.environ.get("SUMON_OPENAI_BASE_URL") or None
+GEMINI_API_ENDPOINT = os.environ.get("SUMON_GEMINI_API_ENDPOINT") or None
+# Caché explícita de contexto de Gemini: tamaño mínimo del prefijo según el modelo, duración y
+# versión fija del modelo (los alias sin versión no admiten CachedContent en los modelos 1.5)
+MIN_TOKENS_CONTEXTO_GEMINI = {"gemini-1.5-flash": 32768, "gemini-1.5-pro": 32768}
+MIN_TOKENS_CONTEXTO_GEMINI_POR_DEFECTO = 4096
+TTL_CONTEXTO_GEMINI_SEGUNDOS = 900
+MODELOS_GEMINI_CON_VERSION = {"gemini-1.5-flash": "gemini-1.5-flash-002", "gemini-1.5-pro": "gemini-1.5-pro-002"}
+
+class RegistroClientesLLM:
+    """
+    Registro de clientes de LLM compartido por todo el proceso (sesiones de Streamlit e hilos del
+    modo por lote). Cada cliente se construye una sola vez por proveedor, API key y modelo, de modo
+    que las conexiones HTTP se mantienen vivas y se reutilizan entre llamadas. En Gemini no se usa
+    `genai.configure`, que cambiaría la API key de los modelos de todas las sesiones: cada API key
+    tiene sus propios clientes del SDK y los modelos se ligan a ellos.
+    """
+    def __init__(self, timeout_segundos=LLM_TIMEOUT_SEGUNDOS):
+        self.timeout_segundos = timeout_segundos
+        self._lock = threading.Lock()
+        self._clientes = {}
+        self._lock_contextos = threading.Lock() # Crear un CachedContent es una llamada de red: lock aparte
+        self._contextos_gemini = {} # (api key, modelo, huella del prefijo) → (modelo, vence) o None si no se pudo crear
+
+    @staticmethod
+    def _huella_api_key(api_key):
+        # No se guardan las API keys en claro como parte de las claves del registro
+        return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+    def cliente_openai(self, api_key):
+        clave = ("GPT", self._huella_api_key(api_key))
+        with self._lock:
+            cliente = self._clientes.get(clave)
+            if cliente is None:
+                # El cliente de OpenAI mantiene su propio pool de conexiones HTTP (keep-alive).
+                # Los reintentos los gestiona ControlCuota, no el SDK.
+                import openai
+
+                cliente = openai.OpenAI(api_key=api_key, base_url=OPENAI_BASE_URL, timeout=self.timeout_segundos, max_retries=0)
+                self._clientes[clave] = cliente
+            return cliente
+
+    def _clientes_gemini(self, api_key):
+        """Gestor de clientes del SDK de Gemini propio de `api_key`. Se llama con `self._lock` adquirido."""
+        clave = ("Gemini", self._huella_api_key(api_key))
+        gestor = self._clientes.get(clave)
+        if gestor is None:
+            from google.generativeai.client import _ClientManager
+
+            gestor = _ClientManager()
+            if GEMINI_API_ENDPOINT:
+                # El endpoint alternativo se habla por REST (admite http:// para servidores locales)
+                gestor.configure(api_key=api_key, transport="rest", client_options={"api_endpoint": GEMINI_API_ENDPOINT})
+            else:
+                gestor.configure(api_key=api_key)
+            self._clientes[clave] = gestor
+        return gestor
+
+    def _ligar_modelo_gemini(self, modelo, api_key):
+        # El SDK toma el cliente global en la primera llamada si el modelo no tiene uno propio
+        with self._lock:
+            modelo._client = self._clientes_gemini(api_key).get_default_client("generative")
+        return modelo
+
+    def modelo_gemini(self, api_key, model_name):
+        clave = ("Gemini", self._huella_api_key(api_key), model_name)
+        with self._lock:
+            modelo = self._clientes.get(clave)
+        if modelo is None:
+            import google.generativeai as genai
+
+            modelo = self._ligar_modelo_gemini(genai.GenerativeModel(model_name), api_key)
+            with self._lock:
+                modelo = self._clientes.setdefault(clave, modelo)
+        return modelo
+
+    def modelo_gemini_con_contexto(self, api_key, model_name, prefijo):
+        """
+        Modelo de Gemini ligado a un CachedContent con `prefijo`, creado una vez y renovado al
+        vencer. Devuelve None si el prefijo no alcanza el mínimo del modelo o el proveedor
+        rechazó crear la caché (en ese caso no se vuelve a intentar con el mismo prefijo).
+        """
+        minimo = MIN_TOKENS_CONTEXTO_GEMINI.get(model_name, MIN_TOKENS_CONTEXTO_GEMINI_POR_DEFECTO)
+        if estimar_tokens(prefijo) < minimo:
+            return None
+        clave = (self._huella_api_key(api_key), model_name, hashlib.sha256(prefijo.encode("utf-8")).hexdigest())
+        with self._lock_contextos:
+            if clave in self._contextos_gemini:
+                registro = self._contextos_gemini[clave]
+                if registro is None:
+                    return None
+                modelo, vence = registro
+                if time.monotonic() < vence - 60:
+                    return modelo
+            try:
+                import google.generativeai as genai
+                from google.generativeai import caching
+
+                # Como `CachedContent.create`, pero con el cliente de esta API key y no con el global
+                with self._lock:
+                    cliente_cache = self._clientes_gemini(api_key).get_default_client("cache")
+                peticion = caching.CachedContent._prepare_create_request(
+                    model=MODELOS_GEMINI_CON_VERSION.get(model_name, model_name),
+                    display_name=f"sumon-{clave[2][:12]}", contents=[prefijo],
+                    ttl=datetime.timedelta(seconds=TTL_CONTEXTO_GEMINI_SEGUNDOS)
+                )
+                contexto = caching.CachedContent._from_obj(cliente_cache.create_cached_content(peticion))
+                modelo = self._ligar_modelo_gemini(genai.GenerativeModel.from_cached_content(contexto), api_key)
+            except Exception as e:
+                logger.warning("No se pudo crear la caché de contexto de Gemini para %s: %s", model_name, e)
+                self._contextos_gemini[clave] = None
+                return None
+            self._contextos_gemini[clave] = (modelo, time.monotonic() + TTL_CONTEXTO_GEMINI_SEGUNDOS)
+            return modelo
+
+    def opciones_peticion_gemini(self):
+        return {"timeout": self.timeout_segundos}
+
+@instancia_por_proceso
+def obtener_registro_clientes_llm():
+    return RegistroClientesLLM()
+
+# --- Streaming y validación incremental del formato de salida ---
+SECCIONES_ITEM = ["PREGUNTA:", "RESPUESTA CORRECTA:", "JUSTIFICACIONES:", "GRAFICO_NECESARIO:", "DESCRIPCION_GRAFICO:"]
+SECCIONES_AUDITORIA = ["VALIDACIÓN DE CRITERIOS:", "DICTAMEN FINAL:", "OBSERVACIONES FINALES:"]
+MAX_TOKENS_SIN_ENCABEZADO = 150 # Tokens tolerados antes del primer encabezado esperado
+MAX_TOKENS_ENTRE_SECCIONES = 900 # Tokens tolerados sin que aparezca el siguiente encabezado
+
+class SalidaFueraDeFormato(Exception):
+    """
+    Se lanza cuando una respuesta en streaming se cancela antes de terminar porque
+    claramente no sigue el formato esperado. Conserva el texto recibido hasta ese momento.
+    """
+    def __init__(self, mensaje, texto_parcial=""):
+        super().__init__(mensaje)
+        self.texto_parcial = texto_parcial
+
+def crear_validador_formato(secciones, max_tokens_sin_encabezado=MAX_TOKENS_SIN_ENCABEZADO,
+                            max_tokens_entre_secciones=MAX_TOKENS_ENTRE_SECCIONES):
+    """
+    Devuelve una función `validar(texto_parcial)` que localiza, en orden, los encabezados de
+    `secciones` recibidos hasta el momento y devuelve un mensaje de error si la salida ya se
+    desvió del formato (o None si todavía puede ser válida).
+    """
+    def validar(texto_parcial):
+        posicion = 0
+        ultima_seccion = None
+        for seccion in secciones:
+            encontrada = texto_parcial.find(seccion, posicion)
+            if encontrada == -1:
+                break
+            ultima_seccion = seccion
+            posicion = encontrada + len(seccion)
+        else:
+            return None # Todas las secciones ya aparecieron
+
+        tokens_pendientes = estimar_tokens(texto_parcial[posicion:])
+        if ultima_seccion is None:
+            if tokens_pendientes > max_tokens_sin_encabezado:
+                return f"No apareció el encabezado '{secciones[0]}' en los primeros {max_tokens_sin_encabezado} tokens."
+        elif tokens_pendientes > max_tokens_entre_secciones:
+            return f"Después de '{ultima_seccion}' no apareció la siguiente sección esperada en {max_tokens_entre_secciones} tokens."
+        return None
+    return validar
+
+def crear_renderizador_streaming(panel, intervalo_segundos=0.15):
+    """
+    Devuelve un callback que muestra en `panel` (un `st.empty()`) el texto acumulado,
+    limitando la frecuencia de refresco para no saturar el navegador con cada token.
+    """
+    ultimo_refresco = [0.0]
+    def renderizar(texto_acumulado):
+        ahora = time.monotonic()
+        if ahora - ultimo_refresco[0] >= intervalo_segundos:
+            ultimo_refresco[0] = ahora
+            panel.markdown(texto_acumulado + " ▌")
+    return renderizar
+
+def _consumir_stream(fragmentos, al_recibir_texto=None, validar_parcial=None, cancelar=None):
+    """
+    Acumula los fragmentos de texto de un stream. Si `validar_parcial` detecta que la salida
+    se salió del formato, cancela la petición con `cancelar()` y lanza SalidaFueraDeFormato.
+    """
+    partes = []
+    for fragmento in fragmentos:
+        if not fragmento:
+            continue
+        partes.append(fragmento)
+        texto_acumulado = "".join(partes)
+        if al_recibir_texto is not None:
+            al_recibir_texto(texto_acumulado)
+        if validar_parcial is not None:
+            error_formato = validar_parcial(texto_acumulado)
+            if error_formato:
+                if cancelar is not None:
+                    cancelar()
+                raise SalidaFueraDeFormato(error_formato, texto_acumulado)
+    return "".join(partes)
+
+def _fragmentos_gemini(response):
+    for chunk in response:
+        yield chunk.text
+
+def _tokens_cacheados_openai(uso):
+    detalles = getattr(uso, "prompt_tokens_details", None)
+    return (getattr(detalles, "cached_tokens", None) or 0) if detalles is not None else 0
+
+def _fragmentos_openai(stream, medicion=None):
+    for chunk in stream:
+        # Con stream_options={"include_usage": True} el último fragmento trae el uso de tokens
+        if medicion is not None and getattr(chunk, "usage", None):
+            medicion["uso"] = (chunk.usage.prompt_tokens, chunk.usage.completion_tokens)
+            medicion["tokens_cacheados"] = _tokens_cacheados_openai(chunk.usage)
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+def _esquema_para_gemini(esquema):
+    # El esquema de Gemini es un subconjunto de OpenAPI: no admite "additionalProperties"
+    if isinstance(esquema, dict):
+        return {clave: _esquema_para_gemini(valor) for clave, valor in esquema.items() if clave != "additionalProperties"}
+    if isinstance(esquema, list):
+        return [_esquema_para_gemini(valor) for valor in esquema]
+    return esquema
+
+def _formato_respuesta_openai(model_name, nombre_esquema, esquema):
+    # Los "structured outputs" con esquema estricto solo existen en los modelos recientes;
+    # el resto recibe el modo JSON simple y el esquema va descrito en el prompt.
+    if model_name.startswith(("gpt-4o", "gpt-4.1", "o1", "o3", "o4")):
+        return {"type": "json_schema", "json_schema": {"name": nombre_esquema, "schema": esquema, "strict": True}}
+    return {"type": "json_object"}
+
+# --- Función para generar texto con Gemini o GPT ---
+def generar_texto_con_llm(model_type, model_name, prompt, usar_cache=True, al_recibir_texto=None, validar_parcial=None,
+                          esquema_json=None, contexto_metricas=None, configuracion=None, prefijo=None, enrutamiento=None,
+                          contador_llamadas=None):
+    """
+    Envía el prompt al proveedor indicado y devuelve el texto de la respuesta.
+    Si `usar_cache` es True (y la caché está activada en la configuración), primero se busca
+    una respuesta previa para el mismo proveedor, modelo, prompt y parámetros; esto permite
+    además reproducir corridas completas sin conexión.
+    Si se indica `al_recibir_texto` o `validar_parcial`, la respuesta se pide en streaming:
+    `al_recibir_texto(texto_acumulado)` se llama con cada fragmento y `validar_parcial` puede
+    cancelar la petición a mitad de camino (lanza SalidaFueraDeFormato).
+    `esquema_json=(nombre, esquema)` pide al proveedor una respuesta JSON que cumpla el esquema
+    (structured outputs de OpenAI / `response_schema` de Gemini).
+    Cada llamada deja un registro de latencia, tokens y costo en el registro de métricas;
+    `contexto_metricas` (p. ej. etapa, intento, id del ítem) se añade a ese registro.
+    `configuracion` (ConfiguracionLLM) aporta las API keys; por defecto se leen del entorno.
+    `prefijo` son las instrucciones estables que preceden a `prompt` y que deben ser idénticas
+    entre llamadas: en GPT van como mensaje de sistema (caché automática de prefijos de OpenAI) y
+    en Gemini como CachedContent si alcanzan el mínimo del modelo. Los tokens servidos desde esa
+    caché se registran en "tokens_cacheados".
+    `enrutamiento` (PoliticaEnrutamiento) añade cobertura con el modelo secundario y conmutación
+    por error; el registro de cada llamada indica su "ruta" (primario, cobertura o conmutación).
+    Con `configuracion.lote`, la llamada espera su respuesta de la API de lotes del proveedor (sin
+    streaming ni enrutamiento) y se registra con "en_lote" y el precio de lote.
+    `contador_llamadas` (ContadorLlamadas) suma cada petición que sale al proveedor, incluidas las
+    duplicadas de la cobertura y las de la conmutación.
+    """
+    configuracion = configuracion or ConfiguracionLLM.desde_entorno()
+    argumentos = {"usar_cache": usar_cache, "esquema_json": esquema_json, "configuracion": configuracion, "prefijo": prefijo,
+                  "contador_llamadas": contador_llamadas}
+    # En un lote del proveedor no hay latencia que cubrir: la política de enrutamiento no aplica
+    if (configuracion.lote is not None or enrutamiento is None or enrutamiento.secundario is None
+            or tuple(enrutamiento.secundario) == (model_type, model_name)):
+        return _generar_texto_en_modelo(model_type, model_name, prompt, al_recibir_texto=al_recibir_texto,
+                                        validar_parcial=validar_parcial, contexto_metricas=contexto_metricas, **argumentos)
+    return _generar_texto_con_enrutamiento(model_type, model_name, prompt, enrutamiento, al_recibir_texto, validar_parcial,
+                                           contexto_metricas or {}, argumentos)
+
+def _generar_texto_con_enrutamiento(model_type, model_name, prompt, politica, al_recibir_texto, validar_parcial,
+                                    contexto_metricas, argumentos):
+    """
+    Lanza la llamada al primario en un hilo y, si no responde antes del umbral de cobertura, una
+    duplicada al secundario: gana la primera respuesta válida y la otra se corta (en streaming,
+    con `validar_parcial`). Si una rama falla y no queda otra en curso, se conmuta al secundario.
+    Los eventos de las ramas llegan por una cola, de modo que `al_recibir_texto` se sigue
+    llamando desde el hilo que llamó a esta función.
+    """
+    configuracion = argumentos["configuracion"]
+    registro_salud = obtener_registro_salud_modelos()
+    primario, secundario = (model_type, model_name), tuple(politica.secundario)
+    salud_primario = registro_salud.para(*primario)
+    salud_secundario = registro_salud.para(*secundario)
+    secundario_utilizable = configuracion.proveedor_ok(secundario[0]) and salud_secundario.disponible()
+
+    if not salud_primario.disponible() and secundario_utilizable:
+        # Primario fuera de circulación por fallos recientes: se va directo al secundario
+        salud_primario.contar("conmutaciones")
+        return _generar_texto_en_modelo(*secundario, prompt, al_recibir_texto=al_recibir_texto, validar_parcial=validar_parcial,
+                                        contexto_metricas={**contexto_metricas, "ruta": "conmutación"}, **argumentos)
+
+    eventos = queue.Queue()
+    ramas = {} # ruta → (modelo, evento de cancelación, inicio)
+
+    def _lanzar(ruta, modelo):
+        cancelada = threading.Event()
+
+        def _validar(texto_parcial):
+            if cancelada.is_set():
+                return "Otra petición de la cobertura respondió primero."
+            return validar_parcial(texto_parcial) if validar_parcial is not None else None
+
+        def _trabajo():
+            try:
+                texto = _generar_texto_en_modelo(
+                    *modelo, prompt,
+                    al_recibir_texto=(lambda texto_parcial: eventos.put((ruta, "parcial", texto_parcial))) if al_recibir_texto else None,
+                    validar_parcial=_validar, contexto_metricas={**contexto_metricas, "ruta": ruta}, **argumentos
+                )
+                eventos.put((ruta, "fin", texto))
+            except Exception as e:
+                eventos.put((ruta, "error", e))
+
+        ramas[ruta] = (modelo, cancelada, time.monotonic())
+        threading.Thread(target=_trabajo, daemon=True).start()
+
+    _lanzar("primario", primario)
+    limite_cobertura = None
+    if politica.cobertura and secundario_utilizable:
+        limite_cobertura = time.monotonic() + salud_primario.umbral_cobertura(politica)
+    en_curso = 1
+    ruta_con_texto = None # Solo se muestra el texto parcial de una rama
+    primer_error = None
+    while True:
+        espera = None if limite_cobertura is None else max(0.0, limite_cobertura - time.monotonic())
+        try:
+            ruta, tipo, valor = eventos.get(timeout=espera)
+        except queue.Empty:
+            limite_cobertura = None
+            salud_primario.contar("coberturas")
+            _lanzar("cobertura", secundario)
+            en_curso += 1
+            continue
+        if tipo == "parcial":
+            if ruta_con_texto in (None, ruta):
+                ruta_con_texto = ruta
+                al_recibir_texto(valor)
+            continue
+        en_curso -= 1
+        if tipo == "fin" and valor is not None:
+            for otra_ruta, (_, cancelada, inicio) in ramas.items():
+                if otra_ruta != ruta:
+                    cancelada.set()
+                    if otra_ruta == "primario":
+                        salud_primario.registrar_latencia(time.monotonic() - inicio)
+            if ruta == "cobertura":
+                salud_primario.contar("coberturas_ganadas")
+            if al_recibir_texto is not None and ruta_con_texto not in (None, ruta):
+                al_recibir_texto(valor) # El panel mostraba la rama perdedora
+            return valor
+        if primer_error is None:
+            primer_error = valor if tipo == "error" else None
+        if en_curso:
+            continue # La otra rama todavía puede responder
+        formato_invalido = isinstance(valor, SalidaFueraDeFormato)
+        if "cobertura" not in ramas and "conmutación" not in ramas and politica.conmutar_por_error \
+                and secundario_utilizable and not formato_invalido:
+            salud_primario.contar("conmutaciones")
+            limite_cobertura = None
+            _lanzar("conmutación", secundario)
+            en_curso += 1
+            continue
+        if primer_error is not None:
+            raise primer_error
+        return None
+
+def _generar_texto_en_modelo(model_type, model_name, prompt, usar_cache=True, al_recibir_texto=None, validar_parcial=None,
+                             esquema_json=None, contexto_metricas=None, configuracion=None, prefijo=None, contador_llamadas=None):
+    """Una llamada a un solo modelo (caché, cuota, métricas y salud del modelo); ver `generar_texto_con_llm`."""
+    parametros = {"max_tokens": 2000} if model_type == "GPT" else {}
+    if esquema_json is not None:
+        parametros["esquema_json"] = esquema_json[0]
+    if prefijo:
+        parametros["prefijo_separado"] = True
+    prompt_completo = f"{prefijo}\n{prompt}" if prefijo else prompt
+    medicion = {"inicio": time.monotonic(), "primer_token": None, "uso": None, "tokens_cacheados": 0}
+    registro_llamada = {
+        "timestamp": time.time(), "model_type": model_type, "model_name": model_name,
+        **(contexto_metricas or {}),
+        "desde_cache": False, "error": None
+    }
+
+    def _registrar(texto_respuesta, tokens_fuente="estimado"):
+        fin = time.monotonic()
+        if medicion["uso"] is not None:
+            tokens_prompt, tokens_respuesta = medicion["uso"]
+            tokens_fuente = "api"
+        else:
+            tokens_prompt, tokens_respuesta = estimar_tokens(prompt_completo), estimar_tokens(texto_respuesta or "")
+        tokens_cacheados = 0 if registro_llamada["desde_cache"] else medicion["tokens_cacheados"]
+        registro_llamada.update({
+            "latencia_s": round(fin - medicion["inicio"], 3),
+            "ttft_s": round((medicion["primer_token"] or fin) - medicion["inicio"], 3),
+            "tokens_prompt": tokens_prompt,
+            "tokens_respuesta": tokens_respuesta,
+            "tokens_cacheados": tokens_cacheados,
+            "tokens_fuente": tokens_fuente,
+            "costo_usd": 0.0 if registro_llamada["desde_cache"] else estimar_costo_usd(
+                model_name, tokens_prompt, tokens_respuesta, tokens_cacheados, en_lote=registro_llamada.get("en_lote", False)
+            ),
+        })
+        obtener_registro_metricas().registrar_llamada(registro_llamada)
+
+    cache = obtener_cache_respuestas_llm() if (usar_cache and configuracion.usar_cache) else None
+    clave_cache = None
+    if cache is not None:
+        clave_cache = CacheRespuestasLLM.construir_clave(model_type, model_name, prompt_completo, parametros)
+        respuesta_cacheada = cache.obtener(clave_cache)
+        if respuesta_cacheada is not None:
+            if al_recibir_texto is not None:
+                al_recibir_texto(respuesta_cacheada)
+            registro_llamada["desde_cache"] = True
+            _registrar(respuesta_cacheada)
+            return respuesta_cacheada
+
+    if contador_llamadas is not None:
+        contador_llamadas.sumar()
+    if configuracion.lote is not None:
+        # Generación diferida: la petición sale en el próximo lote del proveedor y esta llamada espera su resultado
+        resultado_lote = configuracion.lote.solicitar(model_type, model_name, prompt, prefijo=prefijo, esquema_json=esquema_json,
+                                                      max_tokens=parametros.get("max_tokens", 2000))
+        registro_llamada.update({"en_lote": True, "id_lote": resultado_lote.id_lote})
+        if resultado_lote.tokens_prompt is not None:
+            medicion["uso"] = (resultado_lote.tokens_prompt, resultado_lote.tokens_respuesta or 0)
+            medicion["tokens_cacheados"] = resultado_lote.tokens_cacheados
+        if resultado_lote.error is not None:
+            registro_llamada["error"] = f"ErrorLoteProveedor: {resultado_lote.error}"
+            _registrar("")
+            from sumon.lotes_proveedor import ErrorLoteProveedor
+            raise ErrorLoteProveedor(resultado_lote.error)
+        _registrar(resultado_lote.texto)
+        if cache is not None and resultado_lote.texto:
+            cache.guardar(clave_cache, model_type, model_name, resultado_lote.texto)
+        return resultado_lote.texto
+
+    en_streaming = al_recibir_texto is not None or validar_parcial is not None
+
+    def _al_recibir_texto_medido(texto_acumulado):
+        if medicion["primer_token"] is None:
+            medicion["primer_token"] = time.monotonic()
+        if al_recibir_texto is not None:
+            al_recibir_texto(texto_acumulado)
+
+    control_cuota = obtener_registro_control_cuota().para(model_type, model_name)
+    tokens_estimados = estimar_tokens(prompt_completo) + parametros.get("max_tokens", TOKENS_SALIDA_ESTIMADOS)
+
+    def _tokens_usados():
+        # Lo que el proveedor informó de la llamada, para corregir lo descontado del cupo de TPM
+        if medicion["uso"] is None:
+            return None
+        tokens_prompt, tokens_respuesta = medicion["uso"]
+        return (tokens_prompt or 0) + (tokens_respuesta or 0)
+
+    texto = None
+    try:
+        if model_type == "Gemini":
+            if not configuracion.gemini_ok:
+                logger.error("API Key de Gemini no configurada. No se puede generar texto con Gemini.")
+                return None
+            registro = obtener_registro_clientes_llm()
+            modelo = None
+            if prefijo:
+                modelo = registro.modelo_gemini_con_contexto(configuracion.gemini_api_key, model_name, prefijo)
+            # Con el prefijo en la caché de contexto solo se envía la parte variable; si no, va todo
+            # el texto con el prefijo al comienzo (que también aprovecha la caché implícita de Gemini)
+            contenido = prompt if modelo is not None else prompt_completo
+            modelo = modelo or registro.modelo_gemini(configuracion.gemini_api_key, model_name)
+            generation_config = None
+            if esquema_json is not None:
+                generation_config = {"response_mime_type": "application/json", "response_schema": _esquema_para_gemini(esquema_json[1])}
+
+            def _llamar_gemini():
+                response = modelo.generate_content(contenido, generation_config=generation_config, stream=en_streaming,
+                                                   request_options=registro.opciones_peticion_gemini())
+                if en_streaming:
+                    # Al dejar de iterar, el stream de Gemini se cierra y el servidor deja de generar
+                    texto_respuesta = _consumir_stream(_fragmentos_gemini(response), _al_recibir_texto_medido, validar_parcial)
+                else:
+                    texto_respuesta = response.text
+                uso = getattr(response, "usage_metadata", None)
+                if uso is not None and uso.prompt_token_count:
+                    medicion["uso"] = (uso.prompt_token_count, uso.candidates_token_count)
+                    medicion["tokens_cacheados"] = getattr(uso, "cached_content_token_count", 0) or 0
+                return texto_respuesta
+
+            texto = control_cuota.ejecutar(_llamar_gemini, tokens_estimados, tokens_reales=_tokens_usados)
+        elif model_type == "GPT":
+            if not configuracion.openai_ok:
+                logger.error("API Key de OpenAI no configurada. No se puede generar texto con GPT.")
+                return None
+            client = obtener_registro_clientes_llm().cliente_openai(configuracion.openai_api_key)
+            opciones_extra = {}
+            if esquema_json is not None:
+                opciones_extra["response_format"] = _formato_respuesta_openai(model_name, *esquema_json)
+            if en_streaming:
+                opciones_extra["stream_options"] = {"include_usage": True}
+            mensajes = [{"role": "user", "content": prompt}]
+            if prefijo:
+                # El prefijo estable abre la conversación; la clave agrupa en el mismo servidor de
+                # OpenAI las peticiones que lo comparten y mejora la tasa de aciertos de su caché
+                mensajes.insert(0, {"role": "system", "content": prefijo})
+                opciones_extra["prompt_cache_key"] = hashlib.sha256(prefijo.encode("utf-8")).hexdigest()[:32]
+
+            def _llamar_openai():
+                response = client.chat.completions.create(
+                    model=model_name,
+                    messages=mensajes,
+                    max_tokens=parametros["max_tokens"], # Ajusta según necesidad
+                    stream=en_streaming,
+                    **opciones_extra
+                )
+                if en_streaming:
+                    return _consumir_stream(_fragmentos_openai(response, medicion), _al_recibir_texto_medido, validar_parcial,
+                                            cancelar=response.close)
+                if response.usage is not None:
+                    medicion["uso"] = (response.usage.prompt_tokens, response.usage.completion_tokens)
+                    medicion["tokens_cacheados"] = _tokens_cacheados_openai(response.usage)
+                return response.choices[0].message.content
+
+            texto = control_cuota.ejecutar(_llamar_openai, tokens_estimados, tokens_reales=_tokens_usados)
+    except Exception as e:
+        registro_llamada["error"] = f"{type(e).__name__}: {e}"
+        _registrar(getattr(e, "texto_parcial", ""))
+        if not isinstance(e, SalidaFueraDeFormato): # Un formato inválido no es culpa del proveedor
+            obtener_registro_salud_modelos().para(model_type, model_name).registrar_fallo()
+        raise
+
+    _registrar(texto)
+    if texto is not None:
+        obtener_registro_salud_modelos().para(model_type, model_name).registrar_exito(registro_llamada["latencia_s"])
+    if cache is not None and texto:
+        cache.guardar(clave_cache, model_type, model_name, texto)
+    return texto
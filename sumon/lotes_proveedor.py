@@ -0,0 +1,480 @@
+"""
+Generación diferida con las API de lotes de los proveedores (OpenAI Batch y el modo por lotes de
+Gemini): las peticiones de muchas filas se serializan en un archivo JSONL, se envían de una vez y
+se sondean hasta que el proveedor devuelve los resultados. A cambio de latencia (hasta 24 h), el
+proveedor cobra la mitad y usa una cuota aparte de la interactiva.
+
+`AgrupadorLotesProveedor` se conecta a `generar_texto_con_llm` mediante `ConfiguracionLLM.lote`:
+cada fila sigue el mismo flujo de generación, auditoría y refinamiento, pero sus llamadas esperan
+a que todas las filas activas tengan una petición pendiente y entonces se envían juntas, un lote
+por modelo. La primera ronda lleva las generaciones de todas las filas, la segunda sus
+auditorías, la tercera los refinamientos, etc. Las respuestas vuelven al flujo como si fueran de
+una llamada interactiva, de modo que el análisis y el refinamiento no cambian.
+
+Las peticiones enviadas quedan registradas en SQLite hasta que se consumen sus resultados: si el
+proceso se interrumpe y el trabajo se reanuda, las peticiones idénticas esperan al lote ya
+enviado en lugar de pagarse dos veces.
+
+`ClienteLotesLocal` imita a un proveedor con archivos en un directorio (entrada.jsonl → salida.jsonl),
+para las pruebas y el benchmark; `resolver_lotes_locales` los responde.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import urllib.request
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from sumon.llm import (
+    GEMINI_API_ENDPOINT, _esquema_para_gemini, _formato_respuesta_openai, obtener_registro_clientes_llm
+)
+
+logger = logging.getLogger(__name__)
+
+RUTA_REGISTRO_LOTES = os.environ.get(
+    "SUMON_LOTES_PROVEEDOR",
+    os.path.join(os.path.expanduser("~"), ".cache", "sumon2", "lotes_proveedor.sqlite3")
+)
+INTERVALO_SONDEO_SEGUNDOS = 60.0 # Entre consultas del estado de un lote enviado
+VENTANA_AGRUPACION_SEGUNDOS = 2.0 # Sin peticiones nuevas durante este tiempo, la ronda se envía
+MAX_SOLICITUDES_POR_LOTE = 50000 # Límite de peticiones por archivo de OpenAI Batch
+ESTADO_EN_PROCESO, ESTADO_TERMINADO, ESTADO_FALLIDO = "en_proceso", "terminado", "fallido"
+
+class ErrorLoteProveedor(Exception):
+    """El proveedor no devolvió respuesta para una petición del lote (rechazo, lote fallido o vencido)."""
+
+@dataclass
+class SolicitudLote:
+    """Una llamada de `generar_texto_con_llm` pendiente de enviarse en un lote."""
+    model_type: str
+    model_name: str
+    prompt: str
+    prefijo: str = None
+    esquema_json: tuple = None
+    max_tokens: int = 2000
+
+    @property
+    def huella(self):
+        """Identifica la petición entre ejecuciones (es también su custom_id/key en el JSONL)."""
+        contenido = json.dumps([self.model_type, self.model_name, self.prefijo or "", self.prompt,
+                                self.esquema_json[0] if self.esquema_json else None], ensure_ascii=False)
+        return hashlib.sha256(contenido.encode("utf-8")).hexdigest()[:32]
+
+@dataclass
+class ResultadoLote:
+    texto: str = None
+    error: str = None
+    id_lote: str = None
+    tokens_prompt: int = None
+    tokens_respuesta: int = None
+    tokens_cacheados: int = 0
+
+# --- Formatos JSONL de cada proveedor ---
+def _esquema_rest_gemini(esquema):
+    # La API REST de Gemini espera los tipos en mayúsculas (el SDK los convierte por su cuenta)
+    if isinstance(esquema, dict):
+        return {clave: (valor.upper() if clave == "type" and isinstance(valor, str) else _esquema_rest_gemini(valor))
+                for clave, valor in _esquema_para_gemini(esquema).items()}
+    if isinstance(esquema, list):
+        return [_esquema_rest_gemini(valor) for valor in esquema]
+    return esquema
+
+def linea_openai(solicitud):
+    """Petición de OpenAI Batch (chat completions), con el prefijo como mensaje de sistema."""
+    mensajes = [{"role": "user", "content": solicitud.prompt}]
+    if solicitud.prefijo:
+        mensajes.insert(0, {"role": "system", "content": solicitud.prefijo})
+    cuerpo = {"model": solicitud.model_name, "messages": mensajes, "max_tokens": solicitud.max_tokens}
+    if solicitud.esquema_json is not None:
+        cuerpo["response_format"] = _formato_respuesta_openai(solicitud.model_name, *solicitud.esquema_json)
+    return {"custom_id": solicitud.huella, "method": "POST", "url": "/v1/chat/completions", "body": cuerpo}
+
+def linea_gemini(solicitud):
+    """Petición del modo por lotes de Gemini (GenerateContentRequest con su clave)."""
+    texto = f"{solicitud.prefijo}\n{solicitud.prompt}" if solicitud.prefijo else solicitud.prompt
+    peticion = {"contents": [{"role": "user", "parts": [{"text": texto}]}]}
+    if solicitud.esquema_json is not None:
+        peticion["generationConfig"] = {"responseMimeType": "application/json",
+                                        "responseSchema": _esquema_rest_gemini(solicitud.esquema_json[1])}
+    return {"key": solicitud.huella, "request": peticion}
+
+def resultado_openai(linea):
+    """(custom_id, ResultadoLote) de una línea del archivo de salida (o de errores) de OpenAI Batch."""
+    respuesta = linea.get("response") or {}
+    cuerpo = respuesta.get("body") or {}
+    if linea.get("error") or respuesta.get("status_code") != 200:
+        return linea.get("custom_id"), ResultadoLote(error=json.dumps(linea.get("error") or cuerpo.get("error") or cuerpo, ensure_ascii=False))
+    uso = cuerpo.get("usage") or {}
+    return linea.get("custom_id"), ResultadoLote(
+        texto=cuerpo["choices"][0]["message"]["content"],
+        tokens_prompt=uso.get("prompt_tokens"), tokens_respuesta=uso.get("completion_tokens"),
+        tokens_cacheados=(uso.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+    )
+
+def resultado_gemini(linea):
+    """(key, ResultadoLote) de una línea del archivo de respuestas del modo por lotes de Gemini."""
+    if linea.get("error") or "response" not in linea:
+        return linea.get("key"), ResultadoLote(error=json.dumps(linea.get("error") or linea, ensure_ascii=False))
+    respuesta = linea["response"]
+    candidatos = respuesta.get("candidates") or []
+    partes = (candidatos[0].get("content") or {}).get("parts", []) if candidatos else []
+    if not partes:
+        return linea.get("key"), ResultadoLote(error=f"Respuesta sin texto: {json.dumps(respuesta, ensure_ascii=False)[:300]}")
+    uso = respuesta.get("usageMetadata") or {}
+    return linea.get("key"), ResultadoLote(
+        texto="".join(parte.get("text", "") for parte in partes),
+        tokens_prompt=uso.get("promptTokenCount"), tokens_respuesta=uso.get("candidatesTokenCount"),
+        tokens_cacheados=uso.get("cachedContentTokenCount") or 0
+    )
+
+FORMATOS_LOTE = {"openai": (linea_openai, resultado_openai), "gemini": (linea_gemini, resultado_gemini)}
+
+def _jsonl(lineas):
+    return "".join(json.dumps(linea, ensure_ascii=False) + "\n" for linea in lineas).encode("utf-8")
+
+# --- Clientes de lotes: enviar(modelo, líneas) → id, consultar(id) → estado, descargar(id) → líneas ---
+class ClienteLotesOpenAI:
+    """OpenAI Batch: el JSONL se sube como archivo "batch" y el resultado se descarga de output_file_id."""
+    formato = "openai"
+
+    def __init__(self, api_key):
+        self._cliente = obtener_registro_clientes_llm().cliente_openai(api_key)
+
+    def enviar(self, model_name, lineas, descripcion=""):
+        archivo = self._cliente.files.create(file=("sumon_lote.jsonl", _jsonl(lineas)), purpose="batch")
+        lote = self._cliente.batches.create(input_file_id=archivo.id, endpoint="/v1/chat/completions",
+                                            completion_window="24h", metadata={"descripcion": descripcion[:500]})
+        return lote.id
+
+    def consultar(self, id_lote):
+        lote = self._cliente.batches.retrieve(id_lote)
+        if lote.status in ("validating", "in_progress", "finalizing", "cancelling"):
+            return ESTADO_EN_PROCESO
+        # Un lote vencido o cancelado conserva los resultados que alcanzó a producir
+        if lote.status == "completed" or lote.output_file_id or lote.error_file_id:
+            return ESTADO_TERMINADO
+        return ESTADO_FALLIDO
+
+    def descargar(self, id_lote):
+        lote = self._cliente.batches.retrieve(id_lote)
+        lineas = []
+        for id_archivo in (lote.output_file_id, lote.error_file_id):
+            if id_archivo:
+                lineas += [json.loads(linea) for linea in self._cliente.files.content(id_archivo).text.splitlines() if linea.strip()]
+        return lineas
+
+class ClienteLotesGemini:
+    """
+    Modo por lotes de Gemini por REST (el SDK google-generativeai no lo incluye): el JSONL se sube
+    con la API de archivos, se crea el lote con `batchGenerateContent` y el archivo de respuestas
+    se descarga al terminar.
+    """
+    formato = "gemini"
+    ESTADOS_EN_PROCESO = ("BATCH_STATE_PENDING", "BATCH_STATE_RUNNING", "JOB_STATE_PENDING", "JOB_STATE_RUNNING")
+
+    def __init__(self, api_key, endpoint=GEMINI_API_ENDPOINT, timeout_segundos=300):
+        base = endpoint or "generativelanguage.googleapis.com"
+        self._base = base.rstrip("/") if base.startswith("http") else f"https://{base.rstrip('/')}"
+        self._api_key = api_key
+        self._timeout = timeout_segundos
+
+    def _peticion(self, metodo, url, cuerpo=None, cabeceras=None):
+        datos = cuerpo if isinstance(cuerpo, (bytes, type(None))) else json.dumps(cuerpo).encode("utf-8")
+        peticion = urllib.request.Request(url, data=datos, method=metodo,
+                                          headers={"x-goog-api-key": self._api_key, "Content-Type": "application/json", **(cabeceras or {})})
+        with urllib.request.urlopen(peticion, timeout=self._timeout) as respuesta:
+            return respuesta.headers, respuesta.read()
+
+    @staticmethod
+    def _buscar(datos, clave):
+        # Las respuestas del servicio anidan el estado y el archivo de salida en "metadata"/"response"/"output"
+        if isinstance(datos, dict):
+            if clave in datos:
+                return datos[clave]
+            for valor in datos.values():
+                encontrado = ClienteLotesGemini._buscar(valor, clave)
+                if encontrado is not None:
+                    return encontrado
+        return None
+
+    def enviar(self, model_name, lineas, descripcion=""):
+        contenido = _jsonl(lineas)
+        cabeceras, _ = self._peticion("POST", f"{self._base}/upload/v1beta/files", {"file": {"display_name": "sumon_lote"}}, {
+            "X-Goog-Upload-Protocol": "resumable", "X-Goog-Upload-Command": "start",
+            "X-Goog-Upload-Header-Content-Length": str(len(contenido)), "X-Goog-Upload-Header-Content-Type": "application/jsonl"
+        })
+        _, cuerpo = self._peticion("POST", cabeceras["x-goog-upload-url"], contenido, {
+            "X-Goog-Upload-Offset": "0", "X-Goog-Upload-Command": "upload, finalize", "Content-Type": "application/jsonl"
+        })
+        nombre_archivo = json.loads(cuerpo)["file"]["name"]
+        _, cuerpo = self._peticion("POST", f"{self._base}/v1beta/models/{model_name}:batchGenerateContent", {
+            "batch": {"display_name": descripcion[:100] or "sumon", "input_config": {"file_name": nombre_archivo}}
+        })
+        # La respuesta es el lote o una operación que lo describe en "metadata"
+        respuesta = json.loads(cuerpo)
+        nombre = respuesta.get("name", "")
+        return nombre if nombre.startswith("batches/") else (self._buscar(respuesta.get("metadata") or {}, "name") or nombre)
+
+    def _lote(self, id_lote):
+        _, cuerpo = self._peticion("GET", f"{self._base}/v1beta/{id_lote}")
+        return json.loads(cuerpo)
+
+    def consultar(self, id_lote):
+        lote = self._lote(id_lote)
+        estado = self._buscar(lote, "state")
+        if estado in self.ESTADOS_EN_PROCESO or (estado is None and not lote.get("done")):
+            return ESTADO_EN_PROCESO
+        return ESTADO_TERMINADO if self._buscar(lote, "responsesFile") else ESTADO_FALLIDO
+
+    def descargar(self, id_lote):
+        archivo = self._buscar(self._lote(id_lote), "responsesFile")
+        _, cuerpo = self._peticion("GET", f"{self._base}/download/v1beta/{archivo}:download?alt=media")
+        return [json.loads(linea) for linea in cuerpo.decode("utf-8").splitlines() if linea.strip()]
+
+class ClienteLotesLocal:
+    """
+    Proveedor de lotes simulado con archivos: cada lote es un directorio con `entrada.jsonl` (en el
+    formato del proveedor imitado); el lote termina cuando alguien escribe `salida.jsonl` junto a
+    él (o falla con `error.txt`). `resolver_lotes_locales` responde los pendientes.
+    """
+    def __init__(self, directorio, formato="openai"):
+        if formato not in FORMATOS_LOTE:
+            raise ValueError(f"Formato de lote desconocido: {formato}")
+        self.directorio = directorio
+        self.formato = formato
+        os.makedirs(directorio, exist_ok=True)
+
+    def enviar(self, model_name, lineas, descripcion=""):
+        id_lote = f"lote-{uuid.uuid4().hex[:12]}"
+        ruta_lote = os.path.join(self.directorio, id_lote)
+        os.makedirs(ruta_lote)
+        with open(os.path.join(ruta_lote, "modelo.json"), "w", encoding="utf-8") as archivo:
+            json.dump({"modelo": model_name, "formato": self.formato, "descripcion": descripcion}, archivo, ensure_ascii=False)
+        # La entrada se escribe completa antes de hacerse visible al que resuelve los lotes
+        with open(os.path.join(ruta_lote, "entrada.jsonl.tmp"), "wb") as archivo:
+            archivo.write(_jsonl(lineas))
+        os.replace(os.path.join(ruta_lote, "entrada.jsonl.tmp"), os.path.join(ruta_lote, "entrada.jsonl"))
+        return id_lote
+
+    def consultar(self, id_lote):
+        ruta_lote = os.path.join(self.directorio, id_lote)
+        if os.path.exists(os.path.join(ruta_lote, "salida.jsonl")):
+            return ESTADO_TERMINADO
+        if os.path.exists(os.path.join(ruta_lote, "error.txt")) or not os.path.isdir(ruta_lote):
+            return ESTADO_FALLIDO
+        return ESTADO_EN_PROCESO
+
+    def descargar(self, id_lote):
+        with open(os.path.join(self.directorio, id_lote, "salida.jsonl"), encoding="utf-8") as archivo:
+            return [json.loads(linea) for linea in archivo if linea.strip()]
+
+def texto_de_peticion(linea):
+    """Prompt completo (prefijo incluido) de una línea de entrada en formato OpenAI o Gemini."""
+    if "body" in linea:
+        return "\n".join(str(mensaje.get("content", "")) for mensaje in linea["body"].get("messages", []))
+    return "\n".join(parte.get("text", "") for contenido in linea["request"].get("contents", []) for parte in contenido.get("parts", []))
+
+def linea_respuesta_local(linea, texto, formato):
+    """Línea de salida en el formato del proveedor imitado, con el uso estimado en tokens."""
+    tokens_prompt, tokens_respuesta = len(texto_de_peticion(linea)) // 4, len(texto) // 4
+    if formato == "openai":
+        return {"id": f"respuesta-{linea['custom_id']}", "custom_id": linea["custom_id"], "error": None, "response": {
+            "status_code": 200, "body": {
+                "model": linea["body"].get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": texto}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": tokens_prompt, "completion_tokens": tokens_respuesta}
+            }
+        }}
+    return {"key": linea["key"], "response": {
+        "candidates": [{"content": {"role": "model", "parts": [{"text": texto}]}, "finishReason": "STOP"}],
+        "usageMetadata": {"promptTokenCount": tokens_prompt, "candidatesTokenCount": tokens_respuesta}
+    }}
+
+def resolver_lotes_locales(directorio, responder):
+    """
+    Responde los lotes pendientes de un ClienteLotesLocal: `responder(modelo, prompt)` devuelve el
+    texto de cada petición. Devuelve cuántos lotes resolvió.
+    """
+    resueltos = 0
+    for id_lote in sorted(os.listdir(directorio)) if os.path.isdir(directorio) else []:
+        ruta_lote = os.path.join(directorio, id_lote)
+        if not os.path.exists(os.path.join(ruta_lote, "entrada.jsonl")) or os.path.exists(os.path.join(ruta_lote, "salida.jsonl")):
+            continue
+        with open(os.path.join(ruta_lote, "modelo.json"), encoding="utf-8") as archivo:
+            datos_lote = json.load(archivo)
+        with open(os.path.join(ruta_lote, "entrada.jsonl"), encoding="utf-8") as archivo:
+            lineas = [json.loads(linea) for linea in archivo if linea.strip()]
+        salida = [linea_respuesta_local(linea, responder(datos_lote["modelo"], texto_de_peticion(linea)), datos_lote["formato"])
+                  for linea in lineas]
+        with open(os.path.join(ruta_lote, "salida.jsonl.tmp"), "wb") as archivo:
+            archivo.write(_jsonl(salida))
+        os.replace(os.path.join(ruta_lote, "salida.jsonl.tmp"), os.path.join(ruta_lote, "salida.jsonl"))
+        resueltos += 1
+    return resueltos
+
+# --- Agrupador: las llamadas de todas las filas activas salen en un mismo lote ---
+class _Espera:
+    def __init__(self, solicitud):
+        self.solicitud = solicitud
+        self.evento = threading.Event()
+        self.resultado = None
+
+class AgrupadorLotesProveedor:
+    """
+    Reúne las llamadas de las filas que participan en el lote (`participante()`) y las envía por
+    la API de lotes del proveedor cuando todas esperan respuesta y no llegan peticiones nuevas
+    durante `ventana_agrupacion_s`. `clientes` asocia cada tipo de modelo ("GPT", "Gemini") con
+    su cliente de lotes. Se usa a través de `ConfiguracionLLM.lote`.
+    """
+    def __init__(self, clientes, ruta_registro=RUTA_REGISTRO_LOTES, intervalo_sondeo_s=INTERVALO_SONDEO_SEGUNDOS,
+                 ventana_agrupacion_s=VENTANA_AGRUPACION_SEGUNDOS, max_solicitudes_por_lote=MAX_SOLICITUDES_POR_LOTE):
+        self.clientes = clientes
+        self.intervalo_sondeo_s = intervalo_sondeo_s
+        self.ventana_agrupacion_s = ventana_agrupacion_s
+        self.max_solicitudes_por_lote = max_solicitudes_por_lote
+        self.lotes_enviados = 0
+        self._cond = threading.Condition()
+        self._activos = 0
+        self._pendientes = []
+        self._ultima_llegada = 0.0
+        self._coordinador = None
+        directorio = os.path.dirname(ruta_registro)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self._lock_registro = threading.Lock()
+        self._conn = sqlite3.connect(ruta_registro, check_same_thread=False, timeout=30)
+        with self._lock_registro, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS solicitudes_enviadas (
+                    huella TEXT PRIMARY KEY,
+                    model_type TEXT NOT NULL,
+                    id_lote TEXT NOT NULL,
+                    enviada REAL NOT NULL
+                )
+            """)
+
+    @contextmanager
+    def participante(self):
+        """Marca al hilo de una fila como participante: el lote no sale mientras la fila trabaja sin esperar."""
+        with self._cond:
+            self._activos += 1
+        try:
+            yield self
+        finally:
+            with self._cond:
+                self._activos -= 1
+                self._cond.notify_all()
+
+    def solicitar(self, model_type, model_name, prompt, prefijo=None, esquema_json=None, max_tokens=2000):
+        """Encola la llamada y bloquea hasta que su lote termina; devuelve un ResultadoLote."""
+        espera = _Espera(SolicitudLote(model_type, model_name, prompt, prefijo, esquema_json, max_tokens))
+        with self._cond:
+            if model_type not in self.clientes:
+                return ResultadoLote(error=f"No hay cliente de lotes para {model_type}.")
+            self._pendientes.append(espera)
+            self._ultima_llegada = time.monotonic()
+            if self._coordinador is None:
+                self._coordinador = threading.Thread(target=self._coordinar, name="sumon-lotes", daemon=True)
+                self._coordinador.start()
+            self._cond.notify_all()
+        espera.evento.wait()
+        return espera.resultado
+
+    def _ronda_lista(self):
+        if not self._pendientes or len(self._pendientes) < self._activos:
+            return False
+        return time.monotonic() - self._ultima_llegada >= self.ventana_agrupacion_s
+
+    def _coordinar(self):
+        while True:
+            with self._cond:
+                while not self._ronda_lista():
+                    self._cond.wait(timeout=self.ventana_agrupacion_s / 2 or 0.05)
+                ronda, self._pendientes = self._pendientes, []
+            try:
+                self._procesar_ronda(ronda)
+            except Exception as e:
+                logger.exception("Falló el envío de una ronda de lotes al proveedor.")
+                for espera in ronda:
+                    if not espera.evento.is_set():
+                        espera.resultado = ResultadoLote(error=f"{type(e).__name__}: {e}")
+                        espera.evento.set()
+
+    def _procesar_ronda(self, ronda):
+        """Envía (o retoma) un lote por modelo, sondea hasta que terminan y reparte los resultados."""
+        por_huella = {}
+        for espera in ronda:
+            por_huella.setdefault(espera.solicitud.huella, []).append(espera)
+        with self._lock_registro:
+            ya_enviadas = dict(self._conn.execute(
+                f"SELECT huella, id_lote FROM solicitudes_enviadas WHERE huella IN ({','.join('?' * len(por_huella))})",
+                list(por_huella)
+            ).fetchall())
+        lotes = {} # id_lote → (model_type, huellas)
+        por_modelo = {}
+        for huella, esperas in por_huella.items():
+            solicitud = esperas[0].solicitud
+            if huella in ya_enviadas:
+                lotes.setdefault(ya_enviadas[huella], (solicitud.model_type, set()))[1].add(huella)
+            else:
+                por_modelo.setdefault((solicitud.model_type, solicitud.model_name), []).append(solicitud)
+        if ya_enviadas:
+            logger.info("Se retoman %d peticiones de %d lotes enviados antes.", len(ya_enviadas), len(set(ya_enviadas.values())))
+
+        for (model_type, model_name), solicitudes in por_modelo.items():
+            cliente = self.clientes[model_type]
+            serializar, _ = FORMATOS_LOTE[cliente.formato]
+            for inicio in range(0, len(solicitudes), self.max_solicitudes_por_lote):
+                tramo = solicitudes[inicio:inicio + self.max_solicitudes_por_lote]
+                id_lote = cliente.enviar(model_name, [serializar(solicitud) for solicitud in tramo],
+                                         descripcion=f"sumon: {len(tramo)} peticiones a {model_name}")
+                self.lotes_enviados += 1
+                logger.info("Lote %s enviado a %s (%s) con %d peticiones.", id_lote, model_type, model_name, len(tramo))
+                with self._lock_registro, self._conn:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO solicitudes_enviadas (huella, model_type, id_lote, enviada) VALUES (?, ?, ?, ?)",
+                        [(solicitud.huella, model_type, id_lote, time.time()) for solicitud in tramo]
+                    )
+                lotes[id_lote] = (model_type, {solicitud.huella for solicitud in tramo})
+
+        pendientes = dict(lotes)
+        while pendientes:
+            for id_lote, (model_type, huellas) in list(pendientes.items()):
+                cliente = self.clientes[model_type]
+                estado = cliente.consultar(id_lote)
+                if estado == ESTADO_EN_PROCESO:
+                    continue
+                del pendientes[id_lote]
+                resultados = {}
+                if estado == ESTADO_TERMINADO:
+                    _, interpretar = FORMATOS_LOTE[cliente.formato]
+                    resultados = dict(interpretar(linea) for linea in cliente.descargar(id_lote))
+                logger.info("Lote %s %s: %d de %d respuestas.", id_lote, estado, len(resultados), len(huellas))
+                for huella in huellas:
+                    resultado = resultados.get(huella) or ResultadoLote(error=f"El lote {id_lote} terminó sin respuesta para esta petición ({estado}).")
+                    resultado.id_lote = id_lote
+                    for espera in por_huella[huella]:
+                        espera.resultado = resultado
+                        espera.evento.set()
+                with self._lock_registro, self._conn:
+                    self._conn.executemany("DELETE FROM solicitudes_enviadas WHERE huella = ?", [(huella,) for huella in huellas])
+            if pendientes:
+                time.sleep(self.intervalo_sondeo_s)
+
+def clientes_lotes(configuracion, directorio_local=None):
+    """Cliente de lotes por tipo de modelo: el del proveedor real o, con `directorio_local`, el simulado con archivos."""
+    if directorio_local:
+        return {"GPT": ClienteLotesLocal(os.path.join(directorio_local, "openai"), "openai"),
+                "Gemini": ClienteLotesLocal(os.path.join(directorio_local, "gemini"), "gemini")}
+    clientes = {}
+    if configuracion.openai_ok:
+        clientes["GPT"] = ClienteLotesOpenAI(configuracion.openai_api_key)
+    if configuracion.gemini_ok:
+        clientes["Gemini"] = ClienteLotesGemini(configuracion.gemini_api_key)
+    return clientes
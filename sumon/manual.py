@@ -0,0 +1,149 @@
+"""
+Índice de recuperación (BM25, sin red) sobre el texto del manual de reglas: en cada prompt se
+envían solo las secciones relevantes para la fila, con la página de origen.
+"""
+import functools
+import hashlib
+import math
+import re
+from collections import Counter
+
+from sumon import extraccion_pdf
+from sumon.comun import estimar_tokens, quitar_tildes
+
+# --- Índice de recuperación sobre el manual de reglas ---
+MANUAL_TOP_K = 6 # Secciones del manual que se incluyen en cada prompt
+MANUAL_PRESUPUESTO_TOKENS = 3000 # Tope de tokens del manual por prompt
+MANUAL_MAX_CARACTERES_SECCION = 1200
+MANUAL_MAX_CARACTERES_COMPLETO = 15000 # Recorte del manual cuando va completo en el prompt (sin índice)
+# Vocabulario general de construcción de ítems; las reglas generales aplican a cualquier fila
+CONSULTA_BASE_MANUAL = "construcción ítem enunciado opciones distractores justificación respuesta correcta"
+STOPWORDS_ES = {
+    "a", "al", "ante", "con", "como", "cual", "de", "del", "desde", "donde", "el", "en", "entre", "es", "esta",
+    "este", "esto", "la", "las", "lo", "los", "mas", "o", "para", "pero", "por", "que", "se", "si", "sin",
+    "sobre", "su", "sus", "un", "una", "uno", "unos", "unas", "y", "e", "ni", "ser", "son", "no", "le", "les"
+}
+
+def _tokenizar_para_indice(texto):
+    # Minúsculas y sin tildes, para que "Área" y "area" coincidan
+    texto = quitar_tildes(str(texto).lower())
+    return [t for t in re.findall(r"[a-z0-9]+", texto) if len(t) > 1 and t not in STOPWORDS_ES]
+
+def dividir_manual_en_secciones(texto, max_caracteres=MANUAL_MAX_CARACTERES_SECCION):
+    """
+    Divide el texto del manual en secciones de hasta `max_caracteres`, respetando los saltos de
+    línea para no cortar reglas a la mitad y sin cruzar saltos de página.
+    Returns: lista de tuplas (número de página, texto de la sección).
+    """
+    secciones = []
+    for num_pagina, texto_pagina in enumerate(texto.split(extraccion_pdf.SEPARADOR_PAGINAS), start=1):
+        actual = []
+        longitud_actual = 0
+        for linea in texto_pagina.splitlines():
+            linea = linea.strip()
+            if not linea:
+                continue
+            if actual and longitud_actual + len(linea) + 1 > max_caracteres:
+                secciones.append((num_pagina, "\n".join(actual)))
+                actual, longitud_actual = [], 0
+            actual.append(linea)
+            longitud_actual += len(linea) + 1
+        if actual:
+            secciones.append((num_pagina, "\n".join(actual)))
+    return secciones
+
+class IndiceManual:
+    """
+    Índice BM25 local (sin red) sobre las secciones del manual de reglas. Permite enviar en
+    cada prompt solo las secciones relevantes para la fila en lugar del manual truncado.
+    """
+    def __init__(self, texto, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        secciones_con_pagina = dividir_manual_en_secciones(texto)
+        self.paginas = [num_pagina for num_pagina, _ in secciones_con_pagina]
+        self.secciones = [seccion for _, seccion in secciones_con_pagina]
+        self._frecuencias = [Counter(_tokenizar_para_indice(seccion)) for seccion in self.secciones]
+        self._longitudes = [sum(frecuencias.values()) for frecuencias in self._frecuencias]
+        self._longitud_media = (sum(self._longitudes) / len(self._longitudes)) if self._longitudes else 0.0
+        documentos_por_termino = Counter()
+        for frecuencias in self._frecuencias:
+            documentos_por_termino.update(frecuencias.keys())
+        total = len(self.secciones)
+        self._idf = {
+            termino: math.log(1 + (total - n + 0.5) / (n + 0.5))
+            for termino, n in documentos_por_termino.items()
+        }
+
+    def buscar(self, consulta, top_k=MANUAL_TOP_K):
+        """Devuelve [(indice_seccion, puntaje)] ordenado de mayor a menor relevancia."""
+        terminos = set(_tokenizar_para_indice(consulta))
+        puntajes = []
+        for indice, frecuencias in enumerate(self._frecuencias):
+            puntaje = 0.0
+            normalizacion = self.k1 * (1 - self.b + self.b * self._longitudes[indice] / (self._longitud_media or 1))
+            for termino in terminos:
+                tf = frecuencias.get(termino)
+                if tf:
+                    puntaje += self._idf[termino] * tf * (self.k1 + 1) / (tf + normalizacion)
+            if puntaje > 0:
+                puntajes.append((indice, puntaje))
+        puntajes.sort(key=lambda par: par[1], reverse=True)
+        return puntajes[:top_k]
+
+    def seleccionar_secciones(self, consulta, top_k=MANUAL_TOP_K, presupuesto_tokens=MANUAL_PRESUPUESTO_TOKENS):
+        """
+        Concatena las secciones más relevantes para `consulta` sin superar `presupuesto_tokens`,
+        en el orden en que aparecen en el manual, indicando la página de cada una.
+        """
+        elegidas = []
+        tokens_usados = 0
+        for indice, _ in self.buscar(consulta, top_k=top_k):
+            tokens_seccion = estimar_tokens(self.secciones[indice])
+            if tokens_usados + tokens_seccion > presupuesto_tokens:
+                continue
+            elegidas.append(indice)
+            tokens_usados += tokens_seccion
+        return "\n\n".join(f"[Manual, pág. {self.paginas[indice]}]\n{self.secciones[indice]}" for indice in sorted(elegidas))
+
+@functools.lru_cache(maxsize=8) # El índice se construye una sola vez por texto de manual
+def construir_indice_manual(texto_manual):
+    return IndiceManual(texto_manual)
+
+def _es_nulo(valor):
+    return valor is None or (isinstance(valor, float) and math.isnan(valor))
+
+def consulta_manual_para_fila(fila_datos):
+    campos = [fila_datos.get(columna, "") for columna in ("ÁREA", "ASIGNATURA", "NANOHABILIDAD", "PROCESO COGNITIVO")]
+    return " ".join([CONSULTA_BASE_MANUAL] + [str(campo) for campo in campos if not _es_nulo(campo)])
+
+def leer_texto_manual(datos_pdf):
+    """Texto completo del manual en PDF, con las páginas separadas por `extraccion_pdf.SEPARADOR_PAGINAS`."""
+    return extraccion_pdf.SEPARADOR_PAGINAS.join(extraccion_pdf.leer_paginas_pdf_con_cache(datos_pdf))
+
+def parametros_manual(texto_manual, max_caracteres=None):
+    """
+    Lo que se guarda del manual con un trabajo para reanudarlo igual: la huella del texto leído
+    (antes de recortarlo) y el recorte con que va completo en el prompt (None si se envían solo las
+    secciones relevantes). None si no hay manual.
+    """
+    if not texto_manual:
+        return None
+    return {"huella": hashlib.sha256(texto_manual.encode("utf-8")).hexdigest()[:16], "max_caracteres": max_caracteres}
+
+def diferencia_manual(guardado, actual):
+    """
+    Por qué el manual `actual` no es el `guardado` con el trabajo (ambos de `parametros_manual`);
+    None si coinciden.
+    """
+    if guardado == actual:
+        return None
+    if guardado is None:
+        return "el trabajo se creó sin manual de reglas"
+    if actual is None:
+        return "el trabajo se creó con un manual de reglas y no se cargó ninguno"
+    if guardado["huella"] != actual["huella"]:
+        return "el manual cargado no es el mismo con que se creó el trabajo"
+    if guardado["max_caracteres"] is None:
+        return "el trabajo se creó enviando solo las secciones relevantes del manual"
+    return f"el trabajo se creó enviando el manual completo (recortado a {guardado['max_caracteres']} caracteres)"
@@ -0,0 +1,116 @@
+"""
+Registro en memoria de cada llamada a un LLM (latencia, TTFT, tokens, costo, caché, errores), de
+cada ítem procesado y de cada auditoría en cascada (dictamen del auditor rápido frente al del
+auditor fuerte), con resúmenes para la vista de métricas y el benchmark.
+"""
+import threading
+from collections import deque
+
+import pandas as pd
+
+from sumon.comun import instancia_por_proceso
+
+# Precio aproximado en USD por millón de tokens (entrada, salida); actualízalo según la tarifa vigente
+PRECIOS_POR_MILLON_TOKENS = {
+    "gemini-1.5-flash": (0.075, 0.30),
+    "gemini-1.5-pro": (1.25, 5.00),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4-turbo": (10.00, 30.00),
+    "gpt-3.5-turbo": (0.50, 1.50),
+}
+# Fracción del precio de entrada que se cobra por los tokens servidos desde la caché de prefijos
+FRACCION_PRECIO_TOKENS_CACHEADOS = {"gpt": 0.5, "gemini": 0.25}
+FRACCION_PRECIO_LOTE = 0.5 # Descuento de las API de lotes (OpenAI Batch y modo por lotes de Gemini)
+MAX_REGISTROS_METRICAS = 20000
+
+def estimar_costo_usd(model_name, tokens_prompt, tokens_respuesta, tokens_cacheados=0, en_lote=False):
+    precio_entrada, precio_salida = PRECIOS_POR_MILLON_TOKENS.get(model_name, (0.0, 0.0))
+    fraccion_cacheados = FRACCION_PRECIO_TOKENS_CACHEADOS.get(model_name.split("-")[0], 1.0)
+    tokens_entrada = tokens_prompt - tokens_cacheados + tokens_cacheados * fraccion_cacheados
+    costo = (tokens_entrada * precio_entrada + tokens_respuesta * precio_salida) / 1_000_000
+    return costo * FRACCION_PRECIO_LOTE if en_lote else costo
+
+class RegistroMetricas:
+    """
+    Registros estructurados de cada llamada a un LLM, de cada ítem procesado y de cada auditoría
+    en cascada, compartidos por todo el proceso. Se conservan los últimos MAX_REGISTROS_METRICAS
+    de cada tipo.
+    """
+    def __init__(self, max_registros=MAX_REGISTROS_METRICAS):
+        self._lock = threading.Lock()
+        self._llamadas = deque(maxlen=max_registros)
+        self._items = deque(maxlen=max_registros)
+        self._cascada = deque(maxlen=max_registros)
+
+    def registrar_llamada(self, registro):
+        with self._lock:
+            self._llamadas.append(registro)
+
+    def registrar_item(self, registro):
+        with self._lock:
+            self._items.append(registro)
+
+    def registrar_cascada(self, registro):
+        with self._lock:
+            self._cascada.append(registro)
+
+    def llamadas_df(self):
+        with self._lock:
+            return pd.DataFrame(list(self._llamadas))
+
+    def items_df(self):
+        with self._lock:
+            return pd.DataFrame(list(self._items))
+
+    def cascada_df(self):
+        with self._lock:
+            return pd.DataFrame(list(self._cascada))
+
+    def vaciar(self):
+        with self._lock:
+            self._llamadas.clear()
+            self._items.clear()
+            self._cascada.clear()
+
+@instancia_por_proceso
+def obtener_registro_metricas():
+    return RegistroMetricas()
+
+def resumen_metricas_por_modelo(df_llamadas):
+    """p50/p95 de latencia y TTFT, tokens (y fracción del prompt servida por la caché de prefijos), costo y tasa de caché por proveedor y modelo."""
+    if df_llamadas.empty:
+        return df_llamadas
+    agrupado = df_llamadas.groupby(["model_type", "model_name"])
+    resumen = pd.DataFrame({
+        "llamadas": agrupado.size(),
+        "latencia_p50_s": agrupado["latencia_s"].quantile(0.50),
+        "latencia_p95_s": agrupado["latencia_s"].quantile(0.95),
+        "ttft_p50_s": agrupado["ttft_s"].quantile(0.50),
+        "ttft_p95_s": agrupado["ttft_s"].quantile(0.95),
+        "tokens_prompt": agrupado["tokens_prompt"].sum(),
+        "tokens_respuesta": agrupado["tokens_respuesta"].sum(),
+        "tokens_cacheados": agrupado["tokens_cacheados"].sum(),
+        "costo_usd": agrupado["costo_usd"].sum(),
+        "aciertos_cache": agrupado["desde_cache"].mean(),
+        "errores": agrupado["error"].apply(lambda errores: int(errores.notna().sum())),
+    })
+    resumen["fraccion_prompt_cacheada"] = (resumen["tokens_cacheados"] / resumen["tokens_prompt"].where(resumen["tokens_prompt"] > 0)).fillna(0.0)
+    return resumen.round(4).reset_index()
+
+def resumen_cascada(df_cascada):
+    """
+    Por par de auditores y dictamen del auditor rápido: auditorías, fracción escalada al auditor
+    fuerte y concordancia entre ambos cuando los dos dictaminaron. Una concordancia alta en los
+    dictámenes que se aceptan sin escalar (medida con la verificación por muestreo) indica que la
+    cascada puede confiar en ellos; una baja, que conviene escalarlos.
+    """
+    if df_cascada.empty:
+        return df_cascada
+    agrupado = df_cascada.groupby(["modelo_rapido", "modelo_fuerte", "dictamen_rapido"])
+    resumen = pd.DataFrame({
+        "auditorias": agrupado.size(),
+        "fraccion_escalada": agrupado["escalada"].mean(),
+        "comparadas": agrupado["concuerda"].apply(lambda concuerda: int(concuerda.notna().sum())),
+        "concordancia": agrupado["concuerda"].apply(lambda concuerda: concuerda.dropna().astype(float).mean()),
+    })
+    return resumen.round(4).reset_index()
@@ -0,0 +1,1090 @@
+"""
+Flujo de generación de ítems: generación con el modelo elegido, pre-auditoría local, auditoría
+con LLM y refinamiento hasta la aprobación, para una fila o para un lote en paralelo.
+
+El progreso se informa con `al_progresar(EventoProgreso)` en lugar de escribir en la página;
+la interfaz de Streamlit y la línea de comandos deciden cómo mostrarlo.
+"""
+import random
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+
+from sumon.comun import estimar_tokens
+from sumon.duplicados import FirmasRonda
+from sumon.enrutamiento import PoliticaEnrutamiento
+from sumon.items import (
+    ESQUEMA_AUDITORIA_JSON, ESQUEMA_ITEM_JSON, INSTRUCCIONES_SALIDA_JSON_AUDITORIA, INSTRUCCIONES_SALIDA_JSON_ITEM,
+    construir_prompt_reparacion, extraer_criterios_fallidos, get_descripcion_bloom, parsear_auditoria_json,
+    parsear_item_json, preauditar_item
+)
+from sumon.llm import (
+    SECCIONES_AUDITORIA, SECCIONES_ITEM, ConfiguracionLLM, ContadorLlamadas, SalidaFueraDeFormato,
+    crear_validador_formato, generar_texto_con_llm
+)
+from sumon.manual import MANUAL_PRESUPUESTO_TOKENS, MANUAL_TOP_K, construir_indice_manual, consulta_manual_para_fila
+from sumon.metricas import obtener_registro_metricas
+
+# --- Eventos de progreso ---
+@dataclass
+class EventoProgreso:
+    """
+    Aviso emitido por el flujo de generación. Tipos:
+    - "info", "nota", "advertencia", "error", "exito": mensajes para el usuario (`mensaje`).
+    - "etapa": empieza una llamada al modelo (`datos["etapa"]` es "generación" o "auditoría").
+    - "fin_etapa": terminó esa llamada.
+    - "texto_parcial": texto acumulado en streaming (`datos["texto"]`, `datos["etapa"]`).
+    - "item": ítem generado en el intento (`datos`: item_text, grafico_necesario, descripcion_grafico).
+    - "auditoria": resultado de la auditoría en texto (`datos["texto"]`).
+    - "detalle": texto en Markdown complementario al último mensaje.
+    """
+    tipo: str
+    mensaje: str = ""
+    intento: int = 0
+    datos: dict = field(default_factory=dict)
+
+# --- Candidatos de una ronda de generación ---
+@dataclass
+class ResultadoCandidato:
+    """
+    Resultado de generar, pre-auditar y auditar un candidato en un intento. `registrar_item` indica
+    que el candidato llegó a ser un ítem evaluable (pre-auditado o auditado); `fatal`, que el
+    proveedor no respondió y no tiene sentido seguir refinando; `error`, una excepción inesperada.
+    """
+    item_text: str = ""
+    grafico_necesario: str = "NO"
+    descripcion_grafico: str = ""
+    estado: str = "❌ RECHAZADO"
+    observaciones: str = ""
+    criterios_fallidos: list = field(default_factory=list)
+    criterios_auditoria: list = field(default_factory=list)
+    auditoria_texto: str = None # None si el candidato no llegó a la auditoría
+    item_completo: bool = False
+    registrar_item: bool = False
+    auditado: bool = False
+    fatal: bool = False
+    error: Exception = None
+    candidato: int = None
+
+def _puntaje_candidato(resultado):
+    """Orden de preferencia entre candidatos: aprobado, parcial, auditado, pre-auditado, inválido, error."""
+    if resultado.error is not None or resultado.fatal:
+        nivel = -1
+    elif resultado.estado == "✅ CUMPLE TOTALMENTE":
+        nivel = 4
+    elif resultado.auditado:
+        nivel = 3 if "PARCIALMENTE" in resultado.estado else 2
+    else:
+        nivel = 1 if resultado.registrar_item else 0
+    return nivel, -len(resultado.criterios_fallidos)
+
+INSTRUCCIONES_VARIANTE_CANDIDATO = """
+            --- VARIANTE {candidato} DE {total} ---
+            Se están construyendo {total} versiones independientes de este ítem. Redacta la versión {candidato} con una situación, unos datos y unos distractores propios.
+"""
+CANDIDATOS_POR_RONDA = 1 # Candidatos generados en paralelo en cada intento (1 = refinamiento secuencial)
+DICTAMEN_CASI_DUPLICADO = "❌ RECHAZADO (casi duplicado)"
+FRACCION_VERIFICACION_CASCADA = 0.1 # Rechazos claros del auditor rápido que se verifican igual con el fuerte
+
+# --- Auditoría en cascada ---
+@dataclass
+class DictamenAuditoria:
+    """Auditoría ya interpretada de un auditor; `texto` es None si el auditor no respondió."""
+    texto: str = None
+    estado: str = "❌ RECHAZADO"
+    criterios_fallidos: list = field(default_factory=list)
+    criterios_auditoria: list = field(default_factory=list)
+    observaciones: str = ""
+
+def categoria_dictamen(estado):
+    """"aprobado", "parcial" o "rechazado" según el dictamen; None si no se pudo extraer."""
+    if estado.startswith("✅"):
+        return "aprobado"
+    if "PARCIALMENTE" in estado:
+        return "parcial"
+    if "no se pudo extraer" in estado:
+        return None
+    return "rechazado"
+
+def motivo_para_escalar(dictamen_rapido, fraccion_verificacion=FRACCION_VERIFICACION_CASCADA):
+    """
+    Por qué el dictamen del auditor rápido debe confirmarse con el auditor fuerte, o None si se
+    acepta tal cual. Solo un rechazo claro (dictamen ❌ respaldado por algún criterio fallido) se
+    acepta: la aprobación final la da siempre el auditor fuerte. Una fracción de los rechazos
+    claros se escala igual para medir la concordancia entre ambos.
+    """
+    if dictamen_rapido.texto is None:
+        return "el auditor rápido no respondió"
+    categoria = categoria_dictamen(dictamen_rapido.estado)
+    if categoria is None:
+        return "dictamen no extraíble"
+    if categoria == "aprobado":
+        return "aprobación final"
+    if categoria == "parcial":
+        return "dictamen parcial"
+    if not dictamen_rapido.criterios_fallidos:
+        return "el dictamen no concuerda con los criterios"
+    if random.random() < fraccion_verificacion:
+        return "verificación por muestreo"
+    return None
+
+# --- Función para auditar el ítem generado ---
+def _bloque_manual_auditoria(manual_reglas_texto):
+    return f"""
+    --- MANUAL DE REGLAS ADICIONAL ---
+    Las siguientes reglas son de suma importancia para la calidad y pertinencia del ítem. Debes asegurar que el ítem cumple con todas ellas.
+    {manual_reglas_texto}
+    -----------------------------------
+"""
+
+def construir_prefijo_auditoria(manual_reglas_texto="", salida_estructurada=False):
+    """
+    Parte estable del prompt de auditoría (rol, criterios, manual y formato de salida): no depende
+    de la fila ni del ítem, de modo que es idéntica en todas las auditorías de un lote y el
+    proveedor puede servirla desde su caché de prefijos.
+    """
+    prefijo = f"""
+    Eres un experto en validación de ítems educativos, especializado en pruebas tipo ICFES y las directrices del equipo IMPROVE.
+    Tu tarea es AUDITAR RIGUROSAMENTE el ítem generado por un modelo de lenguaje que aparece al final, después de sus parámetros.
+
+    Debes verificar que el ítem cumpla con TODOS los siguientes criterios, prestando especial atención a la alineación con los parámetros proporcionados y a las reglas de formato y contenido.
+
+    --- CRITERIOS DE AUDITORÍA ---
+    1.  **Formato del Enunciado:** ¿El enunciado está formulado como pregunta clara y directa, sin ambigüedades ni errores?
+    2.  **Número de Opciones:** ¿Hay exactamente 3 opciones (A, B, C)?
+    3.  **Respuesta Correcta Indicada:** ¿La sección 'RESPUESTA CORRECTA:' está claramente indicada y coincide con una de las opciones?
+    4.  **Diseño de Justificaciones:**
+        * ¿Hay justificaciones bien diferenciadas para CADA opción (A, B, C)?
+        * ¿La justificación de la opción **correcta** explica el razonamiento, procedimiento o estrategia relevante (NO por descarte)?
+        * ¿Las justificaciones de las opciones **incorrectas** están redactadas siguiendo el formato: “El estudiante podría escoger la opción X porque… Sin embargo, esto es incorrecto porque…”?
+    5.  **Estilo y Restricciones:** ¿No se usan negaciones mal redactadas, nombres reales, marcas, lugares reales, datos personales o frases vagas como “ninguna de las anteriores” o “todas las anteriores”?
+    6.  **Alineación del Contenido:** ¿El ítem (contexto, enunciado, opciones) está alineado EXCLUSIVAMENTE con los elementos temáticos y cognitivos indicados en los PARÁMETROS DEL ÍTEM (grado, área, asignatura, estación, proceso cognitivo, nanohabilidad, microhabilidad, competencia y nivel educativo)?
+    7.  **Gráfico (si aplica):** Si el ítem indica que requiere un gráfico, ¿la descripción del gráfico es clara, detallada y funcional para su futura creación?
+"""
+    if manual_reglas_texto:
+        prefijo += _bloque_manual_auditoria(manual_reglas_texto)
+    prefijo += """
+    Devuelve tu auditoría con este formato estructurado:
+
+    VALIDACIÓN DE CRITERIOS:
+    - Formato del Enunciado: [✅ / ❌] + Comentario (si ❌)
+    - Número de Opciones (3): [✅ / ❌]
+    - Respuesta Correcta Indicada: [✅ / ❌]
+    - Diseño de Justificaciones: [✅ / ⚠️ / ❌] + Observaciones (si ⚠️/❌)
+    - Estilo y Restricciones: [✅ / ⚠️ / ❌] + Observaciones (si ⚠️/❌)
+    - Alineación del Contenido: [✅ / ❌] + Comentario (si ❌)
+    - Gráfico (si aplica): [✅ / ⚠️ / ❌] + Observaciones (si ⚠️/❌)
+
+    DICTAMEN FINAL:
+    [✅ CUMPLE TOTALMENTE / ⚠️ CUMPLE PARCIALMENTE / ❌ RECHAZADO]
+
+    OBSERVACIONES FINALES:
+    [Explica de forma concisa qué aspectos necesitan mejora, si el dictamen no es ✅. Si es ✅, puedes indicar "El ítem cumple con todos los criterios."]
+"""
+    if salida_estructurada:
+        prefijo += INSTRUCCIONES_SALIDA_JSON_AUDITORIA
+    return prefijo
+
+def auditar_item_con_llm(model_type, model_name, item_generado, grado, area, asignatura, estacion, 
+                         proceso_cognitivo, nanohabilidad, microhabilidad, 
+                         competencia_nanohabilidad, contexto_educativo, manual_reglas_texto="", descripcion_bloom="", grafico_necesario="", descripcion_grafico="",
+                         al_recibir_texto=None, validar_parcial=None, salida_estructurada=False, contexto_metricas=None,
+                         configuracion=None, manual_en_prefijo=True, enrutamiento=None, contador_llamadas=None):
+    """
+    Audita un ítem generado para verificar su cumplimiento con criterios específicos.
+    `al_recibir_texto` y `validar_parcial` se pasan a `generar_texto_con_llm` para el modo streaming.
+    Con `salida_estructurada`, la auditoría se pide como JSON según ESQUEMA_AUDITORIA_JSON.
+    El prompt se envía como prefijo estable (`construir_prefijo_auditoria`) más los parámetros y
+    el ítem; con `manual_en_prefijo=False` (secciones del manual elegidas para cada fila), el
+    manual va en la parte variable. `enrutamiento` (PoliticaEnrutamiento) y `contador_llamadas` se
+    pasan a `generar_texto_con_llm`.
+    """
+    prefijo = construir_prefijo_auditoria(manual_reglas_texto if manual_en_prefijo else "", salida_estructurada)
+    auditoria_prompt = f"""
+    --- PARÁMETROS DEL ÍTEM ---
+        * Grado: {grado}
+        * Área: {area}
+        * Asignatura: {asignatura}
+        * Estación o unidad temática: {estacion}
+        * Proceso Cognitivo (Taxonomía de Bloom): {proceso_cognitivo} (su descripción es "{descripcion_bloom}")
+        * Nanohabilidad (foco principal): {nanohabilidad}
+        * Microhabilidad (evidencia de aprendizaje): {microhabilidad}
+        * Competencia (asociada a Nanohabilidad): {competencia_nanohabilidad}
+        * Nivel educativo del estudiante: {contexto_educativo}
+        * Gráfico Necesario: {grafico_necesario}
+        * Descripción del Gráfico: {descripcion_grafico if grafico_necesario == 'SÍ' else 'N/A'}
+"""
+    if manual_reglas_texto and not manual_en_prefijo:
+        auditoria_prompt += _bloque_manual_auditoria(manual_reglas_texto)
+    auditoria_prompt += f"""
+    ÍTEM A AUDITAR:
+    --------------------
+    {item_generado}
+    --------------------
+    """
+    esquema_json = ("auditoria_item", ESQUEMA_AUDITORIA_JSON) if salida_estructurada else None
+    return generar_texto_con_llm(model_type, model_name, auditoria_prompt,
+                                 al_recibir_texto=al_recibir_texto, validar_parcial=validar_parcial,
+                                 esquema_json=esquema_json, contexto_metricas=contexto_metricas,
+                                 configuracion=configuracion, prefijo=prefijo, enrutamiento=enrutamiento,
+                                 contador_llamadas=contador_llamadas)
+
+# --- Función para generar preguntas usando el modelo de generación seleccionado ---
+def _bloque_manual_generacion(manual_reglas_texto):
+    return f"""
+            --- REGLAS ADICIONALES DEL MANUAL DE CONSTRUCCIÓN ---
+            Considera y aplica estrictamente todas las directrices, ejemplos y restricciones contenidas en el siguiente manual.
+            Esto es de suma importancia para la calidad y pertinencia del ítem.
+
+            Manual de Reglas:
+            {manual_reglas_texto}
+            ----------------------------------------------------
+"""
+
+def construir_prefijo_generacion(tipo_pregunta, formato_justificacion, manual_reglas_texto="",
+                                 informacion_adicional_usuario="", salida_estructurada=False):
+    """
+    Parte estable del prompt de generación (rol, reglas de construcción, manual, información del
+    usuario y formato de salida). Depende solo de los criterios del lote, no de la fila, de modo
+    que es idéntica byte a byte en todos los ítems y el proveedor puede servirla desde su caché de
+    prefijos; los parámetros de la fila y la retroalimentación van después.
+    """
+    prefijo = f"""
+            Eres un diseñador experto en ítems de evaluación educativa, especializado en pruebas tipo ICFES u otras de alta calidad técnica.
+
+            Tu tarea es construir un ítem de {tipo_pregunta} con una única respuesta correcta, cumpliendo rigurosamente las reglas de construcción de ítems y alineado con el marco cognitivo de la Taxonomía de Bloom.
+            Los parámetros del ítem (grado, área, asignatura, estación, proceso cognitivo, nanohabilidad, nivel y dificultad) se indican al final, después de estas instrucciones.
+
+            --- INSTRUCCIONES PARA LA CONSTRUCCIÓN DEL ÍTEM ---
+            CONTEXTO DEL ÍTEM:
+            - Incluye una situación contextualizada, relevante y plausible para el grado y área indicados.
+            - La temática debe ser la de la estación o unidad temática indicada, y esto debe ser central, no una mera contextualización.
+            - La situación debe ser funcional: debe activar el pensamiento requerido por la nanohabilidad.
+            - Debe garantizarse que el proceso cognitivo corresponde fielmente a la descripción de la taxonomia de Bloom.
+            - Evita referencias a marcas, nombres propios, lugares reales o información personal identificable.
+
+            ENUNCIADO:
+            - Formula una pregunta clara, directa, sin ambigüedades ni tecnicismos innecesarios.
+            - Si utilizas negaciones, resáltalas en MAYÚSCULAS Y NEGRITA (por ejemplo: **NO ES**, **EXCEPTO**).
+            - Asegúrate de que el enunciado refleje el tipo de tarea cognitiva esperado según el proceso de Bloom.
+
+            OPCIONES DE RESPUESTA:
+            - Escribe exactamente tres opciones (A, B y C).
+            - Solo una opción debe ser correcta.
+            - Los distractores (respuestas incorrectas) deben estar bien diseñados: deben ser creíbles, funcionales y representar errores comunes o concepciones alternativas frecuentes.
+            - No utilices fórmulas vagas como “ninguna de las anteriores” o “todas las anteriores”.
+
+            JUSTIFICACIONES:
+            {formato_justificacion}
+"""
+    if manual_reglas_texto:
+        prefijo += _bloque_manual_generacion(manual_reglas_texto)
+    prefijo += f"""
+            --- INFORMACIÓN ADICIONAL PROPORCIONADA POR EL USUARIO ---
+            {informacion_adicional_usuario if informacion_adicional_usuario else "No se proporcionó información adicional."}
+            ----------------------------------------------------------
+
+            --- INSTRUCCIONES ESPECÍFICAS DE SALIDA PARA GRÁFICO ---
+            Después del bloque de JUSTIFICACIONES, incluye la siguiente información para indicar si el ítem necesita un gráfico y cómo sería:
+            GRAFICO_NECESARIO: [SÍ/NO]
+            DESCRIPCION_GRAFICO: [Si GRAFICO_NECESARIO es SÍ, proporciona una descripción MUY DETALLADA del gráfico. Incluye: tipo de gráfico (ej. barras, líneas, circular, diagrama de flujo, imagen de un objeto), datos o rangos de valores, etiquetas de ejes, elementos clave, propósito del gráfico y cómo se relaciona con la pregunta. Si es NO, escribe N/A.]
+
+            --- FORMATO ESPERADO DE SALIDA ---
+            PREGUNTA: [Redacta aquí el enunciado de la pregunta]
+            A. [Opción A]  
+            B. [Opción B]  
+            C. [Opción C]  
+            RESPUESTA CORRECTA: [Letra de la opción correcta, por ejemplo: B]
+            JUSTIFICACIONES:  
+            A. [Explica por qué A es incorrecta o correcta]  
+            B. [Explica por qué B es incorrecta o correcta]  
+            C. [Explica por qué C es incorrecta o correcta]  
+            GRAFICO_NECESARIO: [SÍ/NO]
+            DESCRIPCION_GRAFICO: [Descripción detallada o N/A]
+"""
+    if salida_estructurada:
+        prefijo += INSTRUCCIONES_SALIDA_JSON_ITEM
+    return prefijo
+
+def generar_pregunta_con_seleccion(gen_model_type, gen_model_name, audit_model_type, audit_model_name, 
+                                 fila_datos, criterios_generacion, manual_reglas_texto="", informacion_adicional_usuario="",
+                                 al_progresar=None, indice_manual=None, configuracion=None, punto_control=None,
+                                 banco_items=None, indice_duplicados=None):
+    """
+    Genera una pregunta educativa de opción múltiple usando el modelo de generación seleccionado
+    y la itera para refinarla si la auditoría lo requiere.
+    `al_progresar(evento)` recibe un EventoProgreso por cada paso; sin él, el flujo es silencioso.
+    `configuracion` (ConfiguracionLLM) aporta API keys, caché y streaming; por defecto, el entorno.
+    Si se entrega `indice_manual`, el manual que reciben los prompts se reemplaza por las
+    secciones más relevantes para la fila, dentro del presupuesto de tokens configurado.
+    Con `criterios_generacion["refinamiento_compacto"]` (activo por defecto), los reintentos usan
+    un prompt de reparación con solo los criterios fallidos en lugar del prompt completo.
+    `punto_control` (p. ej. `AlmacenTrabajos.punto_control`) guarda el estado del refinamiento al
+    terminar cada intento; si ya tiene un estado guardado, el ítem continúa desde ese intento sin
+    repetir las llamadas al modelo ya hechas. Al terminar se guarda un estado final: volver a
+    procesar la fila devuelve el mismo ítem sin registrar de nuevo métricas ni banco, y su
+    `origen` hace que el ítem ocupe siempre el mismo lugar del banco.
+    Con `criterios_generacion["candidatos_por_ronda"]` > 1, cada intento genera y audita ese número
+    de candidatos en paralelo: el primero aprobado gana y el resto se cancela; si ninguno se
+    aprueba, el mejor se refina en el intento siguiente. `criterios_generacion["max_llamadas_por_item"]`
+    limita el total de peticiones al modelo del ítem y, con él, el costo: cuentan las de todos los
+    candidatos (también los cancelados), las duplicadas de la cobertura y las de la conmutación,
+    pero no los aciertos de caché. Un intento solo empieza si el saldo alcanza para generar y auditar
+    un candidato completo.
+    Con `banco_items` (BancoItems), el ítem procesado se guarda en el banco y, si además
+    `criterios_generacion["reutilizar_banco"]` está activo, un ítem ya aprobado para la misma
+    clasificación se devuelve directamente (con "id_banco") sin llamar al modelo.
+    Con `indice_duplicados` (IndiceDuplicados), el ítem aprobado se agrega al índice (solo su
+    versión final) y, si `criterios_generacion["detectar_duplicados"]` está activo (por defecto),
+    cada candidato bien formado se compara antes con los ítems ya aprobados y con los demás
+    candidatos de su ronda: un casi duplicado vuelve a generarse sin auditoría, con la indicación
+    de diferenciarse del ítem parecido.
+    Los prompts se envían como un prefijo estable (`construir_prefijo_generacion`, que incluye el
+    manual completo cuando no hay `indice_manual`) seguido de los parámetros de la fila, para que
+    el proveedor sirva el prefijo desde su caché de prefijos.
+    `criterios_generacion["modelo_respaldo_generacion"]` y `["modelo_respaldo_auditoria"]`
+    (["Tipo", "modelo"]) activan la cobertura y la conmutación por error de cada etapa con ese
+    modelo secundario (ver `sumon.enrutamiento`).
+    Con `criterios_generacion["modelo_auditoria_rapida"]` (["Tipo", "modelo"]), la auditoría es
+    una cascada: el modelo rápido audita primero y su rechazo claro se acepta; el dictamen parcial,
+    el no extraíble, el que no concuerda con los criterios y la aprobación pasan al auditor
+    principal (ver `motivo_para_escalar`). Cada auditoría en cascada queda en el registro de
+    métricas (`cascada_df`) con la concordancia entre ambos auditores.
+    """
+    configuracion = configuracion or ConfiguracionLLM.desde_entorno()
+    streaming_activo = configuracion.streaming
+    attempt = 0
+
+    def _avisar(tipo, mensaje="", **datos):
+        if al_progresar is not None:
+            al_progresar(EventoProgreso(tipo, mensaje, attempt, datos))
+
+    def _al_recibir_texto(etapa):
+        # Solo se pide el texto parcial si alguien lo va a mostrar
+        if not (streaming_activo and al_progresar is not None):
+            return None
+        return lambda texto: _avisar("texto_parcial", etapa=etapa, texto=texto)
+
+    inicio_item = time.monotonic()
+    id_item = uuid.uuid4().hex[:12] # Relaciona las llamadas registradas en las métricas con este ítem
+    refinamiento_compacto = criterios_generacion.get("refinamiento_compacto", True)
+    salida_estructurada = criterios_generacion.get("salida_estructurada", False)
+    candidatos_por_ronda = max(1, int(criterios_generacion.get("candidatos_por_ronda") or CANDIDATOS_POR_RONDA))
+    if configuracion.lote is not None:
+        candidatos_por_ronda = 1 # En un lote del proveedor cada fila aporta una sola petición por ronda
+    max_llamadas_por_item = criterios_generacion.get("max_llamadas_por_item") or None # None o 0 = sin límite
+    detectar_duplicados = criterios_generacion.get("detectar_duplicados", True)
+    enrutamiento_generacion = PoliticaEnrutamiento.desde_criterios(criterios_generacion.get("modelo_respaldo_generacion"))
+    enrutamiento_auditoria = PoliticaEnrutamiento.desde_criterios(criterios_generacion.get("modelo_respaldo_auditoria"))
+    auditor_rapido = criterios_generacion.get("modelo_auditoria_rapida") or None
+    fraccion_verificacion = criterios_generacion.get("fraccion_verificacion_cascada", FRACCION_VERIFICACION_CASCADA)
+    # Índice para buscar las reglas relacionadas con los criterios fallidos durante el refinamiento
+    indice_refinamiento = indice_manual
+    if indice_refinamiento is None and manual_reglas_texto and refinamiento_compacto:
+        indice_refinamiento = construir_indice_manual(manual_reglas_texto)
+    if indice_manual is not None:
+        manual_reglas_texto = indice_manual.seleccionar_secciones(
+            consulta_manual_para_fila(fila_datos),
+            top_k=criterios_generacion.get("manual_top_k", MANUAL_TOP_K),
+            presupuesto_tokens=criterios_generacion.get("manual_presupuesto_tokens", MANUAL_PRESUPUESTO_TOKENS)
+        )
+    tipo_pregunta = criterios_generacion.get("tipo_pregunta", "opción múltiple con 3 opciones") 
+    dificultad = criterios_generacion.get("dificultad", "media")
+    contexto_educativo = criterios_generacion.get("contexto_educativo", "general")
+    formato_justificacion = criterios_generacion.get("formato_justificacion", """
+        • Justificación correcta: debe explicar el razonamiento o proceso cognitivo (NO por descarte).
+        • Justificaciones incorrectas: deben redactarse como: “El estudiante podría escoger la opción X porque… Sin embargo, esto es incorrecto porque…”
+    """)
+    
+    # Con el manual completo, este va en el prefijo estable; las secciones elegidas para la fila, no
+    manual_en_prefijo = indice_manual is None
+    prefijo_generacion = construir_prefijo_generacion(
+        tipo_pregunta, formato_justificacion, manual_reglas_texto if manual_en_prefijo else "",
+        informacion_adicional_usuario, salida_estructurada
+    )
+
+    grado_elegido = fila_datos.get('GRADO', 'no especificado')
+    area_elegida = fila_datos.get('ÁREA', 'no especificada')
+    asignatura_elegida = fila_datos.get('ASIGNATURA', 'no especificada')
+    estacion_elegida = fila_datos.get('ESTACIÓN', 'no especificada')
+    proceso_cognitivo_elegido = fila_datos.get('PROCESO COGNITIVO', 'no especificado')
+    nanohabilidad_elegida = fila_datos.get('NANOHABILIDAD', 'no especificada')
+    microhabilidad_elegida = fila_datos.get('MICROHABILIDAD', 'no especificada')
+    competencia_nanohabilidad_elegida = fila_datos.get('COMPETENCIA NANOHABILIDAD', 'no especificada')
+
+    dato_para_pregunta_foco = nanohabilidad_elegida
+    descripcion_bloom = get_descripcion_bloom(proceso_cognitivo_elegido)
+
+    current_item_text = ""
+    auditoria_status = "❌ RECHAZADO" # Estado inicial
+    audit_observations = "" # Observaciones para el refinamiento
+    max_refinement_attempts = 5 # Número máximo de intentos de refinamiento
+    grafico_necesario = "NO" # Valor por defecto
+    descripcion_grafico = "" # Valor por defecto
+    criterios_fallidos = [] # Criterios no cumplidos en el último intento (para el refinamiento compacto)
+    item_previo_completo = False # Si el último intento produjo un ítem completo que se pueda reparar
+    tokens_prompt_por_intento = [] # Tamaño estimado del prompt de generación de cada intento
+    criterios_auditoria = [] # Veredictos por criterio de la última auditoría estructurada
+    ultima_auditoria = "" # Texto de la última auditoría (para el registro de intentos del trabajo)
+    # Peticiones al modelo gastadas en el ítem (para `max_llamadas_por_item`); los candidatos en
+    # paralelo, incluidos los cancelados, suman desde sus hilos cada petición que envían
+    llamadas = ContadorLlamadas()
+    casi_duplicados = 0 # Candidatos descartados por parecerse a un ítem ya aprobado o a otro candidato
+
+    # Almacenar detalles de clasificación para el ítem
+    classification_details = {
+        "Grado": grado_elegido,
+        "Área": area_elegida,
+        "Asignatura": asignatura_elegida,
+        "Estación": estacion_elegida,
+        "Proceso Cognitivo": proceso_cognitivo_elegido,
+        "Nanohabilidad": nanohabilidad_elegida,
+        "Microhabilidad": microhabilidad_elegida,
+        "Competencia Nanohabilidad": competencia_nanohabilidad_elegida
+    }
+
+    item_final_data = None # Variable para guardar el ítem final (aprobado o la última versión auditada)
+
+    # --- Reutilización del banco: una clasificación ya resuelta no vuelve a generarse ---
+    if banco_items is not None and criterios_generacion.get("reutilizar_banco", False):
+        existentes = banco_items.aprobados_para(classification_details, limite=1)
+        if existentes:
+            item_reutilizado = existentes[0]
+            banco_items.registrar_uso(item_reutilizado["id_banco"])
+            _avisar("exito", f"Se reutiliza el ítem aprobado #{item_reutilizado['id_banco']} del banco para esta clasificación.")
+            obtener_registro_metricas().registrar_item({
+                "timestamp": time.time(), "id_item": id_item,
+                "gen_model": f"{gen_model_type} - {gen_model_name}", "audit_model": f"{audit_model_type} - {audit_model_name}",
+                "nanohabilidad": nanohabilidad_elegida, "intentos": 0, "aprobado": True, "intentos_hasta_aprobacion": 0,
+                "candidatos_por_ronda": candidatos_por_ronda, "llamadas_llm": 0, "desde_banco": True,
+                "dictamen_final": item_reutilizado.get("final_audit_status"), "duracion_s": round(time.monotonic() - inicio_item, 3)
+            })
+            return [item_reutilizado]
+
+    def _estado_refinamiento():
+        # Lo necesario para continuar el refinamiento tras el último intento terminado
+        return {
+            "attempt": attempt, "id_item": id_item, "current_item_text": current_item_text,
+            "auditoria_status": auditoria_status, "audit_observations": audit_observations,
+            "grafico_necesario": grafico_necesario, "descripcion_grafico": descripcion_grafico,
+            "criterios_fallidos": criterios_fallidos, "item_previo_completo": item_previo_completo,
+            "tokens_prompt_por_intento": tokens_prompt_por_intento, "criterios_auditoria": criterios_auditoria,
+            "ultima_auditoria": ultima_auditoria, "item_final_data": item_final_data, "llamadas_usadas": llamadas.valor,
+            "casi_duplicados": casi_duplicados
+        }
+
+    estado_guardado = punto_control.cargar() if punto_control is not None else None
+    if estado_guardado and estado_guardado.get("terminado"):
+        # El proceso anterior terminó el ítem pero no llegó a marcar la fila como terminada
+        _avisar("info", f"El ítem ya estaba terminado (dictamen: {estado_guardado['auditoria_status']}).")
+        return [estado_guardado["item_final_data"]] if estado_guardado["item_final_data"] else []
+    if estado_guardado:
+        attempt = estado_guardado["attempt"]
+        id_item = estado_guardado["id_item"]
+        current_item_text = estado_guardado["current_item_text"]
+        auditoria_status = estado_guardado["auditoria_status"]
+        audit_observations = estado_guardado["audit_observations"]
+        grafico_necesario = estado_guardado["grafico_necesario"]
+        descripcion_grafico = estado_guardado["descripcion_grafico"]
+        criterios_fallidos = estado_guardado["criterios_fallidos"]
+        item_previo_completo = estado_guardado["item_previo_completo"]
+        tokens_prompt_por_intento = estado_guardado["tokens_prompt_por_intento"]
+        criterios_auditoria = estado_guardado["criterios_auditoria"]
+        ultima_auditoria = estado_guardado["ultima_auditoria"]
+        item_final_data = estado_guardado["item_final_data"]
+        llamadas = ContadorLlamadas(estado_guardado.get("llamadas_usadas", 0))
+        casi_duplicados = estado_guardado.get("casi_duplicados", 0)
+        _avisar("info", f"Se reanuda el ítem desde el punto de control del intento {attempt} (dictamen: {auditoria_status}).")
+    intento_guardado = attempt
+
+    def _procesar_candidato(prompt, avisar, cancelada=None, candidato=None, prefijo=None, firmas_ronda=None):
+        """
+        Genera, pre-audita y audita un candidato a partir de `prefijo` + `prompt` sin tocar el estado del
+        refinamiento: devuelve un ResultadoCandidato que el bucle aplica si lo elige, o None si
+        `cancelada` (threading.Event) se activó porque otro candidato de la ronda ya fue aprobado.
+        `firmas_ronda` (FirmasRonda) es compartido por los candidatos de la ronda para compararlos entre sí.
+        """
+        sufijo = f", candidato {candidato}" if candidato else ""
+        contexto_candidato = {"candidato": candidato} if candidato else {}
+        resultado = ResultadoCandidato(item_text=current_item_text, grafico_necesario=grafico_necesario,
+                                       descripcion_grafico=descripcion_grafico, candidato=candidato)
+
+        def _validador(secciones):
+            validar_formato = crear_validador_formato(secciones) if (streaming_activo and not salida_estructurada) else None
+            if cancelada is None:
+                return validar_formato
+            def validar(texto_parcial):
+                # Corta el stream de los candidatos que ya no hacen falta
+                if cancelada.is_set():
+                    return "Otro candidato de la ronda ya fue aprobado."
+                return validar_formato(texto_parcial) if validar_formato is not None else None
+            return validar
+
+        def _texto_parcial(etapa):
+            # En paralelo los eventos se reenvían al terminar el candidato: no hay texto parcial
+            return _al_recibir_texto(etapa) if cancelada is None else None
+
+        def _cancelado():
+            return cancelada is not None and cancelada.is_set()
+
+        def _auditar(tipo_auditor, modelo_auditor, enrutamiento, nivel=None):
+            """Audita `resultado.item_text` con un auditor; None si el candidato se canceló mientras tanto."""
+            etiqueta = f" ({nivel})" if nivel else ""
+            avisar("etapa", f"Auditando ítem{etiqueta} ({tipo_auditor} - {modelo_auditor}, Intento {attempt}{sufijo})...", etapa="auditoría")
+            contexto_auditoria = {"etapa": "auditoría", "intento": attempt, **contexto_candidato, "id_item": id_item}
+            if nivel:
+                contexto_auditoria["nivel_auditoria"] = nivel
+            try:
+                auditoria_resultado = auditar_item_con_llm(
+                    tipo_auditor, modelo_auditor,
+                    item_generado=resultado.item_text,
+                    grado=grado_elegido, area=area_elegida, asignatura=asignatura_elegida, estacion=estacion_elegida,
+                    proceso_cognitivo=proceso_cognitivo_elegido, nanohabilidad=nanohabilidad_elegida,
+                    microhabilidad=microhabilidad_elegida, competencia_nanohabilidad=competencia_nanohabilidad_elegida,
+                    contexto_educativo=contexto_educativo, manual_reglas_texto=manual_reglas_texto,
+                    descripcion_bloom=descripcion_bloom,
+                    grafico_necesario=resultado.grafico_necesario,
+                    descripcion_grafico=resultado.descripcion_grafico,
+                    al_recibir_texto=_texto_parcial("auditoría"),
+                    validar_parcial=_validador(SECCIONES_AUDITORIA),
+                    salida_estructurada=salida_estructurada,
+                    contexto_metricas=contexto_auditoria,
+                    configuracion=configuracion, manual_en_prefijo=manual_en_prefijo, enrutamiento=enrutamiento,
+                    contador_llamadas=llamadas
+                )
+            except SalidaFueraDeFormato as e:
+                if _cancelado():
+                    return None
+                # La auditoría parcial no tendrá dictamen; se trata como un dictamen no extraíble
+                avisar("advertencia", f"Auditoría{etiqueta} cancelada por formato inválido (intento {attempt}{sufijo}): {e}")
+                auditoria_resultado = e.texto_parcial
+            finally:
+                avisar("fin_etapa", etapa="auditoría")
+            if auditoria_resultado is None:
+                return DictamenAuditoria()
+
+            dictamen = DictamenAuditoria(texto=auditoria_resultado)
+            auditoria_estructurada = None
+            if salida_estructurada:
+                try:
+                    auditoria_estructurada = parsear_auditoria_json(auditoria_resultado)
+                    dictamen.texto = auditoria_estructurada.a_texto()
+                except ValueError as e:
+                    avisar("advertencia", f"La respuesta JSON del auditor no es válida (intento {attempt}{sufijo}): {e}")
+
+            avisar("auditoria", f"Resultado de Auditoría{etiqueta}:", texto=dictamen.texto)
+
+            if auditoria_estructurada is not None:
+                # --- Auditoría estructurada: dictamen y criterios se leen directamente del objeto ---
+                dictamen.estado = auditoria_estructurada.estado
+                dictamen.criterios_fallidos = auditoria_estructurada.criterios_fallidos()
+                dictamen.criterios_auditoria = [vars(criterio).copy() for criterio in auditoria_estructurada.criterios]
+                dictamen.observaciones = auditoria_estructurada.observaciones_finales or "El auditor no incluyó observaciones finales."
+            else:
+                # --- Extraer DICTAMEN FINAL de forma más robusta ---
+                dictamen_final_match = re.search(r"DICTAMEN FINAL:\s*\[(.*?)]", dictamen.texto, re.DOTALL)
+                if dictamen_final_match:
+                    dictamen.estado = dictamen_final_match.group(1).strip()
+                else:
+                    dictamen.estado = "❌ RECHAZADO (no se pudo extraer dictamen)"
+
+                dictamen.criterios_fallidos = extraer_criterios_fallidos(dictamen.texto)
+
+                observaciones_start = dictamen.texto.find("OBSERVACIONES FINALES:")
+                if observaciones_start != -1:
+                    dictamen.observaciones = dictamen.texto[observaciones_start + len("OBSERVACIONES FINALES:"):].strip()
+                else:
+                    dictamen.observaciones = "No se pudieron extraer observaciones específicas del auditor. Posiblemente un error de formato en la respuesta del auditor."
+            return dictamen
+
+        if _cancelado():
+            return None # Otro candidato ya fue aprobado antes de que este empezara
+        try:
+            avisar("etapa", f"Generando contenido con IA ({gen_model_type} - {gen_model_name}, Intento {attempt}{sufijo})...", etapa="generación")
+            try:
+                full_llm_response = generar_texto_con_llm(
+                    gen_model_type, gen_model_name, prompt,
+                    usar_cache=configuracion is not None and configuracion.cachear_generacion,
+                    al_recibir_texto=_texto_parcial("generación"),
+                    validar_parcial=_validador(SECCIONES_ITEM),
+                    esquema_json=("item_educativo", ESQUEMA_ITEM_JSON) if salida_estructurada else None,
+                    contexto_metricas={"etapa": "generación", "intento": attempt, **contexto_candidato, "id_item": id_item},
+                    configuracion=configuracion, prefijo=prefijo, enrutamiento=enrutamiento_generacion,
+                    contador_llamadas=llamadas
+                )
+            except SalidaFueraDeFormato as e:
+                if _cancelado():
+                    return None
+                # Se canceló la petición a mitad de camino: se reintenta sin gastar una auditoría
+                avisar("advertencia", f"Generación cancelada por formato inválido (intento {attempt}{sufijo}): {e}")
+                resultado.item_text = e.texto_parcial
+                resultado.estado = "❌ RECHAZADO (formato inválido)"
+                resultado.observaciones = f"La respuesta anterior se canceló porque no siguió el formato de salida: {e} Respeta exactamente el FORMATO ESPERADO DE SALIDA."
+                return resultado
+            finally:
+                avisar("fin_etapa", etapa="generación")
+
+            if full_llm_response is None: # Si hubo un error en la generación con LLM
+                avisar("error", f"Fallo en la generación de texto con {gen_model_type} ({gen_model_name}).")
+                resultado.estado = "❌ RECHAZADO (Error de Generación)"
+                resultado.observaciones = "El modelo de generación no pudo producir una respuesta válida."
+                resultado.fatal = True
+                return resultado
+
+            resultado.item_completo = True
+
+            if salida_estructurada:
+                # --- Salida JSON: el ítem llega como objeto tipado, sin expresiones regulares ---
+                try:
+                    item_estructurado = parsear_item_json(full_llm_response)
+                except ValueError as e:
+                    avisar("advertencia", f"La respuesta JSON del generador no es válida (intento {attempt}{sufijo}): {e}")
+                    resultado.item_text = full_llm_response
+                    resultado.item_completo = False
+                    resultado.estado = "❌ RECHAZADO (formato inválido)"
+                    resultado.observaciones = f"La respuesta anterior no fue un JSON válido: {e} Responde únicamente con el objeto JSON solicitado."
+                    return resultado
+                resultado.item_text = item_estructurado.a_texto()
+                resultado.grafico_necesario = "SÍ" if item_estructurado.grafico_necesario else "NO"
+                resultado.descripcion_grafico = item_estructurado.descripcion_grafico if item_estructurado.grafico_necesario else ""
+            else:
+                # --- Parsear la respuesta para extraer el ítem y la información del gráfico ---
+                item_and_graphic_match = re.search(r"(PREGUNTA:.*?)(GRAFICO_NECESARIO:\s*(SÍ|NO).*?DESCRIPCION_GRAFICO:.*)", full_llm_response, re.DOTALL)
+
+                if item_and_graphic_match:
+                    resultado.item_text = item_and_graphic_match.group(1).strip()
+                    grafico_info_block = item_and_graphic_match.group(2).strip()
+
+                    grafico_necesario_match = re.search(r"GRAFICO_NECESARIO:\s*(SÍ|NO)", grafico_info_block)
+                    if grafico_necesario_match:
+                        resultado.grafico_necesario = grafico_necesario_match.group(1).strip()
+
+                    descripcion_grafico_match = re.search(r"DESCRIPCION_GRAFICO:\s*(.*)", grafico_info_block, re.DOTALL)
+                    if descripcion_grafico_match:
+                        resultado.descripcion_grafico = descripcion_grafico_match.group(1).strip()
+                        if resultado.descripcion_grafico.upper() == 'N/A':
+                            resultado.descripcion_grafico = ""
+                else:
+                    resultado.item_text = full_llm_response
+                    resultado.grafico_necesario = "NO"
+                    resultado.descripcion_grafico = ""
+                    avisar("advertencia", "No se pudo parsear el formato de gráfico de la respuesta. Asumiendo que no requiere gráfico.")
+
+            avisar("item", f"Ítem Generado/Refinado (Intento {attempt}{sufijo}):", item_text=resultado.item_text,
+                   grafico_necesario=resultado.grafico_necesario, descripcion_grafico=resultado.descripcion_grafico)
+
+            # --- Pre-auditoría local: los ítems mal formados vuelven a refinamiento sin llamar al auditor ---
+            errores_estructurales = preauditar_item(resultado.item_text)
+            if errores_estructurales:
+                resultado.criterios_fallidos = errores_estructurales
+                resultado.estado = "❌ RECHAZADO (validación estructural)"
+                resultado.observaciones = "Validación automática previa a la auditoría:\n" + "\n".join(f"- {error}" for error in errores_estructurales)
+                resultado.registrar_item = True
+                avisar("advertencia", f"El ítem no superó la validación estructural (intento {attempt}{sufijo}); se refina sin auditoría LLM.")
+                avisar("detalle", resultado.observaciones)
+                return resultado
+
+            # --- Casi duplicados: un ítem que repite uno ya aprobado u otro candidato de la ronda se regenera sin auditarlo ---
+            if indice_duplicados is not None and detectar_duplicados:
+                duplicado, parecido = indice_duplicados.buscar(resultado.item_text), "un ítem ya aprobado"
+                if duplicado is None and firmas_ronda is not None:
+                    duplicado, parecido = firmas_ronda.comparar_y_registrar(resultado.item_text), "otro candidato de la ronda"
+                if duplicado is not None:
+                    similitud, extracto = duplicado
+                    resultado.criterios_fallidos = [f"Originalidad: el ítem es casi idéntico a {parecido}"]
+                    resultado.estado = DICTAMEN_CASI_DUPLICADO
+                    resultado.observaciones = (
+                        f"El enunciado y las opciones coinciden en un {similitud:.0%} con {parecido}. "
+                        "Construye un ítem nuevo que se diferencie de él en la situación, los datos, el enunciado "
+                        f"y los distractores:\n{extracto}"
+                    )
+                    resultado.item_completo = False # Se regenera con el prompt completo, no se repara
+                    resultado.registrar_item = True
+                    avisar("advertencia", f"El ítem es casi duplicado de {parecido} (similitud {similitud:.0%}, "
+                                          f"intento {attempt}{sufijo}); se regenera sin auditoría LLM.")
+                    return resultado
+
+            if _cancelado():
+                return None # No se gasta una auditoría en un candidato que ya no hace falta
+
+            if auditor_rapido is None:
+                dictamen = _auditar(audit_model_type, audit_model_name, enrutamiento_auditoria)
+                if dictamen is None:
+                    return None
+            else:
+                # --- Cascada: el auditor rápido decide los rechazos claros; el resto se escala ---
+                tipo_rapido, modelo_rapido = auditor_rapido
+                dictamen_rapido = _auditar(tipo_rapido, modelo_rapido, None, nivel="rápida")
+                if dictamen_rapido is None:
+                    return None
+                motivo = motivo_para_escalar(dictamen_rapido, fraccion_verificacion)
+                dictamen = dictamen_rapido
+                if motivo is not None:
+                    if _cancelado():
+                        return None
+                    avisar("info", f"Se escala la auditoría a {audit_model_type} - {audit_model_name}{sufijo}: {motivo}.")
+                    dictamen = _auditar(audit_model_type, audit_model_name, enrutamiento_auditoria, nivel="fuerte")
+                    if dictamen is None:
+                        return None
+                categoria_rapida = categoria_dictamen(dictamen_rapido.estado) if dictamen_rapido.texto is not None else None
+                categoria_fuerte = categoria_dictamen(dictamen.estado) if motivo is not None and dictamen.texto is not None else None
+                obtener_registro_metricas().registrar_cascada({
+                    "timestamp": time.time(), "id_item": id_item, "intento": attempt, "candidato": candidato,
+                    "modelo_rapido": f"{tipo_rapido} - {modelo_rapido}", "modelo_fuerte": f"{audit_model_type} - {audit_model_name}",
+                    "dictamen_rapido": categoria_rapida or "sin dictamen", "escalada": motivo is not None, "motivo": motivo,
+                    "dictamen_fuerte": categoria_fuerte,
+                    "concuerda": (categoria_rapida == categoria_fuerte) if categoria_rapida and categoria_fuerte else None
+                })
+
+            resultado.auditoria_texto = dictamen.texto or ""
+            if dictamen.texto is None: # Si hubo un error en la auditoría con LLM
+                avisar("error", f"Fallo en la auditoría con {audit_model_type} ({audit_model_name}).")
+                resultado.estado = "❌ RECHAZADO (Error de Auditoría)"
+                resultado.observaciones = "El modelo de auditoría no pudo producir una respuesta válida."
+                resultado.fatal = True
+                return resultado
+
+            resultado.estado = dictamen.estado
+            resultado.criterios_fallidos = dictamen.criterios_fallidos
+            resultado.criterios_auditoria = dictamen.criterios_auditoria
+            resultado.observaciones = dictamen.observaciones
+            resultado.auditado = True
+            resultado.registrar_item = True
+            avisar("info", f"Dictamen extraído{sufijo}: {resultado.estado}. Observaciones: {resultado.observaciones[:100]}...")
+            return resultado
+        except Exception as e:
+            resultado.error = e
+            return resultado
+
+    def _ronda_en_paralelo(prompt, num_candidatos, prefijo=None):
+        """
+        Lanza `num_candidatos` candidatos a la vez (cada uno con una instrucción de variante) y
+        devuelve sus resultados en el orden en que terminan. El primero aprobado cierra la ronda:
+        el resto se cancela y sus resultados no se esperan.
+        Los eventos de cada candidato se acumulan y se reenvían desde este hilo al terminar, de
+        modo que `al_progresar` nunca se llama desde los hilos de los candidatos.
+        """
+        cancelada = threading.Event()
+        firmas_ronda = FirmasRonda()
+        eventos = {candidato: [] for candidato in range(1, num_candidatos + 1)}
+
+        def _acumular(candidato):
+            def avisar(tipo, mensaje="", **datos):
+                eventos[candidato].append(EventoProgreso(tipo, mensaje, attempt, {**datos, "candidato": candidato}))
+            return avisar
+
+        resultados = []
+        executor = ThreadPoolExecutor(max_workers=num_candidatos)
+        try:
+            futuros = {
+                executor.submit(
+                    _procesar_candidato,
+                    prompt + INSTRUCCIONES_VARIANTE_CANDIDATO.format(candidato=candidato, total=num_candidatos),
+                    _acumular(candidato), cancelada, candidato, prefijo, firmas_ronda
+                ): candidato
+                for candidato in range(1, num_candidatos + 1)
+            }
+            for futuro in as_completed(futuros):
+                resultado = futuro.result()
+                if al_progresar is not None:
+                    for evento in eventos[futuros[futuro]]:
+                        if evento.tipo not in ("etapa", "fin_etapa", "texto_parcial"):
+                            al_progresar(evento)
+                if resultado is None:
+                    continue
+                resultados.append(resultado)
+                if resultado.estado == "✅ CUMPLE TOTALMENTE":
+                    cancelada.set()
+                    break
+        finally:
+            # Los candidatos sin empezar se descartan; los que están en curso no empiezan otra etapa y su stream
+            # se corta con `cancelada`. Se espera a que terminen para que sus peticiones cuenten en `llamadas`.
+            executor.shutdown(wait=True, cancel_futures=True)
+        return resultados
+
+    while auditoria_status != "✅ CUMPLE TOTALMENTE" and attempt < max_refinement_attempts:
+        if punto_control is not None and attempt > intento_guardado:
+            # El intento anterior terminó (con o sin auditoría): se guarda antes de empezar el siguiente
+            punto_control.guardar(_estado_refinamiento())
+            intento_guardado = attempt
+        candidatos_ronda = candidatos_por_ronda
+        if max_llamadas_por_item is not None:
+            # Cada candidato puede gastar una generación y una auditoría (dos con la cascada)
+            llamadas_por_candidato = 3 if auditor_rapido else 2
+            llamadas_restantes = max_llamadas_por_item - llamadas.valor
+            if llamadas_restantes < llamadas_por_candidato:
+                _avisar("advertencia", f"Se alcanzó el máximo de {max_llamadas_por_item} llamadas al modelo para este ítem.")
+                break
+            candidatos_ronda = min(candidatos_por_ronda, llamadas_restantes // llamadas_por_candidato)
+        attempt += 1
+        _avisar("info", f"--- Generando/Refinando Ítem (Intento {attempt}/{max_refinement_attempts}) ---")
+
+        usar_reparacion = refinamiento_compacto and attempt > 1 and item_previo_completo and (criterios_fallidos or audit_observations)
+        if usar_reparacion:
+            secciones_relacionadas = ""
+            if indice_refinamiento is not None:
+                secciones_relacionadas = indice_refinamiento.seleccionar_secciones(
+                    " ".join(criterios_fallidos) + " " + audit_observations,
+                    top_k=max(1, criterios_generacion.get("manual_top_k", MANUAL_TOP_K) // 2),
+                    presupuesto_tokens=criterios_generacion.get("manual_presupuesto_tokens", MANUAL_PRESUPUESTO_TOKENS) // 2
+                )
+            prompt_content_for_llm = construir_prompt_reparacion(
+                current_item_text, grafico_necesario, descripcion_grafico, criterios_fallidos, audit_observations,
+                secciones_relacionadas, classification_details, descripcion_bloom,
+                tipo_pregunta, contexto_educativo, dificultad
+            )
+        else:
+            prompt_content_for_llm = f"""
+            --- CONTEXTO Y PARÁMETROS DEL ÍTEM ---
+            - Grado: {grado_elegido}
+            - Área: {area_elegida}
+            - Asignatura: {asignatura_elegida}
+            - Estación o unidad temática: {estacion_elegida}
+            - Proceso cognitivo (Taxonomía de Bloom): {proceso_cognitivo_elegido}
+            - Descripción del proceso cognitivo:
+              "{descripcion_bloom}"
+            - Nanohabilidad (foco principal del ítem): {nanohabilidad_elegida}
+            - Nivel educativo esperado del estudiante: {contexto_educativo}
+            - Nivel de dificultad deseado: {dificultad}
+            """
+            if manual_reglas_texto and not manual_en_prefijo:
+                prompt_content_for_llm += _bloque_manual_generacion(manual_reglas_texto)
+            prompt_content_for_llm += f"""
+            --- DATO CLAVE PARA LA CONSTRUCCIÓN ---
+            Basado en el foco temático y el proceso cognitivo, considera el siguiente dato o idea esencial:
+            "{dato_para_pregunta_foco}"
+            """
+        
+            # Si no es el primer intento, añade las observaciones de auditoría para refinamiento
+            if attempt > 1:
+                prompt_content_for_llm += f"""
+                --- RETROALIMENTACIÓN DE AUDITORÍA PARA REFINAMIENTO ---
+                El ítem anterior no cumplió con todos los criterios. Por favor, revisa las siguientes observaciones y mejora el ítem para abordarlas.
+                Observaciones del Auditor:
+                {audit_observations}
+                ---------------------------------------------------
+                """
+                # Agrega el ítem anterior para que el LLM lo pueda reformular
+                prompt_content_for_llm += f"""
+                --- ÍTEM ANTERIOR A REFINAR ---
+                {current_item_text}
+                -------------------------------
+                """
+
+        if usar_reparacion:
+            prefijo_intento = None
+            if salida_estructurada:
+                prompt_content_for_llm += INSTRUCCIONES_SALIDA_JSON_ITEM
+        else:
+            prefijo_intento = prefijo_generacion
+
+        tokens_prefijo = estimar_tokens(prefijo_intento) if prefijo_intento else 0
+        tokens_prompt = tokens_prefijo + estimar_tokens(prompt_content_for_llm)
+        tokens_prompt_por_intento.append(tokens_prompt)
+        _avisar("nota", f"Prompt de generación del intento {attempt}: ~{tokens_prompt} tokens "
+                        f"({'reparación compacta' if usar_reparacion else f'completo, ~{tokens_prefijo} en el prefijo estable'}).")
+
+        if candidatos_ronda > 1:
+            _avisar("info", f"Se generan y auditan {candidatos_ronda} candidatos en paralelo; gana el primero aprobado.")
+            resultados_ronda = _ronda_en_paralelo(prompt_content_for_llm, candidatos_ronda, prefijo_intento)
+        else:
+            resultados_ronda = [_procesar_candidato(prompt_content_for_llm, _avisar, prefijo=prefijo_intento)]
+
+        casi_duplicados += sum(1 for resultado in resultados_ronda if resultado.estado == DICTAMEN_CASI_DUPLICADO)
+        # El aprobado, o el mejor de la ronda, pasa a ser el ítem que se refina en la siguiente
+        elegido = max(resultados_ronda, key=_puntaje_candidato)
+        current_item_text = elegido.item_text
+        grafico_necesario = elegido.grafico_necesario
+        descripcion_grafico = elegido.descripcion_grafico
+        item_previo_completo = elegido.item_completo
+        if elegido.auditoria_texto is not None:
+            ultima_auditoria = elegido.auditoria_texto
+
+        if elegido.error is not None:
+            _avisar("error", f"Error durante la generación o auditoría (intento {attempt}): {elegido.error}")
+            audit_observations = f"Error técnico durante la generación: {elegido.error}. Por favor, corrige este problema."
+            auditoria_status = "❌ RECHAZADO (error técnico)" 
+            item_final_data = {
+                "item_text": current_item_text if current_item_text else "No se pudo generar el ítem debido a un error técnico.",
+                "classification": classification_details,
+                "grafico_necesario": "NO",
+                "descripcion_grafico": "",
+                "final_audit_status": auditoria_status,
+                "final_audit_observations": audit_observations,
+                "tokens_prompt_por_intento": list(tokens_prompt_por_intento)
+            }
+            break # Sale del ciclo si hay un error técnico grave
+
+        auditoria_status = elegido.estado
+        audit_observations = elegido.observaciones
+        if elegido.registrar_item:
+            criterios_fallidos = elegido.criterios_fallidos
+            # Guardar los datos del ítem, incluyendo el estado final de la auditoría y observaciones
+            item_final_data = {
+                "item_text": current_item_text,
+                "classification": classification_details,
+                "grafico_necesario": grafico_necesario,
+                "descripcion_grafico": descripcion_grafico,
+                "final_audit_status": auditoria_status, # Guarda el estado final del intento
+                "final_audit_observations": audit_observations, # Guarda las observaciones del intento
+                "tokens_prompt_por_intento": list(tokens_prompt_por_intento)
+            }
+            if elegido.auditado:
+                criterios_auditoria = elegido.criterios_auditoria
+                item_final_data["criterios_auditoria"] = criterios_auditoria # Veredictos por criterio (solo con salida estructurada)
+
+        if elegido.fatal:
+            break # Salir del bucle de refinamiento
+
+        if auditoria_status == "✅ CUMPLE TOTALMENTE":
+            _avisar("exito", f"¡El ítem ha sido auditado y CUMPLE TOTALMENTE en el intento {attempt}"
+                             f"{f' (candidato {elegido.candidato})' if elegido.candidato else ''}!")
+            break # Sale del ciclo de refinamiento si es aprobado
+        elif elegido.auditado:
+            _avisar("advertencia", f"El ítem necesita refinamiento. Dictamen: {auditoria_status}. Intentando de nuevo...")
+
+    aprobado = auditoria_status == "✅ CUMPLE TOTALMENTE"
+    if item_final_data is not None and banco_items is not None:
+        item_final_data["id_banco"] = banco_items.guardar(
+            item_final_data, origen=punto_control.origen if punto_control is not None else None
+        )
+    if aprobado and indice_duplicados is not None:
+        # Solo la versión aprobada: los borradores y los candidatos descartados no bloquean ítems futuros
+        indice_duplicados.agregar(current_item_text, id_item)
+    if punto_control is not None:
+        # Estado final: si la fila se vuelve a procesar, devuelve este resultado sin repetir nada
+        punto_control.guardar({**_estado_refinamiento(), "terminado": True})
+
+    obtener_registro_metricas().registrar_item({
+        "timestamp": time.time(), "id_item": id_item,
+        "gen_model": f"{gen_model_type} - {gen_model_name}", "audit_model": f"{audit_model_type} - {audit_model_name}",
+        "nanohabilidad": nanohabilidad_elegida, "intentos": attempt, "aprobado": aprobado,
+        "candidatos_por_ronda": candidatos_por_ronda, "llamadas_llm": llamadas.valor,
+        "intentos_hasta_aprobacion": attempt if aprobado else None,
+        "desde_banco": False, "casi_duplicados": casi_duplicados,
+        "dictamen_final": auditoria_status, "duracion_s": round(time.monotonic() - inicio_item, 3)
+    })
+
+    if item_final_data is None: 
+        _avisar("error", f"No se pudo generar ningún ítem después de {max_refinement_attempts} intentos debido a fallas en la generación/auditoría.")
+        return [] # Retorna una lista vacía si no se logró generar nada en absoluto.
+
+    return [item_final_data] # Siempre devuelve una lista con el último ítem procesado.
+
+# --- Generación por lote ---
+def generar_lote_de_preguntas(gen_model_type, gen_model_name, audit_model_type, audit_model_name,
+                              df_filas, criterios_generacion, manual_reglas_texto="", informacion_adicional_usuario="",
+                              max_concurrencia=4, al_avanzar=None, indice_manual=None, configuracion=None,
+                              al_progresar=None, id_trabajo=None, almacen_trabajos=None, banco_items=None,
+                              indice_duplicados=None, limite_filas=None):
+    """
+    Ejecuta `generar_pregunta_con_seleccion` para cada fila de `df_filas` en un pool acotado de hilos.
+    `al_avanzar(completados, total, item_data)` se invoca desde el hilo que llama (seguro para
+    actualizar widgets de Streamlit) cada vez que termina una fila.
+    `al_progresar`, si se indica, recibe los eventos de todas las filas desde los hilos de trabajo
+    (con `datos["fila"]` = posición de la fila en el lote).
+    Con `id_trabajo` (creado con `AlmacenTrabajos.crear_trabajo`), las filas salen del almacén si
+    `df_filas` es None, las ya terminadas no se vuelven a procesar, cada intento deja un punto de
+    control y cada fila terminada se guarda en el almacén: un trabajo interrumpido se reanuda
+    llamando de nuevo a esta función con el mismo `id_trabajo`.
+    `banco_items` se pasa a cada fila (guardado y, si está activo, reutilización de aprobados) y
+    `indice_duplicados`, compartido por todas las filas, evita que el lote repita ítems.
+    `limite_filas` (p. ej. `EjecutorSegundoPlano.limite_filas_lote`, un semáforo compartido por
+    varios lotes) se adquiere mientras se procesa cada fila: acota las filas en curso de todos los
+    lotes que lo comparten, además de `max_concurrencia`.
+    Con `configuracion.lote` (AgrupadorLotesProveedor), cada fila participa en las rondas de la API
+    de lotes del proveedor: conviene que `max_concurrencia` abarque todas las filas, porque cada
+    ronda solo reúne las peticiones de las filas en curso.
+    Returns: lista de `item_final_data` alineada con las filas (misma longitud y orden); la
+    posición de una fila sin resultado queda en None.
+    """
+    if id_trabajo is not None:
+        if almacen_trabajos is None:
+            from sumon.trabajos import obtener_almacen_trabajos
+            almacen_trabajos = obtener_almacen_trabajos()
+        registros_trabajo = almacen_trabajos.filas(id_trabajo)
+        filas = [fila for _, fila, _, _ in registros_trabajo] if df_filas is None else [fila for _, fila in df_filas.iterrows()]
+        resultados = [item_data for _, _, _, item_data in registros_trabajo]
+        pendientes = [indice for indice, _, estado, _ in registros_trabajo if estado != "terminada"]
+    else:
+        filas = [fila for _, fila in df_filas.iterrows()]
+        resultados = [None] * len(filas)
+        pendientes = list(range(len(filas)))
+    total = len(filas)
+
+    def _progreso_de_fila(indice):
+        if al_progresar is None:
+            return None
+        def _reenviar(evento):
+            evento.datos["fila"] = indice
+            al_progresar(evento)
+        return _reenviar
+
+    def _procesar_fila(indice, fila):
+        with limite_filas if limite_filas is not None else nullcontext():
+            punto_control = None
+            if id_trabajo is not None:
+                almacen_trabajos.marcar_en_curso(id_trabajo, indice)
+                punto_control = almacen_trabajos.punto_control(id_trabajo, indice)
+            if configuracion is not None and configuracion.lote is not None:
+                with configuracion.lote.participante():
+                    return _generar_fila(fila, indice, punto_control)
+            return _generar_fila(fila, indice, punto_control)
+
+    def _generar_fila(fila, indice, punto_control):
+        return generar_pregunta_con_seleccion(
+            gen_model_type, gen_model_name, audit_model_type, audit_model_name,
+            fila_datos=fila,
+            criterios_generacion=criterios_generacion,
+            manual_reglas_texto=manual_reglas_texto,
+            informacion_adicional_usuario=informacion_adicional_usuario,
+            al_progresar=_progreso_de_fila(indice),
+            indice_manual=indice_manual,
+            configuracion=configuracion,
+            punto_control=punto_control,
+            banco_items=banco_items,
+            indice_duplicados=indice_duplicados
+        )
+
+    with ThreadPoolExecutor(max_workers=max(1, int(max_concurrencia))) as executor:
+        futuros = {
+            executor.submit(_procesar_fila, indice, filas[indice]): indice
+            for indice in pendientes
+        }
+        completados = total - len(futuros)
+        for futuro in as_completed(futuros):
+            indice = futuros[futuro]
+            try:
+                procesados = futuro.result()
+                item_data = procesados[0] if procesados else None
+            except Exception as e:
+                fila = filas[indice]
+                item_data = {
+                    "item_text": "No se pudo generar el ítem debido a un error técnico.",
+                    "classification": {
+                        "Grado": fila.get('GRADO', 'no especificado'),
+                        "Área": fila.get('ÁREA', 'no especificada'),
+                        "Asignatura": fila.get('ASIGNATURA', 'no especificada'),
+                        "Estación": fila.get('ESTACIÓN', 'no especificada'),
+                        "Proceso Cognitivo": fila.get('PROCESO COGNITIVO', 'no especificado'),
+                        "Nanohabilidad": fila.get('NANOHABILIDAD', 'no especificada'),
+                        "Microhabilidad": fila.get('MICROHABILIDAD', 'no especificada'),
+                        "Competencia Nanohabilidad": fila.get('COMPETENCIA NANOHABILIDAD', 'no especificada')
+                    },
+                    "grafico_necesario": "NO",
+                    "descripcion_grafico": "",
+                    "final_audit_status": "❌ RECHAZADO (error técnico)",
+                    "final_audit_observations": f"Error técnico durante la generación por lote: {e}"
+                }
+            resultados[indice] = item_data
+            if id_trabajo is not None:
+                almacen_trabajos.completar_fila(id_trabajo, indice, item_data)
+            completados += 1
+            if al_avanzar is not None:
+                al_avanzar(completados, total, item_data)
+
+    return resultados
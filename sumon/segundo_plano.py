@@ -0,0 +1,255 @@
+"""
+Ejecución de trabajos en segundo plano para la aplicación de Streamlit: la generación corre en un
+pool de hilos del proceso y no en el hilo del script, de modo que una nueva ejecución de la página
+(cambiar un widget, recargar) no la interrumpe. Cada trabajo tiene un id, un estado y una cola de
+eventos de progreso que la página consulta periódicamente.
+
+El pool es compartido por todas las sesiones y reparte los hilos con justicia: primero los
+trabajos interactivos (un ítem individual) y, entre iguales, el de la sesión con menos trabajos en
+curso; además, cada sesión tiene un tope de trabajos simultáneos. Los lotes nunca ocupan todos los
+hilos (queda al menos uno para los trabajos interactivos) y sus filas comparten un tope común,
+`limite_filas_lote`, por debajo de la concurrencia inicial por modelo del control de cuota. Así,
+el lote largo de un usuario no deja esperando, ni sin cupo con el proveedor, el ítem individual
+de otro.
+"""
+import itertools
+import logging
+import os
+import threading
+import time
+import uuid
+
+from sumon.comun import instancia_por_proceso
+
+logger = logging.getLogger(__name__)
+
+MAX_TRABAJOS_SIMULTANEOS = int(os.environ.get("SUMON_TRABAJOS_SIMULTANEOS", "4")) # Hilos del pool (todas las sesiones)
+MAX_TRABAJOS_POR_SESION = 2 # Trabajos en curso a la vez por sesión; los demás esperan en cola
+HILOS_RESERVADOS_INTERACTIVOS = 1 # Hilos del pool que los lotes no pueden ocupar
+# Filas de todos los lotes en curso a la vez: menos que CONCURRENCIA_INICIAL_POR_MODELO (4), para
+# que un ítem individual encuentre cupo en el control de cuota del modelo aunque haya lotes
+MAX_FILAS_LOTE_SIMULTANEAS = int(os.environ.get("SUMON_FILAS_LOTE_SIMULTANEAS", "3"))
+MAX_EVENTOS_POR_TRABAJO = 2000 # Eventos que se conservan; los más antiguos se descartan
+RETENCION_TRABAJOS_SEGUNDOS = 3600.0 # Tiempo que un trabajo terminado sigue disponible para consultarlo
+
+ESTADO_EN_COLA = "en_cola"
+ESTADO_EN_CURSO = "en_curso"
+ESTADO_TERMINADO = "terminado"
+ESTADO_FALLIDO = "fallido"
+ESTADO_CANCELADO = "cancelado"
+ESTADOS_ACTIVOS = (ESTADO_EN_COLA, ESTADO_EN_CURSO)
+
+PRIORIDAD_INTERACTIVA = 0 # Un ítem individual: alguien está mirando la pantalla
+PRIORIDAD_LOTE = 1
+
+class TrabajoSegundoPlano:
+    """
+    Un trabajo enviado a `EjecutorSegundoPlano`. La función del trabajo recibe este objeto y usa
+    `publicar` como callback `al_progresar` (eventos con atributo `tipo`) y `registrar_avance`
+    para el avance de un lote; la página lee `eventos_desde`, `texto_parcial` y `avance`.
+    Los eventos "texto_parcial" no se encolan: solo se conserva el último texto acumulado, que es
+    lo único que hace falta para mostrar el streaming.
+    """
+    def __init__(self, funcion, sesion, descripcion="", prioridad=PRIORIDAD_LOTE):
+        self.id_trabajo = uuid.uuid4().hex[:12]
+        self.funcion = funcion
+        self.sesion = sesion
+        self.descripcion = descripcion
+        self.prioridad = prioridad
+        self.estado = ESTADO_EN_COLA
+        self.resultado = None
+        self.error = None
+        self.creado = time.time()
+        self.iniciado = None
+        self.terminado = None
+        self._lock = threading.Lock()
+        self._eventos = []
+        self._descartados = 0 # Eventos eliminados del principio de la cola
+        self._texto_parcial = ""
+        self._avance = None
+
+    @property
+    def activo(self):
+        return self.estado in ESTADOS_ACTIVOS
+
+    def publicar(self, evento):
+        with self._lock:
+            if evento.tipo == "texto_parcial":
+                self._texto_parcial = evento.datos.get("texto", "")
+                return
+            if evento.tipo in ("etapa", "fin_etapa"):
+                self._texto_parcial = ""
+            self._eventos.append(evento)
+            sobrantes = len(self._eventos) - MAX_EVENTOS_POR_TRABAJO
+            if sobrantes > 0:
+                del self._eventos[:sobrantes]
+                self._descartados += sobrantes
+
+    def registrar_avance(self, completados, total, mensaje=""):
+        with self._lock:
+            self._avance = (completados, total, mensaje)
+
+    def eventos_desde(self, posicion=0):
+        """Eventos a partir de `posicion` y la posición siguiente (para leer solo los nuevos)."""
+        with self._lock:
+            inicio = max(0, posicion - self._descartados)
+            return list(self._eventos[inicio:]), self._descartados + len(self._eventos)
+
+    @property
+    def texto_parcial(self):
+        with self._lock:
+            return self._texto_parcial
+
+    @property
+    def avance(self):
+        """(completados, total, mensaje) del último avance registrado, o None."""
+        with self._lock:
+            return self._avance
+
+    def duracion(self):
+        if self.iniciado is None:
+            return 0.0
+        return (self.terminado or time.time()) - self.iniciado
+
+    def resumen(self):
+        return {
+            "id_trabajo": self.id_trabajo, "descripcion": self.descripcion, "estado": self.estado,
+            "creado": self.creado, "duracion_s": round(self.duracion(), 1), "error": self.error
+        }
+
+class EjecutorSegundoPlano:
+    """
+    Pool fijo de `max_trabajos` hilos que ejecuta los trabajos de todas las sesiones del proceso.
+    El siguiente trabajo se elige por (prioridad, trabajos en curso de su sesión, orden de llegada)
+    entre los de sesiones que no han llegado a `max_por_sesion`; los lotes ocupan como mucho
+    `max_trabajos - reservados_interactivos` hilos (al menos uno). `limite_filas_lote` es un
+    semáforo de `max_filas_lote` cupos que los lotes pasan a `generar_lote_de_preguntas`
+    (`limite_filas`) para acotar sus filas en curso entre todos. Los hilos se crean al enviar el
+    primer trabajo y no terminan nunca (son daemon).
+    """
+    def __init__(self, max_trabajos=MAX_TRABAJOS_SIMULTANEOS, max_por_sesion=MAX_TRABAJOS_POR_SESION,
+                 retencion_s=RETENCION_TRABAJOS_SEGUNDOS, reservados_interactivos=HILOS_RESERVADOS_INTERACTIVOS,
+                 max_filas_lote=MAX_FILAS_LOTE_SIMULTANEAS):
+        self.max_trabajos = max(1, int(max_trabajos))
+        self.max_por_sesion = max(1, int(max_por_sesion))
+        self.max_lotes = max(1, self.max_trabajos - int(reservados_interactivos))
+        self.retencion_s = retencion_s
+        self.limite_filas_lote = threading.BoundedSemaphore(max(1, int(max_filas_lote)))
+        self._condicion = threading.Condition()
+        self._trabajos = {}
+        self._en_cola = []
+        self._en_curso_por_sesion = {}
+        self._lotes_en_curso = 0
+        self._orden = itertools.count()
+        self._hilos = []
+
+    def enviar(self, funcion, sesion, descripcion="", prioridad=PRIORIDAD_LOTE):
+        """Encola `funcion(trabajo)` a nombre de `sesion` y devuelve el TrabajoSegundoPlano."""
+        trabajo = TrabajoSegundoPlano(funcion, sesion, descripcion=descripcion, prioridad=prioridad)
+        with self._condicion:
+            self._purgar()
+            self._trabajos[trabajo.id_trabajo] = trabajo
+            self._en_cola.append((next(self._orden), trabajo))
+            while len(self._hilos) < self.max_trabajos:
+                hilo = threading.Thread(target=self._atender, name=f"sumon-trabajo-{len(self._hilos)}", daemon=True)
+                hilo.start()
+                self._hilos.append(hilo)
+            self._condicion.notify_all()
+        return trabajo
+
+    def obtener(self, id_trabajo, sesion=None):
+        """El trabajo con ese id; con `sesion`, solo si pertenece a ella. None si no existe."""
+        with self._condicion:
+            trabajo = self._trabajos.get(id_trabajo)
+        if trabajo is None or (sesion is not None and trabajo.sesion != sesion):
+            return None
+        return trabajo
+
+    def listar(self, sesion=None):
+        with self._condicion:
+            trabajos = [t for t in self._trabajos.values() if sesion is None or t.sesion == sesion]
+        return sorted(trabajos, key=lambda t: t.creado, reverse=True)
+
+    def cancelar(self, id_trabajo):
+        """Cancela un trabajo que todavía está en cola; uno ya en curso no se interrumpe."""
+        with self._condicion:
+            for posicion, (_, trabajo) in enumerate(self._en_cola):
+                if trabajo.id_trabajo == id_trabajo:
+                    del self._en_cola[posicion]
+                    trabajo.estado = ESTADO_CANCELADO
+                    trabajo.terminado = time.time()
+                    return True
+        return False
+
+    def posicion_en_cola(self, id_trabajo):
+        """Trabajos que se ejecutarían antes que este (0 si es el siguiente); None si no está en cola."""
+        with self._condicion:
+            ordenados = sorted(self._en_cola, key=self._clave_eleccion)
+        return next((posicion for posicion, (_, t) in enumerate(ordenados) if t.id_trabajo == id_trabajo), None)
+
+    def resumen(self):
+        with self._condicion:
+            estados = [t.estado for t in self._trabajos.values()]
+            return {
+                "hilos": self.max_trabajos, "hilos_lotes": self.max_lotes, "en_curso": estados.count(ESTADO_EN_CURSO),
+                "en_cola": len(self._en_cola), "sesiones_activas": len(self._en_curso_por_sesion)
+            }
+
+    def _clave_eleccion(self, entrada):
+        orden, trabajo = entrada
+        return (trabajo.prioridad, self._en_curso_por_sesion.get(trabajo.sesion, 0), orden)
+
+    def _siguiente(self):
+        # Se llama con la condición adquirida
+        hay_hilo_para_lotes = self._lotes_en_curso < self.max_lotes
+        elegibles = [
+            entrada for entrada in self._en_cola
+            if self._en_curso_por_sesion.get(entrada[1].sesion, 0) < self.max_por_sesion
+            and (entrada[1].prioridad == PRIORIDAD_INTERACTIVA or hay_hilo_para_lotes)
+        ]
+        if not elegibles:
+            return None
+        entrada = min(elegibles, key=self._clave_eleccion)
+        self._en_cola.remove(entrada)
+        return entrada[1]
+
+    def _atender(self):
+        while True:
+            with self._condicion:
+                trabajo = self._siguiente()
+                while trabajo is None:
+                    self._condicion.wait()
+                    trabajo = self._siguiente()
+                self._en_curso_por_sesion[trabajo.sesion] = self._en_curso_por_sesion.get(trabajo.sesion, 0) + 1
+                if trabajo.prioridad != PRIORIDAD_INTERACTIVA:
+                    self._lotes_en_curso += 1
+                trabajo.estado = ESTADO_EN_CURSO
+                trabajo.iniciado = time.time()
+            try:
+                trabajo.resultado = trabajo.funcion(trabajo)
+                estado_final = ESTADO_TERMINADO
+            except Exception as e:
+                trabajo.error = f"{type(e).__name__}: {e}"
+                logger.exception("Falló el trabajo en segundo plano %s (%s).", trabajo.id_trabajo, trabajo.descripcion)
+                estado_final = ESTADO_FALLIDO
+            with self._condicion:
+                trabajo.terminado = time.time()
+                trabajo.estado = estado_final
+                self._en_curso_por_sesion[trabajo.sesion] -= 1
+                if not self._en_curso_por_sesion[trabajo.sesion]:
+                    del self._en_curso_por_sesion[trabajo.sesion]
+                if trabajo.prioridad != PRIORIDAD_INTERACTIVA:
+                    self._lotes_en_curso -= 1
+                # Puede haber trabajos de esta sesión o lotes esperando por los topes
+                self._condicion.notify_all()
+
+    def _purgar(self):
+        # Se llama con la condición adquirida
+        limite = time.time() - self.retencion_s
+        for id_trabajo, trabajo in list(self._trabajos.items()):
+            if not trabajo.activo and (trabajo.terminado or 0) < limite:
+                del self._trabajos[id_trabajo]
+
+@instancia_por_proceso
+def obtener_ejecutor_segundo_plano():
+    return EjecutorSegundoPlano()
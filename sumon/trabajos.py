@@ -0,0 +1,231 @@
+"""
+Almacén persistente (SQLite) de trabajos por lote: filas a procesar, estado de cada una, puntos
+de control del refinamiento y los ítems y auditorías intermedios de cada intento. Un trabajo
+interrumpido (recarga del navegador, reinicio del servidor, caída del proceso) se reanuda desde
+el último intento guardado de cada fila.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from sumon.comun import instancia_por_proceso
+
+RUTA_ALMACEN_TRABAJOS = os.environ.get(
+    "SUMON_TRABAJOS",
+    os.path.join(os.path.expanduser("~"), ".cache", "sumon2", "trabajos.sqlite3")
+)
+# Estados de una fila; "en_curso" al reanudar significa que el proceso anterior se interrumpió
+ESTADOS_FILA = ("pendiente", "en_curso", "terminada")
+
+def _a_json(valor):
+    # Los valores de las celdas llegan como tipos de numpy (int64, etc.)
+    return json.dumps(valor, ensure_ascii=False, default=lambda v: v.item() if hasattr(v, "item") else str(v))
+
+class PuntoControlFila:
+    """
+    Punto de control de una fila de un trabajo, para `generar_pregunta_con_seleccion`:
+    `cargar()` devuelve el estado del refinamiento guardado (o None) y `guardar(estado)` lo
+    actualiza al terminar cada intento, dejando además registro del ítem y la auditoría del intento.
+    `origen` identifica la fila ante el banco de ítems, para no duplicarla si se procesa otra vez.
+    """
+    def __init__(self, almacen, id_trabajo, indice):
+        self.almacen = almacen
+        self.id_trabajo = id_trabajo
+        self.indice = indice
+        self.origen = f"{id_trabajo}/{indice}"
+
+    def cargar(self):
+        return self.almacen.cargar_punto_control(self.id_trabajo, self.indice)
+
+    def guardar(self, estado):
+        self.almacen.guardar_punto_control(self.id_trabajo, self.indice, estado)
+
+class AlmacenTrabajos:
+    """
+    Trabajos por lote guardados en SQLite. Cada escritura es una transacción corta, de modo que
+    el estado en disco nunca queda a medias aunque el proceso muera entre dos llamadas.
+    Es seguro para usarse desde varios hilos y sesiones del mismo proceso.
+    """
+    def __init__(self, ruta):
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(ruta, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS trabajos (
+                    id_trabajo TEXT PRIMARY KEY,
+                    descripcion TEXT NOT NULL,
+                    parametros TEXT NOT NULL,
+                    creado REAL NOT NULL,
+                    actualizado REAL NOT NULL
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS filas_trabajo (
+                    id_trabajo TEXT NOT NULL,
+                    indice INTEGER NOT NULL,
+                    fila TEXT NOT NULL,
+                    estado TEXT NOT NULL,
+                    intentos INTEGER NOT NULL DEFAULT 0,
+                    punto_control TEXT,
+                    item_data TEXT,
+                    actualizado REAL NOT NULL,
+                    PRIMARY KEY (id_trabajo, indice)
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS intentos_trabajo (
+                    id_trabajo TEXT NOT NULL,
+                    indice INTEGER NOT NULL,
+                    intento INTEGER NOT NULL,
+                    item_text TEXT NOT NULL,
+                    dictamen TEXT NOT NULL,
+                    auditoria TEXT NOT NULL,
+                    creado REAL NOT NULL,
+                    PRIMARY KEY (id_trabajo, indice, intento)
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_filas_trabajo_estado ON filas_trabajo (id_trabajo, estado)")
+
+    def crear_trabajo(self, filas, parametros=None, descripcion="", id_trabajo=None):
+        """
+        Registra un trabajo con `filas` (diccionarios o Series de la estructura) y los
+        `parametros` necesarios para reanudarlo (modelos, criterios, etc.). Devuelve su id.
+        """
+        id_trabajo = id_trabajo or uuid.uuid4().hex[:12]
+        ahora = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO trabajos (id_trabajo, descripcion, parametros, creado, actualizado) VALUES (?, ?, ?, ?, ?)",
+                (id_trabajo, descripcion, _a_json(parametros or {}), ahora, ahora)
+            )
+            self._conn.executemany(
+                "INSERT INTO filas_trabajo (id_trabajo, indice, fila, estado, actualizado) VALUES (?, ?, ?, 'pendiente', ?)",
+                [(id_trabajo, indice, _a_json(dict(fila)), ahora) for indice, fila in enumerate(filas)]
+            )
+        return id_trabajo
+
+    def existe(self, id_trabajo):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM trabajos WHERE id_trabajo = ?", (id_trabajo,)).fetchone() is not None
+
+    def parametros(self, id_trabajo):
+        with self._lock:
+            fila = self._conn.execute("SELECT parametros FROM trabajos WHERE id_trabajo = ?", (id_trabajo,)).fetchone()
+        if fila is None:
+            raise KeyError(f"No existe el trabajo '{id_trabajo}'.")
+        return json.loads(fila[0])
+
+    def filas(self, id_trabajo):
+        """Lista de (indice, fila, estado, item_data) en el orden original del trabajo."""
+        with self._lock:
+            registros = self._conn.execute(
+                "SELECT indice, fila, estado, item_data FROM filas_trabajo WHERE id_trabajo = ? ORDER BY indice", (id_trabajo,)
+            ).fetchall()
+        return [
+            (indice, json.loads(fila), estado, json.loads(item_data) if item_data else None)
+            for indice, fila, estado, item_data in registros
+        ]
+
+    def items(self, id_trabajo):
+        """Ítems finales de las filas terminadas, en el orden original."""
+        return [item_data for _, _, estado, item_data in self.filas(id_trabajo) if estado == "terminada" and item_data]
+
+    def punto_control(self, id_trabajo, indice):
+        return PuntoControlFila(self, id_trabajo, indice)
+
+    def marcar_en_curso(self, id_trabajo, indice):
+        self._actualizar_fila(id_trabajo, indice, "UPDATE filas_trabajo SET estado = 'en_curso', actualizado = ? WHERE id_trabajo = ? AND indice = ?")
+
+    def cargar_punto_control(self, id_trabajo, indice):
+        with self._lock:
+            fila = self._conn.execute(
+                "SELECT punto_control FROM filas_trabajo WHERE id_trabajo = ? AND indice = ?", (id_trabajo, indice)
+            ).fetchone()
+        return json.loads(fila[0]) if fila and fila[0] else None
+
+    def guardar_punto_control(self, id_trabajo, indice, estado):
+        ahora = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE filas_trabajo SET punto_control = ?, intentos = ?, actualizado = ? WHERE id_trabajo = ? AND indice = ?",
+                (_a_json(estado), estado.get("attempt", 0), ahora, id_trabajo, indice)
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO intentos_trabajo (id_trabajo, indice, intento, item_text, dictamen, auditoria, creado) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (id_trabajo, indice, estado.get("attempt", 0), estado.get("current_item_text") or "",
+                 estado.get("auditoria_status") or "", estado.get("ultima_auditoria") or "", ahora)
+            )
+            self._conn.execute("UPDATE trabajos SET actualizado = ? WHERE id_trabajo = ?", (ahora, id_trabajo))
+
+    def completar_fila(self, id_trabajo, indice, item_data):
+        ahora = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE filas_trabajo SET estado = 'terminada', item_data = ?, actualizado = ? WHERE id_trabajo = ? AND indice = ?",
+                (_a_json(item_data), ahora, id_trabajo, indice)
+            )
+            self._conn.execute("UPDATE trabajos SET actualizado = ? WHERE id_trabajo = ?", (ahora, id_trabajo))
+
+    def _actualizar_fila(self, id_trabajo, indice, sentencia):
+        ahora = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(sentencia, (ahora, id_trabajo, indice))
+            self._conn.execute("UPDATE trabajos SET actualizado = ? WHERE id_trabajo = ?", (ahora, id_trabajo))
+
+    def intentos(self, id_trabajo, indice):
+        """Ítem, dictamen y auditoría de cada intento guardado de una fila."""
+        with self._lock:
+            registros = self._conn.execute(
+                "SELECT intento, item_text, dictamen, auditoria FROM intentos_trabajo WHERE id_trabajo = ? AND indice = ? ORDER BY intento",
+                (id_trabajo, indice)
+            ).fetchall()
+        return [dict(zip(("intento", "item_text", "dictamen", "auditoria"), registro)) for registro in registros]
+
+    def progreso(self, id_trabajo):
+        """Filas totales, por estado, aprobadas e intentos acumulados del trabajo."""
+        with self._lock:
+            conteos = dict(self._conn.execute(
+                "SELECT estado, COUNT(*) FROM filas_trabajo WHERE id_trabajo = ? GROUP BY estado", (id_trabajo,)
+            ).fetchall())
+            (intentos,) = self._conn.execute(
+                "SELECT COALESCE(SUM(intentos), 0) FROM filas_trabajo WHERE id_trabajo = ?", (id_trabajo,)
+            ).fetchone()
+            (aprobadas,) = self._conn.execute(
+                "SELECT COUNT(*) FROM filas_trabajo WHERE id_trabajo = ? AND estado = 'terminada' "
+                "AND json_extract(item_data, '$.final_audit_status') = '✅ CUMPLE TOTALMENTE'", (id_trabajo,)
+            ).fetchone()
+        total = sum(conteos.values())
+        terminadas = conteos.get("terminada", 0)
+        return {
+            "id_trabajo": id_trabajo, "total": total, "terminadas": terminadas,
+            "en_curso": conteos.get("en_curso", 0), "pendientes": conteos.get("pendiente", 0),
+            "aprobadas": aprobadas, "intentos": intentos, "completo": total > 0 and terminadas == total
+        }
+
+    def listar(self, limite=50):
+        """Trabajos más recientes con su progreso."""
+        with self._lock:
+            registros = self._conn.execute(
+                "SELECT id_trabajo, descripcion, creado, actualizado FROM trabajos ORDER BY actualizado DESC LIMIT ?", (limite,)
+            ).fetchall()
+        return [
+            {"descripcion": descripcion, "creado": creado, "actualizado": actualizado, **self.progreso(id_trabajo)}
+            for id_trabajo, descripcion, creado, actualizado in registros
+        ]
+
+    def eliminar(self, id_trabajo):
+        with self._lock, self._conn:
+            for tabla in ("intentos_trabajo", "filas_trabajo", "trabajos"):
+                self._conn.execute(f"DELETE FROM {tabla} WHERE id_trabajo = ?", (id_trabajo,))
+
+@instancia_por_proceso
+def obtener_almacen_trabajos():
+    return AlmacenTrabajos(RUTA_ALMACEN_TRABAJOS)
@@ -0,0 +1,70 @@
+"""
+Configuración común de las pruebas: todos los almacenes en disco del paquete (caché de respuestas,
+banco, trabajos, índice de duplicados, etc.) apuntan a un directorio temporal. Las rutas se leen
+de las variables de entorno al importar cada módulo, por eso se fijan aquí antes de importar sumon.
+"""
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+_DIRECTORIO_PRUEBAS = tempfile.mkdtemp(prefix="sumon_pruebas_")
+for _variable, _nombre in (
+    ("SUMON_CACHE_LLM", "respuestas_llm.sqlite3"),
+    ("SUMON_BANCO_ITEMS", "banco_items.sqlite3"),
+    ("SUMON_TRABAJOS", "trabajos.sqlite3"),
+    ("SUMON_DUPLICADOS", "duplicados.sqlite3"),
+    ("SUMON_LOTES_PROVEEDOR", "lotes_proveedor.sqlite3"),
+    ("SUMON_CACHE_EXCEL", "cache_excel"),
+    ("SUMON_CACHE_PDF", "cache_pdf"),
+    ("SUMON_CACHE_EXPORTACION", "cache_exportacion"),
+):
+    os.environ[_variable] = os.path.join(_DIRECTORIO_PRUEBAS, _nombre)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def servidor_llm(monkeypatch):
+    """
+    Servidor simulado del benchmark (OpenAI y Gemini) sin latencia, con los clientes apuntando a él,
+    sin límites de cuota y con la salud de los modelos y los controles de cuota empezando de cero.
+    """
+    from benchmark_sumon import ServidorLLMSimulado
+    from sumon import cuota, llm
+    from sumon.enrutamiento import obtener_registro_salud_modelos
+
+    servidor = ServidorLLMSimulado(latencia_s=0.0, semilla=0).iniciar()
+    monkeypatch.setattr(llm, "OPENAI_BASE_URL", f"{servidor.url}/v1")
+    monkeypatch.setattr(cuota, "ESPERA_BASE_REINTENTO", 0.01)
+    sin_limite = {"rpm": 10**6, "tpm": 10**9}
+    monkeypatch.setattr(cuota, "LIMITES_CUOTA_POR_PROVEEDOR", {"Gemini": sin_limite, "GPT": sin_limite})
+    monkeypatch.setattr(cuota, "LIMITES_CUOTA_POR_MODELO", {})
+    monkeypatch.setattr(cuota.obtener_registro_control_cuota(), "_controles", {})
+    monkeypatch.setattr(obtener_registro_salud_modelos(), "_salud", {})
+    yield servidor
+    servidor.detener()
+
+
+@pytest.fixture
+def configuracion_llm(servidor_llm):
+    """
+    ConfiguracionLLM contra el servidor simulado. La API key es única por prueba para que el
+    registro de clientes cree uno nuevo con la URL del servidor; la caché y las métricas empiezan vacías.
+    """
+    from sumon.cache_respuestas import obtener_cache_respuestas_llm
+    from sumon.llm import ConfiguracionLLM
+    from sumon.metricas import obtener_registro_metricas
+
+    obtener_cache_respuestas_llm().vaciar()
+    obtener_registro_metricas().vaciar()
+    return ConfiguracionLLM(openai_api_key=f"clave-{uuid.uuid4().hex}")
+
+
+@pytest.fixture
+def fila_estructura():
+    from benchmark_sumon import filas_sinteticas
+
+    return filas_sinteticas(1)[0]
@@ -0,0 +1,63 @@
+import pytest
+
+from sumon.banco import DICTAMEN_APROBADO, BancoItems
+
+CLASIFICACION = {"Grado": 5, "Área": "Matemáticas", "Asignatura": "Aritmética", "Estación": "Suma",
+                 "Proceso Cognitivo": "Aplicar", "Nanohabilidad": "Sumar cantidades"}
+
+
+@pytest.fixture
+def banco(tmp_path):
+    return BancoItems(str(tmp_path / "banco.sqlite3"))
+
+def _item(texto, dictamen=DICTAMEN_APROBADO, **clasificacion):
+    return {"item_text": texto, "classification": {**CLASIFICACION, **clasificacion}, "final_audit_status": dictamen}
+
+def _textos(resultados):
+    return [item["item_text"] for item in resultados]
+
+def _indice_fts_integro(banco):
+    # Con "external content", el índice FTS solo es correcto si los triggers lo mantuvieron al día
+    with banco._conn:
+        banco._conn.execute("INSERT INTO items_fts (items_fts) VALUES ('integrity-check')")
+    return True
+
+def test_el_indice_fts_sigue_a_inserciones_actualizaciones_y_borrados(banco):
+    if not banco.fts:
+        pytest.skip("SQLite sin FTS5")
+    id_manzanas = banco.guardar(_item("Marta compra manzanas en la feria"))
+    banco.guardar(_item("Pedro reparte naranjas entre amigos"))
+    assert _textos(banco.buscar("manzanas")) == ["Marta compra manzanas en la feria"]
+    assert _textos(banco.buscar("naran")) == ["Pedro reparte naranjas entre amigos"] # Prefijo
+    assert _textos(banco.buscar("Sumar cantidades", limite=5)) # También la nanohabilidad
+
+    # Volver a guardar el mismo ítem actualiza el dictamen (UPDATE) sin duplicar el índice
+    banco.guardar(_item("Marta compra manzanas en la feria", dictamen="❌ RECHAZADO"))
+    assert len(banco.buscar("manzanas")) == 1
+    assert banco.buscar("manzanas", solo_aprobados=True) == []
+
+    banco.eliminar(id_manzanas)
+    assert banco.buscar("manzanas") == []
+    assert _indice_fts_integro(banco)
+
+def test_busqueda_con_filtros_y_texto_con_simbolos(banco):
+    banco.guardar(_item("Suma de fracciones con pizzas", Grado=5))
+    banco.guardar(_item("Suma de fracciones con tortas", Grado="6"))
+    assert _textos(banco.buscar("fracciones", filtros={"Grado": 6})) == ["Suma de fracciones con tortas"]
+    # Las comillas y operadores de FTS5 del usuario no rompen la consulta
+    assert _textos(banco.buscar('fracciones" (pizzas*')) == ["Suma de fracciones con pizzas"]
+
+def test_busqueda_sin_fts_usa_like(banco):
+    banco.guardar(_item("Marta compra manzanas en la feria"))
+    banco.fts = False
+    assert _textos(banco.buscar("manzanas feria")) == ["Marta compra manzanas en la feria"]
+    assert banco.buscar("peras") == []
+
+def test_aprobados_para_la_misma_clasificacion(banco):
+    banco.guardar(_item("Aprobado de suma"))
+    banco.guardar(_item("Rechazado de suma", dictamen="❌ RECHAZADO"))
+    banco.guardar(_item("Aprobado de otra estación", **{"Estación": "Resta"}))
+    (item,) = banco.aprobados_para(CLASIFICACION)
+    assert item["item_text"] == "Aprobado de suma"
+    assert banco.contar() == 3
+    assert banco.contar(solo_aprobados=True) == 2
@@ -0,0 +1,41 @@
+from sumon.cache_respuestas import CacheRespuestasLLM
+from sumon.metricas import obtener_registro_metricas
+from sumon.pipeline import generar_pregunta_con_seleccion
+
+
+def test_guardar_y_obtener(tmp_path):
+    cache = CacheRespuestasLLM(str(tmp_path / "cache.sqlite3"))
+    clave = CacheRespuestasLLM.construir_clave("GPT", "gpt-4o", "hola", {"max_tokens": 10})
+    assert cache.obtener(clave) is None
+    cache.guardar(clave, "GPT", "gpt-4o", "respuesta")
+    assert cache.obtener(clave) == "respuesta"
+    assert clave != CacheRespuestasLLM.construir_clave("GPT", "gpt-4o", "hola", {"max_tokens": 20})
+    cache.vaciar()
+    assert cache.contar() == 0
+
+
+def _generar(configuracion, fila):
+    return generar_pregunta_con_seleccion(
+        "GPT", "gpt-4o", "GPT", "gpt-4o", fila_datos=fila, criterios_generacion={}, configuracion=configuracion
+    )
+
+
+def _desde_cache_por_etapa():
+    df = obtener_registro_metricas().llamadas_df()
+    return df.groupby("etapa")["desde_cache"].apply(list).to_dict()
+
+
+def test_la_generacion_no_se_cachea_por_defecto(configuracion_llm, fila_estructura, servidor_llm):
+    _generar(configuracion_llm, fila_estructura)
+    _generar(configuracion_llm, fila_estructura)
+    por_etapa = _desde_cache_por_etapa()
+    assert por_etapa["generación"] == [False, False]
+    # El mismo ítem produce el mismo prompt de auditoría: la segunda auditoría sale de la caché
+    assert por_etapa["auditoría"] == [False, True]
+
+
+def test_cachear_generacion_reutiliza_el_item(configuracion_llm, fila_estructura):
+    configuracion_llm.cachear_generacion = True
+    _generar(configuracion_llm, fila_estructura)
+    _generar(configuracion_llm, fila_estructura)
+    assert _desde_cache_por_etapa()["generación"] == [False, True]
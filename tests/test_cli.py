@@ -0,0 +1,37 @@
+from sumon import manual
+from sumon.cli import main
+from sumon.manual import diferencia_manual, parametros_manual
+from sumon.trabajos import obtener_almacen_trabajos
+
+
+def _trabajo_con_manual(fila_estructura, texto_manual, max_caracteres=None):
+    return obtener_almacen_trabajos().crear_trabajo([fila_estructura], parametros={
+        "gen_modelo": ["GPT", "gpt-4o"], "audit_modelo": ["GPT", "gpt-4o"], "criterios_generacion": {},
+        "informacion_adicional_usuario": "", "manual": parametros_manual(texto_manual, max_caracteres)
+    })
+
+def test_reanudar_exige_el_mismo_manual(tmp_path, monkeypatch, capsys, fila_estructura, servidor_llm):
+    monkeypatch.setenv("OPENAI_API_KEY", "clave-de-prueba")
+    monkeypatch.setattr(manual, "leer_texto_manual", lambda datos_pdf: datos_pdf.decode("utf-8"))
+    ruta_manual = tmp_path / "manual.pdf"
+    ruta_manual.write_text("Reglas del manual, versión 2.", encoding="utf-8")
+    argumentos = ["--manual", str(ruta_manual), "--salida", str(tmp_path / "items.jsonl")]
+
+    id_otro_manual = _trabajo_con_manual(fila_estructura, "Reglas del manual, versión 1.")
+    assert main(["--trabajo", id_otro_manual, *argumentos]) == 2
+    assert "no es el mismo" in capsys.readouterr().err
+    assert main(["--trabajo", id_otro_manual, "--salida", str(tmp_path / "items.jsonl")]) == 2
+    assert servidor_llm.estadisticas["peticiones"] == 0
+
+    # El mismo manual se reanuda y conserva la forma de envío del trabajo, aunque no se repita --manual-completo
+    id_mismo_manual = _trabajo_con_manual(fila_estructura, "Reglas del manual, versión 2.", max_caracteres=15000)
+    assert main(["--trabajo", id_mismo_manual, *argumentos]) == 0
+    assert obtener_almacen_trabajos().progreso(id_mismo_manual)["completo"]
+
+def test_diferencia_manual():
+    indexado = parametros_manual("Reglas")
+    assert parametros_manual("") is None
+    assert diferencia_manual(indexado, parametros_manual("Reglas")) is None
+    assert "sin manual" in diferencia_manual(None, indexado)
+    assert "no se cargó" in diferencia_manual(indexado, None)
+    assert "completo" in diferencia_manual(parametros_manual("Reglas", 15000), indexado)
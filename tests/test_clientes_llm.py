@@ -0,0 +1,26 @@
+from sumon import llm
+from sumon.llm import RegistroClientesLLM
+
+
+def test_cada_sesion_de_gemini_llama_con_su_propia_api_key(servidor_llm, monkeypatch):
+    monkeypatch.setattr(llm, "GEMINI_API_ENDPOINT", servidor_llm.url)
+    registro = RegistroClientesLLM()
+    # Los dos modelos se crean antes de la primera llamada: con un cliente global, ambos usarían la última key
+    modelo_a = registro.modelo_gemini("clave-a", "gemini-1.5-flash")
+    modelo_b = registro.modelo_gemini("clave-b", "gemini-1.5-flash")
+    assert registro.modelo_gemini("clave-a", "gemini-1.5-flash") is modelo_a
+
+    for modelo in (modelo_a, modelo_b, modelo_a):
+        modelo.generate_content("Genera un ítem")
+    assert servidor_llm.claves_api == ["clave-a", "clave-b", "clave-a"]
+
+def test_la_cache_de_contexto_de_gemini_usa_la_api_key_de_la_sesion(servidor_llm, monkeypatch):
+    monkeypatch.setattr(llm, "GEMINI_API_ENDPOINT", servidor_llm.url)
+    registro = RegistroClientesLLM()
+    prefijo = "Regla del manual de construcción de ítems. " * 2000 # Sobre el mínimo de tokens del contexto
+    modelo_a = registro.modelo_gemini_con_contexto("clave-a", "gemini-2.0-flash", prefijo)
+    registro.modelo_gemini("clave-b", "gemini-2.0-flash")
+    modelo_a.generate_content("Genera un ítem")
+
+    assert servidor_llm.estadisticas["contextos_creados"] == 1
+    assert servidor_llm.claves_api == ["clave-a", "clave-a"]
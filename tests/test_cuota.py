@@ -0,0 +1,129 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from sumon import cuota
+from sumon.cuota import ControlCuota, ControladorConcurrencia, CuboDeTokens
+
+
+class ErrorProveedor(Exception):
+    """Imita los errores de los SDK: `status_code` y, si hay, cabeceras de la respuesta."""
+    def __init__(self, status_code, cabeceras=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers=cabeceras or {})
+
+
+def test_cubo_entrega_la_capacidad_y_luego_espera_la_recarga():
+    cubo = CuboDeTokens(capacidad=2, tasa_por_segundo=20)
+    inicio = time.monotonic()
+    cubo.adquirir()
+    cubo.adquirir()
+    assert time.monotonic() - inicio < 0.03
+    cubo.adquirir()
+    assert time.monotonic() - inicio >= 0.04 # Una unidad a 20 por segundo: ~0,05 s
+
+def test_cubo_no_pide_mas_que_su_capacidad():
+    cubo = CuboDeTokens(capacidad=10, tasa_por_segundo=1000)
+    cubo.adquirir(10_000) # Se recorta a la capacidad en lugar de bloquear para siempre
+    assert cubo._disponibles < 1
+
+def test_aimd_sube_con_exitos_y_se_reduce_a_la_mitad_con_limitaciones():
+    controlador = ControladorConcurrencia(inicial=4, minimo=1, maximo=5)
+    for _ in range(4):
+        controlador.registrar_exito()
+    assert 4.9 < controlador.limite <= 5 # +1/limite por éxito: ~1 por cada "ventana" completa
+    for _ in range(20):
+        controlador.registrar_exito()
+    assert controlador.limite == 5
+    controlador.registrar_limitacion()
+    assert controlador.limite == 2.5
+    for _ in range(5):
+        controlador.registrar_limitacion()
+    assert controlador.limite == 1
+
+def test_concurrencia_bloquea_por_encima_del_limite():
+    controlador = ControladorConcurrencia(inicial=1)
+    entro = threading.Event()
+
+    def _segunda_llamada():
+        with controlador:
+            entro.set()
+
+    with controlador:
+        hilo = threading.Thread(target=_segunda_llamada)
+        hilo.start()
+        assert not entro.wait(0.05)
+    assert entro.wait(1)
+    hilo.join()
+
+def test_control_cuota_reintenta_un_429_y_reduce_la_concurrencia(monkeypatch):
+    monkeypatch.setattr(cuota, "ESPERA_BASE_REINTENTO", 0.001)
+    control = ControlCuota(rpm=10**6, tpm=10**9)
+    respuestas = [ErrorProveedor(429), ErrorProveedor(503), "ok"]
+
+    def _llamada():
+        respuesta = respuestas.pop(0)
+        if isinstance(respuesta, Exception):
+            raise respuesta
+        return respuesta
+
+    assert control.ejecutar(_llamada, tokens_estimados=10) == "ok"
+    assert control.reintentos == 2
+    assert control.limitaciones == 1
+    assert control.concurrencia.limite == pytest.approx(cuota.CONCURRENCIA_INICIAL_POR_MODELO / 2 + 1 / 2)
+
+def test_control_cuota_respeta_retry_after(monkeypatch):
+    monkeypatch.setattr(cuota, "ESPERA_BASE_REINTENTO", 0.001)
+    control = ControlCuota(rpm=10**6, tpm=10**9)
+    respuestas = [ErrorProveedor(429, {"retry-after-ms": "100"}), "ok"]
+
+    def _llamada():
+        respuesta = respuestas.pop(0)
+        if isinstance(respuesta, Exception):
+            raise respuesta
+        return respuesta
+
+    inicio = time.monotonic()
+    assert control.ejecutar(_llamada, tokens_estimados=10) == "ok"
+    assert time.monotonic() - inicio >= 0.1
+
+def test_control_cuota_no_reintenta_errores_definitivos():
+    control = ControlCuota(rpm=10**6, tpm=10**9)
+    llamadas = []
+
+    def _llamada():
+        llamadas.append(1)
+        raise ErrorProveedor(400)
+
+    with pytest.raises(ErrorProveedor):
+        control.ejecutar(_llamada, tokens_estimados=10)
+    assert len(llamadas) == 1
+    assert control.reintentos == 0
+
+def test_el_cupo_de_tokens_se_ajusta_al_uso_real():
+    control = ControlCuota(rpm=10**6, tpm=6000) # 100 tokens por segundo
+    control.ejecutar(lambda: "ok", tokens_estimados=1000, tokens_reales=lambda: None) # Sin uso informado: queda la estimación
+    assert control.tokens._disponibles == pytest.approx(6000 - 1000, abs=5)
+    control.ejecutar(lambda: "ok", tokens_estimados=1000, tokens_reales=lambda: 300)
+    assert control.tokens._disponibles == pytest.approx(5000 - 300, abs=5)
+    # Un uso mayor que el estimado se descuenta aunque el saldo quede negativo
+    control.ejecutar(lambda: "ok", tokens_estimados=1000, tokens_reales=lambda: 5000)
+    assert control.tokens._disponibles == pytest.approx(4700 - 5000, abs=5)
+
+def test_los_reintentos_no_descuentan_dos_veces_el_cupo_de_tokens(monkeypatch):
+    monkeypatch.setattr(cuota, "ESPERA_BASE_REINTENTO", 0.001)
+    control = ControlCuota(rpm=10**6, tpm=6000)
+    respuestas = [ErrorProveedor(429), ErrorProveedor(503), "ok"]
+
+    def _llamada():
+        respuesta = respuestas.pop(0)
+        if isinstance(respuesta, Exception):
+            raise respuesta
+        return respuesta
+
+    assert control.ejecutar(_llamada, tokens_estimados=1000, tokens_reales=lambda: 800) == "ok"
+    assert control.reintentos == 2
+    assert control.tokens._disponibles == pytest.approx(6000 - 800, abs=5)
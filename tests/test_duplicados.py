@@ -0,0 +1,116 @@
+from benchmark_sumon import ITEM_BIEN_FORMADO
+from sumon.duplicados import (
+    UMBRAL_DUPLICADO, FirmasRonda, IndiceDuplicados, firma_minhash, shingles, similitud_estimada, texto_comparable
+)
+from sumon.metricas import obtener_registro_metricas
+from sumon.pipeline import generar_pregunta_con_seleccion
+
+ITEM_DISTINTO = ITEM_BIEN_FORMADO.replace(
+    "En una tienda escolar, Marta compra 2 cuadernos y luego 3 más. ¿Cuántos cuadernos compra en total?",
+    "Un tren recorre 120 kilómetros en 2 horas a velocidad constante. ¿Cuál es su rapidez media?"
+).replace("cuadernos", "km/h")
+
+
+def _firma(texto):
+    return firma_minhash(shingles(texto))
+
+def test_similitud_estimada_aproxima_jaccard():
+    palabras = [f"palabra{numero}" for numero in range(200)]
+    texto_a = " ".join(palabras[:150])
+    texto_b = " ".join(palabras[50:])
+    conjunto_a, conjunto_b = shingles(texto_a), shingles(texto_b)
+    jaccard = len(conjunto_a & conjunto_b) / len(conjunto_a | conjunto_b)
+    assert similitud_estimada(_firma(texto_a), _firma(texto_a)) == 1.0
+    assert abs(similitud_estimada(_firma(texto_a), _firma(texto_b)) - jaccard) < 0.15
+
+def test_shingles_ignoran_mayusculas_y_tildes():
+    assert shingles("La Canción del Camión") == shingles("la cancion del camion")
+
+def test_texto_comparable_usa_enunciado_y_opciones():
+    texto = texto_comparable(ITEM_BIEN_FORMADO)
+    assert texto.startswith("En una tienda escolar")
+    assert "6 cuadernos" in texto
+    assert "JUSTIFICACIONES" not in texto and "Sin embargo" not in texto
+
+def test_indice_detecta_casi_duplicados_y_persiste(tmp_path):
+    ruta = str(tmp_path / "duplicados.sqlite3")
+    indice = IndiceDuplicados(ruta)
+    indice.agregar(ITEM_BIEN_FORMADO, "item-1")
+    casi_igual = ITEM_BIEN_FORMADO.replace("En una tienda escolar", "En la tienda escolar")
+
+    similitud, extracto = indice.buscar(casi_igual)
+    assert similitud >= UMBRAL_DUPLICADO
+    assert extracto.startswith("En una tienda escolar")
+    assert indice.buscar(ITEM_DISTINTO) is None
+    # Las firmas se cargan desde SQLite al abrir el índice de nuevo
+    assert IndiceDuplicados(ruta).buscar(casi_igual) is not None
+
+def test_agregar_reemplaza_la_firma_del_mismo_item(tmp_path):
+    ruta = str(tmp_path / "duplicados.sqlite3")
+    indice = IndiceDuplicados(ruta)
+    indice.agregar(ITEM_BIEN_FORMADO, "item-1")
+    indice.agregar(ITEM_DISTINTO, "item-1")
+
+    assert indice.contar() == 1
+    assert indice.buscar(ITEM_BIEN_FORMADO) is None
+    assert indice.buscar(ITEM_DISTINTO) is not None
+    assert IndiceDuplicados(ruta).contar() == 1
+
+def test_reemplazar_un_item_no_toca_los_demas(tmp_path):
+    ruta = str(tmp_path / "duplicados.sqlite3")
+    indice = IndiceDuplicados(ruta)
+    indice.agregar(ITEM_BIEN_FORMADO, "item-1")
+    indice.agregar(ITEM_DISTINTO, "item-2")
+    indice.agregar(ITEM_DISTINTO, "item-1")
+    assert indice.contar() == 2
+    assert indice.buscar(ITEM_BIEN_FORMADO) is None
+
+    indice.vaciar()
+    indice.agregar(ITEM_BIEN_FORMADO, "item-1")
+    assert indice.contar() == 1
+    # Un índice con varias firmas del mismo ítem (guardadas antes del reemplazo) conserva la última
+    with indice._conn:
+        indice._conn.execute("INSERT INTO firmas (id_item, extracto, firma, creado) SELECT id_item, extracto, firma, creado FROM firmas")
+    reabierto = IndiceDuplicados(ruta)
+    assert reabierto.contar() == 1
+    reabierto.agregar(ITEM_DISTINTO, "item-1")
+    assert reabierto.buscar(ITEM_BIEN_FORMADO) is None
+
+def test_firmas_ronda_registra_el_primero_y_marca_los_parecidos():
+    firmas_ronda = FirmasRonda()
+    assert firmas_ronda.comparar_y_registrar(ITEM_BIEN_FORMADO) is None
+    assert firmas_ronda.comparar_y_registrar(ITEM_DISTINTO) is None
+    similitud, extracto = firmas_ronda.comparar_y_registrar(ITEM_BIEN_FORMADO)
+    assert similitud == 1.0
+    assert extracto.startswith("En una tienda escolar")
+
+def test_solo_se_indexa_la_version_aprobada(configuracion_llm, fila_estructura, servidor_llm, tmp_path):
+    configuracion_llm.usar_cache = False # Las auditorías rechazadas no deben reutilizarse
+    indice = IndiceDuplicados(str(tmp_path / "duplicados.sqlite3"))
+    argumentos = dict(fila_datos=fila_estructura, criterios_generacion={},
+                      configuracion=configuracion_llm, indice_duplicados=indice)
+
+    servidor_llm.tasa_rechazo = 1.0 # Ningún intento se aprueba: los borradores no se indexan
+    generar_pregunta_con_seleccion("GPT", "gpt-4o", "GPT", "gpt-4o", **argumentos)
+    assert indice.contar() == 0
+
+    servidor_llm.tasa_rechazo = 0.0
+    generar_pregunta_con_seleccion("GPT", "gpt-4o", "GPT", "gpt-4o", **argumentos)
+    assert indice.contar() == 1
+
+    # El servidor devuelve siempre el mismo ítem: el siguiente es casi duplicado del aprobado
+    (resultado,) = generar_pregunta_con_seleccion("GPT", "gpt-4o", "GPT", "gpt-4o", **argumentos)
+    assert resultado["final_audit_status"] == "❌ RECHAZADO (casi duplicado)"
+    assert indice.contar() == 1
+
+def test_candidatos_de_la_ronda_se_comparan_entre_si(configuracion_llm, fila_estructura, servidor_llm, tmp_path):
+    servidor_llm.tasa_rechazo = 1.0
+    generar_pregunta_con_seleccion(
+        "GPT", "gpt-4o", "GPT", "gpt-4o", fila_datos=fila_estructura,
+        criterios_generacion={"candidatos_por_ronda": 2},
+        configuracion=configuracion_llm, indice_duplicados=IndiceDuplicados(str(tmp_path / "duplicados.sqlite3"))
+    )
+    (item,) = obtener_registro_metricas().items_df().to_dict("records")
+    # En cada ronda los dos candidatos son iguales: uno se audita y el otro es casi duplicado
+    assert item["intentos"] > 1
+    assert item["casi_duplicados"] == item["intentos"]
@@ -0,0 +1,64 @@
+import json
+import os
+import zipfile
+
+import docx
+import pytest
+
+from benchmark_sumon import ITEM_BIEN_FORMADO
+from sumon.exportacion import exportar_a_word, exportar_items
+
+
+def _items(n):
+    return [{
+        "item_text": ITEM_BIEN_FORMADO.replace("Marta", f"Estudiante {numero}"),
+        "classification": {"Grado": 5, "Nanohabilidad": f"nano {numero}"},
+        "final_audit_status": "✅ CUMPLE TOTALMENTE"
+    } for numero in range(1, n + 1)]
+
+def _parrafos(documento):
+    return [parrafo.text for parrafo in documento.paragraphs]
+
+@pytest.mark.parametrize("max_procesos", [1, 2])
+def test_docx_por_fragmentos_equivale_al_documento_unico(tmp_path, max_procesos):
+    items = _items(5)
+    ruta = exportar_items(items, "docx", archivo_destino=str(tmp_path / "items.docx"),
+                          items_por_fragmento=2, max_procesos=max_procesos)
+
+    unido = docx.Document(ruta)
+    assert _parrafos(unido) == _parrafos(docx.Document(exportar_a_word(items)))
+    encabezados = [texto for texto in _parrafos(unido) if texto.startswith("Ítem #")]
+    assert encabezados == [f"Ítem #{numero}" for numero in range(1, 6)]
+    assert sum(texto == "Preguntas Generadas y Auditadas" for texto in _parrafos(unido)) == 1
+    with zipfile.ZipFile(ruta) as archivo:
+        assert archivo.testzip() is None
+        assert archivo.read("word/document.xml").count(b"<w:sectPr") == 1
+
+def test_zip_con_un_documento_por_fragmento(tmp_path):
+    ruta = exportar_items(_items(5), "zip", archivo_destino=str(tmp_path / "items.zip"), items_por_fragmento=2, max_procesos=1)
+    with zipfile.ZipFile(ruta) as archivo:
+        nombres = archivo.namelist()
+        ultimo = docx.Document(archivo.open(nombres[-1]))
+    assert nombres == ["items_00001-00002.docx", "items_00003-00004.docx", "items_00005-00005.docx"]
+    assert "Ítem #5" in _parrafos(ultimo)
+
+def test_banco_jsonl_con_las_partes_del_item(tmp_path):
+    ruta = exportar_items(_items(2), "jsonl", archivo_destino=str(tmp_path / "banco.jsonl"))
+    with open(ruta, encoding="utf-8") as archivo:
+        registros = [json.loads(linea) for linea in archivo]
+    assert [registro["numero"] for registro in registros] == [1, 2]
+    assert registros[1]["pregunta"].startswith("En una tienda escolar, Estudiante 2")
+    assert registros[1]["respuesta_correcta"] == "B"
+    assert registros[1]["Nanohabilidad"] == "nano 2"
+
+def test_exportacion_identica_reutiliza_el_archivo_en_cache(tmp_path):
+    items = _items(3)
+    ruta = exportar_items(items, "docx", max_procesos=1, ruta_cache=str(tmp_path))
+    os.utime(ruta, (0, 0))
+    assert exportar_items(items, "docx", max_procesos=1, ruta_cache=str(tmp_path)) == ruta
+    assert os.path.getmtime(ruta) == 0
+    assert exportar_items(_items(4), "docx", max_procesos=1, ruta_cache=str(tmp_path)) != ruta
+
+def test_formato_desconocido():
+    with pytest.raises(ValueError):
+        exportar_items(_items(1), "pdf")
@@ -0,0 +1,103 @@
+import json
+
+import pytest
+
+from benchmark_sumon import ITEM_BIEN_FORMADO, ITEM_BIEN_FORMADO_JSON, ITEM_MAL_FORMADO
+from sumon.items import (
+    ItemEstructurado, parsear_auditoria_json, parsear_item_json, parsear_item_texto, preauditar_item
+)
+
+
+def test_parsear_item_json_y_volver_a_texto():
+    item = parsear_item_json(json.dumps(ITEM_BIEN_FORMADO_JSON))
+    assert item.respuesta_correcta == "B"
+    assert item.opciones["C"] == "6 cuadernos"
+    assert item.a_texto() + "\nGRAFICO_NECESARIO: NO\nDESCRIPCION_GRAFICO: N/A" == ITEM_BIEN_FORMADO
+
+
+def test_parsear_item_json_tolera_bloque_de_codigo():
+    texto = "```json\n" + json.dumps(ITEM_BIEN_FORMADO_JSON) + "\n```"
+    assert parsear_item_json(texto).pregunta == ITEM_BIEN_FORMADO_JSON["pregunta"]
+
+
+@pytest.mark.parametrize("texto", ["no es json", "[1, 2]", json.dumps({"pregunta": "sin opciones"})])
+def test_parsear_item_json_rechaza_respuestas_invalidas(texto):
+    with pytest.raises(ValueError):
+        parsear_item_json(texto)
+
+
+def test_parsear_item_texto_es_inversa_de_a_texto():
+    item = ItemEstructurado(
+        pregunta="¿Cuánto es 2 + 3?", opciones={"A": "4", "B": "5", "C": "6"}, respuesta_correcta="B",
+        justificaciones={"A": "Cuenta de menos.", "B": "Es la suma.", "C": "Cuenta de más."}
+    )
+    assert parsear_item_texto(item.a_texto()) == item
+
+
+def test_parsear_item_texto_enunciado_de_varias_lineas_y_partes_faltantes():
+    item = parsear_item_texto("PREGUNTA: Observa la tabla.\n¿Qué fila suma más?\nA. La primera\nB. La segunda")
+    assert item.pregunta == "Observa la tabla.\n¿Qué fila suma más?"
+    assert item.opciones == {"A": "La primera", "B": "La segunda"}
+    assert item.respuesta_correcta == "" and item.justificaciones == {}
+
+
+def test_parsear_auditoria_json():
+    auditoria = parsear_auditoria_json(json.dumps({
+        "criterios": [
+            {"criterio": "Claridad", "veredicto": "CUMPLE"},
+            {"criterio": "Distractores", "veredicto": "cumple parcialmente", "comentario": "La C es obvia."},
+            {"criterio": "Formato", "veredicto": "desconocido"},
+        ],
+        "dictamen_final": "cumple parcialmente",
+        "observaciones_finales": "Revisar distractores."
+    }))
+    assert auditoria.estado == "⚠️ CUMPLE PARCIALMENTE"
+    assert auditoria.criterios_fallidos() == ["Distractores: ⚠️ La C es obvia.", "Formato: ❌"]
+    assert "[⚠️ CUMPLE PARCIALMENTE]" in auditoria.a_texto()
+
+
+def test_parsear_auditoria_json_rechaza_dictamen_desconocido():
+    with pytest.raises(ValueError):
+        parsear_auditoria_json(json.dumps({"dictamen_final": "QUIZÁS"}))
+
+
+def test_preauditar_item_bien_formado():
+    assert preauditar_item(ITEM_BIEN_FORMADO) == []
+    # Las marcas de Markdown y las tildes no cambian el resultado
+    assert preauditar_item(ITEM_BIEN_FORMADO.replace("\nA. ", "\n**A.** ").replace("opcion", "opción")) == []
+
+
+def test_preauditar_item_mal_formado():
+    observaciones = preauditar_item(ITEM_MAL_FORMADO)
+    assert any("tres opciones" in observacion and "A, B" in observacion for observacion in observaciones)
+    assert any("RESPUESTA CORRECTA" in observacion for observacion in observaciones)
+    assert any("JUSTIFICACIONES" in observacion for observacion in observaciones)
+
+
+@pytest.mark.parametrize("respuesta", ["Opción B", "opcion B", "(B)", "**B)**", "[B]", "**Opción (B)**"])
+def test_preauditar_item_acepta_variantes_de_la_respuesta_correcta(respuesta):
+    texto = ITEM_BIEN_FORMADO.replace("RESPUESTA CORRECTA: B", f"RESPUESTA CORRECTA: {respuesta}")
+    assert preauditar_item(texto) == []
+    assert parsear_item_texto(texto).respuesta_correcta == "B"
+
+
+def test_preauditar_item_respuesta_fuera_de_las_opciones():
+    (observacion,) = preauditar_item(ITEM_BIEN_FORMADO.replace("RESPUESTA CORRECTA: B", "RESPUESTA CORRECTA: D"))
+    assert "(D)" in observacion
+
+
+def test_preauditar_item_justificaciones():
+    sin_formato = ITEM_BIEN_FORMADO.replace(
+        "El estudiante podría escoger la opción A porque cuenta uno de menos. Sin embargo, esto es incorrecto porque 2 + 3 = 5.",
+        "Es incorrecta porque 2 + 3 = 5."
+    )
+    (observacion,) = preauditar_item(sin_formato)
+    assert "opción incorrecta A" in observacion
+
+    sin_c = ITEM_BIEN_FORMADO.split("\nC. El estudiante")[0] + "\nGRAFICO_NECESARIO: NO"
+    assert preauditar_item(sin_c) == ["Falta la justificación de la opción C."]
+
+
+def test_preauditar_item_frases_prohibidas():
+    texto = ITEM_BIEN_FORMADO.replace("C. 6 cuadernos", "C. Ninguna de las anteriores")
+    assert preauditar_item(texto) == ["No se permite la frase “ninguna de las anteriores”."]
@@ -0,0 +1,52 @@
+import pandas as pd
+
+from sumon import pipeline
+from sumon.trabajos import AlmacenTrabajos
+
+
+def _filas(n):
+    return pd.DataFrame([{"NANOHABILIDAD": f"nano {i}", "ESTACIÓN": "E"} for i in range(n)])
+
+
+def _generador(sin_resultado=(), con_error=()):
+    def generar(*args, fila_datos, **kwargs):
+        nano = fila_datos["NANOHABILIDAD"]
+        if nano in con_error:
+            raise RuntimeError("fallo del proveedor")
+        if nano in sin_resultado:
+            return []
+        return [{"item_text": f"ítem de {nano}", "final_audit_status": "✅ CUMPLE TOTALMENTE"}]
+    return generar
+
+
+def test_resultados_alineados_con_las_filas(monkeypatch):
+    monkeypatch.setattr(pipeline, "generar_pregunta_con_seleccion", _generador(sin_resultado={"nano 1"}, con_error={"nano 2"}))
+    resultados = pipeline.generar_lote_de_preguntas(
+        "GPT", "g", "GPT", "a", df_filas=_filas(4), criterios_generacion={}, max_concurrencia=3
+    )
+    assert len(resultados) == 4
+    assert resultados[0]["item_text"] == "ítem de nano 0"
+    assert resultados[1] is None
+    assert resultados[2]["final_audit_status"] == "❌ RECHAZADO (error técnico)"
+    assert resultados[2]["classification"]["Nanohabilidad"] == "nano 2"
+    assert resultados[3]["item_text"] == "ítem de nano 3"
+
+
+def test_reanudar_trabajo_conserva_la_alineacion(monkeypatch, tmp_path):
+    almacen = AlmacenTrabajos(str(tmp_path / "trabajos.sqlite3"))
+    df = _filas(3)
+    id_trabajo = almacen.crear_trabajo((fila for _, fila in df.iterrows()))
+    almacen.completar_fila(id_trabajo, 1, {"item_text": "ya hecho", "final_audit_status": "✅ CUMPLE TOTALMENTE"})
+    llamadas = []
+
+    def generar(*args, fila_datos, **kwargs):
+        llamadas.append(fila_datos["NANOHABILIDAD"])
+        return _generador()(fila_datos=fila_datos)
+
+    monkeypatch.setattr(pipeline, "generar_pregunta_con_seleccion", generar)
+    resultados = pipeline.generar_lote_de_preguntas(
+        "GPT", "g", "GPT", "a", df_filas=None, criterios_generacion={}, id_trabajo=id_trabajo, almacen_trabajos=almacen
+    )
+    assert sorted(llamadas) == ["nano 0", "nano 2"]
+    assert [item["item_text"] for item in resultados] == ["ítem de nano 0", "ya hecho", "ítem de nano 2"]
+    assert almacen.progreso(id_trabajo)["completo"]
@@ -0,0 +1,103 @@
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from sumon.lotes_proveedor import AgrupadorLotesProveedor, ClienteLotesLocal, resolver_lotes_locales
+
+
+def _agrupador(tmp_path, intervalo_sondeo_s=0.01):
+    cliente = ClienteLotesLocal(str(tmp_path / "lotes"), "openai")
+    return AgrupadorLotesProveedor({"GPT": cliente}, ruta_registro=str(tmp_path / "registro.sqlite3"),
+                                   intervalo_sondeo_s=intervalo_sondeo_s, ventana_agrupacion_s=0.05)
+
+def _lotes_en(tmp_path):
+    directorio = tmp_path / "lotes"
+    return sorted(nombre for nombre in os.listdir(directorio) if (directorio / nombre / "entrada.jsonl").exists())
+
+def _esperar_lotes(tmp_path, cantidad, limite_s=5.0):
+    fin = time.monotonic() + limite_s
+    while len(_lotes_en(tmp_path)) < cantidad:
+        assert time.monotonic() < fin, "El lote no se envió a tiempo"
+        time.sleep(0.01)
+    return _lotes_en(tmp_path)
+
+def _esperar_registro(tmp_path, limite_s=5.0):
+    # El lote se hace visible en el directorio un momento antes de quedar registrado
+    fin = time.monotonic() + limite_s
+    with sqlite3.connect(str(tmp_path / "registro.sqlite3")) as conn:
+        while not conn.execute("SELECT COUNT(*) FROM solicitudes_enviadas").fetchone()[0]:
+            assert time.monotonic() < fin, "El lote no quedó registrado a tiempo"
+            time.sleep(0.01)
+
+def _solicitar_en_hilos(agrupador, prompts):
+    """Cada prompt lo pide un hilo participante, como una fila del lote; devuelve (hilos, resultados)."""
+    resultados = {}
+
+    def _fila(prompt):
+        with agrupador.participante():
+            resultados[prompt] = agrupador.solicitar("GPT", "gpt-4o", prompt)
+
+    hilos = [threading.Thread(target=_fila, args=(prompt,), daemon=True) for prompt in prompts]
+    for hilo in hilos:
+        hilo.start()
+    return hilos, resultados
+
+def _responder(modelo, prompt):
+    return f"{modelo} responde a: {prompt}"
+
+def test_las_filas_activas_salen_en_un_lote_y_cada_una_recibe_su_respuesta(tmp_path):
+    agrupador = _agrupador(tmp_path)
+    prompts = [f"pregunta {numero}" for numero in range(3)]
+    hilos, resultados = _solicitar_en_hilos(agrupador, prompts)
+    _esperar_lotes(tmp_path, 1)
+    assert resolver_lotes_locales(str(tmp_path / "lotes"), _responder) == 1
+    for hilo in hilos:
+        hilo.join(timeout=5)
+
+    assert agrupador.lotes_enviados == 1
+    for prompt in prompts:
+        assert resultados[prompt].error is None
+        assert resultados[prompt].texto == f"gpt-4o responde a: {prompt}"
+        assert resultados[prompt].tokens_prompt is not None
+
+def test_un_lote_fallido_devuelve_error_a_cada_peticion(tmp_path):
+    agrupador = _agrupador(tmp_path)
+    hilos, resultados = _solicitar_en_hilos(agrupador, ["a", "b"])
+    (id_lote,) = _esperar_lotes(tmp_path, 1)
+    (tmp_path / "lotes" / id_lote / "error.txt").write_text("cuota agotada", encoding="utf-8")
+    for hilo in hilos:
+        hilo.join(timeout=5)
+
+    for resultado in resultados.values():
+        assert resultado.texto is None
+        assert "fallido" in resultado.error
+        assert resultado.id_lote == id_lote
+
+def test_una_reanudacion_espera_el_lote_ya_enviado(tmp_path):
+    # Primera ejecución: envía el lote y deja de sondearlo, como un proceso interrumpido
+    interrumpido = _agrupador(tmp_path, intervalo_sondeo_s=3600)
+    _solicitar_en_hilos(interrumpido, ["pregunta"])
+    (id_lote,) = _esperar_lotes(tmp_path, 1)
+    _esperar_registro(tmp_path)
+
+    reanudado = _agrupador(tmp_path)
+    hilos, resultados = _solicitar_en_hilos(reanudado, ["pregunta"])
+    resolver_lotes_locales(str(tmp_path / "lotes"), _responder)
+    for hilo in hilos:
+        hilo.join(timeout=5)
+
+    assert reanudado.lotes_enviados == 0
+    assert _lotes_en(tmp_path) == [id_lote]
+    assert resultados["pregunta"].texto == "gpt-4o responde a: pregunta"
+    assert resultados["pregunta"].id_lote == id_lote
+
+def test_sin_cliente_para_el_proveedor_no_se_encola(tmp_path):
+    resultado = _agrupador(tmp_path).solicitar("Gemini", "gemini-1.5-pro", "pregunta")
+    assert "No hay cliente de lotes" in resultado.error
+
+def test_cliente_local_rechaza_un_formato_desconocido(tmp_path):
+    with pytest.raises(ValueError):
+        ClienteLotesLocal(str(tmp_path), "anthropic")
@@ -0,0 +1,29 @@
+import time
+
+from sumon.metricas import obtener_registro_metricas
+from sumon.pipeline import generar_pregunta_con_seleccion
+
+
+def test_max_llamadas_cuenta_las_peticiones_reales(configuracion_llm, fila_estructura, servidor_llm):
+    servidor_llm.tasa_rechazo = 1.0 # El auditor nunca aprueba: se agota el presupuesto
+    configuracion_llm.usar_cache = False
+    generar_pregunta_con_seleccion(
+        "GPT", "gpt-4o", "GPT", "gpt-4o", fila_datos=fila_estructura,
+        criterios_generacion={"candidatos_por_ronda": 2, "max_llamadas_por_item": 5},
+        configuracion=configuracion_llm
+    )
+    (llamadas_llm,) = obtener_registro_metricas().items_df()["llamadas_llm"]
+    # Ronda 1: dos candidatos (4 peticiones); queda 1, que no alcanza para generar y auditar otro
+    assert llamadas_llm == servidor_llm.estadisticas["peticiones"] <= 5
+
+def test_las_peticiones_de_los_candidatos_cancelados_tambien_cuentan(configuracion_llm, fila_estructura, servidor_llm):
+    servidor_llm.latencia_s = 0.05 # Cuando gana un candidato, los demás siguen con peticiones en curso
+    configuracion_llm.usar_cache = False
+    generar_pregunta_con_seleccion(
+        "GPT", "gpt-4o", "GPT", "gpt-4o", fila_datos=fila_estructura,
+        criterios_generacion={"candidatos_por_ronda": 3}, configuracion=configuracion_llm
+    )
+    peticiones = servidor_llm.estadisticas["peticiones"]
+    time.sleep(0.2) # Ningún candidato cancelado sigue enviando peticiones después de devolver el ítem
+    (llamadas_llm,) = obtener_registro_metricas().items_df()["llamadas_llm"]
+    assert llamadas_llm == peticiones == servidor_llm.estadisticas["peticiones"]
@@ -0,0 +1,109 @@
+import logging
+import threading
+import time
+
+import pandas as pd
+
+from sumon import pipeline
+from sumon.segundo_plano import (
+    ESTADO_EN_COLA, ESTADO_EN_CURSO, ESTADO_FALLIDO, ESTADO_TERMINADO, PRIORIDAD_INTERACTIVA, EjecutorSegundoPlano
+)
+
+
+def _esperar_estado(trabajo, estado, limite_s=5.0):
+    fin = time.monotonic() + limite_s
+    while trabajo.estado != estado:
+        assert time.monotonic() < fin, f"El trabajo quedó en {trabajo.estado}, se esperaba {estado}"
+        time.sleep(0.01)
+
+def _bloqueante(liberar, orden=None):
+    """Trabajo que anota su descripción al empezar y espera a que se libere."""
+    def funcion(trabajo):
+        if orden is not None:
+            orden.append(trabajo.descripcion)
+        liberar.wait(5)
+        return trabajo.descripcion
+    return funcion
+
+def test_interactivos_primero_y_luego_la_sesion_con_menos_trabajos():
+    ejecutor = EjecutorSegundoPlano(max_trabajos=1, max_por_sesion=2, reservados_interactivos=0)
+    liberar, orden = threading.Event(), []
+    ocupante = ejecutor.enviar(_bloqueante(liberar), "a", descripcion="ocupa")
+    _esperar_estado(ocupante, ESTADO_EN_CURSO)
+
+    en_cola = [
+        ejecutor.enviar(_bloqueante(liberar, orden), "a", descripcion="lote a"),
+        ejecutor.enviar(_bloqueante(liberar, orden), "b", descripcion="lote b"),
+        ejecutor.enviar(_bloqueante(liberar, orden), "c", descripcion="individual c", prioridad=PRIORIDAD_INTERACTIVA),
+    ]
+    assert [ejecutor.posicion_en_cola(trabajo.id_trabajo) for trabajo in en_cola] == [2, 1, 0]
+
+    liberar.set()
+    for trabajo in en_cola:
+        _esperar_estado(trabajo, ESTADO_TERMINADO)
+    assert orden[0] == "individual c"
+
+def test_tope_de_trabajos_por_sesion():
+    ejecutor = EjecutorSegundoPlano(max_trabajos=3, max_por_sesion=1, reservados_interactivos=0)
+    liberar = threading.Event()
+    primero = ejecutor.enviar(_bloqueante(liberar), "a")
+    segundo = ejecutor.enviar(_bloqueante(liberar), "a")
+    otra_sesion = ejecutor.enviar(_bloqueante(liberar), "b")
+    _esperar_estado(primero, ESTADO_EN_CURSO)
+    _esperar_estado(otra_sesion, ESTADO_EN_CURSO)
+    assert segundo.estado == ESTADO_EN_COLA
+
+    liberar.set()
+    _esperar_estado(segundo, ESTADO_TERMINADO)
+
+def test_los_lotes_no_ocupan_el_hilo_reservado_a_los_interactivos():
+    ejecutor = EjecutorSegundoPlano(max_trabajos=2, max_por_sesion=4, reservados_interactivos=1)
+    liberar = threading.Event()
+    lotes = [ejecutor.enviar(_bloqueante(liberar), "a", descripcion=f"lote {numero}") for numero in range(2)]
+    _esperar_estado(lotes[0], ESTADO_EN_CURSO)
+    individual = ejecutor.enviar(lambda trabajo: "listo", "b", prioridad=PRIORIDAD_INTERACTIVA)
+
+    _esperar_estado(individual, ESTADO_TERMINADO)
+    assert individual.resultado == "listo"
+    assert lotes[1].estado == ESTADO_EN_COLA
+
+    liberar.set()
+    _esperar_estado(lotes[1], ESTADO_TERMINADO)
+
+def test_las_filas_de_todos_los_lotes_comparten_un_tope(monkeypatch):
+    ejecutor = EjecutorSegundoPlano(max_trabajos=3, max_por_sesion=2, reservados_interactivos=1, max_filas_lote=2)
+    lock, en_curso, maximo = threading.Lock(), [0], [0]
+
+    def _generar(*args, fila_datos, **kwargs):
+        with lock:
+            en_curso[0] += 1
+            maximo[0] = max(maximo[0], en_curso[0])
+        time.sleep(0.02)
+        with lock:
+            en_curso[0] -= 1
+        return [{"item_text": fila_datos["NANOHABILIDAD"]}]
+
+    monkeypatch.setattr(pipeline, "generar_pregunta_con_seleccion", _generar)
+    df_filas = pd.DataFrame([{"NANOHABILIDAD": f"nano {numero}", "ESTACIÓN": "E"} for numero in range(4)])
+
+    def _lote(trabajo):
+        return pipeline.generar_lote_de_preguntas("GPT", "g", "GPT", "a", df_filas=df_filas, criterios_generacion={},
+                                                  max_concurrencia=4, limite_filas=ejecutor.limite_filas_lote)
+
+    lotes = [ejecutor.enviar(_lote, sesion) for sesion in ("a", "b")]
+    for trabajo in lotes:
+        _esperar_estado(trabajo, ESTADO_TERMINADO)
+        assert [item["item_text"] for item in trabajo.resultado] == list(df_filas["NANOHABILIDAD"])
+    assert maximo[0] == 2
+
+def test_un_trabajo_fallido_queda_registrado(caplog):
+    ejecutor = EjecutorSegundoPlano(max_trabajos=1)
+
+    def _falla(trabajo):
+        raise RuntimeError("sin cuota")
+
+    with caplog.at_level(logging.ERROR, logger="sumon.segundo_plano"):
+        trabajo = ejecutor.enviar(_falla, "a", descripcion="lote roto")
+        _esperar_estado(trabajo, ESTADO_FALLIDO)
+    assert trabajo.error == "RuntimeError: sin cuota"
+    assert any("lote roto" in registro.getMessage() and registro.exc_info for registro in caplog.records)
@@ -0,0 +1,70 @@
+from sumon.banco import BancoItems
+from sumon.metricas import obtener_registro_metricas
+from sumon.pipeline import generar_pregunta_con_seleccion
+from sumon.trabajos import AlmacenTrabajos
+
+
+def _almacen(tmp_path):
+    return AlmacenTrabajos(str(tmp_path / "trabajos.sqlite3"))
+
+
+def test_punto_control_guardar_y_cargar(tmp_path):
+    almacen = _almacen(tmp_path)
+    id_trabajo = almacen.crear_trabajo([{"NANOHABILIDAD": "n"}], parametros={"gen_modelo": ["GPT", "g"]}, descripcion="d")
+    punto_control = almacen.punto_control(id_trabajo, 0)
+    assert punto_control.cargar() is None
+    punto_control.guardar({"attempt": 1, "current_item_text": "v1", "auditoria_status": "⚠️ CUMPLE PARCIALMENTE"})
+    punto_control.guardar({"attempt": 2, "current_item_text": "v2", "auditoria_status": "✅ CUMPLE TOTALMENTE"})
+    assert punto_control.cargar()["current_item_text"] == "v2"
+    assert [intento["item_text"] for intento in almacen.intentos(id_trabajo, 0)] == ["v1", "v2"]
+    assert almacen.parametros(id_trabajo) == {"gen_modelo": ["GPT", "g"]}
+    progreso = almacen.progreso(id_trabajo)
+    assert (progreso["terminadas"], progreso["intentos"], progreso["completo"]) == (0, 2, False)
+
+
+def test_completar_filas_y_progreso(tmp_path):
+    almacen = _almacen(tmp_path)
+    id_trabajo = almacen.crear_trabajo([{"i": 0}, {"i": 1}])
+    almacen.marcar_en_curso(id_trabajo, 0)
+    almacen.completar_fila(id_trabajo, 0, {"item_text": "x", "final_audit_status": "✅ CUMPLE TOTALMENTE"})
+    progreso = almacen.progreso(id_trabajo)
+    assert (progreso["terminadas"], progreso["pendientes"], progreso["aprobadas"]) == (1, 1, 1)
+    almacen.completar_fila(id_trabajo, 1, {"item_text": "y", "final_audit_status": "❌ RECHAZADO"})
+    assert almacen.progreso(id_trabajo)["completo"]
+    assert [item["item_text"] for item in almacen.items(id_trabajo)] == ["x", "y"]
+    almacen.eliminar(id_trabajo)
+    assert not almacen.existe(id_trabajo)
+
+
+def test_reprocesar_fila_terminada_no_duplica_banco_ni_metricas(tmp_path, configuracion_llm, fila_estructura, servidor_llm):
+    almacen = _almacen(tmp_path)
+    banco = BancoItems(str(tmp_path / "banco.sqlite3"))
+    id_trabajo = almacen.crear_trabajo([fila_estructura])
+
+    def _procesar():
+        return generar_pregunta_con_seleccion(
+            "GPT", "gpt-4o", "GPT", "gpt-4o", fila_datos=fila_estructura, criterios_generacion={},
+            configuracion=configuracion_llm, punto_control=almacen.punto_control(id_trabajo, 0), banco_items=banco
+        )
+
+    primero = _procesar()
+    peticiones = servidor_llm.estadisticas["peticiones"]
+    # Caída antes de `completar_fila`: la fila se vuelve a procesar al reanudar
+    segundo = _procesar()
+    assert segundo == primero
+    assert servidor_llm.estadisticas["peticiones"] == peticiones
+    assert banco.contar() == 1
+    assert len(obtener_registro_metricas().items_df()) == 1
+
+
+def test_banco_reemplaza_el_item_del_mismo_origen(tmp_path):
+    banco = BancoItems(str(tmp_path / "banco.sqlite3"))
+    clasificacion = {"Grado": 5, "Nanohabilidad": "Sumar"}
+    id_banco = banco.guardar({"item_text": "Primera versión con manzanas", "classification": clasificacion}, origen="t/0")
+    assert banco.guardar({"item_text": "Segunda versión con peras", "classification": clasificacion}, origen="t/0") == id_banco
+    assert banco.contar() == 1
+    assert banco.buscar("manzanas") == []
+    assert [item["id_banco"] for item in banco.buscar("peras")] == [id_banco]
+    # Sin origen, un texto distinto es otro ítem
+    banco.guardar({"item_text": "Tercera versión", "classification": clasificacion})
+    assert banco.contar() == 2